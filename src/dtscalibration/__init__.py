@@ -1,4 +1,6 @@
 # coding=utf-8
+from .calibrate_utils import CalibrationPlan
+from .calibrate_utils import OnlineSingleEndedCalibration
 from .datastore import DataStore
 from .datastore import open_datastore
 from .datastore import open_mf_datastore
@@ -27,7 +29,8 @@ __all__ = [
     'suggest_cable_shift_double_ended', 'plot_accuracy',
     'plot_location_residuals_double_ended',
     'plot_residuals_reference_sections',
-    'plot_residuals_reference_sections_single', 'plot_sigma_report']
+    'plot_residuals_reference_sections_single', 'plot_sigma_report',
+    'CalibrationPlan', 'OnlineSingleEndedCalibration']
 
 # filenames = ['datastore.py', 'datastore_utils.py', 'calibrate_utils.py',
 #              'plot.py', 'io.py']
@@ -1,7 +1,14 @@
 # coding=utf-8
+import hashlib
+import time
+import warnings
+import dask
+import dask.array as da
 import numpy as np
 import scipy.sparse as sp
+import scipy.stats as sst
 from scipy.sparse import linalg as ln
+from scipy.special import ndtri
 
 
 def parse_st_var(ds, st_var, st_label='st', ix_sel=None):
@@ -67,6 +74,11 @@ def calibration_single_ended_solver(
         calc_cov=True,
         solver='sparse',
         matching_indices=None,
+        matrix_free=False,
+        plan=None,
+        time_chunks=None,
+        precondition=None,
+        diagnostics=None,
         verbose=False):
     """
     The solver for single-ended setups. Assumes `ds` is pre-configured with
@@ -87,19 +99,44 @@ def calibration_single_ended_solver(
         variance is a function of the intensity (Poisson distributed) define an
         array with shape (nx, nt), where nx are the number of calibration
         locations.
-    calc_cov : bool
+    calc_cov : bool, str
         whether to calculate the covariance matrix. Required for calculation
-        of confidence boundaries. But uses a lot of memory.
-    solver : {'sparse', 'stats', 'external', 'external_split'}
+        of confidence boundaries. But uses a lot of memory. If `'blocks'` the
+        covariance is returned as a `BlockCovariance` object, which requires
+        far less memory.
+    solver : {'sparse', 'direct', 'stats', 'block', 'chunked', 'external',
+              'external_split'}
         Always use sparse to save memory. The statsmodel can be used to validate
-        sparse solver. `external` returns the matrices that would enter the
-        matrix solver (Eq.37). `external_split` returns a dictionary with
-        matrix X split in the coefficients per parameter. The use case for
-        the latter is when certain parameters are fixed/combined.
+        sparse solver. `direct` factorizes the normal equations of mid-sized
+        problems, see `wls_sparse` with `backend='auto'`. `block` eliminates C and the transient attenuation per
+        time step, see `wls_block`. `chunked` accumulates the normal equations
+        per time chunk, see `wls_time_chunks`. `external` returns the matrices
+        that would enter the matrix solver (Eq.37). `external_split` returns a
+        dictionary with matrix X split in the coefficients per parameter. The
+        use case for the latter is when certain parameters are fixed/combined.
     matching_indices : array-like
         Is an array of size (np, 2), where np is the number of paired
         locations. This array is produced by `matching_sections()`.
-
+    matrix_free : bool
+        Represent X as a `DesignOperator` instead of a sparse matrix, so that
+        the row and column indices of all coefficients are never stored. Not
+        available for the `stats` and `external_split` solvers.
+    plan : CalibrationPlan, optional
+        Reuse the coefficient matrix, the previous solution, and the
+        factorization of the `block` solver of earlier calibrations of the
+        same geometry. The factorization is only reused for the same weights
+        and reference temperatures. Only for the `sparse` and `block`
+        solvers.
+    time_chunks : int, optional
+        Number of time steps per chunk for the `chunked` solver. Defaults to
+        the dask chunks of `ds.st`.
+    precondition : {'columns', 'blocks', None}
+        Right preconditioner of LSQR for the `sparse` solver, see
+        `lsqr_preconditioner`.
+    diagnostics : dict, optional
+        Is updated with the convergence diagnostics of the `sparse`, `block`
+        and `chunked` solvers, such as the number of iterations and an
+        estimate of the condition number.
     verbose : bool
 
     Returns
@@ -118,6 +155,38 @@ def calibration_single_ended_solver(
     nta = ds.trans_att.size
     nm = matching_indices.shape[0] if np.any(matching_indices) else 0
 
+    if solver == 'chunked':
+        assert not matrix_free and plan is None, \
+            'The chunked solver builds the coefficient matrix per chunk'
+
+        # C and the transient attenuation are local to their time step
+        groups = np.concatenate(
+            ([-1, -1], np.arange(nt), np.tile(np.arange(nt), nta)))
+
+        def chunks():
+            for sl in time_chunk_slices(ds, time_chunks):
+                t = np.arange(nt)[sl]
+                ix = np.concatenate(
+                    (
+                        [0, 1], 2 + t,
+                        (2 + nt + np.arange(nta)[:, None] * nt + t).ravel()))
+                X, y, w, x0 = calibration_single_ended_solver(
+                    ds.isel(time=sl),
+                    time_chunk_st_var(st_var, nt, sl),
+                    time_chunk_st_var(ast_var, nt, sl),
+                    calc_cov=False,
+                    solver='external',
+                    matching_indices=matching_indices)
+                yield X, y, w, x0, ix
+
+        return wls_time_chunks(
+            chunks(),
+            2 + nt + nta * nt,
+            groups=groups,
+            calc_cov=calc_cov,
+            verbose=verbose,
+            diagnostics=diagnostics)
+
     if np.any(matching_indices):
         ds_ms0 = ds.isel(x=matching_indices[:, 0])
         ds_ms1 = ds.isel(x=matching_indices[:, 1])
@@ -125,121 +194,151 @@ def calibration_single_ended_solver(
     p0_est_dalpha = np.asarray([485., 0.1] + nt * [1.4] + nta * nt * [0.])
     p0_est_alpha = np.asarray([485.] + no * [0.] + nt * [1.4] + nta * nt * [0.])
 
-    # X \gamma  # Eq.34
     cal_ref = ds.ufunc_per_section(
         label='st', ref_temp_broadcasted=True, calc_per='all')
     cal_ref = cal_ref  # sort by increasing x
-    data_gamma = 1 / (cal_ref.T.ravel() + 273.15)  # gamma
-    coord_gamma_row = np.arange(nt * nx, dtype=int)
-    coord_gamma_col = np.zeros(nt * nx, dtype=int)
-    X_gamma = sp.coo_matrix(
-        (data_gamma, (coord_gamma_row, coord_gamma_col)),
-        shape=(nt * nx, 1),
-        copy=False)
-
-    # X \Delta\alpha  # Eq.34
-    data_dalpha = np.tile(-x_sec, nt)  # dalpha
-    coord_dalpha_row = np.arange(nt * nx, dtype=int)
-    coord_dalpha_col = np.zeros(nt * nx, dtype=int)
-    X_dalpha = sp.coo_matrix(
-        (data_dalpha, (coord_dalpha_row, coord_dalpha_col)),
-        shape=(nt * nx, 1),
-        copy=False)
-
-    # X C  # Eq.34
-    data_c = -np.ones(nt * nx, dtype=int)
-    coord_c_row = np.arange(nt * nx, dtype=int)
-    coord_c_col = np.repeat(np.arange(nt, dtype=int), nx)
-
-    X_c = sp.coo_matrix(
-        (data_c, (coord_c_row, coord_c_col)), shape=(nt * nx, nt), copy=False)
+    data_gamma = 1 / (np.asarray(cal_ref).T.ravel() + 273.15)  # gamma
+
+    if plan is not None:
+        assert solver in ['sparse', 'direct', 'block'], \
+            'A CalibrationPlan is only used by the sparse, direct and ' \
+            'block solvers'
+        entry = plan.get(
+            plan.key(
+                'single', nt, x_all, ix_sec, ds.trans_att.values,
+                matching_indices, matrix_free))
+    else:
+        entry = dict()
+
+    if matrix_free:
+        assert solver != 'external_split', \
+            'The split matrices are not available with `matrix_free`'
+        X = construct_design_operator_single_ended(
+            nt,
+            x_sec,
+            np.asarray(cal_ref),
+            ds.trans_att.values,
+            x_all=x_all,
+            matching_indices=matching_indices)
+
+    elif 'X' in entry:
+        X = plan.refresh_gamma(entry, data_gamma)
 
-    # X ta #not documented
-    if ds.trans_att.size > 0:
-        TA_list = list()
+    else:
+        # X \gamma  # Eq.34
+        coord_gamma_row = np.arange(nt * nx, dtype=int)
+        coord_gamma_col = np.zeros(nt * nx, dtype=int)
+        X_gamma = sp.coo_matrix(
+            (data_gamma, (coord_gamma_row, coord_gamma_col)),
+            shape=(nt * nx, 1),
+            copy=False)
 
-        for transient_att_xi in ds.trans_att.values:
-            # first index on the right hand side a the difficult splice
-            # Deal with connector outside of fiber
-            if transient_att_xi >= x_sec[-1]:
-                ix_sec_ta_ix0 = nx
-            elif transient_att_xi <= x_sec[0]:
-                ix_sec_ta_ix0 = 0
-            else:
-                ix_sec_ta_ix0 = np.flatnonzero(x_sec >= transient_att_xi)[0]
+        # X \Delta\alpha  # Eq.34
+        data_dalpha = np.tile(-x_sec, nt)  # dalpha
+        coord_dalpha_row = np.arange(nt * nx, dtype=int)
+        coord_dalpha_col = np.zeros(nt * nx, dtype=int)
+        X_dalpha = sp.coo_matrix(
+            (data_dalpha, (coord_dalpha_row, coord_dalpha_col)),
+            shape=(nt * nx, 1),
+            copy=False)
 
-            # Data is -1
-            # I = 1/Tref*gamma - C - da - TA
-            data_ta = -np.ones(nt * (nx - ix_sec_ta_ix0), dtype=float)
+        # X C  # Eq.34
+        data_c = -np.ones(nt * nx, dtype=int)
+        coord_c_row = np.arange(nt * nx, dtype=int)
+        coord_c_col = np.repeat(np.arange(nt, dtype=int), nx)
 
-            # skip ix_sec_ta_ix0 locations, because they are upstream of
-            # the connector.
-            coord_ta_row = (
-                np.tile(np.arange(ix_sec_ta_ix0, nx), nt)
-                + np.repeat(np.arange(nx * nt, step=nx), nx - ix_sec_ta_ix0))
+        X_c = sp.coo_matrix(
+            (data_c, (coord_c_row, coord_c_col)), shape=(nt * nx, nt), copy=False)
 
-            # nt parameters
-            coord_ta_col = np.repeat(
-                np.arange(nt, dtype=int), nx - ix_sec_ta_ix0)
+        # X ta #not documented
+        if ds.trans_att.size > 0:
+            TA_list = list()
+
+            for transient_att_xi in ds.trans_att.values:
+                # first index on the right hand side a the difficult splice
+                # Deal with connector outside of fiber
+                if transient_att_xi >= x_sec[-1]:
+                    ix_sec_ta_ix0 = nx
+                elif transient_att_xi <= x_sec[0]:
+                    ix_sec_ta_ix0 = 0
+                else:
+                    ix_sec_ta_ix0 = np.flatnonzero(x_sec >= transient_att_xi)[0]
+
+                # Data is -1
+                # I = 1/Tref*gamma - C - da - TA
+                data_ta = -np.ones(nt * (nx - ix_sec_ta_ix0), dtype=float)
+
+                # skip ix_sec_ta_ix0 locations, because they are upstream of
+                # the connector.
+                coord_ta_row = (
+                    np.tile(np.arange(ix_sec_ta_ix0, nx), nt)
+                    + np.repeat(np.arange(nx * nt, step=nx), nx - ix_sec_ta_ix0))
+
+                # nt parameters
+                coord_ta_col = np.repeat(
+                    np.arange(nt, dtype=int), nx - ix_sec_ta_ix0)
+
+                TA_list.append(
+                    sp.coo_matrix(
+                        (data_ta, (coord_ta_row, coord_ta_col)),
+                        shape=(nt * nx, nt),
+                        copy=False))
+
+            X_TA = sp.hstack(TA_list)
 
-            TA_list.append(
-                sp.coo_matrix(
-                    (data_ta, (coord_ta_row, coord_ta_col)),
-                    shape=(nt * nx, nt),
-                    copy=False))
+        else:
+            X_TA = sp.coo_matrix(([], ([], [])), shape=(nt * nx, 0))
 
-        X_TA = sp.hstack(TA_list)
+        if np.any(matching_indices):
+            # first make matrix without the TA part (only diff in attentuation)
+            data_ma = np.tile(ds_ms1['x'].values - ds_ms0['x'].values, nt)
 
-    else:
-        X_TA = sp.coo_matrix(([], ([], [])), shape=(nt * nx, 0))
+            coord_ma_row = np.arange(nm * nt)
 
-    if np.any(matching_indices):
-        # first make matrix without the TA part (only diff in attentuation)
-        data_ma = np.tile(ds_ms1['x'].values - ds_ms0['x'].values, nt)
+            coord_ma_col = np.ones(nt * nm)
 
-        coord_ma_row = np.arange(nm * nt)
+            X_ma = sp.coo_matrix(
+                (data_ma, (coord_ma_row, coord_ma_col)),
+                shape=(nm * nt, 2 + nt),
+                copy=False)
 
-        coord_ma_col = np.ones(nt * nm)
+            # make TA matrix
+            if ds.trans_att.size > 0:
+                transient_m_data = np.zeros((nm, nta))
+                for ii, row in enumerate(matching_indices):
+                    for jj, transient_att_xi in enumerate(ds.trans_att.values):
+                        transient_m_data[ii, jj] = np.logical_and(
+                            transient_att_xi > x_all[row[0]],
+                            transient_att_xi < x_all[row[1]]).astype(int)
 
-        X_ma = sp.coo_matrix(
-            (data_ma, (coord_ma_row, coord_ma_col)),
-            shape=(nm * nt, 2 + nt),
-            copy=False)
+                data_mt = np.tile(transient_m_data, (nt, 1)).flatten('F')
 
-        # make TA matrix
-        if ds.trans_att.size > 0:
-            transient_m_data = np.zeros((nm, nta))
-            for ii, row in enumerate(matching_indices):
-                for jj, transient_att_xi in enumerate(ds.trans_att.values):
-                    transient_m_data[ii, jj] = np.logical_and(
-                        transient_att_xi > x_all[row[0]],
-                        transient_att_xi < x_all[row[1]]).astype(int)
+                coord_mt_row = (np.tile(np.arange(nm * nt), nta))
 
-            data_mt = np.tile(transient_m_data, (nt, 1)).flatten('F')
+                coord_mt_col = (
+                    np.tile(np.repeat(np.arange(nt), nm), nta)
+                    + np.repeat(np.arange(nta * nt, step=nt), nt * nm))
 
-            coord_mt_row = (np.tile(np.arange(nm * nt), nta))
+                X_mt = sp.coo_matrix(
+                    (data_mt, (coord_mt_row, coord_mt_col)),
+                    shape=(nm * nt, nta * nt),
+                    copy=False)
 
-            coord_mt_col = (
-                np.tile(np.repeat(np.arange(nt), nm), nta)
-                + np.repeat(np.arange(nta * nt, step=nt), nt * nm))
+            else:
+                X_mt = sp.coo_matrix(
+                    ([], ([], [])), shape=(nm * nt, 0), copy=False)
 
-            X_mt = sp.coo_matrix(
-                (data_mt, (coord_mt_row, coord_mt_col)),
-                shape=(nm * nt, nta * nt),
-                copy=False)
+            # merge the two
+            X_m = sp.hstack((X_ma, X_mt))
 
         else:
-            X_mt = sp.coo_matrix(
-                ([], ([], [])), shape=(nm * nt, 0), copy=False)
+            X_m = sp.coo_matrix(([], ([], [])), shape=(0, 2 + nt + nta * nt))
 
-        # merge the two
-        X_m = sp.hstack((X_ma, X_mt))
-
-    else:
-        X_m = sp.coo_matrix(([], ([], [])), shape=(0, 2 + nt + nta * nt))
+        # Stack all X's
+        X = sp.vstack((sp.hstack((X_gamma, X_dalpha, X_c, X_TA)), X_m))
 
-    # Stack all X's
-    X = sp.vstack((sp.hstack((X_gamma, X_dalpha, X_c, X_TA)), X_m))
+        if plan is not None:
+            X = plan.store(entry, X)
 
     # y, transpose the values to arrange them correctly
     y = np.log(ds_sec.st / ds_sec.ast).values.T.ravel()
@@ -257,8 +356,9 @@ def calibration_single_ended_solver(
         st_var_sec = parse_st_var(ds, st_var, st_label='st', ix_sel=ix_sec)
         ast_var_sec = parse_st_var(ds, ast_var, st_label='ast', ix_sel=ix_sec)
 
+        # transpose the values to arrange them in the same order as y
         w = 1 / (ds_sec.st**-2 * st_var_sec
-                 + ds_sec.ast**-2 * ast_var_sec).values.ravel()
+                 + ds_sec.ast**-2 * ast_var_sec).values.T.ravel()
 
         if np.any(matching_indices):
             st_var_ms0 = parse_st_var(
@@ -274,21 +374,48 @@ def calibration_single_ended_solver(
                 (ds_ms0.st.values**-2 * st_var_ms0) +
                 (ds_ms0.ast.values**-2 * ast_var_ms0) +
                 (ds_ms1.st.values**-2 * st_var_ms1) +
-                (ds_ms1.ast.values**-2 * ast_var_ms1)).ravel()
+                (ds_ms1.ast.values**-2 * ast_var_ms1)).T.ravel()
 
             w = np.hstack((w, w_ms))
     else:
         w = 1.  # unweighted
 
-    if solver == 'sparse':
+    # C and the transient attenuation are local to their time step
+    groups = np.concatenate(
+        ([-1, -1], np.arange(nt), np.tile(np.arange(nt), nta)))
+
+    # warm start from the previous calibration of the same geometry
+    x0 = entry.get('p_sol', p0_est_dalpha)
+
+    if solver in ['sparse', 'direct']:
         if calc_cov:
             p_sol, p_var, p_cov = wls_sparse(
-                X, y, w=w, x0=p0_est_dalpha, calc_cov=calc_cov, verbose=verbose)
+                X,
+                y,
+                w=w,
+                x0=x0,
+                calc_cov=calc_cov,
+                verbose=verbose,
+                groups=groups,
+                precondition=precondition,
+                backend='auto' if solver == 'direct' else 'lsqr',
+                diagnostics=diagnostics)
         else:
             p_sol, p_var = wls_sparse(
-                X, y, w=w, x0=p0_est_dalpha, calc_cov=calc_cov, verbose=verbose)
+                X,
+                y,
+                w=w,
+                x0=x0,
+                calc_cov=calc_cov,
+                verbose=verbose,
+                groups=groups,
+                precondition=precondition,
+                backend='auto' if solver == 'direct' else 'lsqr',
+                diagnostics=diagnostics)
 
     elif solver == 'stats':
+        assert not matrix_free, 'The stats solver requires a sparse X'
+
         if calc_cov:
             p_sol, p_var, p_cov = wls_stats(
                 X, y, w=w, calc_cov=calc_cov, verbose=verbose)
@@ -296,6 +423,35 @@ def calibration_single_ended_solver(
             p_sol, p_var = wls_stats(
                 X, y, w=w, calc_cov=calc_cov, verbose=verbose)
 
+    elif solver == 'block':
+        if plan is not None:
+            fac = plan.factorization(entry, X, w, data_gamma, groups)
+        else:
+            fac = None
+
+        if calc_cov:
+            p_sol, p_var, p_cov = wls_block(
+                X,
+                y,
+                w=w,
+                groups=groups,
+                x0=x0,
+                calc_cov=calc_cov,
+                verbose=verbose,
+                fac=fac,
+                diagnostics=diagnostics)
+        else:
+            p_sol, p_var = wls_block(
+                X,
+                y,
+                w=w,
+                groups=groups,
+                x0=x0,
+                calc_cov=calc_cov,
+                verbose=verbose,
+                fac=fac,
+                diagnostics=diagnostics)
+
     elif solver == 'external':
         return X, y, w, p0_est_dalpha
 
@@ -324,6 +480,9 @@ def calibration_single_ended_solver(
     else:
         raise ValueError("Choose a valid solver")
 
+    if plan is not None:
+        entry['p_sol'] = p_sol
+
     if calc_cov:
         return p_sol, p_var, p_cov
     else:
@@ -339,6 +498,11 @@ def calibration_double_ended_solver(
         calc_cov=True,
         solver='sparse',
         matching_indices=None,
+        matrix_free=False,
+        plan=None,
+        time_chunks=None,
+        precondition=None,
+        diagnostics=None,
         verbose=False):
     """
     The solver for double-ended setups. Assumes `ds` is pre-configured with
@@ -378,18 +542,46 @@ def calibration_double_ended_solver(
         variance is a function of the intensity (Poisson distributed) define an
         array with shape (nx, nt), where nx are the number of calibration
         locations.
-    calc_cov : bool
+    calc_cov : bool, str
         whether to calculate the covariance matrix. Required for calculation
-        of confidence boundaries. But uses a lot of memory.
-    solver : {'sparse', 'stats', 'external', 'external_split'}
+        of confidence boundaries. But uses a lot of memory. If `'blocks'` the
+        covariance is returned as a `BlockCovariance` object, which requires
+        far less memory.
+    solver : {'sparse', 'direct', 'stats', 'block', 'chunked', 'external',
+              'external_split'}
         Always use sparse to save memory. The statsmodel can be used to validate
-        sparse solver. `external` returns the matrices that would enter the
-        matrix solver (Eq.37). `external_split` returns a dictionary with
-        matrix X split in the coefficients per parameter. The use case for
-        the latter is when certain parameters are fixed/combined.
+        sparse solver. `direct` factorizes the normal equations of mid-sized
+        problems, see `wls_sparse` with `backend='auto'`. `block` eliminates either the parameters per time step
+        or E per location, see `double_ended_block_groups`. `chunked`
+        accumulates the normal equations per time chunk, see
+        `wls_time_chunks`. `external` returns
+        the matrices that would enter the matrix solver (Eq.37).
+        `external_split` returns a dictionary with matrix X split in the
+        coefficients per parameter. The use case for the latter is when
+        certain parameters are fixed/combined.
     matching_indices : array-like
         Is an array of size (np, 2), where np is the number of paired
         locations. This array is produced by `matching_sections()`.
+    matrix_free : bool
+        Represent X as a `DesignOperator` instead of a sparse matrix, so that
+        the row and column indices of all coefficients are never stored. Not
+        available for the `stats` and `external_split` solvers.
+    plan : CalibrationPlan, optional
+        Reuse the coefficient matrix, the previous solution, and the
+        factorization of the `block` solver of earlier calibrations of the
+        same geometry. The factorization is only reused for the same weights
+        and reference temperatures. Only for the `sparse` and `block`
+        solvers.
+    time_chunks : int, optional
+        Number of time steps per chunk for the `chunked` solver. Defaults to
+        the dask chunks of `ds.st`.
+    precondition : {'columns', 'blocks', None}
+        Right preconditioner of LSQR for the `sparse` solver, see
+        `lsqr_preconditioner`.
+    diagnostics : dict, optional
+        Is updated with the convergence diagnostics of the `sparse`, `block`
+        and `chunked` solvers, such as the number of iterations and an
+        estimate of the condition number.
     verbose : bool
 
     Returns
@@ -405,6 +597,58 @@ def calibration_double_ended_solver(
     nt = ds.time.size
     nta = ds.trans_att.size
 
+    if solver == 'chunked':
+        assert not matrix_free and plan is None, \
+            'The chunked solver builds the coefficient matrix per chunk'
+
+        if np.any(matching_indices):
+            n_E = matching_section_location_indices(
+                ix_sec, matching_indices[:, 0], matching_indices[:, 1]).size
+        else:
+            n_E = nx_sec - 1
+
+        def chunks():
+            for sl in time_chunk_slices(ds, time_chunks):
+                t = np.arange(nt)[sl]
+                ix = np.concatenate(
+                    (
+                        [0], 1 + t, 1 + nt + t, 1 + 2 * nt + np.arange(n_E),
+                        (
+                            1 + 2 * nt + n_E + np.arange(2 * nta)[:, None] * nt
+                            + t).ravel()))
+                X, y, w, x0 = calibration_double_ended_solver(
+                    ds.isel(time=sl),
+                    time_chunk_st_var(st_var, nt, sl),
+                    time_chunk_st_var(ast_var, nt, sl),
+                    time_chunk_st_var(rst_var, nt, sl),
+                    time_chunk_st_var(rast_var, nt, sl),
+                    calc_cov=False,
+                    solver='external',
+                    matching_indices=matching_indices)
+                yield X, y, w, x0, ix
+
+        out = wls_time_chunks(
+            chunks(),
+            1 + 2 * nt + n_E + 2 * nta * nt,
+            groups=double_ended_block_groups(
+                nt,
+                n_E,
+                nta,
+                matching_indices=matching_indices,
+                eliminate='time'),
+            calc_cov=calc_cov,
+            verbose=verbose,
+            diagnostics=diagnostics)
+
+        return double_ended_expand_solution(
+            ds,
+            *out,
+            st_var=st_var,
+            ast_var=ast_var,
+            rst_var=rst_var,
+            rast_var=rast_var,
+            matching_indices=matching_indices)
+
     # Calculate E as initial estimate for the E calibration.
     # Does not require ta to be passed on
     E_all_guess, E_all_var_guess = calc_alpha_double(
@@ -417,8 +661,42 @@ def calibration_double_ended_solver(
         ix_alpha_is_zero=ix_alpha_is_zero)
     df_est, db_est = calc_df_db_double_est(ds, ix_alpha_is_zero, 485.)
 
-    E, Z_D, Z_gamma, Zero_d, Z_TA_fw, Z_TA_bw, = \
-        construct_submatrices(nt, nx_sec, ds, ds.trans_att.values, x_sec)
+    cal_ref = np.array(
+        ds.ufunc_per_section(
+            label='st', ref_temp_broadcasted=True, calc_per='all'))
+    data_gamma = np.tile(1 / (cal_ref.ravel() + 273.15), 2)  # F and B
+
+    if plan is not None:
+        assert solver in ['sparse', 'direct', 'block'], \
+            'A CalibrationPlan is only used by the sparse, direct and ' \
+            'block solvers'
+        entry = plan.get(
+            plan.key(
+                'double', nt, ds.x.values, ix_sec, ds.trans_att.values,
+                matching_indices, matrix_free))
+    else:
+        entry = dict()
+
+    # the coefficient matrix of a known geometry is reused
+    build_X = not matrix_free and 'X' not in entry
+
+    if matrix_free:
+        assert solver != 'external_split', \
+            'The split matrices are not available with `matrix_free`'
+        X = construct_design_operator_double_ended(
+            nt,
+            ds.x.values,
+            ix_sec,
+            cal_ref,
+            ds.trans_att.values,
+            matching_indices=matching_indices)
+
+    elif not build_X:
+        X = plan.refresh_gamma(entry, data_gamma)
+
+    else:
+        E, Z_D, Z_gamma, Zero_d, Z_TA_fw, Z_TA_bw, = \
+            construct_submatrices(nt, nx_sec, ds, ds.trans_att.values, x_sec)
 
     # y  # Eq.41--45
     y_F = np.log(ds_sec.st / ds_sec.ast).values.ravel()
@@ -449,56 +727,69 @@ def calibration_double_ended_solver(
                 nta * nt * 2 * [0.]))
 
         # Stack all X's
-        X = sp.vstack(
-            (
-                sp.hstack((Z_gamma, -Z_D, Zero_d, -E, Z_TA_fw)),
-                sp.hstack((Z_gamma, Zero_d, -Z_D, E, Z_TA_bw))))
+        if build_X:
+            X = sp.vstack(
+                (
+                    sp.hstack((Z_gamma, -Z_D, Zero_d, -E, Z_TA_fw)),
+                    sp.hstack((Z_gamma, Zero_d, -Z_D, E, Z_TA_bw))))
 
         y = np.concatenate((y_F, y_B))
         w = np.concatenate((w_F, w_B))
 
     else:
-        E_match_F, E_match_B, E_match_no_cal, Z_TA_eq1, Z_TA_eq2, \
-            Z_TA_eq3, d_no_cal, ix_from_cal_match_to_glob, ix_match_not_cal, \
-            Zero_eq12_gamma, Zero_eq3_gamma, Zero_d_eq12 = \
-            construct_submatrices_matching_sections(
-                ds.x.values, ix_sec, matching_indices[:, 0],
-                matching_indices[:, 1], nt, ds.trans_att.values)
+        if not build_X:
+            ix_from_cal_match_to_glob = matching_section_location_indices(
+                ix_sec, matching_indices[:, 0], matching_indices[:, 1])
+            ix_match_not_cal = np.setdiff1d(matching_indices.ravel(), ix_sec)
+
+        else:
+            E_match_F, E_match_B, E_match_no_cal, Z_TA_eq1, Z_TA_eq2, \
+                Z_TA_eq3, d_no_cal, ix_from_cal_match_to_glob, \
+                ix_match_not_cal, Zero_eq12_gamma, Zero_eq3_gamma, \
+                Zero_d_eq12 = construct_submatrices_matching_sections(
+                    ds.x.values, ix_sec, matching_indices[:, 0],
+                    matching_indices[:, 1], nt, ds.trans_att.values)
 
         p0_est = np.concatenate(
             (
                 np.asarray([485.] + 2 * nt * [1.4]),
                 E_all_guess[ix_from_cal_match_to_glob], nta * nt * 2 * [0.]))
-        # Stack all X's
-        # X_sec contains a different number of columns than X.
-        X_sec = sp.vstack(
-            (
-                sp.hstack((Z_gamma, -Z_D, Zero_d, -E, Z_TA_fw)),
-                sp.hstack((Z_gamma, Zero_d, -Z_D, E, Z_TA_bw))))
-        X_sec2 = sp.csr_matrix(
-            ([], ([], [])),
-            shape=(2 * nt * nx_sec, 1 + 2 * nt + ds.x.size + 2 * nta * nt))
 
-        from_i = np.concatenate(
-            (
-                np.arange(1 + 2 * nt), 1 + 2 * nt + ix_sec[1:],
-                np.arange(
-                    1 + 2 * nt + ds.x.size,
-                    1 + 2 * nt + ds.x.size + 2 * nta * nt)))
-        X_sec2[:, from_i] = X_sec
-        from_i2 = np.concatenate(
-            (
-                np.arange(1 + 2 * nt), 1 + 2 * nt + ix_from_cal_match_to_glob,
-                np.arange(
-                    1 + 2 * nt + ds.x.size,
-                    1 + 2 * nt + ds.x.size + 2 * nta * nt)))
-        X = sp.vstack(
-            (
-                X_sec2[:, from_i2],
-                sp.hstack((Zero_eq12_gamma, Zero_d_eq12, E_match_F, Z_TA_eq1)),
-                sp.hstack((Zero_eq12_gamma, Zero_d_eq12, E_match_B, Z_TA_eq2)),
-                sp.hstack(
-                    (Zero_eq3_gamma, d_no_cal, E_match_no_cal, Z_TA_eq3))))
+        if build_X:
+            # Stack all X's
+            # X_sec contains a different number of columns than X.
+            X_sec = sp.vstack(
+                (
+                    sp.hstack((Z_gamma, -Z_D, Zero_d, -E, Z_TA_fw)),
+                    sp.hstack((Z_gamma, Zero_d, -Z_D, E, Z_TA_bw))))
+            X_sec2 = sp.csr_matrix(
+                ([], ([], [])),
+                shape=(
+                    2 * nt * nx_sec, 1 + 2 * nt + ds.x.size + 2 * nta * nt))
+
+            from_i = np.concatenate(
+                (
+                    np.arange(1 + 2 * nt), 1 + 2 * nt + ix_sec[1:],
+                    np.arange(
+                        1 + 2 * nt + ds.x.size,
+                        1 + 2 * nt + ds.x.size + 2 * nta * nt)))
+            X_sec2[:, from_i] = X_sec
+            from_i2 = np.concatenate(
+                (
+                    np.arange(1 + 2 * nt),
+                    1 + 2 * nt + ix_from_cal_match_to_glob,
+                    np.arange(
+                        1 + 2 * nt + ds.x.size,
+                        1 + 2 * nt + ds.x.size + 2 * nta * nt)))
+            X = sp.vstack(
+                (
+                    X_sec2[:, from_i2],
+                    sp.hstack(
+                        (Zero_eq12_gamma, Zero_d_eq12, E_match_F, Z_TA_eq1)),
+                    sp.hstack(
+                        (Zero_eq12_gamma, Zero_d_eq12, E_match_B, Z_TA_eq2)),
+                    sp.hstack(
+                        (Zero_eq3_gamma, d_no_cal, E_match_no_cal, Z_TA_eq3))))
 
         y_F = np.log(ds_sec.st / ds_sec.ast).values.ravel()
         y_B = np.log(ds_sec.rst / ds_sec.rast).values.ravel()
@@ -558,10 +849,34 @@ def calibration_double_ended_solver(
 
         w = np.concatenate((w_F, w_B, w_eq1, w_eq2, w_eq3))
 
-    if solver == 'sparse':
+    if build_X and plan is not None:
+        X = plan.store(entry, X)
+
+    # warm start from the previous calibration of the same geometry
+    p0_est = entry.get('p_sol', p0_est)
+    solver_kwargs = dict()
+
+    if solver in ['sparse', 'direct']:
         solver_fun = wls_sparse
+        solver_kwargs['precondition'] = precondition
+        solver_kwargs['backend'] = 'auto' if solver == 'direct' else 'lsqr'
+        solver_kwargs['diagnostics'] = diagnostics
+        solver_kwargs['groups'] = double_ended_block_groups(
+            nt, p0_est.size - 1 - 2 * nt - 2 * nt * nta, nta,
+            matching_indices=matching_indices)
     elif solver == 'stats':
+        assert not matrix_free, 'The stats solver requires a sparse X'
         solver_fun = wls_stats
+    elif solver == 'block':
+        solver_fun = wls_block
+        solver_kwargs['diagnostics'] = diagnostics
+        solver_kwargs['groups'] = double_ended_block_groups(
+            nt, p0_est.size - 1 - 2 * nt - 2 * nt * nta, nta,
+            matching_indices=matching_indices)
+
+        if plan is not None:
+            solver_kwargs['fac'] = plan.factorization(
+                entry, X, w, data_gamma, solver_kwargs['groups'])
     elif solver == 'external':
         return X, y, w, p0_est
     elif solver == 'external_split':
@@ -610,7 +925,8 @@ def calibration_double_ended_solver(
         x0=p0_est,
         calc_cov=calc_cov,
         verbose=verbose,
-        return_werr=verbose)
+        return_werr=verbose,
+        **solver_kwargs)
     if calc_cov and verbose:
         p_sol, p_var, p_cov, werr = out
     elif not calc_cov and verbose:
@@ -620,12 +936,81 @@ def calibration_double_ended_solver(
     elif not calc_cov and not verbose:
         p_sol, p_var = out
 
+    if plan is not None:
+        entry['p_sol'] = p_sol
+
     # if verbose:
     #     from dtscalibration.plot import plot_location_residuals_double_ended
     #
     #     dv = plot_location_residuals_double_ended(ds, werr, hix, tix, ix_sec,
     #                                               ix_match_not_cal, nt)
 
+    if calc_cov:
+        return double_ended_expand_solution(
+            ds,
+            p_sol,
+            p_var,
+            p_cov,
+            st_var=st_var,
+            ast_var=ast_var,
+            rst_var=rst_var,
+            rast_var=rast_var,
+            matching_indices=matching_indices)
+    else:
+        return double_ended_expand_solution(
+            ds,
+            p_sol,
+            p_var,
+            st_var=st_var,
+            ast_var=ast_var,
+            rst_var=rst_var,
+            rast_var=rast_var,
+            matching_indices=matching_indices)
+
+
+def double_ended_expand_solution(
+        ds,
+        p_sol,
+        p_var,
+        p_cov=None,
+        st_var=None,
+        ast_var=None,
+        rst_var=None,
+        rast_var=None,
+        matching_indices=None):
+    """
+    Expand the solution of the double-ended calibration, which contains the
+    integrated differential attenuation (E) of the locations within the
+    reference and matching sections, to a solution with E at all locations.
+
+    Parameters
+    ----------
+    ds : DataStore
+    p_sol, p_var : array-like
+        Solution and its variance of the least squares problem.
+    p_cov : array-like, BlockCovariance, optional
+        Covariance of the solution of the least squares problem.
+    st_var, ast_var, rst_var, rast_var : float, array-like, optional
+        See `calibration_double_ended_solver`.
+    matching_indices : array-like
+        Is an array of size (np, 2), where np is the number of paired
+        locations. This array is produced by `matching_sections()`.
+
+    Returns
+    -------
+    po_sol, po_var[, po_cov]
+    """
+    ix_sec = ds.ufunc_per_section(x_indices=True, calc_per='all')
+    ix_alpha_is_zero = ix_sec[0]  # per definition of E
+    nx_sec = ix_sec.size
+    nt = ds.time.size
+    nta = ds.trans_att.size
+    calc_cov = p_cov is not None
+
+    if np.any(matching_indices):
+        ix_from_cal_match_to_glob = matching_section_location_indices(
+            ix_sec, matching_indices[:, 0], matching_indices[:, 1])
+
     # p_sol contains the int diff att of all the locations within the
     # reference sections. po_sol is its expanded version that contains also
     # the int diff att for outside the reference sections.
@@ -714,8 +1099,6 @@ def calibration_double_ended_solver(
 
     if calc_cov:
         # the COV can be expensive to compute (in the least squares routine)
-        po_cov = np.diag(po_var).copy()
-
         if np.any(matching_indices):
             from_i = np.concatenate(
                 (
@@ -732,6 +1115,10 @@ def calibration_double_ended_solver(
                         1 + 2 * nt + nx_sec,
                         1 + 2 * nt + nx_sec + nta * nt * 2)))
 
+        if isinstance(p_cov, BlockCovariance):
+            return po_sol, po_var, p_cov.embed(from_i, po_var)
+
+        po_cov = np.diag(po_var).copy()
         iox_sec1, iox_sec2 = np.meshgrid(from_i, from_i, indexing='ij')
         po_cov[iox_sec1, iox_sec2] = p_cov
 
@@ -741,6 +1128,64 @@ def calibration_double_ended_solver(
         return po_sol, po_var
 
 
+def double_ended_block_groups(
+        nt, n_E, nta, matching_indices=None, eliminate='auto'):
+    """
+    The groups of the double-ended parameters
+    [gamma, D_fw(nt), D_bw(nt), E(n_E), TA(2 * nt * nta)] for `wls_block`.
+
+    The observations couple every time step to every location, so either
+    the parameters of a time step (D_fw, D_bw and the transient attenuation)
+    are eliminated per time step, leaving gamma and E as global parameters,
+    or E is eliminated per location, leaving gamma, D_fw, D_bw and the
+    transient attenuation as global parameters.
+
+    Parameters
+    ----------
+    nt : int
+        Number of time steps
+    n_E : int
+        Number of E parameters. Zero if alpha is fixed.
+    nta : int
+        Number of transient attenuation locations
+    matching_indices : array-like, optional
+        Matching sections couple E at two locations, so then only the
+        elimination per time step is possible.
+    eliminate : {'auto', 'time', 'x'}
+        `'auto'` chooses the elimination that leaves the smallest reduced
+        system.
+
+    Returns
+    -------
+    groups : array-like of int
+        Of size 1 + 2 * nt + n_E + 2 * nt * nta
+    """
+    n_per_time = 2 * (1 + nta)
+
+    if eliminate == 'auto':
+        if np.any(matching_indices) or n_E <= nt * n_per_time:
+            eliminate = 'time'
+        else:
+            eliminate = 'x'
+
+    if eliminate == 'time':
+        return np.concatenate(
+            (
+                [-1], np.arange(nt), np.arange(nt), -np.ones(n_E, dtype=int),
+                np.tile(np.arange(nt), 2 * nta)))
+
+    elif eliminate == 'x':
+        assert not np.any(matching_indices), \
+            'Matching sections couple E at two locations'
+        return np.concatenate(
+            (
+                -np.ones(1 + 2 * nt, dtype=int), np.arange(n_E),
+                -np.ones(2 * nt * nta, dtype=int)))
+
+    else:
+        raise ValueError("Choose eliminate from {'auto', 'time', 'x'}")
+
+
 def matching_section_location_indices(ix_sec, hix, tix):
     # contains all indices of the entire fiber that either are used for
     # calibrating to reference temperature or for matching sections. Is sorted.
@@ -1066,6 +1511,719 @@ def construct_submatrices(nt, nx, ds, trans_att, x_sec):
     return E, Z_D, Z_gamma, Zero_d, Z_TA_fw, Z_TA_bw
 
 
+class DesignOperator(ln.LinearOperator):
+    """
+    Matrix-free coefficient matrix X of the calibration problems. The
+    observations are divided in blocks, and the observations of each block
+    form a (nloc, nt) grid of locations and time steps. The coefficients of
+    a block are described by three types of terms, so that the row and
+    column indices of X are never stored:
+
+    - `full`: (k, coef). One parameter `k` with a coefficient per
+      observation, `coef` broadcasts to (nloc, nt). E.g., gamma.
+    - `time`: (k0, a). One parameter per time step, `k0` is the index of the
+      parameter of the first time step, and `a` is the coefficient per
+      location, of size nloc. E.g., C and the transient attenuation.
+    - `loc`: (cols, b). One parameter per location, `cols` contains the
+      index of the parameter for each location, or -1 for none, and `b`
+      contains the coefficient per location. E.g., the integrated
+      differential attenuation E.
+
+    Parameters
+    ----------
+    npar : int
+        Number of parameters
+    blocks : list of dict
+        With keys `shape`, (nloc, nt), `time_major`, True if the
+        observations of a time step are stored consecutively, and `full`,
+        `time`, and `loc`, each a list of terms.
+    w_std : array-like, optional
+        The square root of the weights, of size nobs. The rows of X are
+        multiplied with `w_std`.
+    """
+
+    def __init__(self, npar, blocks, w_std=None):
+        self.blocks = blocks
+        self.w_std = w_std
+        nobs = sum(int(np.prod(block['shape'])) for block in blocks)
+        super().__init__(dtype=float, shape=(nobs, npar))
+
+    def weighted(self, w_std):
+        """The rows of X multiplied with `w_std`"""
+        w_std = np.broadcast_to(np.ravel(w_std), (self.shape[0],))
+
+        if self.w_std is not None:
+            w_std = w_std * self.w_std
+
+        return DesignOperator(self.shape[1], self.blocks, w_std=w_std)
+
+    def isfinite(self):
+        """Whether all coefficients are finite"""
+        for block in self.blocks:
+            for terms in [block['full'], block['time'], block['loc']]:
+                for _, coef in terms:
+                    if not np.all(np.isfinite(coef)):
+                        return False
+
+        return self.w_std is None or np.all(np.isfinite(self.w_std))
+
+    def gram(self):
+        """
+        The normal matrix X^T X, computed from the terms of the blocks.
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            Of shape (npar, npar)
+        """
+        npar = self.shape[1]
+        rows, cols, vals = [], [], []
+
+        for block, w in zip(self.blocks, self._grids(self._weights())):
+            nloc, nt = block['shape']
+            it = np.arange(nt)
+            terms = [('full', k, np.broadcast_to(c, (nloc, nt)))
+                     for k, c in block['full']]
+            terms += [('time', k0, a) for k0, a in block['time']]
+            terms += [
+                ('loc', np.where(c >= 0, c, 0), np.where(c >= 0, b, 0.))
+                for c, b in block['loc']]
+
+            # The terms are ordered by kind, so only the upper half of the
+            # combinations of kinds needs to be considered
+            for i1, (kind1, k1, c1) in enumerate(terms):
+                for i2, (kind2, k2, c2) in enumerate(terms[i1:], i1):
+                    if kind1 == 'full' and kind2 == 'full':
+                        r, c, v = k1, k2, np.sum(c1 * c2 * w)
+                    elif kind1 == 'full' and kind2 == 'time':
+                        r, c, v = k1, k2 + it, np.sum(c1 * c2[:, None] * w, 0)
+                    elif kind1 == 'full' and kind2 == 'loc':
+                        r, c, v = k1, k2, c2 * np.sum(c1 * w, 1)
+                    elif kind1 == 'time' and kind2 == 'time':
+                        r, c, v = k1 + it, k2 + it, (c1 * c2).dot(w)
+                    elif kind1 == 'time' and kind2 == 'loc':
+                        r = np.broadcast_to(k1 + it[None], (nloc, nt))
+                        c = np.broadcast_to(k2[:, None], (nloc, nt))
+                        v = (c1 * c2)[:, None] * w
+                    else:
+                        r, c, v = k1, k2, c1 * c2 * np.sum(w, 1)
+
+                    r, c, v = np.broadcast_arrays(r, c, v)
+                    rows.append(r.ravel())
+                    cols.append(c.ravel())
+                    vals.append(v.ravel())
+
+                    if i1 != i2:
+                        rows.append(c.ravel())
+                        cols.append(r.ravel())
+                        vals.append(v.ravel())
+
+        return sp.coo_matrix(
+            (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+            shape=(npar, npar)).tocsr()
+
+    def _matvec(self, p):
+        p = np.ravel(p)
+        out = []
+
+        for block in self.blocks:
+            nloc, nt = block['shape']
+            y = np.zeros((nloc, nt))
+
+            for k, coef in block['full']:
+                y += coef * p[k]
+
+            for k0, a in block['time']:
+                y += a[:, None] * p[k0:k0 + nt][None]
+
+            for cols, b in block['loc']:
+                valid = cols >= 0
+                y[valid] += (b[valid] * p[cols[valid]])[:, None]
+
+            out.append(y.T.ravel() if block['time_major'] else y.ravel())
+
+        out = np.concatenate(out)
+
+        if self.w_std is not None:
+            out *= self.w_std
+
+        return out
+
+    def _rmatvec(self, r):
+        r = np.ravel(r)
+
+        if self.w_std is not None:
+            r = r * self.w_std
+
+        out = np.zeros(self.shape[1])
+
+        for block, rb in zip(self.blocks, self._grids(r)):
+            nt = block['shape'][1]
+
+            for k, coef in block['full']:
+                out[k] += np.sum(coef * rb)
+
+            for k0, a in block['time']:
+                out[k0:k0 + nt] += a.dot(rb)
+
+            for cols, b in block['loc']:
+                valid = cols >= 0
+                np.add.at(out, cols[valid], b[valid] * rb[valid].sum(axis=1))
+
+        return out
+
+    def _weights(self):
+        if self.w_std is None:
+            return np.ones(self.shape[0])
+        else:
+            return self.w_std**2
+
+    def _grids(self, v):
+        """Split `v`, of size nobs, in (nloc, nt) arrays per block"""
+        i0 = 0
+
+        for block in self.blocks:
+            nloc, nt = block['shape']
+            vb = v[i0:i0 + nloc * nt]
+            i0 += nloc * nt
+
+            if block['time_major']:
+                yield vb.reshape((nt, nloc)).T
+            else:
+                yield vb.reshape((nloc, nt))
+
+
+def _ta_start_index(x, trans_att):
+    """First index of `x` on the right hand side of the connector"""
+    if trans_att >= x[-1]:
+        return x.size
+    elif trans_att <= x[0]:
+        return 0
+    else:
+        return np.flatnonzero(x >= trans_att)[0]
+
+
+def construct_design_operator_single_ended(
+        nt, x_sec, cal_ref, trans_att, x_all=None, matching_indices=None):
+    """
+    The coefficient matrix of `calibration_single_ended_solver` as
+    `DesignOperator`.
+
+    Parameters
+    ----------
+    nt : int
+    x_sec : array-like
+        Locations of the reference sections
+    cal_ref : array-like
+        Reference temperatures in degC, of shape (nx_sec, nt)
+    trans_att : array-like
+        Locations of the connectors
+    x_all : array-like, optional
+        Locations of the entire fiber. Required with `matching_indices`.
+    matching_indices : array-like, optional
+        See `matching_sections()`
+
+    Returns
+    -------
+    DesignOperator
+    """
+    nx = x_sec.size
+    nta = trans_att.size
+    npar = 2 + nt + nta * nt
+
+    # I = 1/Tref*gamma - C - da - TA
+    block_sec = dict(
+        shape=(nx, nt),
+        time_major=True,
+        full=[(0, 1 / (cal_ref + 273.15)), (1, -x_sec[:, None])],
+        time=[(2, -np.ones(nx))],
+        loc=[])
+
+    for ita, trans_atti in enumerate(trans_att):
+        ix0 = _ta_start_index(x_sec, trans_atti)
+        block_sec['time'].append(
+            (2 + nt + ita * nt, -(np.arange(nx) >= ix0).astype(float)))
+
+    blocks = [block_sec]
+
+    if np.any(matching_indices):
+        hix, tix = matching_indices[:, 0], matching_indices[:, 1]
+        block_m = dict(
+            shape=(hix.size, nt),
+            time_major=True,
+            full=[(1, (x_all[tix] - x_all[hix])[:, None])],
+            time=[],
+            loc=[])
+
+        for ita, trans_atti in enumerate(trans_att):
+            block_m['time'].append(
+                (
+                    2 + nt + ita * nt,
+                    np.logical_and(
+                        trans_atti > x_all[hix],
+                        trans_atti < x_all[tix]).astype(float)))
+
+        blocks.append(block_m)
+
+    return DesignOperator(npar, blocks)
+
+
+def construct_design_operator_double_ended(
+        nt, x, ix_sec, cal_ref, trans_att, matching_indices=None):
+    """
+    The coefficient matrix of `calibration_double_ended_solver` as
+    `DesignOperator`. E is zero at the first index of the reference section.
+
+    Parameters
+    ----------
+    nt : int
+    x : array-like
+        Locations of the entire fiber
+    ix_sec : array-like of int
+        Indices of the reference sections
+    cal_ref : array-like
+        Reference temperatures in degC, of shape (nx_sec, nt)
+    trans_att : array-like
+        Locations of the connectors
+    matching_indices : array-like, optional
+        See `matching_sections()`
+
+    Returns
+    -------
+    DesignOperator
+    """
+    nx_sec = ix_sec.size
+    nta = trans_att.size
+    x_sec = x[ix_sec]
+
+    if np.any(matching_indices):
+        hix, tix = matching_indices[:, 0], matching_indices[:, 1]
+        ix_E = matching_section_location_indices(ix_sec, hix, tix)
+    else:
+        ix_E = ix_sec[1:]
+
+    # Index of the parameter E per location
+    col_E = -np.ones(x.size, dtype=int)
+    col_E[ix_E] = 1 + 2 * nt + np.arange(ix_E.size)
+    i_ta = 1 + 2 * nt + ix_E.size
+    npar = i_ta + 2 * nta * nt
+
+    # I_fw = 1/Tref*gamma - D_fw - E - TA_fw
+    # I_bw = 1/Tref*gamma - D_bw + E - TA_bw
+    gamma = [(0, 1 / (cal_ref + 273.15))]
+    block_fw = dict(
+        shape=(nx_sec, nt),
+        time_major=False,
+        full=gamma,
+        time=[(1, -np.ones(nx_sec))],
+        loc=[(col_E[ix_sec], -np.ones(nx_sec))])
+    block_bw = dict(
+        shape=(nx_sec, nt),
+        time_major=False,
+        full=gamma,
+        time=[(1 + nt, -np.ones(nx_sec))],
+        loc=[(col_E[ix_sec], np.ones(nx_sec))])
+
+    for ita, trans_atti in enumerate(trans_att):
+        is_fw = np.arange(nx_sec) >= _ta_start_index(x_sec, trans_atti)
+        block_fw['time'].append((i_ta + 2 * ita * nt, -is_fw.astype(float)))
+        block_bw['time'].append(
+            (i_ta + 2 * ita * nt + nt, -(~is_fw).astype(float)))
+
+    blocks = [block_fw, block_bw]
+
+    if np.any(matching_indices):
+        ix_match_not_cal = np.setdiff1d(np.concatenate((hix, tix)), ix_sec)
+        nx_nm = ix_match_not_cal.size
+        ones = np.ones(hix.size)
+
+        # F1 - F2 = E2 - E1 + TAF2 - TAF1  # EQ1
+        # B1 - B2 = E1 - E2 + TAB2 - TAB1  # EQ2
+        # (B3 - F3) / 2 = E3 + (df-db) / 2 + (TAF3 - TAB3) / 2  # EQ3
+        block_eq1 = dict(
+            shape=(hix.size, nt),
+            time_major=False,
+            full=[],
+            time=[],
+            loc=[(col_E[hix], -ones), (col_E[tix], ones)])
+        block_eq2 = dict(
+            shape=(hix.size, nt),
+            time_major=False,
+            full=[],
+            time=[],
+            loc=[(col_E[hix], ones), (col_E[tix], -ones)])
+        block_eq3 = dict(
+            shape=(nx_nm, nt),
+            time_major=False,
+            full=[],
+            time=[(1, np.ones(nx_nm) / 2), (1 + nt, -np.ones(nx_nm) / 2)],
+            loc=[(col_E[ix_match_not_cal], np.ones(nx_nm))])
+
+        for ita, trans_atti in enumerate(trans_att):
+            ix0 = _ta_start_index(x, trans_atti)
+            k0 = i_ta + 2 * ita * nt
+            block_eq1['time'].append(
+                (k0, (tix >= ix0).astype(float) - (hix >= ix0)))
+            block_eq2['time'].append(
+                (k0 + nt, (tix < ix0).astype(float) - (hix < ix0)))
+            block_eq3['time'].append(
+                (k0, (ix_match_not_cal >= ix0).astype(float) / 2))
+            block_eq3['time'].append(
+                (k0 + nt, -(ix_match_not_cal < ix0).astype(float) / 2))
+
+        blocks += [block_eq1, block_eq2, block_eq3]
+
+    return DesignOperator(npar, blocks)
+
+
+class CalibrationPlan(object):
+    """
+    Cache for repeated calibrations of the same geometry, e.g., a cable that
+    is recalibrated every few minutes with new measurements. Pass the same
+    plan to every call of `calibration_single_ended()` or
+    `calibration_double_ended()`.
+
+    The cache is keyed on the geometry: the locations, the reference
+    sections, the connectors, the matching sections, and the number of time
+    steps. For a known geometry the coefficient matrix is not assembled
+    again, only the coefficients of gamma are refreshed with the new
+    reference temperatures. The previous solution is used as initial
+    estimate, and the factorization of the block solver is reused if the
+    coefficients and the weights did not change.
+
+    The weights of 'wls' follow from the variances and the measured Stokes
+    intensities, and the coefficients of gamma from the reference
+    temperatures, so new measurements change them, also for a fixed
+    `st_var` and `ast_var`. The factorization is therefore only reused if the
+    same measurements are calibrated again, e.g., with other initial
+    estimates, or for 'ols' with constant reference temperatures. It is not
+    reused otherwise, as the variances of the parameters follow from it.
+
+    Parameters
+    ----------
+    maxsize : int
+        Number of geometries that are kept. The least recently used geometry
+        is removed first.
+
+    Examples
+    --------
+    >>> plan = CalibrationPlan()
+    >>> for ds in measurements:  # doctest: +SKIP
+    ...     ds.calibration_single_ended(
+    ...         sections=sections, st_var=st_var, ast_var=ast_var,
+    ...         method='wls', solver='block', plan=plan)
+    """
+
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = dict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return (
+            f'CalibrationPlan({len(self)} geometries, {self.hits} hits, '
+            f'{self.misses} misses)')
+
+    @staticmethod
+    def key(*args):
+        """Hash of the geometry. Arrays are hashed by value."""
+        h = hashlib.sha1()
+
+        for arg in args:
+            arg = np.asarray(arg if arg is not None else [])
+            h.update(str((arg.dtype, arg.shape)).encode())
+            h.update(np.ascontiguousarray(arg).tobytes())
+
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        The cached entry of the geometry `key`. A new entry is created if the
+        geometry is unknown.
+
+        Returns
+        -------
+        dict
+            With the coefficient matrix `X` if it was stored before.
+        """
+        if key in self._entries:
+            self.hits += 1
+            entry = self._entries.pop(key)
+
+        else:
+            self.misses += 1
+            entry = dict()
+
+            if len(self._entries) >= self.maxsize:
+                del self._entries[next(iter(self._entries))]
+
+        # dicts are ordered, the most recently used entry is last
+        self._entries[key] = entry
+        return entry
+
+    @staticmethod
+    def store(entry, X):
+        """
+        Store the coefficient matrix `X` in `entry`, in CSR format. A
+        `DesignOperator` is cheap to construct and is not stored.
+
+        Returns
+        -------
+        X
+        """
+        if isinstance(X, DesignOperator):
+            return X
+
+        X = sp.csr_matrix(X)
+        entry['X'] = X
+        entry['gamma_pos'] = np.flatnonzero(X.indices == 0)
+        return X
+
+    @staticmethod
+    def refresh_gamma(entry, gamma):
+        """
+        Set the coefficients of gamma, the first parameter, of the stored
+        coefficient matrix to `gamma`, in the order of the rows.
+
+        Returns
+        -------
+        X
+        """
+        X = entry['X']
+        assert entry['gamma_pos'].size == np.size(gamma), \
+            'The stored coefficient matrix does not match the reference ' \
+            'temperatures'
+        X.data[entry['gamma_pos']] = gamma
+        return X
+
+    @staticmethod
+    def factorization(entry, X, w, gamma, groups):
+        """
+        Factorization of the weighted normal matrix for `wls_block`. Reused
+        if `w`, `gamma`, and `groups` are equal to those of the previous call,
+        which requires the same measurements and reference temperatures.
+        """
+        w = np.asarray(w, dtype=float)
+        reuse = (
+            'fac' in entry and np.array_equal(entry['w'], w)
+            and np.array_equal(entry['gamma'], gamma)
+            and np.array_equal(entry['groups'], groups))
+
+        if not reuse:
+            w_std = np.broadcast_to(np.sqrt(w), (X.shape[0],))
+            wX = weighted_design(X, w_std)
+            entry.update(
+                fac=block_factorize(normal_matrix(wX), groups),
+                w=w.copy(),
+                gamma=np.array(gamma),
+                groups=np.array(groups))
+
+        return entry['fac']
+
+
+class OnlineSingleEndedCalibration(object):
+    """
+    Recursive single-ended calibration for measurements that arrive one time
+    step at a time. The parameters and the coefficients are those of
+    `calibration_single_ended_solver`, without matching sections.
+
+    C and the transient attenuation are local to a time step, so they are
+    eliminated from the normal equations of each new time step. Only the
+    reduced 2x2 normal equations of gamma and dalpha are accumulated. After
+    every update, gamma and dalpha equal the weighted least squares solution
+    of all time steps received so far, and the cost of an update is linear
+    in the number of reference locations.
+
+    Parameters
+    ----------
+    ds : DataStore
+        Defines the locations, and the reference sections and connectors if
+        `sections` and `trans_att` are not given. Its Stokes data is not used.
+    sections : Dict[str, List[slice]], optional
+        The reference sections. Defaults to `ds.sections`.
+    st_var, ast_var : float, callable, array-like, optional
+        The variance of the noise of the Stokes and anti-Stokes, see
+        `calibration_single_ended()`. Array-like should be of size nx. If
+        `None`, all observations have the same weight (OLS).
+    trans_att : iterable, optional
+        Locations of the connectors. Defaults to `ds.trans_att`.
+
+    Attributes
+    ----------
+    gamma, dalpha : float
+        Current estimates.
+    p_cov : array-like
+        Covariance of gamma and dalpha, of shape (2, 2).
+    c, talpha : float, array-like
+        C and the transient attenuation of the last time step.
+    nt : int
+        Number of time steps received.
+
+    Examples
+    --------
+    >>> cal = OnlineSingleEndedCalibration(  # doctest: +SKIP
+    ...     ds, st_var=5., ast_var=5.)
+    >>> for st, ast, cold, warm in stream:  # doctest: +SKIP
+    ...     tmpf = cal.update(st, ast, {'cold': cold, 'warm': warm})
+    """
+
+    def __init__(
+            self, ds, sections=None, st_var=None, ast_var=None,
+            trans_att=None):
+        if sections is None:
+            sections = ds.sections
+
+        if trans_att is None:
+            trans_att = ds.trans_att.values if 'trans_att' in ds else []
+
+        self.x = ds.x.values
+        self.sections = sections
+        self.st_var = st_var
+        self.ast_var = ast_var
+        self.trans_att = np.atleast_1d(np.asarray(trans_att, dtype=float))
+        nta = self.trans_att.size
+
+        # the reference locations in order of increasing x
+        ix_label = []
+        for label, section in sections.items():
+            for stretch in section:
+                ix = np.flatnonzero(
+                    (self.x >= stretch.start) & (self.x <= stretch.stop))
+                ix_label.extend((i, label) for i in ix)
+
+        ix_label.sort()
+        self.ix_sec = np.array([i for i, _ in ix_label], dtype=int)
+        self.labels = [label for _, label in ix_label]
+        x_sec = self.x[self.ix_sec]
+
+        # coefficients of C and the transient attenuation (Eq.34)
+        self._B = -np.ones((x_sec.size, 1 + nta))
+        for ita, trans_atti in enumerate(self.trans_att):
+            ix0 = _ta_start_index(x_sec, trans_atti)
+            self._B[:, 1 + ita] = -(np.arange(x_sec.size) >= ix0).astype(float)
+
+        # the transient attenuation at all locations, as in the DataStore
+        self._ta_arr = np.zeros((self.x.size, nta))
+        for ita, trans_atti in enumerate(self.trans_att):
+            self._ta_arr[self.x >= trans_atti, ita] = 1.
+
+        self.nt = 0
+        self.nobs = 0
+        self.S = np.zeros((2, 2))
+        self.r = np.zeros(2)
+        self.yy = 0.
+        self.gamma = np.nan
+        self.dalpha = np.nan
+        self.p_cov = np.full((2, 2), np.nan)
+        self.err_var = np.nan
+        self.c = np.nan
+        self.talpha = np.full(nta, np.nan)
+
+    def __repr__(self):
+        return (
+            f'OnlineSingleEndedCalibration({self.nt} time steps, '
+            f'gamma={self.gamma}, dalpha={self.dalpha})')
+
+    @property
+    def npar(self):
+        """Number of parameters of the equivalent batch calibration."""
+        return 2 + self.nt * (1 + self.trans_att.size)
+
+    def _var(self, st_var, st_sec):
+        if st_var is None:
+            return None
+        elif callable(st_var):
+            return np.asarray(st_var(st_sec), dtype=float)
+        elif np.size(st_var) > 1:
+            return np.asarray(st_var, dtype=float)[self.ix_sec]
+        else:
+            return float(st_var)
+
+    def update(self, st, ast, ref_temps):
+        """
+        Add a time step to the calibration and calibrate it.
+
+        Parameters
+        ----------
+        st, ast : array-like
+            Stokes and anti-Stokes of the new time step, of size nx.
+        ref_temps : Dict[str, float]
+            The temperature in degrees Celsius of every reference section
+            label.
+
+        Returns
+        -------
+        tmpf : array-like
+            Temperature in degrees Celsius of the new time step, of size nx.
+        """
+        st = np.asarray(st, dtype=float)
+        ast = np.asarray(ast, dtype=float)
+        assert st.shape == self.x.shape and ast.shape == self.x.shape, \
+            'Provide the Stokes of a single time step at all locations'
+
+        st_sec = st[self.ix_sec]
+        ast_sec = ast[self.ix_sec]
+        assert np.all(st_sec > 0.) and np.all(ast_sec > 0.), \
+            'There is uncontrolled noise in the (anti-)Stokes signal'
+
+        t_ref = np.array([ref_temps[label] for label in self.labels]) + 273.15
+        assert np.all(np.isfinite(t_ref)), 'Nan/inf in reference temperatures'
+
+        y = np.log(st_sec / ast_sec)
+        A = np.stack((1 / t_ref, -self.x[self.ix_sec]), axis=1)
+        B = self._B
+
+        st_var = self._var(self.st_var, st_sec)
+        ast_var = self._var(self.ast_var, ast_sec)
+
+        if st_var is None:
+            w = np.ones_like(y)
+        else:
+            w = 1 / (st_sec**-2 * st_var + ast_sec**-2 * ast_var)
+
+        # eliminate the parameters of this time step
+        wB = B * w[:, None]
+        Nll_inv = _pinv_sqrt_hermitian(wB.T.dot(B))[0]
+        Nlg = wB.T.dot(A)
+        bl = wB.T.dot(y)
+
+        self.S += (A * w[:, None]).T.dot(A) - Nlg.T.dot(Nll_inv).dot(Nlg)
+        self.r += (A * w[:, None]).T.dot(y) - Nlg.T.dot(Nll_inv).dot(bl)
+        self.yy += np.dot(w * y, y) - bl.dot(Nll_inv).dot(bl)
+        self.nt += 1
+        self.nobs += y.size
+
+        # equilibrate gamma and dalpha, as their coefficients differ in
+        # order of magnitude
+        d = 1 / np.sqrt(np.diag(self.S))
+        S_inv = _pinv_sqrt_hermitian(self.S * d[:, None] * d)[0] * \
+            d[:, None] * d
+        self.gamma, self.dalpha = S_inv.dot(self.r)
+
+        dof = self.nobs - self.npar
+        if dof > 0:
+            ssr = self.yy - self.r.dot(S_inv).dot(self.r)
+            self.err_var = max(ssr, 0.) / dof
+
+        else:
+            self.err_var = np.nan
+
+        self.p_cov = S_inv * self.err_var
+
+        p_loc = Nll_inv.dot(bl - Nlg.dot([self.gamma, self.dalpha]))
+        self.c = p_loc[0]
+        self.talpha = p_loc[1:]
+
+        tmpf = self.gamma / (
+            np.log(st) - np.log(ast) + self.c + self._ta_arr.dot(self.talpha)
+            + self.dalpha * self.x) - 273.15
+        return tmpf
+
+
 def wls_sparse(
         X,
         y,
@@ -1074,6 +2232,10 @@ def wls_sparse(
         verbose=False,
         x0=None,
         return_werr=False,
+        groups=None,
+        precondition=None,
+        backend='lsqr',
+        diagnostics=None,
         **solver_kwargs):
     """
     If some initial estimate x0 is known and if damp == 0, one could proceed as follows:
@@ -1088,8 +2250,29 @@ def wls_sparse(
     X
     y
     w
-    calc_cov
+    calc_cov : bool, str
+        If `'blocks'`, the covariance is returned as a `BlockCovariance`
+        object, which avoids the dense inverse of the normal matrix.
     verbose
+    groups : array-like of int, optional
+        Used if `calc_cov='blocks'` or `precondition='blocks'`. See
+        `wls_block`.
+    precondition : {'columns', 'blocks', None}
+        Right preconditioner for LSQR, see `lsqr_preconditioner`. The
+        columns of X differ orders of magnitude in scale (1/T, x, and ones),
+        which slows down the convergence of LSQR. Without preconditioning,
+        LSQR returns the minimum norm update of x0, which keeps poorly
+        determined parameters close to their initial estimate.
+    backend : {'lsqr', 'splu', 'auto'}
+        `'splu'` solves the normal equations with a sparse LU factorization,
+        see `normal_equations_lu`, which is much faster than LSQR for
+        mid-sized problems and also yields the (co)variance. Falls back to
+        LSQR if the normal matrix is (nearly) singular. `'auto'` chooses
+        between the two with `sparse_backend`.
+    diagnostics : dict, optional
+        Is updated with the backend, the number of iterations, the norm of
+        the weighted residuals, the estimated condition number of the
+        (preconditioned) weighted X, and the wall time in seconds.
     kwargs
 
     Returns
@@ -1108,6 +2291,9 @@ def wls_sparse(
     if sp.issparse(X):
         assert np.all(np.isfinite(X.data)), 'Nan/inf in X: check ' +\
             'reference temperatures?'
+    elif isinstance(X, DesignOperator):
+        assert X.isfinite(), 'Nan/inf in X: check ' +\
+            'reference temperatures?'
     else:
         assert np.all(np.isfinite(X)), 'Nan/inf in X: check ' +\
             'reference temperatures?'
@@ -1130,24 +2316,54 @@ def wls_sparse(
     w_std = np.broadcast_to(
         np.atleast_2d(np.squeeze(w_std)).T, (X.shape[0], 1))
 
-    if not sp.issparse(X):
+    if isinstance(X, DesignOperator):
+        wX = X.weighted(w_std)
+    elif not sp.issparse(X):
         wX = w_std * X
     else:
         wX = X.multiply(w_std)
 
-    if x0 is None:
-        # noinspection PyTypeChecker
-        out_sol = ln.lsqr(wX, wy, show=verbose, calc_var=True, **solver_kwargs)
-        p_sol = out_sol[0]
+    t_start = time.perf_counter()
+
+    if backend == 'auto':
+        backend = sparse_backend(wX)
+
+    assert backend in ['lsqr', 'splu'], \
+        "Choose backend from {'lsqr', 'splu', 'auto'}"
+
+    if backend == 'splu':
+        solve, cond = normal_equations_lu(normal_matrix(wX))
+
+        if solve is None:
+            # Rank deficient. LSQR returns the minimum norm update of x0
+            backend = 'lsqr'
+
+    if backend == 'splu':
+        p_sol = x0
+
+        # with a single step of iterative refinement
+        for _ in range(2):
+            wr0 = wy - wX.dot(p_sol)
+            p_sol = p_sol + solve(wX.T.dot(wr0))
 
     else:
+        # Solve wX M z = wr0 and obtain the solution with p = M z
+        M = lsqr_preconditioner(wX, precondition=precondition, groups=groups)
+
+        if M is None:
+            wXM = wX
+        elif sp.issparse(wX):
+            wXM = wX.dot(M)
+        else:
+            wXM = ln.aslinearoperator(wX) * ln.aslinearoperator(M)
+
         wr0 = wy - wX.dot(x0)
 
         # noinspection PyTypeChecker
         out_sol = ln.lsqr(
-            wX, wr0, show=verbose, calc_var=True, **solver_kwargs)
+            wXM, wr0, show=verbose, calc_var=True, **solver_kwargs)
 
-        p_sol = x0 + out_sol[0]
+        p_sol = x0 + (out_sol[0] if M is None else M.dot(out_sol[0]))
 
     # The residual degree of freedom, defined as the number of observations
     # minus the rank of the regressor matrix.
@@ -1157,18 +2373,59 @@ def wls_sparse(
     wresid = wy - wX.dot(p_sol)
     err_var = np.dot(wresid, wresid) / degrees_of_freedom_err
 
-    if calc_cov:
-        arg = wX.T.dot(wX)
-
-        if sp.issparse(arg):
-            # arg_inv = np.linalg.inv(arg.toarray())
-            arg_inv = np.linalg.lstsq(
-                arg.todense(), np.eye(npar), rcond=None)[0]
-        else:
-            # arg_inv = np.linalg.inv(arg)
-            arg_inv = np.linalg.lstsq(arg, np.eye(npar), rcond=None)[0]
+    if diagnostics is not None and backend == 'splu':
+        diagnostics.update(
+            solver='sparse',
+            backend=backend,
+            iterations=2,
+            residual_norm=float(np.sqrt(np.dot(wresid, wresid))),
+            cond_estimate=float(np.sqrt(cond)),
+            wall_time=time.perf_counter() - t_start)
+
+    elif diagnostics is not None:
+        diagnostics.update(
+            solver='sparse',
+            backend=backend,
+            precondition=str(precondition),
+            iterations=int(out_sol[2]),
+            istop=int(out_sol[1]),
+            residual_norm=float(np.sqrt(np.dot(wresid, wresid))),
+            cond_estimate=float(out_sol[6]),
+            wall_time=time.perf_counter() - t_start)
+
+    if groups is None:
+        groups = -np.ones(npar, dtype=int)
+
+    if calc_cov == 'blocks':
+        p_cov = BlockCovariance(
+            block_factorize(normal_matrix(wX), groups), err_var=err_var)
+        p_var = p_cov.diagonal()
 
-        p_cov = np.array(arg_inv * err_var)
+        if np.any(p_var < 0):
+            m = 'Unable to invert the matrix. The following parameters are ' \
+                'difficult to determine:' + str(np.where(p_var < 0))
+            assert np.all(p_var >= 0), m
+
+        if return_werr:
+            return p_sol, p_var, p_cov, wresid
+        else:
+            return p_sol, p_var, p_cov
+
+    elif calc_cov:
+        arg = normal_matrix(wX)
+
+        if backend == 'splu':
+            # the covariance follows from the factorization of arg
+            arg_inv = solve(np.eye(npar))
+        elif sp.issparse(arg):
+            # arg_inv = np.linalg.inv(arg.toarray())
+            arg_inv = np.linalg.lstsq(
+                arg.todense(), np.eye(npar), rcond=None)[0]
+        else:
+            # arg_inv = np.linalg.inv(arg)
+            arg_inv = np.linalg.lstsq(arg, np.eye(npar), rcond=None)[0]
+
+        p_cov = np.array(arg_inv * err_var)
         p_var = np.diagonal(p_cov)
 
         if np.any(p_var < 0):
@@ -1182,7 +2439,16 @@ def wls_sparse(
             return p_sol, p_var, p_cov
 
     else:
-        p_var = out_sol[-1] * err_var  # normalized covariance
+        if backend == 'splu':
+            p_var = normal_equations_inverse_diagonal(solve, npar) * err_var
+        elif M is None:
+            p_var = out_sol[-1] * err_var  # normalized covariance
+        elif precondition == 'columns':
+            p_var = M.diagonal()**2 * out_sol[-1] * err_var
+        else:
+            # z is correlated, so the variance of M z requires the blocks
+            p_var = block_variance(
+                block_factorize(normal_matrix(wX), groups)) * err_var
 
         if return_werr:
             return p_sol, p_var, wresid
@@ -1190,238 +2456,4197 @@ def wls_sparse(
             return p_sol, p_var
 
 
-def wls_stats(
-        X, y, w=1., calc_cov=False, x0=None, return_werr=False, verbose=False):
+def lsqr_preconditioner(wX, precondition='columns', groups=None):
     """
+    Right preconditioner M for LSQR, so that wX M z = wy is solved instead
+    of wX p = wy, and p = M z.
 
     Parameters
     ----------
-    X
-    y
-    w
-    calc_cov
-    verbose
+    wX : scipy.sparse matrix, DesignOperator
+        Weighted coefficient matrix
+    precondition : {'columns', 'blocks', None}
+        `'columns'` scales the columns of wX to unit norm. `'blocks'`
+        (block-Jacobi) also decorrelates the local parameters of each group,
+        such as C and the transient attenuation of a single time step, with
+        the inverse square root of their block of the normal matrix. Global
+        parameters are only scaled. `None` returns no preconditioner.
+    groups : array-like of int, optional
+        Of size npar, see `wls_block`. Required for `'blocks'`.
 
     Returns
     -------
-
+    M : scipy.sparse.csr_matrix, None
     """
-    import statsmodels.api as sm
-
-    y = np.asarray(y)
-    w = np.asarray(w)
+    if precondition is None:
+        return None
 
-    if sp.issparse(X):
-        X = X.toarray()
+    assert precondition in ['columns', 'blocks'], \
+        "Choose precondition from {'columns', 'blocks', None}"
 
-    if x0 is not None:
-        # Initial values not supported by statsmodels
-        pass
+    if precondition == 'columns' and sp.issparse(wX):
+        diag = np.asarray(wX.multiply(wX).sum(axis=0)).ravel()
+    else:
+        N = sp.csr_matrix(normal_matrix(wX))
+        diag = N.diagonal()
 
-    mod_wls = sm.WLS(y, X, weights=w)
-    res_wls = mod_wls.fit()
-    p_sol = res_wls.params
+    # parameters without observations are left unscaled
+    d = 1 / np.sqrt(np.where(diag > 0., diag, 1.))
 
-    if verbose:
-        print(res_wls.summary())
+    if precondition == 'columns' or groups is None:
+        return sp.diags(d).tocsr()
 
-    p_cov = res_wls.cov_params()
-    p_var = res_wls.bse**2
+    # every global parameter is a block of its own
+    npar = d.size
+    labels = np.array(groups, dtype=int)
+    is_glob = labels < 0
+    labels[is_glob] = labels.max(initial=-1) + 1 + np.arange(is_glob.sum())
+    order = np.argsort(labels, kind='stable')
 
-    if return_werr:
-        wy = np.sqrt(w) * y
-        wX = np.sqrt(w) * X
-        werr = wy - wX.dot(p_sol)
+    N = sp.diags(d).dot(N).dot(sp.diags(d)).tocsr()
+    A_sqrt = _block_diagonal_pinv(N[order][:, order], labels[order])[1]
+    P = sp.csr_matrix(
+        (np.ones(npar), (order, np.arange(npar))), shape=(npar, npar))
+    return sp.diags(d).dot(P).dot(A_sqrt).tocsr()
 
-    if calc_cov:
-        if return_werr:
-            return p_sol, p_var, p_cov, werr
-        else:
-            return p_sol, p_var, p_cov
-    else:
-        if return_werr:
-            return p_sol, p_var, werr
-        else:
-            return p_sol, p_var
 
+def sparse_backend(wX, max_npar=5000, max_nnz=20000000):
+    """
+    Choose the backend of `wls_sparse`. The direct `'splu'` backend for
+    mid-sized problems, and `'lsqr'` for problems with many parameters or
+    many nonzero coefficients, as the factorization grows with npar and the
+    normal matrix with the nonzeros per row of wX.
 
-def calc_alpha_double(
-        mode,
-        ds,
-        st_var=None,
-        ast_var=None,
-        rst_var=None,
-        rast_var=None,
-        D_F_label=None,
-        D_B_label=None,
-        D_F_var_label=None,
-        D_B_var_label=None,
-        ix_alpha_is_zero=-1,
-        talpha_fw=None,
-        talpha_bw=None,
-        talpha_fw_var=None,
-        talpha_bw_var=None):
-    """Eq.50 if weighted least squares. Assumes ds has `trans_att`
-    pre-configured."""
+    Parameters
+    ----------
+    wX : scipy.sparse matrix, np.ndarray, DesignOperator
+        Weighted coefficient matrix
+    max_npar : int
+        Maximum number of parameters for the direct backend
+    max_nnz : int
+        Maximum number of nonzero coefficients of wX for the direct backend
 
-    assert ix_alpha_is_zero >= 0, 'Define ix_alpha_is_zero' + \
-                                  str(ix_alpha_is_zero)
+    Returns
+    -------
+    backend : {'splu', 'lsqr'}
+    """
+    npar = wX.shape[1]
 
-    time_dim = ds.get_time_dim()
+    if sp.issparse(wX):
+        nnz = wX.nnz
+    elif isinstance(wX, DesignOperator):
+        # its normal matrix is computed without forming wX
+        nnz = 0
+    else:
+        nnz = wX.size
 
-    if st_var is not None:
-        if callable(st_var):
-            st_var_val = st_var(ds.st)
-        else:
-            st_var_val = np.asarray(st_var)
-        if callable(ast_var):
-            ast_var_val = ast_var(ds.ast)
-        else:
-            ast_var_val = np.asarray(ast_var)
-        if callable(rst_var):
-            rst_var_val = rst_var(ds.rst)
-        else:
-            rst_var_val = np.asarray(rst_var)
-        if callable(rast_var):
-            rast_var_val = rast_var(ds.rast)
-        else:
-            rast_var_val = np.asarray(rast_var)
+    if npar <= max_npar and nnz <= max_nnz:
+        return 'splu'
+    else:
+        return 'lsqr'
 
-        i_var_fw = ds.i_var(
-            st_var_val, ast_var_val, st_label='st', ast_label='ast')
-        i_var_bw = ds.i_var(
-            rst_var_val, rast_var_val, st_label='rst', ast_label='rast')
 
-        i_fw = np.log(ds.st / ds.ast)
-        i_bw = np.log(ds.rst / ds.rast)
+def normal_equations_lu(N, rcond=1e-13):
+    """
+    Sparse LU factorization of the normal matrix N, which is scaled to a unit
+    diagonal first. N is symmetric positive definite, so the diagonal is used
+    as pivot.
 
-        if mode == 'guess':
-            A_var = (i_var_fw + i_var_bw) / 2
-            A = (i_bw - i_fw) / 2
+    Parameters
+    ----------
+    N : scipy.sparse matrix, np.ndarray
+        The normal matrix wX^T wX
+    rcond : float
+        N is considered singular if the ratio of the smallest and the largest
+        pivot is smaller.
 
-        elif mode == 'exact':
-            D_F = ds[D_F_label]
-            D_B = ds[D_B_label]
-            D_F_var = ds[D_F_var_label]
-            D_B_var = ds[D_B_var_label]
+    Returns
+    -------
+    solve : callable, None
+        solve(b) returns N^-1 b, for b of shape (npar,) or (npar, k). None if
+        N is singular.
+    cond : float
+        Ratio of the largest and the smallest pivot, an estimate of the
+        condition number of N.
+    """
+    N = sp.csc_matrix(N)
+    d = N.diagonal()
+    s = 1 / np.sqrt(np.where(d > 0., d, 1.))
+    Ns = sp.diags(s).dot(N).dot(sp.diags(s)).tocsc()
 
-            if ds.trans_att.size > 0:
-                # Can be improved by including covariances. That reduces the
-                # uncert.
+    try:
+        lu = ln.splu(
+            Ns,
+            permc_spec='MMD_AT_PLUS_A',
+            diag_pivot_thresh=0.,
+            options=dict(SymmetricMode=True))
+    except RuntimeError:
+        # exactly singular
+        return None, np.inf
 
-                ta_arr_fw = np.zeros((ds.x.size, ds[time_dim].size))
-                ta_arr_fw_var = np.zeros((ds.x.size, ds[time_dim].size))
-                for tai, taxi, tai_var in zip(
-                        talpha_fw.T, ds.trans_att.values, talpha_fw_var.T):
-                    ta_arr_fw[ds.x.values >= taxi] = \
-                        ta_arr_fw[ds.x.values >= taxi] + tai
-                    ta_arr_fw_var[ds.x.values >= taxi] = \
-                        ta_arr_fw_var[ds.x.values >= taxi] + tai_var
-
-                ta_arr_bw = np.zeros((ds.x.size, ds[time_dim].size))
-                ta_arr_bw_var = np.zeros((ds.x.size, ds[time_dim].size))
-                for tai, taxi, tai_var in zip(
-                        talpha_bw.T, ds.trans_att.values, talpha_bw_var.T):
-                    ta_arr_bw[ds.x.values < taxi] = \
-                        ta_arr_bw[ds.x.values < taxi] + tai
-                    ta_arr_bw_var[ds.x.values < taxi] = \
-                        ta_arr_bw_var[ds.x.values < taxi] + tai_var
+    pivots = np.abs(lu.U.diagonal())
 
-                A_var = (
-                    i_var_fw + i_var_bw + D_B_var + D_F_var + ta_arr_fw_var
-                    + ta_arr_bw_var) / 2
-                A = (i_bw - i_fw) / 2 + (D_B - D_F) / 2 + (
-                    ta_arr_bw - ta_arr_fw) / 2
+    if pivots.min() <= rcond * pivots.max():
+        return None, np.inf
 
-            else:
-                A_var = (i_var_fw + i_var_bw + D_B_var + D_F_var) / 2
-                A = (i_bw - i_fw) / 2 + (D_B - D_F) / 2
+    def solve(b):
+        return (s * lu.solve(np.asarray((s * b.T).T)).T).T
 
-        E_var = 1 / (1 / A_var).sum(dim=time_dim)
-        E = (A / A_var).sum(dim=time_dim) * E_var
+    return solve, pivots.max() / pivots.min()
 
-    else:
-        i_fw = np.log(ds.st / ds.ast)
-        i_bw = np.log(ds.rst / ds.rast)
 
-        if mode == 'guess':
-            A = (i_bw - i_fw) / 2
-        elif mode == 'exact':
-            D_F = ds[D_F_label]
-            D_B = ds[D_B_label]
-            A = (i_bw - i_fw) / 2 + (D_B - D_F) / 2
+def normal_equations_inverse_diagonal(solve, npar, batch=256):
+    """
+    Diagonal of N^-1 from `solve`, returned by `normal_equations_lu`. The
+    columns of N^-1 are solved in batches, to limit the memory usage.
+    """
+    diag = np.zeros(npar)
 
-        E_var = A.var(dim=time_dim)
-        E = A.mean(dim=time_dim)
+    for i0 in range(0, npar, batch):
+        ix = np.arange(i0, min(i0 + batch, npar))
+        e = np.zeros((npar, ix.size))
+        e[ix, np.arange(ix.size)] = 1.
+        diag[ix] = solve(e)[ix, np.arange(ix.size)]
 
-    # E is defined zero at the first index of the reference sections
-    if mode == 'guess':
-        E -= E.isel(x=ix_alpha_is_zero)
+    return diag
 
-    # assert np.abs(E.isel(x=ix_alpha_is_zero)) < 1e-8, \
-    #     'Something went wrong in the estimation of d_f and d_b: ' + str(E)
 
-    return E, E_var
+def weighted_design(X, w_std):
+    """
+    The rows of the coefficient matrix `X` multiplied with `w_std`, the square
+    root of the weights.
+    """
+    if isinstance(X, DesignOperator):
+        return X.weighted(w_std)
+    else:
+        return sp.csr_matrix(X).multiply(np.reshape(w_std, (-1, 1))).tocsr()
 
 
-def calc_df_db_double_est(ds, ix_alpha_is_zero, gamma_est):
-    Ifwx0 = np.log(
-        ds.st.isel(x=ix_alpha_is_zero)
-        / ds.ast.isel(x=ix_alpha_is_zero)).values
-    Ibwx0 = np.log(
-        ds.rst.isel(x=ix_alpha_is_zero)
-        / ds.rast.isel(x=ix_alpha_is_zero)).values
-    ref_temps_refs = ds.ufunc_per_section(
-        label='st', ref_temp_broadcasted=True, calc_per='all')
-    ix_sec = ds.ufunc_per_section(x_indices=True, calc_per='all')
-    ref_temps_x0 = ref_temps_refs[
-        ix_sec == ix_alpha_is_zero].flatten().compute() + 273.15
-    df_est = gamma_est / ref_temps_x0 - Ifwx0
-    db_est = gamma_est / ref_temps_x0 - Ibwx0
-    return df_est, db_est
+def normal_matrix(wX):
+    """
+    The normal matrix wX^T wX. Computed from the structure of the
+    coefficients if `wX` is a `DesignOperator`.
+    """
+    if isinstance(wX, DesignOperator):
+        return wX.gram()
+    else:
+        return wX.T.dot(wX)
 
 
-def match_sections(ds, matching_sections):
+def wls_block(
+        X,
+        y,
+        w=1.,
+        groups=None,
+        calc_cov=False,
+        verbose=False,
+        x0=None,
+        return_werr=False,
+        fac=None,
+        diagnostics=None):
     """
-    Matches location indices of two sections.
+    Weighted least squares solver that exploits the block structure of the
+    calibration problems. The parameters are split in global parameters
+    (`groups` is -1), such as gamma and dalpha, and local parameters that only
+    interact with parameters of the same group, such as C and the transient
+    attenuation of a single time step. The normal equations are reduced to
+    the global parameters with the Schur complement of the block-diagonal
+    local part, after which the local parameters follow per block.
+
+    The local blocks are inverted in batches, so the cost scales linearly with
+    the number of time steps, instead of the cubic cost of a dense inverse.
+
     Parameters
     ----------
-    ds
-    matching_sections : List[Tuple[slice, slice, bool]]
-        Provide a list of tuples. A tuple per matching section. Each tuple
-        has three items. The first two items are the slices of the sections
-        that are matched. The third item is a boolean and is True if the two
-        sections have a reverse direction ("J-configuration"), most common.
+    X : scipy.sparse matrix, DesignOperator
+        Coefficient matrix, of shape (nobs, npar)
+    y : array-like
+        Observations, of size nobs
+    w : float, array-like
+        Weights of the observations
+    groups : array-like of int
+        Of size npar. -1 for global parameters, and the index of the block
+        for the local parameters. Local parameters of different blocks may
+        not appear in the same observation. If `None` all parameters are
+        treated as global.
+    calc_cov : bool, str
+        Return the full covariance matrix. If `'blocks'`, the covariance is
+        returned as a `BlockCovariance` object, without forming the dense
+        matrix.
+    verbose : bool
+    x0 : array-like
+        Initial estimate of the parameters. The solver only estimates the
+        correction to `x0`, which improves the precision.
+    return_werr : bool
+        Return the weighted residuals
+    fac : dict, optional
+        Factorization of the weighted normal matrix, as returned by
+        `block_factorize`. For example from a `CalibrationPlan`, if the
+        coefficients and the weights are the same as those of a previous
+        calibration.
+    diagnostics : dict, optional
+        Is updated with the number of refinement iterations, the norm of the
+        weighted residuals, the estimated condition number of the reduced
+        system of the global parameters, and the wall time in seconds.
 
     Returns
     -------
-    matching_indices : array-like
-        Is an array of size (np, 2), where np is the number of paired
-        locations. The array contains indices to locations along the fiber.
+    p_sol, p_var[, p_cov][, wresid]
     """
-    for hslice, tslice, reverse_flag in matching_sections:
-        hxs = ds.x.sel(x=hslice).size
-        txs = ds.x.sel(x=tslice).size
+    npar = X.shape[1]
 
-        assert hxs == txs, 'the two sections do not have matching ' \
-                           'number of items: ' + str(hslice) + 'size: ' + \
-                           str(hxs) + str(tslice) + 'size: ' + str(txs)
+    if x0 is None:
+        x0 = np.zeros(npar)
+    assert np.all(np.isfinite(x0)), 'Nan/inf in p0 initial estimate'
 
-    hix = ds.ufunc_per_section(
-        sections={0: [i[0] for i in matching_sections]},
-        x_indices=True,
-        calc_per='all')
+    if sp.issparse(X):
+        assert np.all(np.isfinite(X.data)), 'Nan/inf in X: check ' +\
+            'reference temperatures?'
+    elif isinstance(X, DesignOperator):
+        assert X.isfinite(), 'Nan/inf in X: check ' +\
+            'reference temperatures?'
+    else:
+        assert np.all(np.isfinite(X)), 'Nan/inf in X: check ' +\
+            'reference temperatures?'
+    assert np.all(np.isfinite(w)), 'Nan/inf in weights'
+    assert np.all(np.isfinite(y)), 'Nan/inf in observations'
 
-    tixl = []
-    for _, tslice, reverse_flag in matching_sections:
-        ixi = ds.ufunc_per_section(
-            sections={0: [tslice]}, x_indices=True, calc_per='all')
+    if w is None:  # gracefully default to unweighted
+        w = 1.
 
-        if reverse_flag:
-            tixl.append(ixi[::-1])
-        else:
-            tixl.append(ixi)
+    if groups is None:
+        groups = -np.ones(npar, dtype=int)
 
-    tix = np.concatenate(tixl)
+    t_start = time.perf_counter()
+    w_std = np.broadcast_to(np.sqrt(np.asarray(w, dtype=float)), y.shape)
+    wy = w_std * y
+    wX = weighted_design(X, w_std)
 
-    return np.stack((hix, tix)).T
+    if fac is None:
+        fac = block_factorize(normal_matrix(wX), groups)
+
+    # Solve for the correction to x0 and refine once with the residual of
+    # the first solution to undo most of the round-off of the normal eqns.
+    p_sol = np.array(x0, dtype=float)
+
+    for _ in range(2):
+        wresid = wy - wX.dot(p_sol)
+        p_sol += block_solve(fac, wX.T.dot(wresid))
+
+    nobs = len(y)
+    degrees_of_freedom_err = nobs - npar
+    wresid = wy - wX.dot(p_sol)
+    err_var = np.dot(wresid, wresid) / degrees_of_freedom_err
+
+    if verbose:
+        print(
+            f'Block solver: {fac["ix_glob"].size} global and '
+            f'{fac["ix_loc"].size} local parameters in '
+            f'{fac["nblock"]} blocks. Err var: {err_var}')
+
+    if diagnostics is not None:
+        diagnostics.update(
+            solver='block',
+            iterations=2,
+            residual_norm=float(np.sqrt(np.dot(wresid, wresid))),
+            cond_estimate=block_cond_estimate(fac),
+            wall_time=time.perf_counter() - t_start)
+
+    if calc_cov == 'blocks':
+        p_cov = BlockCovariance(fac, err_var=err_var)
+        p_var = p_cov.diagonal()
+
+    elif calc_cov:
+        p_cov = block_covariance(fac) * err_var
+        p_var = np.diagonal(p_cov)
+
+    else:
+        p_var = block_variance(fac) * err_var
+
+    if np.any(p_var < 0):
+        m = 'Unable to invert the matrix. The following parameters are ' \
+            'difficult to determine:' + str(np.where(p_var < 0))
+        assert np.all(p_var >= 0), m
+
+    if calc_cov and return_werr:
+        return p_sol, p_var, p_cov, wresid
+    elif calc_cov:
+        return p_sol, p_var, p_cov
+    elif return_werr:
+        return p_sol, p_var, wresid
+    else:
+        return p_sol, p_var
+
+
+def wls_time_local(
+        A,
+        y,
+        w=1.,
+        calc_cov=False,
+        x0=None,
+        return_werr=False,
+        diagnostics=None):
+    """
+    Closed-form weighted least squares for problems in which all parameters
+    are local to a time step, such as C (or D_fw and D_bw) and the transient
+    attenuation if gamma and alpha are fixed. Parameter `k * nt + t` belongs
+    to time step `t`, so that the normal equations decouple into nt systems
+    of nk parameters. The coefficients are the same for every time step, so
+    that these are formed with weighted sums over the observations of each
+    time step, and solved at once, without sparse algebra or iterations.
+
+    Parameters
+    ----------
+    A : array-like
+        Coefficients of the nk parameters of a time step, of shape
+        (nrow, nk). See `time_local_system_single_ended`.
+    y : array-like
+        Observations, of shape (nrow, nt)
+    w : float, array-like
+        Weights of the observations, broadcastable to the shape of `y`
+    calc_cov : bool, str
+        Return the full covariance matrix. If `'blocks'`, the covariance is
+        returned as a `BlockCovariance` with a block per time step.
+    x0 : array-like
+        Initial estimate of the parameters. Poorly determined parameters,
+        e.g., transient attenuation outside of the reference sections, keep
+        their initial estimate, similar to the minimum norm update of LSQR.
+    return_werr : bool
+        Return the weighted residuals, of shape (nrow, nt)
+    diagnostics : dict, optional
+        Is updated with the norm of the weighted residuals, the largest
+        estimated condition number of the per time step systems, and the
+        wall time in seconds.
+
+    Returns
+    -------
+    p_sol, p_var[, p_cov][, wresid]
+    """
+    A = np.asarray(A, dtype=float)
+    y = np.asarray(y, dtype=float)
+    nrow, nk = A.shape
+    nt = y.shape[1]
+    npar = nk * nt
+    assert y.shape == (nrow, nt), 'Define an observation per row of A'
+
+    if x0 is None:
+        x0 = np.zeros(npar)
+    if w is None:  # gracefully default to unweighted
+        w = 1.
+
+    w = np.broadcast_to(np.asarray(w, dtype=float), y.shape)
+    assert np.all(np.isfinite(x0)), 'Nan/inf in p0 initial estimate'
+    assert np.all(np.isfinite(w)), 'Nan/inf in weights'
+    assert np.all(np.isfinite(y)), 'Nan/inf in observations'
+    assert np.all(np.isfinite(A)), 'Nan/inf in X: check ' +\
+        'reference temperatures?'
+
+    t_start = time.perf_counter()
+
+    # Weighted sums per time step. N is of shape (nt, nk, nk)
+    N = np.tensordot(w, A[:, :, None] * A[:, None, :], axes=(0, 0))
+    b = (w * y).T.dot(A)
+
+    # Pseudo-inverse, so that the correction to x0 has the minimum norm.
+    # Equal to `np.linalg.pinv(N, hermitian=True)`, of which the
+    # eigenvalues are reused for the condition number and the samples.
+    eigval, eigvec = np.linalg.eigh(N)
+    abs_eigval = np.abs(eigval)
+    large = abs_eigval > 1e-15 * np.max(abs_eigval, axis=-1, keepdims=True)
+    eigval_inv = np.divide(
+        1., eigval, out=np.zeros_like(eigval), where=large)
+    N_inv = np.matmul(
+        eigvec * eigval_inv[:, None, :], np.swapaxes(eigvec, -1, -2))
+
+    p0 = np.reshape(x0, (nk, nt)).T
+    dp = np.einsum('tkl,tl->tk', N_inv, b - np.einsum('tkl,tl->tk', N, p0))
+    p = p0 + dp
+    p_sol = p.T.ravel()
+
+    degrees_of_freedom_err = y.size - npar
+    wresid = np.sqrt(w) * (y - A.dot(p.T))
+    wresid2 = np.sum(wresid**2)
+    err_var = wresid2 / degrees_of_freedom_err
+
+    if diagnostics is not None:
+        if np.any(abs_eigval.min(axis=-1) == 0.):
+            cond = np.inf
+        else:
+            cond = np.max(abs_eigval.max(axis=-1) / abs_eigval.min(axis=-1))
+
+        diagnostics.update(
+            solver='time_local',
+            iterations=0,
+            residual_norm=float(np.sqrt(wresid2)),
+            cond_estimate=float(np.sqrt(cond)),
+            wall_time=time.perf_counter() - t_start)
+
+    p_var = np.diagonal(N_inv, axis1=1, axis2=2).T.ravel() * err_var
+
+    # parameter k * nt + t
+    ix = np.arange(nk)[None, :] * nt + np.arange(nt)[:, None]
+
+    if calc_cov == 'blocks':
+        # All parameters are local, with a block per time step
+        N_sqrt = eigvec * np.sqrt(np.clip(eigval_inv, 0., None))[:, None, :]
+        il = np.arange(npar).reshape((nt, nk))
+        ij = (
+            np.broadcast_to(il[:, :, None], N.shape).ravel(),
+            np.broadcast_to(il[:, None, :], N.shape).ravel())
+        fac = dict(
+            d=np.ones(npar),
+            ix_glob=np.zeros(0, dtype=int),
+            ix_loc=ix.ravel(),
+            nblock=nt,
+            A_inv=sp.csr_matrix((N_inv.ravel(), ij), shape=(npar, npar)),
+            A_sqrt=sp.csr_matrix((N_sqrt.ravel(), ij), shape=(npar, npar)),
+            N_lg=sp.csr_matrix((npar, 0)),
+            S=np.zeros((0, 0)),
+            S_inv=np.zeros((0, 0)))
+        p_cov = BlockCovariance(fac, err_var=err_var)
+
+    elif calc_cov:
+        p_cov = np.zeros((npar, npar))
+        p_cov[ix[:, :, None], ix[:, None, :]] = N_inv * err_var
+
+    if calc_cov and return_werr:
+        return p_sol, p_var, p_cov, wresid
+    elif calc_cov:
+        return p_sol, p_var, p_cov
+    elif return_werr:
+        return p_sol, p_var, wresid
+    else:
+        return p_sol, p_var
+
+
+def time_local_coefficients(X, nt):
+    """
+    The coefficients of the parameters of a single time step, for
+    `wls_time_local`, from the sparse coefficient matrix `X`. The rows of
+    `X` are ordered per location (`i * nt + t`) and its columns per
+    parameter (`k * nt + t`), as the observations and parameters of the
+    double-ended solver.
+
+    Parameters
+    ----------
+    X : scipy.sparse matrix
+        Of shape (nrow * nt, nk * nt)
+    nt : int
+        Number of time steps
+
+    Returns
+    -------
+    A : array-like
+        Of shape (nrow, nk)
+    """
+    X = sp.csr_matrix(X, copy=True)
+    X.sum_duplicates()
+    X.eliminate_zeros()
+    assert X.shape[0] % nt == 0 and X.shape[1] % nt == 0, \
+        'The observations or parameters are not ordered per time step'
+
+    A = X[::nt][:, ::nt].toarray()
+    assert X.nnz == nt * np.count_nonzero(A), \
+        'The coefficients differ per time step, or an observation refers ' \
+        'to the parameters of multiple time steps'
+    return A
+
+
+def transient_att_section_index(x_sec, trans_att):
+    """
+    Per transient attenuation location, the first index of `x_sec` that is
+    downstream of it. `x_sec.size` if it is located beyond the last
+    reference location.
+    """
+    ix0 = np.searchsorted(x_sec, trans_att, side='left')
+    ix0[np.asarray(trans_att) >= x_sec[-1]] = x_sec.size
+    return ix0
+
+
+def time_local_system_single_ended(
+        ds,
+        st_var,
+        ast_var,
+        fix_gamma,
+        fix_dalpha=None,
+        fix_alpha=None,
+        matching_indices=None):
+    """
+    The observations and coefficients of C and the transient attenuation for
+    `wls_time_local`, for single-ended setups with gamma and dalpha (or
+    alpha) fixed. Computed directly from the Stokes and anti-Stokes
+    intensities of the reference sections, without the coefficient matrix.
+    The fixed parameters are moved to the observations, and their variance
+    to the weights, as with the split matrices of
+    `calibration_single_ended_solver`.
+
+    Parameters
+    ----------
+    ds : DataStore
+    st_var, ast_var : float, callable, array-like, optional
+        If `None` use ols calibration
+    fix_gamma : Tuple[float, float]
+        gamma and its variance
+    fix_dalpha : Tuple[float, float], optional
+        dalpha and its variance
+    fix_alpha : Tuple[array-like, array-like], optional
+        alpha and its variance, at every location
+    matching_indices : array-like, optional
+        Only with `fix_dalpha`. See `calibration_single_ended_solver`.
+
+    Returns
+    -------
+    A, y, w, x0
+        The coefficients of C and the transient attenuation of a time step
+        (nrow, 1 + nta), the observations and their weights (nrow, nt), and
+        the initial estimate of the parameters.
+    """
+    assert bool(fix_dalpha) != bool(fix_alpha), \
+        'Use either `fix_dalpha` or `fix_alpha`'
+
+    ix_sec = ds.ufunc_per_section(x_indices=True, calc_per='all')
+    ds_sec = ds.isel(x=ix_sec)
+    x_sec = ds_sec['x'].values
+    nx = x_sec.size
+    nt = ds.time.size
+    trans_att = ds.trans_att.values
+    nta = trans_att.size
+
+    cal_ref = np.asarray(
+        ds.ufunc_per_section(
+            label='st', ref_temp_broadcasted=True, calc_per='all'))
+    data_gamma = 1 / (cal_ref + 273.15)
+
+    # I = 1/Tref*gamma - C - dalpha x - TA
+    A = np.zeros((nx, 1 + nta))
+    A[:, 0] = -1.
+    A[:, 1:] = -1. * (
+        np.arange(nx)[:, None] >= transient_att_section_index(
+            x_sec, trans_att)[None])
+    y = np.log(ds_sec.st / ds_sec.ast).values
+
+    if st_var is not None:
+        st_var_sec = parse_st_var(ds, st_var, st_label='st', ix_sel=ix_sec)
+        ast_var_sec = parse_st_var(ds, ast_var, st_label='ast', ix_sel=ix_sec)
+        var = (
+            ds_sec.st**-2 * st_var_sec + ds_sec.ast**-2 * ast_var_sec).values
+    else:
+        var = np.ones((nx, nt))  # unweighted
+
+    y -= fix_gamma[0] * data_gamma
+    var += fix_gamma[1] * data_gamma
+
+    if fix_alpha:
+        X_alpha = -1.
+        y -= np.asarray(fix_alpha[0])[ix_sec, None] * X_alpha
+        var += np.asarray(fix_alpha[1])[ix_sec, None] * X_alpha
+    else:
+        X_dalpha = -x_sec[:, None]
+        y -= fix_dalpha[0] * X_dalpha
+        var += fix_dalpha[1] * X_dalpha
+
+    if np.any(matching_indices):
+        assert fix_dalpha, 'Matching sections require `fix_dalpha`'
+        ds_ms0 = ds.isel(x=matching_indices[:, 0])
+        ds_ms1 = ds.isel(x=matching_indices[:, 1])
+        x_ms0 = ds_ms0['x'].values
+        x_ms1 = ds_ms1['x'].values
+
+        # I_1 - I_2 = dalpha (x_2 - x_1) + TA between x_1 and x_2
+        A_m = np.zeros((x_ms0.size, 1 + nta))
+        A_m[:, 1:] = (trans_att[None] > x_ms0[:, None]) & (
+            trans_att[None] < x_ms1[:, None])
+        y_m = (
+            np.log(ds_ms0.st.values / ds_ms0.ast.values)
+            - np.log(ds_ms1.st.values / ds_ms1.ast.values))
+
+        if st_var is not None:
+            st_var_ms0 = parse_st_var(
+                ds, st_var, st_label='st', ix_sel=matching_indices[:, 0])
+            st_var_ms1 = parse_st_var(
+                ds, st_var, st_label='st', ix_sel=matching_indices[:, 1])
+            ast_var_ms0 = parse_st_var(
+                ds, ast_var, st_label='ast', ix_sel=matching_indices[:, 0])
+            ast_var_ms1 = parse_st_var(
+                ds, ast_var, st_label='ast', ix_sel=matching_indices[:, 1])
+            var_m = (
+                (ds_ms0.st.values**-2 * st_var_ms0)
+                + (ds_ms0.ast.values**-2 * ast_var_ms0)
+                + (ds_ms1.st.values**-2 * st_var_ms1)
+                + (ds_ms1.ast.values**-2 * ast_var_ms1))
+        else:
+            var_m = np.ones(y_m.shape)
+
+        X_dalpha_m = (x_ms1 - x_ms0)[:, None]
+        y_m -= fix_dalpha[0] * X_dalpha_m
+        var_m += fix_dalpha[1] * X_dalpha_m
+
+        A = np.concatenate((A, A_m))
+        y = np.concatenate((y, y_m))
+        var = np.concatenate((var, var_m))
+
+    x0 = np.concatenate((np.full(nt, 1.4), np.zeros(nta * nt)))
+    return A, y, 1 / var, x0
+
+
+def time_local_system_double_ended(
+        ds, st_var, ast_var, rst_var, rast_var, fix_gamma, fix_alpha):
+    """
+    The observations and coefficients of D_fw, D_bw and the transient
+    attenuation for `wls_time_local`, for double-ended setups with gamma and
+    alpha fixed. Computed directly from the Stokes and anti-Stokes
+    intensities of the reference sections of both directions, without the
+    coefficient matrix. The fixed parameters are moved to the observations,
+    and their variance to the weights, as with the split matrices of
+    `calibration_double_ended_solver`.
+
+    Parameters
+    ----------
+    ds : DataStore
+    st_var, ast_var, rst_var, rast_var : float, callable, array-like, optional
+        If `None` use ols calibration
+    fix_gamma : Tuple[float, float]
+        gamma and its variance
+    fix_alpha : Tuple[array-like, array-like]
+        alpha and its variance, at every location
+
+    Returns
+    -------
+    A, y, w, x0
+        The coefficients of D_fw, D_bw and the transient attenuation of a
+        time step (2 * nx_sec, 2 + 2 * nta), the forward and backward
+        observations and their weights (2 * nx_sec, nt), and the initial
+        estimate of the parameters.
+    """
+    ix_sec = ds.ufunc_per_section(x_indices=True, calc_per='all')
+    ds_sec = ds.isel(x=ix_sec)
+    x_sec = ds_sec['x'].values
+    nx = x_sec.size
+    nt = ds.time.size
+    trans_att = ds.trans_att.values
+    nta = trans_att.size
+
+    cal_ref = np.asarray(
+        ds.ufunc_per_section(
+            label='st', ref_temp_broadcasted=True, calc_per='all'))
+    data_gamma = 1 / (cal_ref + 273.15)
+
+    # I_fw = 1/Tref*gamma - D_fw - E - TA_fw
+    # I_bw = 1/Tref*gamma - D_bw + E - TA_bw
+    # with the parameters [D_fw, D_bw, TA_fw_a, TA_bw_a, TA_fw_b, ..] of a
+    # time step. E is zero at the first index of the reference sections.
+    downstream = np.arange(nx)[:, None] >= transient_att_section_index(
+        x_sec, trans_att)[None]
+    A_F = np.zeros((nx, 2 + 2 * nta))
+    A_B = np.zeros((nx, 2 + 2 * nta))
+    A_F[:, 0] = -1.
+    A_B[:, 1] = -1.
+    A_F[:, 2::2] = -1. * downstream
+    A_B[:, 3::2] = -1. * ~downstream
+    E = (np.arange(nx) > 0)[:, None] * 1.
+
+    y_F = np.log(ds_sec.st / ds_sec.ast).values
+    y_B = np.log(ds_sec.rst / ds_sec.rast).values
+    alpha_sec = np.asarray(fix_alpha[0])[ix_sec, None]
+    alpha_var_sec = np.asarray(fix_alpha[1])[ix_sec, None]
+    y_F -= fix_gamma[0] * data_gamma - E * alpha_sec
+    y_B -= fix_gamma[0] * data_gamma + E * alpha_sec
+
+    if st_var is not None:
+        st_var_sec = parse_st_var(ds, st_var, st_label='st', ix_sel=ix_sec)
+        ast_var_sec = parse_st_var(ds, ast_var, st_label='ast', ix_sel=ix_sec)
+        rst_var_sec = parse_st_var(ds, rst_var, st_label='rst', ix_sel=ix_sec)
+        rast_var_sec = parse_st_var(
+            ds, rast_var, st_label='rast', ix_sel=ix_sec)
+
+        # variances are added. weight is the inverse of the variance of the
+        # observations
+        var_F = (
+            ds_sec.st**-2 * st_var_sec
+            + ds_sec.ast**-2 * ast_var_sec).values
+        var_B = (
+            ds_sec.rst**-2 * rst_var_sec
+            + ds_sec.rast**-2 * rast_var_sec).values
+        w_F = 1 / (var_F + fix_gamma[1] * data_gamma - E * alpha_var_sec)
+        w_B = 1 / (var_B + fix_gamma[1] * data_gamma + E * alpha_var_sec)
+        w = np.concatenate((w_F, w_B))
+
+    else:
+        w = 1.  # unweighted
+
+    df_est, db_est = calc_df_db_double_est(ds, ix_sec[0], 485.)
+    x0 = np.concatenate((df_est, db_est, np.zeros(2 * nta * nt)))
+    return np.concatenate((A_F, A_B)), np.concatenate((y_F, y_B)), w, x0
+
+
+def time_chunk_slices(ds, time_chunks=None):
+    """
+    Split the time dimension of `ds` in chunks.
+
+    Parameters
+    ----------
+    ds : DataStore
+    time_chunks : int, optional
+        Number of time steps per chunk. If `None`, the dask chunks of `ds.st`
+        along time are used, or a single chunk if `ds.st` is not backed by
+        dask.
+
+    Returns
+    -------
+    list of slice
+    """
+    nt = ds.time.size
+
+    if time_chunks is None and ds.st.chunks is not None:
+        sizes = ds.st.chunks[ds.st.get_axis_num('time')]
+    elif time_chunks is None:
+        sizes = [nt]
+    else:
+        assert time_chunks > 0, 'time_chunks should be a positive integer'
+        sizes = np.diff(np.append(np.arange(0, nt, time_chunks), nt))
+
+    bounds = np.cumsum(np.concatenate(([0], sizes)))
+    return [slice(t0, t1) for t0, t1 in zip(bounds[:-1], bounds[1:])]
+
+
+def time_chunk_st_var(st_var, nt, sl):
+    """
+    The part of `st_var` that belongs to the time steps `sl`. The variance
+    of a callable or a single value is the same for every chunk.
+    """
+    if callable(st_var) or np.size(st_var) <= 1:
+        return st_var
+
+    elif hasattr(st_var, 'dims'):
+        return st_var.isel(time=sl) if 'time' in st_var.dims else st_var
+
+    elif np.shape(st_var)[-1] == nt and nt > 1:
+        return np.asarray(st_var)[..., sl]
+
+    else:
+        return st_var
+
+
+def wls_time_chunks(
+        chunks,
+        npar,
+        groups=None,
+        calc_cov=False,
+        verbose=False,
+        diagnostics=None):
+    """
+    Weighted least squares solver that accumulates the normal equations
+    chunk by chunk, so that only a single chunk of observations is in memory
+    at a time. Intended for time series that do not fit in memory, for
+    which the chunks are the time chunks of a dask backed DataStore.
+
+    The local parameters, such as C and the transient attenuation of a time
+    step, may only appear in a single chunk. They are eliminated from the
+    normal equations of their chunk, after which only the contribution to
+    the Schur complement of the global parameters, e.g., gamma and dalpha
+    (single-ended) or gamma and E (double-ended), is added to a running sum.
+    Per chunk, the sparse blocks of its local parameters, A^-1 and N_lg, are
+    kept for the back-substitution and the covariance. Their coupling U =
+    A^-1 N_lg is never stored, see `block_solve`. The memory therefore scales
+    with the non-zeros of N_lg, which is linear in the number of time steps
+    for the single-ended setups, and proportional to the number of
+    observations of the reference sections for the double-ended setups, as
+    every time step couples to E at every reference location. The result
+    equals that of `block_factorize` applied to the normal equations of all
+    chunks.
+
+    Parameters
+    ----------
+    chunks : iterable of tuple
+        Per chunk (X, y, w, x0, ix). The coefficient matrix, the
+        observations, the weights, and the initial estimate of the chunk,
+        and `ix` the indices of the parameters of the chunk in the full
+        parameter vector. The initial estimate of parameters that appear in
+        multiple chunks is taken from the first chunk.
+    npar : int
+        Number of parameters
+    groups : array-like of int
+        Of size npar. See `wls_block`. All global by default.
+    calc_cov : bool, str
+        Return the full covariance matrix. If `'blocks'`, the covariance is
+        returned as a `BlockCovariance` object, without forming the dense
+        matrix.
+    verbose : bool
+    diagnostics : dict, optional
+        Is updated with the number of chunks, the norm of the weighted
+        residuals, the estimated condition number of the reduced system of the
+        global parameters, and the wall time in seconds.
+
+    Returns
+    -------
+    p_sol, p_var[, p_cov]
+    """
+    if groups is None:
+        groups = -np.ones(npar, dtype=int)
+
+    groups = np.asarray(groups, dtype=int)
+    assert groups.size == npar, 'Define a group for each parameter'
+
+    t_start = time.perf_counter()
+
+    ix_glob = np.flatnonzero(groups < 0)
+    ng = ix_glob.size
+    iglob = -np.ones(npar, dtype=int)
+    iglob[ix_glob] = np.arange(ng)
+
+    x0 = np.zeros(npar)
+    known = np.zeros(npar, dtype=bool)
+    b = np.zeros(npar)
+    rwr = 0.
+    nobs = 0
+    nchunk = 0
+
+    # Running sums of the reduced system of the global parameters, scaled
+    # to a unit diagonal at the end, and the local factors per chunk
+    S = np.zeros((ng, ng))
+    diag_g = np.zeros(ng)
+    loc = dict(ix=[], d=[], A_inv=[], A_sqrt=[], N_lg=[])
+    nblock = 0
+
+    for X, y, w, x0_chunk, ix in chunks:
+        assert np.all(np.isfinite(X.data)), 'Nan/inf in X: check ' +\
+            'reference temperatures?'
+        assert np.all(np.isfinite(w)), 'Nan/inf in weights'
+        assert np.all(np.isfinite(y)), 'Nan/inf in observations'
+
+        g_chunk = groups[ix]
+        jg = np.flatnonzero(g_chunk < 0)
+        jl = np.flatnonzero(g_chunk >= 0)
+        jl = jl[np.argsort(g_chunk[jl], kind='stable')]
+        assert not np.any(known[ix[jl]]), \
+            'The local parameters may only appear in a single chunk'
+
+        new = ~known[ix]
+        x0[ix[new]] = np.asarray(x0_chunk)[new]
+        known[ix] = True
+
+        w_std = np.broadcast_to(np.sqrt(np.asarray(w, dtype=float)), y.shape)
+        wX = weighted_design(X, w_std)
+        wr = w_std * (y - X.dot(x0[ix]))
+
+        N = sp.csr_matrix(normal_matrix(wX))
+        b[ix] += wX.T.dot(wr)
+        rwr += np.dot(wr, wr)
+        nobs += y.size
+        nchunk += 1
+
+        # The local parameters are scaled to a unit diagonal, as in
+        # `block_factorize`, and eliminated
+        diag = N.diagonal()
+        assert np.all(diag[jl] > 0), \
+            'Not all parameters are part of an observation'
+        d_l = sp.diags(1 / np.sqrt(diag[jl]))
+        N_ll = d_l.dot(N[jl][:, jl]).dot(d_l).tocsr()
+        N_ll_coo = N_ll.tocoo()
+        g_loc = g_chunk[jl]
+
+        if np.any(
+                (g_loc[N_ll_coo.row] != g_loc[N_ll_coo.col])
+                & (N_ll_coo.data != 0.)):
+            raise ValueError(
+                'Local parameters of different groups appear in the same '
+                'observation. Assign them to the same group or make them '
+                'global.')
+
+        A_inv, A_sqrt, nblock_chunk = _block_diagonal_pinv(N_ll, g_loc)
+        N_lg = d_l.dot(N[jl][:, jg]).tocoo()
+
+        ig = iglob[ix[jg]]
+        diag_g[ig] += diag[jg]
+        S[np.ix_(ig, ig)] += N[jg][:, jg].toarray() - \
+            N_lg.T.dot(A_inv.dot(N_lg)).toarray()
+
+        loc['ix'].append(ix[jl])
+        loc['d'].append(d_l.diagonal())
+        loc['A_inv'].append(A_inv)
+        loc['A_sqrt'].append(A_sqrt)
+        loc['N_lg'].append(
+            sp.csr_matrix(
+                (N_lg.data, (N_lg.row, ig[N_lg.col])), shape=(jl.size, ng)))
+        nblock += nblock_chunk
+
+    assert np.all(known), 'Not all parameters appear in the chunks'
+    assert np.all(diag_g > 0), 'Not all parameters are part of an observation'
+
+    # Scale the global parameters to a unit diagonal, see `block_factorize`
+    d_g = 1 / np.sqrt(diag_g)
+    S = d_g[:, None] * S * d_g[None]
+    ix_loc = np.concatenate(loc['ix']).astype(int)
+    d = np.ones(npar)
+    d[ix_glob] = d_g
+    d[ix_loc] = np.concatenate(loc['d'])
+
+    fac = dict(
+        d=d,
+        ix_glob=ix_glob,
+        ix_loc=ix_loc,
+        nblock=nblock,
+        A_inv=sp.block_diag(loc['A_inv'], format='csr'),
+        A_sqrt=sp.block_diag(loc['A_sqrt'], format='csr'),
+        N_lg=sp.vstack(loc['N_lg']).dot(sp.diags(d_g)).tocsr(),
+        S=S,
+        S_inv=_pinv_sqrt_hermitian(S)[0] if ng else np.zeros((0, 0)))
+    del loc
+
+    dp = block_solve(fac, b)
+    p_sol = x0 + dp
+
+    # weighted sum of squared residuals of the solution. b is in the range
+    # of N, so that dp^T N dp = dp^T b
+    wresid2 = rwr - np.dot(dp, b)
+    degrees_of_freedom_err = nobs - npar
+    err_var = max(wresid2, 0.) / degrees_of_freedom_err
+
+    if verbose:
+        print(
+            f'Chunked solver: {nchunk} chunks, {nobs} observations, '
+            f'{npar} parameters. Err var: {err_var}')
+
+    if diagnostics is not None:
+        diagnostics.update(
+            solver='chunked',
+            chunks=nchunk,
+            residual_norm=float(np.sqrt(max(wresid2, 0.))),
+            cond_estimate=block_cond_estimate(fac),
+            wall_time=time.perf_counter() - t_start)
+
+    if calc_cov == 'blocks':
+        p_cov = BlockCovariance(fac, err_var=err_var)
+        p_var = p_cov.diagonal()
+
+    elif calc_cov:
+        p_cov = block_covariance(fac) * err_var
+        p_var = np.diagonal(p_cov)
+
+    else:
+        p_var = block_variance(fac) * err_var
+
+    if np.any(p_var < 0):
+        m = 'Unable to invert the matrix. The following parameters are ' \
+            'difficult to determine:' + str(np.where(p_var < 0))
+        assert np.all(p_var >= 0), m
+
+    if calc_cov:
+        return p_sol, p_var, p_cov
+    else:
+        return p_sol, p_var
+
+
+def block_factorize(N, groups):
+    """
+    Factorize the normal matrix `N` for the block elimination of the local
+    parameters. See `wls_block`.
+
+    The normal matrix is first scaled to a unit diagonal. For every group of
+    local parameters the block of `N` is inverted, and the global parameters
+    are coupled via the Schur complement
+    S = N_gg - N_gl A^-1 N_lg, with A the block-diagonal of the local
+    parameters.
+
+    Parameters
+    ----------
+    N : scipy.sparse matrix
+        Normal matrix X^T W X, of shape (npar, npar)
+    groups : array-like of int
+        Of size npar. -1 for global parameters, and the index of the block
+        for the local parameters.
+
+    Returns
+    -------
+    dict
+        The factorization that is used by `block_solve`, `block_variance`, and
+        `block_covariance`
+    """
+    N = sp.csr_matrix(N)
+    groups = np.asarray(groups, dtype=int)
+    npar = N.shape[0]
+    assert groups.size == npar, 'Define a group for each parameter'
+
+    # Symmetric scaling to a unit diagonal improves the conditioning
+    diag = N.diagonal()
+    assert np.all(diag > 0), 'Not all parameters are part of an observation'
+    d = 1 / np.sqrt(diag)
+    N = sp.diags(d).dot(N).dot(sp.diags(d)).tocsr()
+
+    ix_glob = np.flatnonzero(groups < 0)
+    ix_loc = np.flatnonzero(groups >= 0)
+    ix_loc = ix_loc[np.argsort(groups[ix_loc], kind='stable')]
+    ng = ix_glob.size
+
+    N_ll = N[ix_loc][:, ix_loc]
+    N_ll_coo = N_ll.tocoo()
+    g_loc = groups[ix_loc]
+
+    if np.any(
+            (g_loc[N_ll_coo.row] != g_loc[N_ll_coo.col])
+            & (N_ll_coo.data != 0.)):
+        raise ValueError(
+            'Local parameters of different groups appear in the same '
+            'observation. Assign them to the same group or make them global.')
+
+    A_inv, A_sqrt, nblock = _block_diagonal_pinv(N_ll, g_loc)
+
+    N_lg = N[ix_loc][:, ix_glob]
+    S = N[ix_glob][:, ix_glob].toarray() - \
+        N_lg.T.dot(A_inv.dot(N_lg)).toarray()
+
+    return dict(
+        d=d,
+        ix_glob=ix_glob,
+        ix_loc=ix_loc,
+        nblock=nblock,
+        A_inv=A_inv,
+        A_sqrt=A_sqrt,
+        N_lg=N_lg,
+        S=S,
+        S_inv=_pinv_sqrt_hermitian(S)[0] if ng else np.zeros((0, 0)))
+
+
+def _block_diagonal_pinv(N_ll, g_loc):
+    """
+    Pseudo-inverse of the block-diagonal matrix `N_ll`, and its square root.
+    The blocks are defined by `g_loc`, which is sorted. All blocks of the
+    same size are inverted in a single batch.
+
+    Returns
+    -------
+    A_inv, A_sqrt : scipy.sparse.csr_matrix
+    nblock : int
+        Number of blocks
+    """
+    nl = g_loc.size
+    _, ix_start, block_sizes = np.unique(
+        g_loc, return_index=True, return_counts=True)
+    inv_row, inv_col, inv_data, sqrt_data = [], [], [], []
+
+    for size in np.unique(block_sizes):
+        cols = ix_start[block_sizes == size][:, None] + np.arange(size)[None]
+        rows_b = np.repeat(cols, size, axis=1)
+        cols_b = np.tile(cols, (1, size))
+        blocks = np.asarray(
+            N_ll[rows_b.ravel(), cols_b.ravel()]).reshape(
+                (-1, size, size))
+
+        # Pseudo-inverse, similar to `np.linalg.lstsq` in `wls_sparse`, so
+        # that setups with a null space still result in a solution. The
+        # square root of the inverse is kept for drawing samples.
+        blocks_inv, blocks_sqrt = _pinv_sqrt_hermitian(blocks)
+
+        inv_row.append(rows_b.ravel())
+        inv_col.append(cols_b.ravel())
+        inv_data.append(blocks_inv.ravel())
+        sqrt_data.append(blocks_sqrt.ravel())
+
+    if nl:
+        ij = (np.concatenate(inv_row), np.concatenate(inv_col))
+        A_inv = sp.csr_matrix((np.concatenate(inv_data), ij), shape=(nl, nl))
+        A_sqrt = sp.csr_matrix(
+            (np.concatenate(sqrt_data), ij), shape=(nl, nl))
+    else:
+        A_inv = sp.csr_matrix((0, 0))
+        A_sqrt = sp.csr_matrix((0, 0))
+
+    return A_inv, A_sqrt, block_sizes.size
+
+
+def _pinv_sqrt_hermitian(a):
+    """
+    Pseudo-inverse of the (stack of) symmetric positive semi-definite
+    matrices `a`, and a square root `L` of the pseudo-inverse, with
+    L L^T = pinv(a). Eigenvalues below size * eps of the largest eigenvalue
+    are discarded, as with `np.linalg.pinv`.
+    """
+    size = a.shape[-1]
+    eigval, eigvec = np.linalg.eigh(a)
+    cutoff = size * np.finfo(float).eps * np.max(
+        np.abs(eigval), axis=-1, keepdims=True)
+    large = np.abs(eigval) > cutoff
+    eigval_inv = np.divide(
+        1., eigval, out=np.zeros_like(eigval), where=large)
+
+    a_inv = np.matmul(
+        eigvec * eigval_inv[..., None, :], np.swapaxes(eigvec, -1, -2))
+    a_sqrt = eigvec * np.sqrt(np.clip(eigval_inv, 0., None))[..., None, :]
+    return a_inv, a_sqrt
+
+
+def block_cond_estimate(fac):
+    """
+    Estimate of the condition number of the weighted coefficient matrix,
+    from the reduced system of the global parameters of the factorization
+    `fac` of `block_factorize`. Infinite if the system is singular.
+    """
+    if not fac['ix_glob'].size:
+        return 1.
+
+    eigval = np.linalg.eigvalsh(fac['S'])
+
+    if eigval[0] <= np.finfo(float).eps * eigval[-1]:
+        return np.inf
+    else:
+        return float(np.sqrt(eigval[-1] / eigval[0]))
+
+
+def block_solve(fac, b):
+    """
+    Solve N p = b, with N factorized by `block_factorize`.
+
+    Parameters
+    ----------
+    fac : dict
+        Factorization returned by `block_factorize`
+    b : array-like
+        Right hand side, of size npar
+
+    Returns
+    -------
+    p : array-like
+    """
+    b = fac['d'] * b
+    z_l = fac['A_inv'].dot(b[fac['ix_loc']])
+    p_g = fac['S_inv'].dot(b[fac['ix_glob']] - fac['N_lg'].T.dot(z_l))
+
+    p = np.zeros_like(b)
+    p[fac['ix_glob']] = p_g
+    p[fac['ix_loc']] = z_l - fac['A_inv'].dot(fac['N_lg'].dot(p_g))
+    return fac['d'] * p
+
+
+def block_variance(fac):
+    """
+    The diagonal of the inverse of N, with N factorized by `block_factorize`.
+    Obtained without forming the inverse of N. U is formed for a batch of
+    the local parameters at a time.
+    """
+    nl = fac['ix_loc'].size
+    step = max(1, 2**20 // max(fac['ix_glob'].size, 1))
+    var_l = fac['A_inv'].diagonal()
+
+    for start in range(0, nl, step):
+        U = _block_U(fac, slice(start, start + step))
+        var_l[start:start + step] += np.sum(U.dot(fac['S_inv']) * U, axis=1)
+
+    var = np.zeros(fac['d'].size)
+    var[fac['ix_glob']] = np.diagonal(fac['S_inv'])
+    var[fac['ix_loc']] = var_l
+    return fac['d']**2 * var
+
+
+def block_covariance(fac):
+    """
+    The dense inverse of N, with N factorized by `block_factorize`.
+    """
+    ix_glob, ix_loc = fac['ix_glob'], fac['ix_loc']
+    U = _block_U(fac)
+    US = U.dot(fac['S_inv'])
+
+    cov = np.zeros((fac['d'].size, fac['d'].size))
+    cov[np.ix_(ix_glob, ix_glob)] = fac['S_inv']
+    cov[np.ix_(ix_loc, ix_glob)] = -US
+    cov[np.ix_(ix_glob, ix_loc)] = -US.T
+    cov[np.ix_(ix_loc, ix_loc)] = fac['A_inv'].toarray() + US.dot(U.T)
+    return fac['d'][:, None] * cov * fac['d'][None]
+
+
+def _block_U(fac, rows=slice(None)):
+    """
+    Dense rows of U = A^-1 N_lg, the coupling of the local to the global
+    parameters of the factorization `fac` of `block_factorize`. U has as
+    many elements as N_lg has non-zeros, so it is formed only when needed
+    instead of kept in `fac`.
+    """
+    A_inv = fac['A_inv'][rows]
+    return np.asarray(A_inv.dot(fac['N_lg']).todense()).reshape(
+        (A_inv.shape[0], fac['ix_glob'].size))
+
+
+class BlockCovariance(object):
+    """
+    Covariance matrix of the parameters, stored as the block factorization of
+    the normal equations (see `block_factorize`) instead of as a dense
+    (npar x npar) matrix. Returned by `wls_sparse` and `wls_block` with
+    `calc_cov='blocks'`.
+
+    With the local parameters eliminated, the (scaled) covariance matrix is
+    G S^-1 G^T + A^-1, in which the rows of G are the unit vectors for the
+    global parameters and -U = -A^-1 N_lg for the local parameters. The
+    variances, selected blocks, matrix-vector products, and random samples
+    are computed from these factors, so the dense matrix is only formed if
+    requested with `toarray()`.
+
+    Parameters
+    ----------
+    fac : dict
+        Factorization returned by `block_factorize`
+    err_var : float
+        Variance of the weighted residuals, with which the inverse of the
+        normal matrix is scaled
+    ix : array-like of int, optional
+        Position of the factorized parameters in the full parameter vector
+    var : array-like, optional
+        Variance of all parameters in the full parameter vector. Only used for
+        the parameters that are not in `ix`, which are uncorrelated.
+    """
+
+    def __init__(self, fac, err_var=1., ix=None, var=None):
+        self.fac = fac
+        self.err_var = err_var
+        nfit = fac['d'].size
+
+        if ix is None:
+            ix = np.arange(nfit)
+        if var is None:
+            var = np.zeros(nfit)
+
+        self.ix = np.asarray(ix, dtype=int)
+        self.var = np.array(var, dtype=float)
+        assert self.ix.size == nfit, 'Define a position for each parameter'
+
+        # position of the full parameters in the global and local parameters
+        self._ifit = -np.ones(self.var.size, dtype=int)
+        self._ifit[self.ix] = np.arange(nfit)
+        self._iglob = -np.ones(nfit, dtype=int)
+        self._iglob[fac['ix_glob']] = np.arange(fac['ix_glob'].size)
+        self._iloc = -np.ones(nfit, dtype=int)
+        self._iloc[fac['ix_loc']] = np.arange(fac['ix_loc'].size)
+        self._S_sqrt = None
+
+        self.var[self.ix] = block_variance(fac) * err_var
+
+    @property
+    def shape(self):
+        return self.var.size, self.var.size
+
+    def __array__(self, dtype=None):
+        return self.toarray().astype(dtype)
+
+    def embed(self, ix, var):
+        """
+        Place the parameters in a larger parameter vector.
+
+        Parameters
+        ----------
+        ix : array-like of int
+            Position of the current parameters in the larger parameter vector
+        var : array-like
+            Variance of the parameters of the larger parameter vector. The
+            parameters not in `ix` are uncorrelated.
+
+        Returns
+        -------
+        BlockCovariance
+        """
+        ix = np.asarray(ix, dtype=int)
+        assert ix.size == self.var.size, 'Define a position for each parameter'
+        return BlockCovariance(
+            self.fac, err_var=self.err_var, ix=ix[self.ix], var=var)
+
+    def diagonal(self):
+        """The variance of the parameters"""
+        return self.var.copy()
+
+    def block(self, rows, cols=None):
+        """
+        Dense sub-block of the covariance matrix.
+
+        Parameters
+        ----------
+        rows, cols : array-like of int
+            Indices of the parameters. If `cols` is None, the square block of
+            `rows` is returned.
+
+        Returns
+        -------
+        array-like
+            Of shape (rows.size, cols.size)
+        """
+        rows = np.atleast_1d(np.asarray(rows, dtype=int))
+        if cols is None:
+            cols = rows
+        else:
+            cols = np.atleast_1d(np.asarray(cols, dtype=int))
+
+        out = np.zeros((rows.size, cols.size))
+
+        # Uncorrelated parameters that are not part of the factorization
+        notfit = self._ifit[rows] < 0
+        same = rows[:, None] == cols[None]
+        out[notfit] = np.where(same[notfit], self.var[rows][notfit, None], 0.)
+
+        irow = np.flatnonzero(~notfit)
+        icol = np.flatnonzero(self._ifit[cols] >= 0)
+        a = self._ifit[rows[irow]]
+        b = self._ifit[cols[icol]]
+
+        cov = self._G(a).dot(self.fac['S_inv']).dot(self._G(b).T)
+
+        aloc = self._iloc[a]
+        bloc = self._iloc[b]
+        ia = np.flatnonzero(aloc >= 0)
+        ib = np.flatnonzero(bloc >= 0)
+        cov[np.ix_(ia, ib)] += self.fac['A_inv'][aloc[ia]][:, bloc[ib]].toarray()
+
+        d = self.fac['d']
+        out[np.ix_(irow, icol)] = d[a][:, None] * cov * d[b][None] * \
+            self.err_var
+        return out
+
+    def elements(self, rows, cols):
+        """
+        Elements of the covariance matrix, similar to `cov[rows, cols]` with
+        numpy fancy indexing. The indices are broadcasted, and only the
+        requested elements are computed.
+
+        Parameters
+        ----------
+        rows, cols : array-like of int
+            Indices of the parameters
+
+        Returns
+        -------
+        array-like
+            Of the broadcasted shape of `rows` and `cols`
+        """
+        rows, cols = np.broadcast_arrays(
+            np.asarray(rows, dtype=int), np.asarray(cols, dtype=int))
+        shape = rows.shape
+        rows, cols = rows.ravel(), cols.ravel()
+
+        # Uncorrelated parameters that are not part of the factorization
+        out = np.where(rows == cols, self.var[rows], 0.)
+
+        fit = np.flatnonzero((self._ifit[rows] >= 0) & (self._ifit[cols] >= 0))
+        a = self._ifit[rows[fit]]
+        b = self._ifit[cols[fit]]
+
+        ua, ia = np.unique(a, return_inverse=True)
+        ub, ib = np.unique(b, return_inverse=True)
+        g_a = self._G(ua).dot(self.fac['S_inv'])
+        g_b = self._G(ub)
+        cov = np.einsum('ij,ij->i', g_a[ia], g_b[ib])
+
+        aloc = self._iloc[a]
+        bloc = self._iloc[b]
+        both = (aloc >= 0) & (bloc >= 0)
+
+        if np.any(both):
+            cov[both] += np.asarray(
+                self.fac['A_inv'][aloc[both], bloc[both]]).ravel()
+
+        d = self.fac['d']
+        out[fit] = d[a] * cov * d[b] * self.err_var
+        return out.reshape(shape)
+
+    def toarray(self):
+        """The dense covariance matrix"""
+        return self.block(np.arange(self.var.size))
+
+    def dot(self, v):
+        """
+        Product of the covariance matrix with the vector `v`
+        """
+        v = np.asarray(v, dtype=float)
+        fac = self.fac
+        u = fac['d'] * v[self.ix]
+        u_g = u[fac['ix_glob']]
+        u_l = u[fac['ix_loc']]
+
+        # U^T = N_gl A^-1, as A^-1 is symmetric
+        t = fac['S_inv'].dot(u_g - fac['N_lg'].T.dot(fac['A_inv'].dot(u_l)))
+        p = np.zeros_like(u)
+        p[fac['ix_glob']] = t
+        p[fac['ix_loc']] = fac['A_inv'].dot(u_l - fac['N_lg'].dot(t))
+
+        out = self.var * v
+        out[self.ix] = fac['d'] * p * self.err_var
+        return out
+
+    def rvs(self, mean=None, size=1, random_state=None):
+        """
+        Draw samples from the multivariate normal distribution with this
+        covariance matrix. The samples are drawn per block, so the dense
+        covariance matrix or its Cholesky decomposition is never formed.
+
+        Parameters
+        ----------
+        mean : array-like, optional
+            Mean of the distribution. Zero by default.
+        size : int
+            Number of samples
+        random_state : int, np.random.RandomState, np.random.Generator, optional
+            Seed or random generator. numpy's global random state by default.
+
+        Returns
+        -------
+        array-like
+            Of shape (size, npar)
+        """
+        if random_state is None:
+            rng = np.random
+        elif hasattr(random_state, 'standard_normal'):
+            rng = random_state
+        else:
+            rng = np.random.RandomState(random_state)
+
+        z = rng.standard_normal((size, self.var.size))
+        return self.transform(z, mean=mean)
+
+    def transform(self, z, mean=None):
+        """
+        Transform samples of the standard normal distribution to samples of
+        the multivariate normal distribution with this covariance matrix.
+
+        Parameters
+        ----------
+        z : array-like
+            Of shape (size, npar)
+        mean : array-like, optional
+            Mean of the distribution. Zero by default.
+
+        Returns
+        -------
+        array-like
+            Of shape (size, npar)
+        """
+        fac = self.fac
+
+        if self._S_sqrt is None:
+            self._S_sqrt = _pinv_sqrt_hermitian(fac['S'])[1] \
+                if fac['ix_glob'].size else np.zeros((0, 0))
+
+        z = np.asarray(z, dtype=float)
+
+        # p_g = L_S z_g and p_l = L_A z_l - U p_g
+        z_fit = z[:, self.ix]
+        p = np.zeros_like(z_fit)
+        p_g = z_fit[:, fac['ix_glob']].dot(self._S_sqrt.T)
+        p[:, fac['ix_glob']] = p_g
+        p[:, fac['ix_loc']] = (
+            fac['A_sqrt'].dot(z_fit[:, fac['ix_loc']].T)
+            - fac['A_inv'].dot(fac['N_lg'].dot(p_g.T))).T
+
+        out = z * np.sqrt(self.var)
+        out[:, self.ix] = fac['d'] * p * np.sqrt(self.err_var)
+
+        if mean is not None:
+            out += mean
+        return out
+
+    def _G(self, a):
+        """Rows `a` of G, see the class docstring"""
+        g = np.zeros((a.size, self.fac['ix_glob'].size))
+        iglob = self._iglob[a]
+        isg = iglob >= 0
+        g[np.flatnonzero(isg), iglob[isg]] = 1.
+        g[~isg] = -_block_U(self.fac, self._iloc[a[~isg]])
+        return g
+
+
+def wls_stats(
+        X, y, w=1., calc_cov=False, x0=None, return_werr=False, verbose=False):
+    """
+
+    Parameters
+    ----------
+    X
+    y
+    w
+    calc_cov
+    verbose
+
+    Returns
+    -------
+
+    """
+    import statsmodels.api as sm
+
+    y = np.asarray(y)
+    w = np.asarray(w)
+
+    if sp.issparse(X):
+        X = X.toarray()
+
+    if x0 is not None:
+        # Initial values not supported by statsmodels
+        pass
+
+    mod_wls = sm.WLS(y, X, weights=w)
+    res_wls = mod_wls.fit()
+    p_sol = res_wls.params
+
+    if verbose:
+        print(res_wls.summary())
+
+    p_cov = res_wls.cov_params()
+    p_var = res_wls.bse**2
+
+    if return_werr:
+        wy = np.sqrt(w) * y
+        wX = np.sqrt(w) * X
+        werr = wy - wX.dot(p_sol)
+
+    if calc_cov:
+        if return_werr:
+            return p_sol, p_var, p_cov, werr
+        else:
+            return p_sol, p_var, p_cov
+    else:
+        if return_werr:
+            return p_sol, p_var, werr
+        else:
+            return p_sol, p_var
+
+
+def calc_alpha_double(
+        mode,
+        ds,
+        st_var=None,
+        ast_var=None,
+        rst_var=None,
+        rast_var=None,
+        D_F_label=None,
+        D_B_label=None,
+        D_F_var_label=None,
+        D_B_var_label=None,
+        ix_alpha_is_zero=-1,
+        talpha_fw=None,
+        talpha_bw=None,
+        talpha_fw_var=None,
+        talpha_bw_var=None):
+    """Eq.50 if weighted least squares. Assumes ds has `trans_att`
+    pre-configured."""
+
+    assert ix_alpha_is_zero >= 0, 'Define ix_alpha_is_zero' + \
+                                  str(ix_alpha_is_zero)
+
+    time_dim = ds.get_time_dim()
+
+    if st_var is not None:
+        if callable(st_var):
+            st_var_val = st_var(ds.st)
+        else:
+            st_var_val = np.asarray(st_var)
+        if callable(ast_var):
+            ast_var_val = ast_var(ds.ast)
+        else:
+            ast_var_val = np.asarray(ast_var)
+        if callable(rst_var):
+            rst_var_val = rst_var(ds.rst)
+        else:
+            rst_var_val = np.asarray(rst_var)
+        if callable(rast_var):
+            rast_var_val = rast_var(ds.rast)
+        else:
+            rast_var_val = np.asarray(rast_var)
+
+        i_var_fw = ds.i_var(
+            st_var_val, ast_var_val, st_label='st', ast_label='ast')
+        i_var_bw = ds.i_var(
+            rst_var_val, rast_var_val, st_label='rst', ast_label='rast')
+
+        i_fw = np.log(ds.st / ds.ast)
+        i_bw = np.log(ds.rst / ds.rast)
+
+        if mode == 'guess':
+            A_var = (i_var_fw + i_var_bw) / 2
+            A = (i_bw - i_fw) / 2
+
+        elif mode == 'exact':
+            D_F = ds[D_F_label]
+            D_B = ds[D_B_label]
+            D_F_var = ds[D_F_var_label]
+            D_B_var = ds[D_B_var_label]
+
+            if ds.trans_att.size > 0:
+                # Can be improved by including covariances. That reduces the
+                # uncert.
+
+                steps = TransientAttenuation(
+                    ds.x.values, ds.trans_att.values)
+                ta_arr_fw = steps.fw(talpha_fw.T)
+                ta_arr_fw_var = steps.fw(talpha_fw_var.T)
+                ta_arr_bw = steps.bw(talpha_bw.T)
+                ta_arr_bw_var = steps.bw(talpha_bw_var.T)
+
+                A_var = (
+                    i_var_fw + i_var_bw + D_B_var + D_F_var + ta_arr_fw_var
+                    + ta_arr_bw_var) / 2
+                A = (i_bw - i_fw) / 2 + (D_B - D_F) / 2 + (
+                    ta_arr_bw - ta_arr_fw) / 2
+
+            else:
+                A_var = (i_var_fw + i_var_bw + D_B_var + D_F_var) / 2
+                A = (i_bw - i_fw) / 2 + (D_B - D_F) / 2
+
+        E_var = 1 / (1 / A_var).sum(dim=time_dim)
+        E = (A / A_var).sum(dim=time_dim) * E_var
+
+    else:
+        i_fw = np.log(ds.st / ds.ast)
+        i_bw = np.log(ds.rst / ds.rast)
+
+        if mode == 'guess':
+            A = (i_bw - i_fw) / 2
+        elif mode == 'exact':
+            D_F = ds[D_F_label]
+            D_B = ds[D_B_label]
+            A = (i_bw - i_fw) / 2 + (D_B - D_F) / 2
+
+        E_var = A.var(dim=time_dim)
+        E = A.mean(dim=time_dim)
+
+    # E is defined zero at the first index of the reference sections
+    if mode == 'guess':
+        E -= E.isel(x=ix_alpha_is_zero)
+
+    # assert np.abs(E.isel(x=ix_alpha_is_zero)) < 1e-8, \
+    #     'Something went wrong in the estimation of d_f and d_b: ' + str(E)
+
+    return E, E_var
+
+
+def calc_df_db_double_est(ds, ix_alpha_is_zero, gamma_est):
+    Ifwx0 = np.log(
+        ds.st.isel(x=ix_alpha_is_zero)
+        / ds.ast.isel(x=ix_alpha_is_zero)).values
+    Ibwx0 = np.log(
+        ds.rst.isel(x=ix_alpha_is_zero)
+        / ds.rast.isel(x=ix_alpha_is_zero)).values
+    ref_temps_refs = ds.ufunc_per_section(
+        label='st', ref_temp_broadcasted=True, calc_per='all')
+    ix_sec = ds.ufunc_per_section(x_indices=True, calc_per='all')
+    ref_temps_x0 = ref_temps_refs[
+        ix_sec == ix_alpha_is_zero].flatten().compute() + 273.15
+    df_est = gamma_est / ref_temps_x0 - Ifwx0
+    db_est = gamma_est / ref_temps_x0 - Ibwx0
+    return df_est, db_est
+
+
+def match_sections(ds, matching_sections):
+    """
+    Matches location indices of two sections.
+    Parameters
+    ----------
+    ds
+    matching_sections : List[Tuple[slice, slice, bool]]
+        Provide a list of tuples. A tuple per matching section. Each tuple
+        has three items. The first two items are the slices of the sections
+        that are matched. The third item is a boolean and is True if the two
+        sections have a reverse direction ("J-configuration"), most common.
+
+    Returns
+    -------
+    matching_indices : array-like
+        Is an array of size (np, 2), where np is the number of paired
+        locations. The array contains indices to locations along the fiber.
+    """
+    for hslice, tslice, reverse_flag in matching_sections:
+        hxs = ds.x.sel(x=hslice).size
+        txs = ds.x.sel(x=tslice).size
+
+        assert hxs == txs, 'the two sections do not have matching ' \
+                           'number of items: ' + str(hslice) + 'size: ' + \
+                           str(hxs) + str(tslice) + 'size: ' + str(txs)
+
+    hix = ds.ufunc_per_section(
+        sections={0: [i[0] for i in matching_sections]},
+        x_indices=True,
+        calc_per='all')
+
+    tixl = []
+    for _, tslice, reverse_flag in matching_sections:
+        ixi = ds.ufunc_per_section(
+            sections={0: [tslice]}, x_indices=True, calc_per='all')
+
+        if reverse_flag:
+            tixl.append(ixi[::-1])
+        else:
+            tixl.append(ixi)
+
+    tix = np.concatenate(tixl)
+
+    return np.stack((hix, tix)).T
+
+
+def temperature_variance_single_ended(
+        ds, p_val, p_cov, st_var, ast_var, fixed_alpha=False):
+    """
+    First-order (delta-method) approximation of the variance of the
+    temperature of single-ended setups,
+
+    T = gamma / (I + C + TA + dalpha * x) - 273.15, with I = ln(st / ast).
+
+    The variance is J cov J^T + (dT/dI)^2 var(I), in which J is the Jacobian
+    of T to the parameters. J only refers to gamma, dalpha (or alpha at that
+    location), and C and the transient attenuation of that time step, so
+    only a few elements of the covariance matrix are required per location
+    and time step.
+
+    Parameters
+    ----------
+    ds : DataStore
+    p_val : array-like
+        The calibrated parameters, see `conf_int_single_ended`
+    p_cov : array-like, BlockCovariance
+        The covariance of `p_val`
+    st_var, ast_var : float, callable, array-like
+        The variance of the noise of the Stokes and anti-Stokes intensities
+    fixed_alpha : bool
+        Whether `p_val` contains alpha per location instead of dalpha
+
+    Returns
+    -------
+    tmpf, tmpf_var : array-like
+        The temperature and its variance, of shape (nx, nt)
+    """
+    no, nt = ds.st.shape
+    x = ds.x.values
+
+    if 'trans_att' in ds.keys():
+        trans_att = ds.trans_att.values
+    else:
+        trans_att = np.zeros(0)
+
+    nta = trans_att.size
+    p_val = np.asarray(p_val)
+    gamma = p_val[0]
+
+    if fixed_alpha:
+        ic = 1 + no
+        alpha = p_val[1:1 + no]
+    else:
+        ic = 2
+        alpha = p_val[1] * x
+
+    ita = ic + nt
+    ta_on = (x[:, None] >= trans_att[None]).astype(float)
+    ta_arr = ta_on.dot(p_val[ita:].reshape((nta, nt)))
+
+    denom = np.log(ds.st.data) - np.log(ds.ast.data) + \
+        p_val[ic:ita][None] + ta_arr + alpha[:, None]
+    tmpf = gamma / denom - 273.15
+
+    # Derivative of T to the denominator
+    u = -gamma / denom**2
+
+    # The coefficients of J and the indices of the parameters, which
+    # broadcast to (nx, nt)
+    terms = [(1 / denom, 0)]
+
+    if fixed_alpha:
+        terms.append((u, 1 + np.arange(no)[:, None]))
+    else:
+        terms.append((u * x[:, None], 1))
+
+    terms.append((u, (ic + np.arange(nt))[None]))
+
+    for j in range(nta):
+        terms.append(
+            (u * ta_on[:, j, None], (ita + j * nt + np.arange(nt))[None]))
+
+    tmpf_var = delta_method_covariance(terms, p_cov) + \
+        u**2 * intensity_variance(ds, ['st', 'ast'], [st_var, ast_var])
+    return tmpf, tmpf_var
+
+
+def temperature_variance_double_ended(
+        ds,
+        p_val,
+        p_cov,
+        st_var,
+        ast_var,
+        rst_var,
+        rast_var,
+        trans_att=None,
+        ix_sec=None):
+    """
+    First-order (delta-method) approximation of the variances of the forward
+    and backward temperatures of double-ended setups, and their covariance,
+
+    T_F = gamma / (I_F + D_F + A + TA_F) - 273.15, with I_F = ln(st / ast),
+    T_B = gamma / (I_B + D_B - A + TA_B) - 273.15, with I_B = ln(rst / rast).
+
+    T_F and T_B are correlated through gamma and A, and their Stokes
+    intensities are independent.
+
+    Parameters
+    ----------
+    ds : DataStore
+    p_val : array-like
+        The calibrated parameters, see `conf_int_double_ended`
+    p_cov : array-like, BlockCovariance, bool
+        The covariance of `p_val`. If False, only the noise of the Stokes
+        intensities is propagated.
+    st_var, ast_var, rst_var, rast_var : float, callable, array-like
+        The variance of the noise of the Stokes and anti-Stokes intensities
+    trans_att : array-like, optional
+        Locations of the transient attenuation
+    ix_sec : array-like of int, optional
+        Indices of the locations in the reference sections. A outside of the
+        reference sections is uncorrelated with the other parameters, as in
+        the Monte Carlo approach.
+
+    Returns
+    -------
+    tmpf, tmpb, tmpf_var, tmpb_var, tmpfb_cov : array-like
+        Of shape (nx, nt)
+    """
+    no, nt = ds.st.shape
+    x = ds.x.values
+
+    if trans_att is None:
+        trans_att = np.zeros(0)
+
+    nta = np.size(trans_att)
+    p_val = np.asarray(p_val)
+    gamma = p_val[0]
+    alpha = p_val[1 + 2 * nt:1 + 2 * nt + no]
+    ita = 1 + 2 * nt + no
+
+    # TA of connector j and direction d is at ita + (2 * j + d) * nt + t
+    ta = p_val[ita:].reshape((nta, 2, nt))
+    ta_fw_on = (x[:, None] >= np.asarray(trans_att)[None]).astype(float)
+    ta_bw_on = 1. - ta_fw_on
+
+    denom_f = np.log(ds.st.data) - np.log(ds.ast.data) + \
+        p_val[1:1 + nt][None] + alpha[:, None] + ta_fw_on.dot(ta[:, 0])
+    denom_b = np.log(ds.rst.data) - np.log(ds.rast.data) + \
+        p_val[1 + nt:1 + 2 * nt][None] - alpha[:, None] + \
+        ta_bw_on.dot(ta[:, 1])
+    tmpf = gamma / denom_f - 273.15
+    tmpb = gamma / denom_b - 273.15
+
+    # Derivatives of T_F and T_B to their denominators
+    u_f = -gamma / denom_f**2
+    u_b = -gamma / denom_b**2
+
+    tmpf_var = u_f**2 * intensity_variance(ds, ['st', 'ast'], [st_var, ast_var])
+    tmpb_var = u_b**2 * intensity_variance(
+        ds, ['rst', 'rast'], [rst_var, rast_var])
+
+    if isinstance(p_cov, bool) and not p_cov:
+        return tmpf, tmpb, tmpf_var, tmpb_var, np.zeros_like(tmpf_var)
+
+    # The coefficients of J and the indices of the parameters, which
+    # broadcast to (nx, nt)
+    ix_t = np.arange(nt)[None]
+    ix_alpha = 1 + 2 * nt + np.arange(no)[:, None]
+    terms_f = [(1 / denom_f, 0), (u_f, 1 + ix_t), (u_f, ix_alpha)]
+    terms_b = [(1 / denom_b, 0), (u_b, 1 + nt + ix_t), (-u_b, ix_alpha)]
+
+    for j in range(nta):
+        terms_f.append(
+            (u_f * ta_fw_on[:, j, None], ita + 2 * j * nt + ix_t))
+        terms_b.append(
+            (u_b * ta_bw_on[:, j, None], ita + (2 * j + 1) * nt + ix_t))
+
+    uncorrelated = np.zeros(p_val.size, dtype=bool)
+
+    if ix_sec is not None:
+        uncorrelated[1 + 2 * nt:1 + 2 * nt + no] = True
+        uncorrelated[1 + 2 * nt + np.asarray(ix_sec)] = False
+
+    tmpf_var = tmpf_var + delta_method_covariance(
+        terms_f, p_cov, uncorrelated=uncorrelated)
+    tmpb_var = tmpb_var + delta_method_covariance(
+        terms_b, p_cov, uncorrelated=uncorrelated)
+    tmpfb_cov = delta_method_covariance(
+        terms_f, p_cov, terms_b, uncorrelated=uncorrelated)
+    return tmpf, tmpb, tmpf_var, tmpb_var, tmpfb_cov
+
+
+def delta_method_covariance(terms, p_cov, terms2=None, uncorrelated=None):
+    """
+    The covariance J cov J2^T of two linearized functions of the parameters,
+    for each location and time step. Only the elements of the covariance
+    matrix that are referred to by the Jacobians are looked up.
+
+    Parameters
+    ----------
+    terms : list of tuple
+        The nonzero entries of the Jacobian J. Tuples of the coefficient and
+        the index of the parameter, which broadcast to (nx, nt).
+    p_cov : array-like, BlockCovariance
+        The covariance of the parameters
+    terms2 : list of tuple, optional
+        The Jacobian J2 of the second function. Defaults to `terms`, which
+        returns the variance.
+    uncorrelated : array-like of bool, optional
+        Of size npar. Parameters of which the covariance with the other
+        parameters is neglected.
+
+    Returns
+    -------
+    array-like
+        Of shape (nx, nt)
+    """
+    if isinstance(p_cov, BlockCovariance):
+        elements = p_cov.elements
+    else:
+        p_cov = np.asarray(p_cov)
+
+        def elements(rows, cols):
+            return p_cov[rows, cols]
+
+    def cov(rows, cols):
+        if uncorrelated is None:
+            return elements(rows, cols)
+
+        return np.where(
+            (uncorrelated[rows] | uncorrelated[cols]) & (rows != cols), 0.,
+            elements(rows, cols))
+
+    out = 0.
+
+    if terms2 is None:
+        # symmetric, so the off-diagonal terms are counted twice
+        for k, (jac_k, ix_k) in enumerate(terms):
+            out = out + jac_k**2 * cov(ix_k, ix_k)
+
+            for jac_l, ix_l in terms[k + 1:]:
+                out = out + 2 * jac_k * jac_l * cov(ix_k, ix_l)
+
+    else:
+        for jac_k, ix_k in terms:
+            for jac_l, ix_l in terms2:
+                out = out + jac_k * jac_l * cov(ix_k, ix_l)
+
+    return out
+
+
+def intensity_variance(ds, labels, variances):
+    """
+    Variance of ln(st / ast) from the variances of the noise of the Stokes
+    and anti-Stokes intensities.
+
+    Parameters
+    ----------
+    ds : DataStore
+    labels : list of str
+        E.g., ['st', 'ast']
+    variances : list of float, callable, array-like
+        The variance of the noise of each of the intensities, see
+        `conf_int_single_ended`
+
+    Returns
+    -------
+    array-like
+        Of shape (nx, nt)
+    """
+    no, nt = ds.st.shape
+    out = 0.
+
+    for label, var in zip(labels, variances):
+        assert var is not None, 'Define the variance of ' + label
+
+        if callable(var):
+            var = var(ds[label]).data
+        elif np.size(var) > 1:
+            var = np.broadcast_to(np.asarray(var), (no, nt))
+
+        out = out + var / ds[label].data**2
+
+    return out
+
+
+def lowbias32(z):
+    """
+    A bijective mixing of 32 bit integers, the lowbias32 hash of C.
+    Wellons' hash-prospector
+    """
+    z = np.array(z, dtype=np.uint32)
+
+    with np.errstate(over='ignore'):
+        z ^= z >> np.uint32(16)
+        z *= np.uint32(0x7feb352d)
+        z ^= z >> np.uint32(15)
+        z *= np.uint32(0x846ca68b)
+        z ^= z >> np.uint32(16)
+
+    return z
+
+
+class RandomStreams(object):
+    """
+    Counter-based random streams for the Monte Carlo samples, which do not
+    depend on how the samples are chunked, on the order in which the chunks
+    are drawn, or on the number of workers.
+
+    Sample `i` of a quantity `label` (e.g., 'st' or the parameters 'p') has
+    its own Philox stream, with a key that is spawned from the
+    `np.random.SeedSequence` of `seed` with spawn key (label, i). The value
+    at flat position k of the sample, e.g., k = ix * nt + it for the Stokes
+    intensity at location ix and time step it, is drawn from position k of
+    the stream, which Philox reaches without drawing the preceding values.
+    A chunk of samples is therefore bit-identical to the same samples
+    drawn as part of any other chunk, and chunks can be drawn in parallel.
+    Normal samples follow from the uniform samples by the inverse of the
+    normal CDF.
+
+    With `lhs_size`, the samples of each position are Latin hypercube
+    samples: sample `i` is drawn uniformly from stratum `rank[i]` of the
+    `lhs_size` strata of equal probability, with `rank` a random
+    permutation per position. The permutation is a Feistel network with
+    round keys per position from the streams with label `label +
+    '/strata'`, so that `rank[i]` follows for the samples `i` of a chunk
+    without drawing the other samples, see `strata()`.
+
+    Parameters
+    ----------
+    seed : int, array-like of int, np.random.SeedSequence, optional
+        The seed. By default, the entropy is drawn from numpy's global random
+        state, so that `np.random.seed()` reproduces the samples. The entropy
+        is stored as `entropy`.
+    """
+
+    # Positions that are at most this far apart are drawn as a single run
+    run_gap = 1024
+
+    # The number of rounds of the Feistel network of the strata
+    feistel_rounds = 4
+
+    def __init__(self, seed=None):
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_seq = seed
+        elif seed is None:
+            self.seed_seq = np.random.SeedSequence(
+                [int(i) for i in np.random.randint(0, 2**31 - 1, size=4)])
+        else:
+            self.seed_seq = np.random.SeedSequence(seed)
+
+        self.entropy = self.seed_seq.entropy
+
+    def __repr__(self):
+        return 'RandomStreams(entropy={})'.format(self.entropy)
+
+    @staticmethod
+    def label_id(label):
+        """A stable integer for `label`"""
+        return int.from_bytes(
+            hashlib.sha256(str(label).encode()).digest()[:4], 'little')
+
+    def key(self, label, i):
+        """The Philox key of sample `i` of `label`"""
+        return np.random.SeedSequence(
+            self.seed_seq.entropy,
+            spawn_key=self.seed_seq.spawn_key +
+            (self.label_id(label), int(i))).generate_state(2, np.uint64)
+
+    def uniform(self, label, mc, positions, lhs_size=None):
+        """
+        Uniform samples on the open interval (0, 1).
+
+        Parameters
+        ----------
+        label : str
+        mc : array-like of int
+            The indices of the samples
+        positions : array-like of int
+            The flat positions within each sample
+        lhs_size : int, optional
+            The total number of samples, if they are Latin hypercube samples
+
+        Returns
+        -------
+        array-like
+            Of shape (len(mc), len(positions))
+        """
+        if lhs_size is not None:
+            rank = self.strata(label, mc, positions, lhs_size)
+            return (rank + self.uniform(label, mc, positions)) / lhs_size
+
+        # the upper 53 bits, centered in their interval to exclude 0 and 1
+        out = (self.raw(label, mc, positions) >> np.uint64(11)).astype(float)
+        out += 0.5
+        out *= 2.**-53
+        return out
+
+    def strata(self, label, mc, positions, lhs_size):
+        """
+        The strata of the Latin hypercube samples `mc` of `positions`, of
+        the `lhs_size` samples. The strata of all `lhs_size` samples of a
+        position are a permutation of range(lhs_size).
+
+        The permutation is a balanced Feistel network on the smallest
+        domain of 4**h >= lhs_size values, with round keys per position
+        drawn from the streams of `label + '/strata'`. Values outside of
+        range(lhs_size) are mapped again until they are inside, which keeps
+        it a permutation of range(lhs_size). The cost is linear in the
+        number of `mc` and `positions`, and does not depend on `lhs_size`.
+
+        Returns
+        -------
+        array-like of int
+            Of shape (len(mc), len(positions))
+        """
+        mc = np.asarray(mc, dtype=np.int64)
+        assert np.all((mc >= 0) & (mc < lhs_size))
+        assert lhs_size <= 2**32
+
+        half = max(1, (int(lhs_size - 1).bit_length() + 1) // 2)
+        mask = np.uint32(2**half - 1)
+        keys = (self.raw(
+            label + '/strata', range(self.feistel_rounds), positions)
+                >> np.uint64(32)).astype(np.uint32)
+
+        def feistel(v, keys):
+            left, right = v >> np.uint32(half), v & mask
+
+            for key in keys:
+                f = lowbias32(right + key)
+                f &= mask
+                f ^= left
+                left, right = right, f
+
+            left = left.astype(np.int64) << half
+            left |= right
+            return left
+
+        out = feistel(mc.astype(np.uint32)[:, None], keys[:, None])
+
+        # the few values outside of range(lhs_size)
+        i, j = np.nonzero(out >= lhs_size)
+
+        while i.size:
+            out[i, j] = feistel(out[i, j].astype(np.uint32), keys[:, j])
+            inside = out[i, j] < lhs_size
+            i, j = i[~inside], j[~inside]
+
+        return out
+
+    def raw(self, label, mc, positions):
+        """
+        The 64 bit integers from which the samples of `uniform()` follow.
+
+        Returns
+        -------
+        array-like of np.uint64
+            Of shape (len(mc), len(positions))
+        """
+        positions = np.asarray(positions, dtype=np.int64).ravel()
+        order = np.argsort(positions, kind='stable')
+        sorted_pos = positions[order]
+        breaks = np.flatnonzero(np.diff(sorted_pos) > self.run_gap) + 1
+        runs = np.split(np.arange(sorted_pos.size), breaks)
+
+        # (start, length, destination, source) per run. Slices for runs of
+        # consecutive positions in increasing order, which are the most common
+        copies = []
+        for run in runs:
+            if not run.size:
+                continue
+
+            start = int(sorted_pos[run[0]])
+            length = int(sorted_pos[run[-1]]) - start + 1
+            dst = order[run]
+
+            if length == run.size and np.all(np.diff(dst) == 1):
+                copies.append(
+                    (start, length, slice(dst[0], dst[-1] + 1), slice(None)))
+            else:
+                copies.append((start, length, dst, sorted_pos[run] - start))
+
+        raw = np.empty((len(mc), positions.size), dtype=np.uint64)
+
+        for row, i in enumerate(mc):
+            key = self.key(label, i)
+
+            for start, length, dst, src in copies:
+                bit_generator = np.random.Philox(key=key)
+                bit_generator.advance(start // 4)
+
+                if start % 4:
+                    bit_generator.random_raw(start % 4)
+
+                raw[row, dst] = bit_generator.random_raw(length)[src]
+
+        return raw
+
+    def standard_normal(self, label, mc, positions, lhs_size=None):
+        """
+        Standard normal samples, see `uniform()`.
+
+        Returns
+        -------
+        array-like
+            Of shape (len(mc), len(positions))
+        """
+        return ndtri(self.uniform(label, mc, positions, lhs_size=lhs_size))
+
+    def standard_normal_plane(self, label, mc, ix, it, nt, lhs_size=None):
+        """
+        Standard normal samples of a quantity of shape (nx, nt), for the
+        locations `ix` and time steps `it`.
+
+        Returns
+        -------
+        array-like
+            Of shape (len(mc), len(ix), len(it))
+        """
+        ix = np.asarray(ix, dtype=np.int64)
+        it = np.asarray(it, dtype=np.int64)
+        positions = ix[:, None] * nt + it[None, :]
+        return self.standard_normal(
+            label, mc, positions, lhs_size=lhs_size).reshape(
+                (len(mc), ix.size, it.size))
+
+    def standard_normal_dask(self, label, shape, chunks, lhs=False):
+        """
+        Standard normal samples as a dask array of `shape`, of which the
+        first dimension is mc and the other dimensions are the flat
+        positions within each sample, see `standard_normal_plane()`. The
+        samples do not depend on `chunks`. If `lhs`, the samples of each
+        position are Latin hypercube samples, stratified over the mc
+        dimension.
+        """
+        lhs_size = shape[0] if lhs else None
+
+        def block(x, block_info=None):
+            loc = block_info[None]['array-location']
+            positions = np.ravel_multi_index(
+                np.meshgrid(
+                    *[np.arange(*i) for i in loc[1:]], indexing='ij'),
+                shape[1:])
+            return self.standard_normal(
+                label, range(*loc[0]), positions,
+                lhs_size=lhs_size).reshape(x.shape)
+
+        return da.empty(shape, chunks=chunks).map_blocks(block, dtype=float)
+
+
+class ParameterSampler(object):
+    """
+    Draws samples of the parameters from the multivariate normal
+    distribution of `p_val` and `p_cov`. The covariance is factorized once,
+    after which any number of samples is drawn with a matrix product.
+
+    The factor is computed for the correlation matrix of the correlated
+    parameters, so that the jitter and the truncation do not depend on the
+    scales of the parameters. Parameters with zero variance are not drawn.
+
+    Parameters
+    ----------
+    p_val : array-like
+        The mean of the parameters
+    p_cov : array-like, BlockCovariance
+        The covariance of `p_val`. A `BlockCovariance` is factorized per
+        block, see `BlockCovariance.transform()`.
+    uncorrelated : array-like of bool, optional
+        Of size npar. Parameters that are drawn independently from their
+        variance, such as the integrated differential attenuation outside of
+        the reference sections of double-ended setups.
+    method : {'cholesky', 'eigen'}
+        'cholesky': The Cholesky factor of the correlation matrix. If it is
+        not positive definite, the smallest jitter on the diagonal of
+        10^-12, 10^-11, ..., `max_jitter` that makes it positive definite is
+        added, and the eigen-decomposition is used if none does.
+        'eigen': The eigen-decomposition of the correlation matrix, truncated
+        to the eigenvalues larger than `tol` times the largest eigenvalue,
+        and to the `rank` largest eigenvalues. A low-rank approximation for
+        rank-deficient covariance matrices.
+    rank : int, optional
+        The maximum number of eigenvalues if `method='eigen'`
+    tol : float, optional
+        The relative cutoff of the eigenvalues if `method='eigen'`. By
+        default, size * eps, as with `np.linalg.pinv`.
+    max_jitter : float
+        The largest jitter on the diagonal of the correlation matrix
+
+    Attributes
+    ----------
+    factor : array-like
+        The factor L of the correlation matrix, with L L^T approximately
+        equal to the correlation matrix. Of shape (n, rank).
+    method : str
+        The method that is used: 'cholesky', 'eigen', or 'blocks'
+    jitter : float
+        The jitter that was added to the diagonal of the correlation matrix
+    rank : int
+        The number of standard normal samples per sample of the correlated
+        parameters
+    """
+
+    def __init__(
+            self,
+            p_val,
+            p_cov,
+            uncorrelated=None,
+            method='cholesky',
+            rank=None,
+            tol=None,
+            max_jitter=1e-6):
+        assert method in ['cholesky', 'eigen'], \
+            "Choose method from {'cholesky', 'eigen'}"
+
+        self.p_val = np.asarray(p_val, dtype=float)
+        npar = self.p_val.size
+
+        if uncorrelated is None:
+            uncorrelated = np.zeros(npar, dtype=bool)
+
+        self.uncorrelated = np.asarray(uncorrelated, dtype=bool)
+        self.from_i = np.flatnonzero(~self.uncorrelated)
+        self.method_requested = (method, rank, tol)
+
+        if isinstance(p_cov, BlockCovariance):
+            self.p_cov = p_cov
+            self.std = np.sqrt(np.clip(p_cov.diagonal(), 0., None))
+            self.factor = None
+            self.method = 'blocks'
+            self.jitter = 0.
+            self.rank = self.from_i.size
+            return
+
+        p_cov = np.asarray(p_cov, dtype=float)
+        assert p_cov.shape == (npar, npar)
+
+        self.p_cov = None
+        self.std = np.sqrt(np.clip(np.diagonal(p_cov), 0., None))
+
+        std = self.std[self.from_i]
+        pos = std > 0
+        corr = p_cov[np.ix_(self.from_i[pos], self.from_i[pos])] / np.outer(
+            std[pos], std[pos])
+
+        factor = None
+        if method == 'cholesky':
+            factor, jitter = self.cholesky(corr, max_jitter)
+
+        if factor is None:
+            factor = self.eigen(corr, rank, tol)
+            method, jitter = 'eigen', 0.
+
+        self.method = method
+        self.jitter = jitter
+        self.factor = np.zeros((self.from_i.size, factor.shape[1]))
+        self.factor[pos] = std[pos, None] * factor
+        self.rank = factor.shape[1]
+
+    def __repr__(self):
+        return 'ParameterSampler(npar={}, method={}, rank={}, jitter={})'.format(
+            self.p_val.size, self.method, self.rank, self.jitter)
+
+    @staticmethod
+    def cholesky(corr, max_jitter=1e-6):
+        """
+        The Cholesky factor of `corr`, with the smallest jitter on the
+        diagonal for which it exists. (None, None) if there is none up to
+        `max_jitter`.
+        """
+        eye = np.eye(corr.shape[0])
+
+        for jitter in [0.] + [10.**k for k in range(-12, 0)
+                              if 10.**k <= max_jitter]:
+            try:
+                return np.linalg.cholesky(corr + jitter * eye), jitter
+            except np.linalg.LinAlgError:
+                pass
+
+        return None, None
+
+    @staticmethod
+    def eigen(corr, rank=None, tol=None):
+        """
+        The factor V sqrt(w) of the truncated eigen-decomposition of `corr`,
+        ordered from the largest to the smallest eigenvalue.
+        """
+        eigval, eigvec = np.linalg.eigh(corr)
+        eigval, eigvec = eigval[::-1], eigvec[:, ::-1]
+
+        if tol is None:
+            tol = corr.shape[0] * np.finfo(float).eps
+
+        if not eigval.size:
+            return np.zeros((0, 0))
+
+        keep = np.flatnonzero(eigval > tol * max(eigval[0], 0.))[:rank]
+        return eigvec[:, keep] * np.sqrt(eigval[keep])
+
+    @staticmethod
+    def key(p_val, p_cov, uncorrelated=None):
+        """Hash of the distribution. Arrays are hashed by value."""
+        if isinstance(p_cov, BlockCovariance):
+            p_cov = id(p_cov)
+
+        return CalibrationPlan.key(p_val, p_cov, uncorrelated)
+
+    def transform(self, z):
+        """
+        Transform samples of the standard normal distribution to samples of
+        the parameters.
+
+        Parameters
+        ----------
+        z : array-like
+            Of shape (size, npar)
+
+        Returns
+        -------
+        array-like
+            Of shape (size, npar)
+        """
+        z = np.asarray(z, dtype=float)
+        p = self.p_val + z * self.std
+
+        if self.method == 'blocks':
+            p[:, self.from_i] = self.p_cov.transform(
+                z, mean=self.p_val)[:, self.from_i]
+        else:
+            p[:, self.from_i] = self.p_val[self.from_i] + \
+                z[:, self.from_i[:self.rank]].dot(self.factor.T)
+        return p
+
+    def rvs(self, size, random_state=None, random_streams=None,
+            mc_chunk_size=100, sampling='random'):
+        """
+        Draw samples of the parameters.
+
+        Parameters
+        ----------
+        size : int
+            The number of samples
+        random_state : int, np.random.RandomState, np.random.Generator, optional
+            Seed or random generator. numpy's global random state by default.
+        random_streams : RandomStreams, optional
+            Draw the standard normal samples from the streams with label
+            'p', per chunk of `mc_chunk_size` samples in parallel, instead
+            of from `random_state`.
+        mc_chunk_size : int
+            The number of samples per chunk if `random_streams` is given
+        sampling : {'random', 'lhs', 'sobol'}
+            'random': Pseudo-random samples.
+            'lhs': Latin hypercube samples, of which each standard normal
+            variable has a single sample in each of the `size` strata of
+            equal probability.
+            'sobol': Scrambled Sobol' samples (`scipy.stats.qmc.Sobol`),
+            whose balance properties require `size` to be a power of 2. The
+            standard normal variables of the correlated parameters come
+            first, so that those of the largest eigenvalues of
+            `method='eigen'` have the lowest dimensions. Variables beyond
+            the largest dimension of the Sobol' sequence are Latin hypercube
+            samples.
+
+        Returns
+        -------
+        array-like
+            Of shape (size, npar)
+        """
+        assert sampling in ['random', 'lhs', 'sobol'], \
+            "Choose sampling from {'random', 'lhs', 'sobol'}"
+        npar = self.p_val.size
+
+        if sampling == 'sobol':
+            if random_streams is not None:
+                seed = np.random.default_rng(random_streams.key('p/sobol', 0))
+            elif random_state is None or hasattr(random_state, 'randint'):
+                seed = (random_state or np.random).randint(0, 2**31 - 1)
+            else:
+                seed = random_state
+
+            return self.transform(self.sobol(size, seed))
+
+        if random_streams is not None:
+            z = random_streams.standard_normal_dask(
+                'p', (size, npar),
+                chunks=(mc_chunk_size, npar),
+                lhs=sampling == 'lhs')
+            return z.map_blocks(self.transform, dtype=float).compute()
+
+        if random_state is None:
+            rng = np.random
+        elif hasattr(random_state, 'standard_normal'):
+            rng = random_state
+        else:
+            rng = np.random.RandomState(random_state)
+
+        if sampling == 'lhs':
+            from scipy.stats import qmc
+
+            lhs = qmc.LatinHypercube(
+                npar,
+                seed=rng if isinstance(rng, np.random.Generator) else
+                rng.randint(0, 2**31 - 1))
+            return self.transform(ndtri(lhs.random(size)))
+
+        return self.transform(rng.standard_normal((size, npar)))
+
+    def sobol(self, size, seed=None):
+        """
+        Scrambled Sobol' samples of the standard normal variables, see
+        `rvs()`.
+
+        Parameters
+        ----------
+        size : int
+            The number of samples
+        seed : int, np.random.Generator, optional
+
+        Returns
+        -------
+        array-like
+            Of shape (size, npar)
+        """
+        from scipy.stats import qmc
+
+        npar = self.p_val.size
+        rng = np.random.default_rng(seed)
+
+        # the variables of the correlated parameters first
+        first = self.from_i if self.method == 'blocks' else \
+            self.from_i[:self.rank]
+        order = np.concatenate(
+            [first, np.setdiff1d(np.arange(npar), first)]).astype(int)
+        d = min(npar, qmc.Sobol.MAXDIM)
+
+        u = np.empty((size, npar))
+
+        with warnings.catch_warnings():
+            # the balance properties require a power of 2
+            warnings.simplefilter('ignore', UserWarning)
+            u[:, order[:d]] = qmc.Sobol(d, seed=rng).random(size)
+
+        if npar > d:
+            u[:, order[d:]] = qmc.LatinHypercube(
+                npar - d, seed=rng).random(size)
+
+        return ndtri(u)
+
+
+def mc_parameter_samples(
+        p_val, p_cov, size, uncorrelated=None, random_streams=None,
+        mc_chunk_size=100, sampler=None, sampling='random'):
+    """
+    Draw the parameters from the multivariate normal distribution described
+    by `p_val` and `p_cov`.
+
+    Parameters
+    ----------
+    p_val : array-like
+        The mean of the parameters
+    p_cov : array-like, BlockCovariance, bool
+        The covariance of `p_val`. If False, the parameters are not drawn and
+        each sample equals `p_val`.
+    size : int
+        The number of samples
+    uncorrelated : array-like of bool, optional
+        Of size npar. Parameters that are drawn independently from their
+        variance, such as the integrated differential attenuation outside of
+        the reference sections of double-ended setups.
+    random_streams : RandomStreams, optional
+        Draw the samples with `ParameterSampler.rvs()`, from the streams with
+        label 'p'. By default, the samples are drawn from numpy's global
+        random state with `scipy.stats.multivariate_normal`.
+    mc_chunk_size : int
+        The number of samples per chunk if `random_streams` is given
+    sampler : ParameterSampler, optional
+        The factorized distribution if `random_streams` is given. A new
+        `ParameterSampler` with the Cholesky factor by default.
+    sampling : {'random', 'lhs', 'sobol'}
+        Pseudo-random, Latin hypercube or scrambled Sobol' samples, see
+        `ParameterSampler.rvs()`. The latter two are always drawn with a
+        `ParameterSampler`.
+
+    Returns
+    -------
+    array-like
+        Of shape (size, npar)
+    """
+    p_val = np.asarray(p_val)
+    npar = p_val.size
+
+    if isinstance(p_cov, bool) and not p_cov:
+        return np.tile(p_val, (size, 1))
+
+    if uncorrelated is None:
+        uncorrelated = np.zeros(npar, dtype=bool)
+
+    from_i = np.flatnonzero(~uncorrelated)
+
+    if isinstance(p_cov, BlockCovariance):
+        p_cov_diag = p_cov.diagonal()
+    else:
+        p_cov = np.asarray(p_cov)
+        p_cov_diag = np.diagonal(p_cov)
+
+    if random_streams is not None or sampling != 'random':
+        if sampler is None:
+            sampler = ParameterSampler(p_val, p_cov, uncorrelated=uncorrelated)
+
+        return sampler.rvs(
+            size,
+            random_streams=random_streams,
+            mc_chunk_size=mc_chunk_size,
+            sampling=sampling)
+
+    p_mc = np.zeros((size, npar))
+
+    if isinstance(p_cov, BlockCovariance):
+        p_mc[:, from_i] = p_cov.rvs(mean=p_val, size=size)[:, from_i]
+    else:
+        p_mc[:, from_i] = np.reshape(
+            sst.multivariate_normal.rvs(
+                mean=p_val[from_i],
+                cov=p_cov[np.ix_(from_i, from_i)],
+                size=size), (size, from_i.size))
+
+    if np.any(uncorrelated):
+        p_mc[:, uncorrelated] = np.random.normal(
+            loc=p_val[uncorrelated],
+            scale=p_cov_diag[uncorrelated]**0.5,
+            size=(size, np.sum(uncorrelated)))
+
+    return p_mc
+
+
+class TransientAttenuation(object):
+    """
+    The transient attenuation along x, a step function that increases with the
+    attenuation of each connector. The number of connectors before each
+    location follows from a binary search of the sorted connector locations,
+    and the step function from a cumulative sum over the connectors, so the
+    attenuation at all locations is a single gather instead of a mask per
+    connector. Works with NumPy and Dask arrays.
+
+    Parameters
+    ----------
+    x : array-like
+        The locations
+    trans_att : array-like
+        The locations of the connectors
+    """
+
+    def __init__(self, x, trans_att):
+        self.x = np.asarray(x)
+        trans_att = np.atleast_1d(np.asarray(trans_att, dtype=float))
+        self.order = np.argsort(trans_att, kind='stable')
+        self.trans_att = trans_att[self.order]
+
+    def __repr__(self):
+        return '<TransientAttenuation: {} connectors, {} locations>'.format(
+            self.size, self.x.size)
+
+    @property
+    def size(self):
+        return self.trans_att.size
+
+    def count(self, ix=None):
+        """
+        The number of connectors at or before the locations, x >= trans_att.
+
+        Parameters
+        ----------
+        ix : array-like of int, optional
+            Indices of the locations. Defaults to all.
+
+        Returns
+        -------
+        array-like of int
+        """
+        x = self.x if ix is None else self.x[ix]
+        return np.searchsorted(self.trans_att, x, side='right')
+
+    def fw(self, ta, ix=None, axis=0):
+        """
+        The sum of the attenuation of the connectors at or before the
+        locations, x >= trans_att, as for the forward channel.
+
+        Parameters
+        ----------
+        ta : array-like
+            The attenuation per connector, with the connectors along `axis`,
+            in the order of `trans_att`
+        ix : array-like of int, optional
+            Indices of the locations. Defaults to all.
+        axis : int
+            The axis of the connectors, which is replaced by the locations
+
+        Returns
+        -------
+        array-like
+        """
+        return self._steps(ta, ix, axis, reverse=False)
+
+    def bw(self, ta, ix=None, axis=0):
+        """
+        The sum of the attenuation of the connectors after the locations,
+        x < trans_att, as for the backward channel. See `fw()`.
+        """
+        return self._steps(ta, ix, axis, reverse=True)
+
+    def _steps(self, ta, ix, axis, reverse):
+        xp = da if isinstance(ta, da.Array) else np
+        ta = xp.moveaxis(ta, axis, 0)[self.order]
+        zero = xp.zeros_like(ta[:1])
+
+        # cum[k] is the sum of the first k connectors, or of the ones after
+        if reverse:
+            cum = xp.concatenate((xp.cumsum(ta[::-1], axis=0)[::-1], zero))
+        else:
+            cum = xp.concatenate((zero, xp.cumsum(ta, axis=0)))
+
+        return xp.moveaxis(cum[self.count(ix)], 0, axis)
+
+
+def mc_temperature_single_ended(ds, p, r, ix, it, fixed_alpha=False):
+    """
+    The temperature of single-ended setups for samples of the parameters and
+    of the Stokes intensities, for the locations `ix` and time steps `it`.
+
+    Parameters
+    ----------
+    ds : DataStore
+    p : array-like
+        Samples of the parameters, of shape (mc, npar)
+    r : dict
+        Samples of the intensities 'st' and 'ast', of shape
+        (mc, ix.size, it.size)
+    ix, it : array-like of int
+        Indices of the locations and time steps
+    fixed_alpha : bool
+        Whether `p` contains alpha per location instead of dalpha
+
+    Returns
+    -------
+    dict
+        'tmpf', of shape (mc, ix.size, it.size)
+    """
+    no, nt = ds.st.shape
+    x = ds.x.values[ix]
+
+    if fixed_alpha:
+        alpha = p[:, 1 + ix, None]
+        c = p[:, 1 + no:1 + no + nt]
+    else:
+        alpha = p[:, 1, None, None] * x[None, :, None]
+        c = p[:, 2:2 + nt]
+
+    denom = np.log(r['st'] / r['ast']) + c[:, None, it] + alpha
+
+    if 'trans_att' in ds.keys() and ds.trans_att.size:
+        nta = ds.trans_att.size
+        ta = p[:, -nt * nta:].reshape((-1, nta, nt))[:, :, it]
+        steps = TransientAttenuation(ds.x.values, ds.trans_att.values)
+        denom = denom + steps.fw(ta, ix=ix, axis=1)
+
+    return {'tmpf': p[:, 0, None, None] / denom - 273.15}
+
+
+def mc_temperature_double_ended(ds, p, r, ix, it, trans_att=None):
+    """
+    The forward and backward temperatures of double-ended setups for samples
+    of the parameters and of the Stokes intensities, for the locations `ix`
+    and time steps `it`.
+
+    Parameters
+    ----------
+    ds : DataStore
+    p : array-like
+        Samples of the parameters, of shape (mc, npar)
+    r : dict
+        Samples of the intensities 'st', 'ast', 'rst' and 'rast', of shape
+        (mc, ix.size, it.size)
+    ix, it : array-like of int
+        Indices of the locations and time steps
+    trans_att : array-like, optional
+        Locations of the transient attenuation
+
+    Returns
+    -------
+    dict
+        'tmpf' and 'tmpb', of shape (mc, ix.size, it.size)
+    """
+    no, nt = ds.st.shape
+
+    if trans_att is None:
+        trans_att = np.zeros(0)
+
+    nta = np.size(trans_att)
+    ita = 1 + 2 * nt + no
+    gamma = p[:, 0, None, None]
+    alpha = p[:, 1 + 2 * nt + ix, None]
+
+    denom_f = np.log(r['st'] / r['ast']) + p[:, None, 1 + it] + alpha
+    denom_b = np.log(r['rst'] / r['rast']) + p[:, None, 1 + nt + it] - alpha
+
+    if nta:
+        # TA of connector j and direction d is at ita + (2 * j + d) * nt + t
+        ta = p[:, ita:].reshape((-1, nta, 2, nt))[..., it]
+        steps = TransientAttenuation(ds.x.values, trans_att)
+        denom_f = denom_f + steps.fw(ta[:, :, 0], ix=ix, axis=1)
+        denom_b = denom_b + steps.bw(ta[:, :, 1], ix=ix, axis=1)
+
+    return {
+        'tmpf': gamma / denom_f - 273.15,
+        'tmpb': gamma / denom_b - 273.15}
+
+
+class RunningMoments(object):
+    """
+    The number, mean, sum of squared deviations, minimum and maximum of a
+    stream of samples, per cell. Batches of samples are combined with the
+    pairwise update of Chan et al. (1979), so the moments of separate streams
+    can be merged. Non-finite samples are ignored.
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the cells
+    """
+
+    def __init__(self, shape=()):
+        self.n = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+
+    def __repr__(self):
+        return 'RunningMoments(shape={}, n={})'.format(
+            self.mean.shape, int(self.n.max(initial=0)))
+
+    def update(self, samples, axis=0, index=Ellipsis):
+        """
+        Add a batch of samples.
+
+        Parameters
+        ----------
+        samples : array-like
+        axis : int, tuple of int
+            The axes of `samples` that are reduced. The remaining axes are
+            the cells.
+        index : slice, array-like of int, optional
+            The cells that are updated
+        """
+        samples = np.asarray(samples, dtype=float)
+        valid = np.isfinite(samples)
+        s = np.where(valid, samples, 0.)
+        n = valid.sum(axis=axis, keepdims=True)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s.sum(axis=axis, keepdims=True) / n
+
+        m2 = np.where(valid, (s - mean)**2, 0.).sum(axis=axis)
+        self._combine(
+            index, np.squeeze(n, axis=axis), np.squeeze(mean, axis=axis), m2,
+            np.where(valid, samples, np.inf).min(axis=axis),
+            np.where(valid, samples, -np.inf).max(axis=axis))
+
+    def merge(self, other, index=Ellipsis):
+        """Add the moments of another stream of samples"""
+        self._combine(
+            index, other.n, other.mean, other.m2, other.min, other.max)
+
+    def _combine(self, index, n, mean, m2, mn, mx):
+        n_a = self.n[index]
+        n_tot = n_a + n
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = np.where(n > 0, mean - self.mean[index], 0.)
+            frac = np.where(n_tot > 0, n / n_tot, 0.)
+
+        self.mean[index] = self.mean[index] + delta * frac
+        self.m2[index] = self.m2[index] + np.where(n > 0, m2, 0.) + \
+            delta**2 * n_a * frac
+        self.min[index] = np.minimum(self.min[index], mn)
+        self.max[index] = np.maximum(self.max[index], mx)
+        self.n[index] = n_tot
+
+    def var(self, ddof=1):
+        """The variance per cell. NaN if there are too few samples."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.n > ddof, self.m2 / (self.n - ddof), np.nan)
+
+    def pool(self, axis, center=None):
+        """
+        The moments of the samples of all cells along an axis, as if they
+        were a single stream of samples.
+
+        Parameters
+        ----------
+        axis : int
+            The axis of the cells that is pooled
+        center : array-like, optional
+            Of the shape of the cells. Subtracted from the samples of each
+            cell. The samples of cells with a non-finite center are ignored.
+
+        Returns
+        -------
+        RunningMoments
+        """
+        mean = self.mean if center is None else self.mean - center
+        n = np.where(np.isfinite(mean), self.n, 0.)
+        mean = np.where(n > 0, mean, 0.)
+        out = RunningMoments(())
+        out.n = n.sum(axis=axis)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out.mean = np.where(
+                out.n > 0, (n * mean).sum(axis=axis) / out.n, 0.)
+
+        dev = mean - np.expand_dims(out.mean, axis)
+        out.m2 = np.where(n > 0, self.m2 + n * dev**2, 0.).sum(axis=axis)
+        shift = 0. if center is None else center
+        out.min = np.where(n > 0, self.min - shift, np.inf).min(axis=axis)
+        out.max = np.where(n > 0, self.max - shift, -np.inf).max(axis=axis)
+        return out
+
+    def take(self, index):
+        """The moments of a selection of the cells"""
+        out = RunningMoments(())
+        out.n = self.n[index]
+        out.mean = self.mean[index]
+        out.m2 = self.m2[index]
+        out.min = self.min[index]
+        out.max = self.max[index]
+        return out
+
+
+class HistogramSketch(object):
+    """
+    A histogram with fixed bins per cell, from which the quantiles of a
+    stream of samples are interpolated without storing the samples. The
+    quantiles are accurate to a fraction of the bin width. Samples outside
+    of [lower, upper] are counted in the outer bins. Sketches with the same
+    bins are merged by adding their counts.
+
+    Parameters
+    ----------
+    lower, upper : array-like
+        The range of the samples per cell
+    nbins : int
+        The number of bins per cell
+    """
+
+    def __init__(self, lower, upper, nbins=500):
+        lower, upper = np.broadcast_arrays(
+            np.asarray(lower, dtype=float), np.asarray(upper, dtype=float))
+        self.lower = lower.copy()
+        self.upper = upper.copy()
+        self.nbins = nbins
+        self.width = (self.upper - self.lower) / nbins
+        self.counts = np.zeros((nbins,) + self.lower.shape, dtype=np.int64)
+
+    def __repr__(self):
+        return 'HistogramSketch(shape={}, nbins={}, n={})'.format(
+            self.lower.shape, self.nbins, int(self.counts.sum()))
+
+    def update(self, samples, axis=0, index=Ellipsis):
+        """
+        Add a batch of samples.
+
+        Parameters
+        ----------
+        samples : array-like
+        axis : int, tuple of int
+            The axes of `samples` that are reduced. The remaining axes are
+            the cells.
+        index : slice, array-like of int, optional
+            The cells that are updated
+        """
+        axis = tuple(np.atleast_1d(axis))
+        samples = np.moveaxis(
+            np.asarray(samples, dtype=float), axis, range(len(axis)))
+
+        cells = np.arange(self.lower.size).reshape(self.lower.shape)[index]
+        samples = samples.reshape((-1,) + cells.shape)
+        lower = self.lower[index]
+        width = self.width[index]
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ib = np.floor(
+                (samples - lower) / np.where(width > 0, width, 1.))
+
+        valid = np.isfinite(ib)
+        ib = np.clip(np.where(valid, ib, 0), 0, self.nbins - 1).astype(int)
+        flat = ib * self.lower.size + cells
+
+        self.counts += np.bincount(
+            flat[valid], minlength=self.counts.size).reshape(
+                self.counts.shape)
+
+    def merge(self, other):
+        """Add the counts of a sketch with the same bins"""
+        assert np.array_equal(self.lower, other.lower) and \
+            np.array_equal(self.upper, other.upper) and \
+            self.nbins == other.nbins, 'The bins of the sketches differ'
+        self.counts += other.counts
+
+    def quantile(self, q):
+        """
+        The quantiles per cell, interpolated linearly within the bins.
+
+        Parameters
+        ----------
+        q : array-like
+            Quantiles between 0 and 1
+
+        Returns
+        -------
+        array-like
+            Of shape (len(q),) + the shape of the cells. NaN for cells
+            without samples.
+        """
+        q = np.atleast_1d(q)
+        n = self.counts.sum(axis=0)
+        cdf = np.cumsum(self.counts, axis=0)
+        out = np.full((q.size,) + self.lower.shape, np.nan)
+
+        for i, qi in enumerate(q):
+            # the k-th smallest sample is at rank k + 0.5 of the histogram,
+            # which gives the linear interpolation of `np.percentile()`
+            rank = qi * (n - 1) + 0.5
+            ib = np.minimum((cdf < rank[None]).sum(axis=0), self.nbins - 1)
+            count = np.take_along_axis(self.counts, ib[None], axis=0)[0]
+            below = np.take_along_axis(cdf, ib[None], axis=0)[0] - count
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                frac = np.clip(
+                    np.where(count > 0, (rank - below) / count, 0.5), 0., 1.)
+
+            out[i] = np.where(
+                n > 0, self.lower + self.width * (ib + frac), np.nan)
+
+        return out
+
+
+def mc_chunks(
+        shape, mc_chunk_size=None, reduce_memory_usage=False, nbins=500):
+    """
+    The chunks of the dask arrays with Monte Carlo samples of shape
+    (mc, x, time).
+
+    By default, the mc dimension is a single chunk. If `mc_chunk_size` is
+    given, the mc dimension is chunked as well, and the chunks of x and time
+    are limited such that a histogram of `nbins` per cell of a block (see
+    `mc_percentile()`) is about as large as dask's `array.chunk-size`.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        (mc_sample_size, nx, nt)
+    mc_chunk_size : int, optional
+        The number of samples per chunk of the mc dimension
+    reduce_memory_usage : bool
+        A single location per chunk
+    nbins : int
+        The number of bins per cell of the histograms
+
+    Returns
+    -------
+    tuple of tuple of int
+    """
+    chunks = {
+        0: mc_chunk_size or -1,
+        1: 1 if reduce_memory_usage else 'auto',
+        2: 'auto'}
+
+    if mc_chunk_size is None:
+        return da.ones(shape, chunks=chunks).chunks
+
+    chunk_size = dask.utils.parse_bytes(dask.config.get('array.chunk-size'))
+    limit = max(chunk_size * mc_chunk_size // nbins, 8 * mc_chunk_size)
+    return da.core.normalize_chunks(
+        chunks, shape, limit=limit, dtype=np.float64)
+
+
+class MonteCarloMemoryPlan(object):
+    """
+    The chunks of the Monte Carlo samples and an estimate of the peak memory
+    that they require, see `mc_memory_plan()`.
+
+    Parameters
+    ----------
+    chunks : tuple of tuple of int
+        The chunks of the dask arrays of shape (mc, x, time)
+    mc_chunk_size : int
+        The number of samples that are drawn at once by a MonteCarloStream
+    tile_size : int
+        The number of (x, time) cells per tile of a MonteCarloStream
+    fixed : int
+        The memory in bytes that does not depend on the chunks
+    per_chunk : int
+        The memory in bytes of the chunks that are in memory at once
+    memory_limit : int, optional
+        The memory in bytes from which the chunks are chosen
+    """
+
+    def __init__(
+            self, chunks, mc_chunk_size, tile_size, fixed, per_chunk,
+            memory_limit=None):
+        self.chunks = chunks
+        self.mc_chunk_size = mc_chunk_size
+        self.tile_size = tile_size
+        self.fixed = fixed
+        self.per_chunk = per_chunk
+        self.memory_limit = memory_limit
+
+    def __repr__(self):
+        limit = 'None' if self.memory_limit is None else \
+            dask.utils.format_bytes(self.memory_limit)
+        return (
+            'MonteCarloMemoryPlan(peak={}, fixed={}, per_chunk={}, '
+            'memory_limit={}, chunks={}, mc_chunk_size={}, tile_size={})'
+        ).format(
+            dask.utils.format_bytes(self.peak),
+            dask.utils.format_bytes(self.fixed),
+            dask.utils.format_bytes(self.per_chunk), limit,
+            tuple(c[0] for c in self.chunks), self.mc_chunk_size,
+            self.tile_size)
+
+    @property
+    def peak(self):
+        """The estimated peak memory in bytes"""
+        return self.fixed + self.per_chunk
+
+
+def mc_memory_plan(
+        shape,
+        npar,
+        nfields,
+        ntemperatures=1,
+        nta_fields=0,
+        nconf_ints=0,
+        memory_limit=None,
+        mc_chunk_size=None,
+        streaming=False,
+        reduce_memory_usage=False,
+        nbins=500,
+        num_workers=None):
+    """
+    Estimates the peak memory of the Monte Carlo samples of shape
+    (mc, x, time), and chooses their chunks such that it stays below
+    `memory_limit`.
+
+    The fixed part consists of the samples of the parameters, which are drawn
+    at once, and of the results per (x, time): the variance and the
+    confidence intervals per temperature, and, if `streaming`, the moments per
+    cell of both passes. The part per chunk consists of the samples of the
+    intensities, of the transient attenuation and of the intermediate
+    results of the temperatures, and of the histograms if the confidence
+    intervals are interpolated from histograms. Without `streaming`, dask
+    computes a chunk per worker at once. With `streaming`, the tiles are
+    drawn one after the other.
+
+    With a `memory_limit`, the mc dimension is a single chunk, or of
+    `mc_chunk_size` samples, or, if `streaming` and not all (x, time) cells
+    fit in a single chunk, of 100 samples. The number of (x, time) cells per
+    chunk is as large as the limit allows, with the time steps within a chunk
+    first.
+    Only if a single cell per chunk exceeds the limit, the mc dimension is
+    chunked further. Without a `memory_limit`, the chunks are those of
+    `mc_chunks()`, or the default tiles of `MonteCarloStream`, and only the
+    peak memory is estimated.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        (mc_sample_size, nx, nt)
+    npar : int
+        The number of parameters
+    nfields : int
+        The number of Stokes and anti-Stokes intensities, 2 or 4
+    ntemperatures : int
+        The number of temperatures that are reduced, e.g., 3 for 'tmpf',
+        'tmpb' and 'tmpw'
+    nta_fields : int
+        The number of (mc, x, time) arrays of the transient attenuation
+    nconf_ints : int
+        The number of confidence intervals
+    memory_limit : int, str, optional
+        E.g., 4e9 or '4GB'
+    mc_chunk_size : int, optional
+        See `mc_chunks()`. If `streaming`, 100 by default, unless all
+        samples fit in the `memory_limit` at once.
+    streaming : bool
+        Plan the tiles and the chunks of a MonteCarloStream instead of the
+        chunks of the dask arrays
+    reduce_memory_usage : bool
+        See `mc_chunks()`. Not used with a `memory_limit`.
+    nbins : int
+        The number of bins of the histograms per cell
+    num_workers : int, optional
+        The number of chunks that are in memory at once. Defaults to 1 if
+        `streaming`, and otherwise to dask's `num_workers` or the number of
+        CPUs.
+
+    Returns
+    -------
+    MonteCarloMemoryPlan
+    """
+    mc, nx, nt = shape
+    itemsize = 8
+
+    if memory_limit is not None:
+        memory_limit = dask.utils.parse_bytes(memory_limit)
+
+    if num_workers is None:
+        if streaming:
+            num_workers = 1
+        else:
+            num_workers = dask.config.get('num_workers', None) or \
+                dask.system.CPU_COUNT
+
+    # The samples of the parameters are drawn from standard normal samples
+    nresults = 2 + nconf_ints + (10 if streaming else 0)
+    fixed = itemsize * (
+        2 * mc * npar + ntemperatures * nresults * nx * nt)
+
+    # The memory per sample and cell, and per cell
+    per_sample = itemsize * (nfields + nta_fields + 3 * ntemperatures)
+    per_hist = itemsize * nbins * ntemperatures if nconf_ints else 0
+
+    def per_chunk(mc_c, cells):
+        hist = per_hist if streaming or mc_c < mc else 0
+        return num_workers * cells * (mc_c * per_sample + hist)
+
+    if memory_limit is None:
+        if streaming:
+            mc_c = min(mc, mc_chunk_size or 100)
+            tile_size = 10000
+            chunks = da.core.normalize_chunks(
+                (mc_c, max(1, tile_size // min(nt, tile_size)),
+                 min(nt, tile_size)), shape)
+        else:
+            chunks = mc_chunks(
+                shape,
+                mc_chunk_size=mc_chunk_size,
+                reduce_memory_usage=reduce_memory_usage,
+                nbins=nbins)
+            mc_c = max(chunks[0])
+            tile_size = max(chunks[1]) * max(chunks[2])
+
+        cells = min(max(chunks[1]) * max(chunks[2]), nx * nt)
+        return MonteCarloMemoryPlan(
+            chunks, mc_c, tile_size, fixed, per_chunk(mc_c, cells))
+
+    available = memory_limit - fixed
+
+    if available <= 0:
+        raise ValueError(
+            'The samples of the parameters and the results per (x, time) '
+            'require about {}, more than the memory_limit of {}'.format(
+                dask.utils.format_bytes(fixed),
+                dask.utils.format_bytes(memory_limit)))
+
+    mc_c = min(mc, mc_chunk_size or mc)
+    cells = available // per_chunk(mc_c, 1)
+
+    if streaming and not mc_chunk_size and cells < nx * nt:
+        # Only if the problem does not fit in a single chunk, tile the
+        # streamed samples as without a memory_limit, as every tile draws
+        # the samples of the parameters again
+        mc_c = min(mc, 100)
+        cells = available // per_chunk(mc_c, 1)
+
+    if cells < 1:
+        # A single cell per chunk and fewer samples per chunk
+        mc_c = (available // num_workers - per_hist) // per_sample
+
+        if mc_c < 1:
+            raise ValueError(
+                'A single sample of a single cell per worker exceeds the '
+                'memory_limit of {}'.format(
+                    dask.utils.format_bytes(memory_limit)))
+
+        cells = 1
+
+    cells = int(min(cells, nx * nt))
+    nt_c = min(nt, cells)
+    nx_c = min(nx, cells // nt_c)
+    chunks = da.core.normalize_chunks((int(mc_c), nx_c, nt_c), shape)
+
+    return MonteCarloMemoryPlan(
+        chunks, int(mc_c), nx_c * nt_c, fixed,
+        per_chunk(mc_c, nx_c * nt_c), memory_limit=memory_limit)
+
+
+def mc_percentile(arr, conf_ints, axis=0, nbins=500):
+    """
+    The percentiles of a dask array with Monte Carlo samples, reduced over
+    `axis`.
+
+    If the reduced axes consist of a single chunk, the percentiles are
+    computed per block with `np.percentile()`. Otherwise, the blocks are
+    reduced to a `HistogramSketch` per cell, on the range of the samples
+    per cell. The histograms are summed over the blocks, in parallel, and the
+    percentiles are interpolated from the summed histograms. The samples can
+    then be chunked along the mc dimension, and the percentiles are accurate
+    to a fraction of (max - min) / nbins.
+
+    Parameters
+    ----------
+    arr : dask.array.Array
+    conf_ints : iterable object of float
+        The percentiles, between 0 and 100.
+    axis : int, tuple of int
+        The axes that are reduced.
+    nbins : int
+        The number of bins per cell of the histograms.
+
+    Returns
+    -------
+    dask.array.Array
+        Of shape (len(conf_ints),) + the shape of the remaining axes
+    """
+    arr = da.asarray(arr)
+    axis = tuple(sorted(int(ax) % arr.ndim for ax in np.atleast_1d(axis)))
+    conf_ints = list(conf_ints)
+    keep = [ax for ax in range(arr.ndim) if ax not in axis]
+    out_chunks = ((len(conf_ints),),) + tuple(arr.chunks[ax] for ax in keep)
+
+    if all(len(arr.chunks[ax]) == 1 for ax in axis):
+        return arr.map_blocks(
+            lambda x: np.percentile(x, q=conf_ints, axis=axis),
+            chunks=out_chunks,
+            drop_axis=axis,
+            new_axis=0,
+            dtype=float)
+
+    lower = da.nanmin(arr, axis=axis, keepdims=True)
+    upper = da.nanmax(arr, axis=axis, keepdims=True)
+
+    def block_counts(x, lo, up):
+        sketch = HistogramSketch(
+            np.squeeze(lo, axis=axis), np.squeeze(up, axis=axis), nbins)
+        sketch.update(x, axis=axis)
+        return np.expand_dims(
+            sketch.counts, axis=tuple(ax + 1 for ax in axis))
+
+    # One histogram per block, with a length-1 axis per reduced axis
+    counts_chunks = ((nbins,),) + tuple(
+        (1,) * len(c) if ax in axis else c for ax, c in enumerate(arr.chunks))
+    counts = da.map_blocks(
+        block_counts,
+        arr,
+        lower,
+        upper,
+        chunks=counts_chunks,
+        new_axis=0,
+        dtype=np.int64).sum(axis=tuple(ax + 1 for ax in axis))
+
+    def block_quantiles(c, lo, up):
+        sketch = HistogramSketch(lo, up, nbins)
+        sketch.counts = c
+        return sketch.quantile(np.asarray(conf_ints) / 100)
+
+    return da.map_blocks(
+        block_quantiles,
+        counts,
+        lower.squeeze(axis=axis),
+        upper.squeeze(axis=axis),
+        chunks=out_chunks,
+        dtype=float)
+
+
+class MonteCarloStream(object):
+    """
+    Monte Carlo samples of the temperature, drawn per tile of (x, time) and
+    per chunk of `mc_chunk_size` samples, that are passed to reducers as
+    soon as they are drawn. Only a single chunk of samples of a single tile
+    is in memory at a time, so the peak memory is independent of the number
+    of samples, apart from the samples of the parameters.
+
+    The samples of each tile and chunk are drawn with their own seed, or
+    from `RandomStreams`, so that every pass over the samples regenerates
+    the same samples. With `RandomStreams`, the samples do not depend on the
+    tiles and chunks, and equal the samples of `conf_int_single_ended()` and
+    `conf_int_double_ended()` with the same seed. A first
+    pass gives the moments and the range of the samples, and a second pass
+    fills the histograms from which the confidence intervals are
+    interpolated. The moments of the first pass are kept, so that the
+    confidence intervals and all averages of the same stream, or of a
+    selection of it, see `select()`, require only a single pass each.
+
+    Parameters
+    ----------
+    ds : DataStore
+    p_mc : array-like
+        The samples of the parameters, of shape (mc_sample_size, npar)
+    labels : list of str
+        The labels of the Stokes and anti-Stokes intensities, e.g.,
+        ['st', 'ast']
+    variances : list of float, callable, array-like
+        The variance of the noise of each of the intensities
+    temperature_fn : callable
+        `temperature_fn(p, r, ix, it)` returns a dict with the samples of the
+        temperatures, of shape (mc, ix.size, it.size), from the samples of
+        the parameters `p` and a dict with the samples of the intensities
+        `r`. For example, `mc_temperature_single_ended()`.
+    ix, it : array-like of int, optional
+        The indices of the locations and time steps for which samples are
+        drawn. All by default.
+    mc_chunk_size : int
+        The number of samples that are drawn at once
+    tile_size : int
+        The number of (x, time) cells per tile
+    random_state : np.random.RandomState, da.random.RandomState,
+                   RandomStreams, optional
+        Draws the seeds of the tiles and chunks, or the random streams from
+        which the intensities are drawn
+    sampling : {'random', 'lhs', 'sobol'}
+        If not 'random', the intensities of each (x, time) are Latin
+        hypercube samples, see `RandomStreams`. Requires `RandomStreams`.
+    """
+
+    def __init__(
+            self,
+            ds,
+            p_mc,
+            labels,
+            variances,
+            temperature_fn,
+            ix=None,
+            it=None,
+            mc_chunk_size=100,
+            tile_size=10000,
+            random_state=None,
+            sampling='random'):
+        no, nt = ds.st.shape
+
+        self.ds = ds
+        self.p_mc = np.asarray(p_mc)
+        self.labels = labels
+        self.variances = variances
+        self.temperature_fn = temperature_fn
+        self.ix = np.arange(no) if ix is None else np.asarray(ix)
+        self.it = np.arange(nt) if it is None else np.asarray(it)
+        self.mc_sample_size = self.p_mc.shape[0]
+        self.mc_chunk_size = mc_chunk_size
+        self.tile_size = tile_size
+        self.sampling = sampling
+        self.cells = dict()
+
+        nt_tile = min(self.it.size, tile_size)
+        nx_tile = max(1, tile_size // nt_tile)
+        self.tiles = [
+            (slice(i, min(i + nx_tile, self.ix.size)),
+             slice(j, min(j + nt_tile, self.it.size)))
+            for i in range(0, self.ix.size, nx_tile)
+            for j in range(0, self.it.size, nt_tile)]
+        self.mc_chunks = [
+            slice(i, min(i + mc_chunk_size, self.mc_sample_size))
+            for i in range(0, self.mc_sample_size, mc_chunk_size)]
+
+        if isinstance(random_state, RandomStreams):
+            self.random_streams = random_state
+            self.seeds = np.zeros(
+                (len(self.tiles), len(self.mc_chunks)), dtype=int)
+        else:
+            assert sampling == 'random', \
+                'Latin hypercube samples require RandomStreams'
+
+            if random_state is None:
+                random_state = np.random
+
+            self.random_streams = None
+            self.seeds = np.asarray(
+                random_state.randint(
+                    0, 2**31 - 1, size=(len(self.tiles), len(self.mc_chunks))))
+
+        # the number of samples per tile, see `adapt()`
+        self.sizes = np.full(len(self.tiles), self.mc_sample_size)
+
+    def __repr__(self):
+        return 'MonteCarloStream(shape=({}, {}, {}), tiles={}, chunks={})'.format(
+            self.mc_sample_size, self.ix.size, self.it.size, len(self.tiles),
+            len(self.mc_chunks))
+
+    @property
+    def shape(self):
+        return self.ix.size, self.it.size
+
+    @property
+    def sample_sizes(self):
+        """The number of samples per (x, time), see `adapt()`"""
+        out = np.zeros(self.shape, dtype=int)
+
+        for (jx, jt), size in zip(self.tiles, self.sizes):
+            out[jx, jt] = size
+
+        return out
+
+    def select(self, ix=None, it=None):
+        """
+        The samples of a selection of the locations and time steps, with the
+        same samples of the parameters and of the intensities. The moments of
+        the cells of the selection that are already reduced are kept.
+
+        Parameters
+        ----------
+        ix, it : array-like of int, optional
+            The indices of the locations and time steps, not relative to
+            the indices of this stream. All by default.
+
+        Returns
+        -------
+        MonteCarloStream
+        """
+        no, nt = self.ds.st.shape
+        ix = np.arange(no) if ix is None else np.asarray(ix)
+        it = np.arange(nt) if it is None else np.asarray(it)
+
+        if np.array_equal(ix, self.ix) and np.array_equal(it, self.it):
+            return self
+
+        assert self.random_streams is not None, \
+            'Only the samples of RandomStreams can be selected'
+        assert np.all(self.sizes == self.mc_sample_size), \
+            'The number of samples differs per tile'
+
+        out = MonteCarloStream(
+            self.ds,
+            self.p_mc,
+            self.labels,
+            self.variances,
+            self.temperature_fn,
+            ix=ix,
+            it=it,
+            mc_chunk_size=self.mc_chunk_size,
+            tile_size=self.tile_size,
+            random_state=self.random_streams,
+            sampling=self.sampling)
+
+        # the positions of the selection in this stream, if any
+        sx, st = np.argsort(self.ix), np.argsort(self.it)
+        jx = sx[np.minimum(
+            np.searchsorted(self.ix, ix, sorter=sx), self.ix.size - 1)]
+        jt = st[np.minimum(
+            np.searchsorted(self.it, it, sorter=st), self.it.size - 1)]
+
+        if np.array_equal(self.ix[jx], ix) and \
+                np.array_equal(self.it[jt], it):
+            for label, cell in self.cells.items():
+                out.cells[label] = CellStatistics(label, out.shape)
+                out.cells[label].moments = cell.moments.take(np.ix_(jx, jt))
+
+        return out
+
+    def cell_statistics(self, labels):
+        """
+        The moments and the range of the samples per (x, time) of the
+        temperatures. A pass over the samples is only made for the labels
+        that are not reduced before.
+
+        Parameters
+        ----------
+        labels : list of str
+            The keys of the temperatures, e.g., ['tmpf', 'tmpb']
+
+        Returns
+        -------
+        dict
+            Per label, a CellStatistics
+        """
+        todo = [label for label in labels if label not in self.cells]
+
+        if todo:
+            cells = [CellStatistics(label, self.shape) for label in todo]
+            self.run(cells)
+            self.cells.update(zip(todo, cells))
+
+        return {label: self.cells[label] for label in labels}
+
+    def intensities(self, jx, jt):
+        """The mean and the variance of the intensities of a tile"""
+        no, nt = self.ds.st.shape
+        ix, it = self.ix[jx], self.it[jt]
+        out = []
+
+        for label, var in zip(self.labels, self.variances):
+            assert var is not None, 'Define the variance of ' + label
+            tile = self.ds[label][ix, it]
+
+            if callable(var):
+                var = var(tile)
+            elif np.size(var) > 1:
+                var = var[ix][:, it] if np.shape(var) == (no, nt) else \
+                    np.broadcast_to(np.asarray(var), (no, nt))[ix][:, it]
+
+            out.append(
+                (
+                    np.asarray(tile),
+                    np.broadcast_to(np.asarray(var, dtype=float),
+                                    tile.shape)))
+
+        return out
+
+    def samples(self, jx, jt, mc, seed, intensities=None):
+        """
+        The samples of the temperatures of a tile and a chunk of samples.
+
+        Parameters
+        ----------
+        jx, jt : slice
+            The tile, relative to `ix` and `it`
+        mc : slice
+            The chunk of samples
+        seed : int
+            Not used if the samples are drawn from `RandomStreams`
+        intensities : list of tuple, optional
+            The output of `intensities(jx, jt)`
+
+        Returns
+        -------
+        dict
+            The samples of the temperatures, of shape
+            (mc, jx size, jt size)
+        """
+        if intensities is None:
+            intensities = self.intensities(jx, jt)
+
+        if self.random_streams is None:
+            rs = np.random.RandomState(seed)
+            size = (mc.stop - mc.start,) + intensities[0][0].shape
+            r = {
+                label: rs.normal(loc=loc, scale=var**0.5, size=size)
+                for label, (loc, var) in zip(self.labels, intensities)}
+        else:
+            nt = self.ds.st.shape[1]
+            lhs_size = None if self.sampling == 'random' else \
+                self.mc_sample_size
+            r = {
+                label: loc + var**0.5 *
+                self.random_streams.standard_normal_plane(
+                    label, range(mc.start, mc.stop), self.ix[jx],
+                    self.it[jt], nt, lhs_size=lhs_size)
+                for label, (loc, var) in zip(self.labels, intensities)}
+
+        return self.temperature_fn(
+            self.p_mc[mc], r, self.ix[jx], self.it[jt])
+
+    def adapt(self, labels, tol, conf_ints=None, per_tile=True,
+              min_sample_size=None):
+        """
+        Draw the samples in chunks until the standard errors of the standard
+        deviation and of the confidence intervals of the temperatures are
+        smaller than `tol`, or until all `mc_sample_size` samples are drawn.
+
+        After each round, the number of samples that is required follows
+        from the standard deviation of each (x, time) so far, from the
+        standard error of the standard deviation, std / sqrt(2 (n - 1)), and
+        of the quantile q of a normal distribution,
+        std sqrt(q (1 - q) / n) / pdf(ppf(q)). The samples of each tile, or
+        of all tiles if not `per_tile`, are extended up to the end of the
+        chunk with the required sample. The moments of this pass are kept,
+        and later passes use the same number of samples per tile.
+
+        Parameters
+        ----------
+        labels : list of str
+            The keys of the temperatures, e.g., ['tmpf', 'tmpb']
+        tol : float
+            The tolerance of the standard errors, in K
+        conf_ints : iterable of float, optional
+            Percentages
+        per_tile : bool
+            Stop per tile. Otherwise, all tiles have the same number of
+            samples, and the stream is shortened to this number, as required
+            for the averages.
+        min_sample_size : int, optional
+            The number of samples of the first round. A single chunk by
+            default.
+
+        Returns
+        -------
+        array-like
+            The number of samples per (x, time)
+        """
+        assert self.sampling == 'random', \
+            'The strata of Latin hypercube samples require all samples'
+        q = np.asarray(conf_ints if conf_ints else [], dtype=float) / 100
+
+        # the number of samples per variance / tol**2
+        factor = max(
+            [0.5] + list(q * (1 - q) / sst.norm.pdf(sst.norm.ppf(q))**2))
+        stops = np.array([mc.stop for mc in self.mc_chunks])
+
+        def chunk_stop(size):
+            i = np.minimum(np.searchsorted(stops, size), stops.size - 1)
+            return stops[i]
+
+        cells = {label: CellStatistics(label, self.shape) for label in labels}
+        sizes = np.zeros(len(self.tiles), dtype=int)
+        targets = np.full(
+            len(self.tiles), chunk_stop(min_sample_size or stops[0]))
+
+        while np.any(targets > sizes):
+            for i in np.flatnonzero(targets > sizes):
+                self._run_tile(
+                    i, list(cells.values()), start=sizes[i], stop=targets[i])
+
+            sizes = targets
+            var = np.max(
+                [np.where(np.isfinite(v), v, 0.)
+                 for v in [cell.var() for cell in cells.values()]],
+                axis=0)
+            required = np.array([
+                1 + factor * var[jx, jt].max() / tol**2
+                for jx, jt in self.tiles])
+
+            if not per_tile:
+                required[:] = required.max()
+
+            targets = np.maximum(sizes, chunk_stop(np.ceil(required)))
+
+        self.sizes = sizes
+        self.cells.update(cells)
+
+        if not per_tile:
+            size = int(sizes.max())
+            self.p_mc = self.p_mc[:size]
+            self.mc_sample_size = size
+            self.mc_chunks = [mc for mc in self.mc_chunks if mc.start < size]
+            self.seeds = self.seeds[:, :len(self.mc_chunks)]
+
+        return self.sample_sizes
+
+    def _run_tile(self, i, reducers, derived=None, start=0, stop=None):
+        """A pass over the samples of tile `i` from `start` to `stop`"""
+        jx, jt = self.tiles[i]
+        stop = self.sizes[i] if stop is None else stop
+        intensities = self.intensities(jx, jt)
+
+        for reducer in reducers:
+            reducer.start_tile(jx, jt)
+
+        for mc, seed in zip(self.mc_chunks, self.seeds[i]):
+            if not start <= mc.start < stop:
+                continue
+
+            samples = self.samples(jx, jt, mc, seed, intensities)
+
+            if derived is not None:
+                derived(samples, jx, jt)
+
+            for reducer in reducers:
+                reducer.update(samples, mc, jx, jt)
+
+        for reducer in reducers:
+            reducer.end_tile(jx, jt)
+
+    def run(self, reducers, derived=None):
+        """
+        A single pass over all samples, or over the number of samples per
+        tile of `adapt()`.
+
+        Parameters
+        ----------
+        reducers : list
+            Objects with the methods `start_tile(jx, jt)`,
+            `update(samples, mc, jx, jt)` and `end_tile(jx, jt)`
+        derived : callable, optional
+            `derived(samples, jx, jt)` adds temperatures to the dict of
+            samples of a tile, e.g., the weighted average of the forward and
+            backward temperatures.
+        """
+        for i in range(len(self.tiles)):
+            self._run_tile(i, reducers, derived=derived)
+
+
+class CellStatistics(object):
+    """
+    Reduces the samples of a temperature per (x, time) cell to their mean,
+    variance, minimum and maximum, and to quantiles if the range of the
+    samples is known.
+
+    Parameters
+    ----------
+    label : str
+        The key of the samples
+    shape : tuple
+        The shape of the (x, time) domain of the MonteCarloStream
+    q : array-like, optional
+        Quantiles between 0 and 1
+    lower, upper : array-like, optional
+        The range of the samples per cell, required for the quantiles
+    nbins : int
+        The number of bins of the histograms
+    """
+
+    def __init__(self, label, shape, q=None, lower=None, upper=None,
+                 nbins=500):
+        assert q is None or (lower is not None and upper is not None), \
+            'The quantiles require the range of the samples'
+        self.label = label
+        self.q = q
+        self.lower = lower
+        self.upper = upper
+        self.nbins = nbins
+        self.moments = RunningMoments(shape)
+
+        if q is not None:
+            self.quantiles = np.full((len(q),) + tuple(shape), np.nan)
+
+    def start_tile(self, jx, jt):
+        if self.q is not None:
+            self._sketch = HistogramSketch(
+                self.lower[jx, jt], self.upper[jx, jt], nbins=self.nbins)
+
+    def update(self, samples, mc, jx, jt):
+        self.moments.update(samples[self.label], index=(jx, jt))
+
+        if self.q is not None:
+            self._sketch.update(samples[self.label])
+
+    def end_tile(self, jx, jt):
+        if self.q is not None:
+            self.quantiles[:, jx, jt] = self._sketch.quantile(self.q)
+            del self._sketch
+
+    def var(self, ddof=1):
+        return self.moments.var(ddof=ddof)
+
+
+class PooledStatistics(object):
+    """
+    Reduces the samples of a temperature over the samples and over the
+    locations (axis=0) or the time steps (axis=1) to their variance, and to
+    quantiles if the range of the samples is known.
+
+    Parameters
+    ----------
+    label : str
+        The key of the samples
+    shape : tuple
+        The shape of the (x, time) domain of the MonteCarloStream
+    axis : int
+        0 pools the locations, 1 pools the time steps
+    center : array-like, optional
+        Of shape `shape`. Subtracted from the samples before the moments are
+        computed.
+    q : array-like, optional
+        Quantiles between 0 and 1, of the samples (without `center`)
+    lower, upper : array-like, optional
+        The range of the pooled samples, required for the quantiles
+    nbins : int
+        The number of bins of the histograms
+    """
+
+    def __init__(self, label, shape, axis, center=None, q=None, lower=None,
+                 upper=None, nbins=500):
+        self.label = label
+        self.axis = axis
+        self.center = center
+        self.q = q
+        self.moments = RunningMoments((shape[1 - axis],))
+
+        if q is not None:
+            self.sketch = HistogramSketch(lower, upper, nbins=nbins)
+
+    def start_tile(self, jx, jt):
+        pass
+
+    def update(self, samples, mc, jx, jt):
+        s = samples[self.label]
+        index = jt if self.axis == 0 else jx
+
+        if self.center is not None:
+            self.moments.update(
+                s - self.center[jx, jt], axis=(0, 1 + self.axis),
+                index=index)
+        else:
+            self.moments.update(s, axis=(0, 1 + self.axis), index=index)
+
+        if self.q is not None:
+            self.sketch.update(s, axis=(0, 1 + self.axis), index=index)
+
+    def end_tile(self, jx, jt):
+        pass
+
+    def var(self, ddof=1):
+        return self.moments.var(ddof=ddof)
+
+    @property
+    def quantiles(self):
+        return self.sketch.quantile(self.q)
+
+
+class WeightedSum(object):
+    """
+    The weighted sum of each sample of a temperature over the locations
+    (axis=0) or the time steps (axis=1). The result is of shape
+    (mc_sample_size, n), with n the number of time steps or locations,
+    respectively. Non-finite terms are skipped.
+
+    Parameters
+    ----------
+    label : str
+        The key of the samples
+    shape : tuple
+        The shape of the (x, time) domain of the MonteCarloStream
+    axis : int
+    weights : array-like
+        Of shape `shape`
+    mc_sample_size : int
+    """
+
+    def __init__(self, label, shape, axis, weights, mc_sample_size):
+        self.label = label
+        self.axis = axis
+        self.weights = weights
+        self.sums = np.zeros((mc_sample_size, shape[1 - axis]))
+
+    def start_tile(self, jx, jt):
+        pass
+
+    def update(self, samples, mc, jx, jt):
+        s = np.nansum(
+            samples[self.label] * self.weights[jx, jt], axis=1 + self.axis)
+
+        if self.axis == 0:
+            self.sums[mc, jt] += s
+        else:
+            self.sums[mc, jx] += s
+
+    def end_tile(self, jx, jt):
+        pass
+
+
+def weighted_temperature_fn(var_f, var_b):
+    """
+    Adds 'tmpw', the inverse-variance weighted average of 'tmpf' and 'tmpb',
+    to the samples of a tile. To be passed as `derived` to
+    `MonteCarloStream.run()`.
+
+    Parameters
+    ----------
+    var_f, var_b : array-like
+        The variance of the forward and backward temperatures, of the shape
+        of the (x, time) domain of the MonteCarloStream
+
+    Returns
+    -------
+    callable
+    """
+    w_f = var_b / (var_f + var_b)
+    w_b = var_f / (var_f + var_b)
+
+    def derived(samples, jx, jt):
+        samples['tmpw'] = w_f[jx, jt] * samples['tmpf'] + \
+            w_b[jx, jt] * samples['tmpb']
+
+    return derived
+
+
+def mc_stream_conf_int(
+        stream, labels, conf_ints=None, weighted=False, x_mask=None,
+        nbins=500):
+    """
+    The variance and the confidence intervals per (x, time) of the
+    temperatures of a MonteCarloStream. The first pass over the samples
+    gives their moments and range, unless the stream has reduced them
+    before, and a second pass the histograms for the confidence intervals.
+
+    Parameters
+    ----------
+    stream : MonteCarloStream
+    labels : list of str
+        The keys of the temperatures, e.g., ['tmpf', 'tmpb']
+    conf_ints : iterable of float, optional
+        Percentages
+    weighted : bool
+        Also reduce 'tmpw', the inverse-variance weighted average of 'tmpf'
+        and 'tmpb'. Requires a second pass.
+    x_mask : array-like of bool, optional
+        Of size `stream.ix`. The variance and the confidence intervals are
+        NaN outside of the mask.
+    nbins : int
+        The number of bins of the histograms per (x, time)
+
+    Returns
+    -------
+    dict
+        Per label, a tuple of the variance and the confidence intervals
+        (None if no `conf_ints` are given)
+    """
+    shape = stream.shape
+    q = np.asarray(conf_ints) / 100 if conf_ints else None
+
+    def mask(a):
+        if x_mask is None:
+            return a
+        return np.where(np.reshape(x_mask, (-1, 1)), a, np.nan)
+
+    cells = stream.cell_statistics(labels)
+
+    out = {}
+    reducers = []
+    derived = None
+
+    for label, cell in cells.items():
+        out[label] = mask(cell.var()), None
+
+        if q is not None:
+            reducers.append(
+                CellStatistics(
+                    label,
+                    shape,
+                    q,
+                    lower=cell.moments.min,
+                    upper=cell.moments.max,
+                    nbins=nbins))
+
+    if weighted:
+        derived = weighted_temperature_fn(out['tmpf'][0], out['tmpb'][0])
+
+        # The weighted average is within the range of tmpf and tmpb
+        reducers.append(
+            CellStatistics(
+                'tmpw',
+                shape,
+                q,
+                lower=np.minimum(
+                    cells['tmpf'].moments.min, cells['tmpb'].moments.min),
+                upper=np.maximum(
+                    cells['tmpf'].moments.max, cells['tmpb'].moments.max),
+                nbins=nbins))
+
+    if reducers:
+        stream.run(reducers, derived=derived)
+
+    for reducer in reducers:
+        out[reducer.label] = (
+            mask(reducer.var()),
+            mask(reducer.quantiles) if q is not None else None)
+
+    return out
+
+
+def mc_stream_average(
+        stream,
+        labels,
+        centers,
+        conf_ints=None,
+        weighted=False,
+        flag1_axes=(),
+        flag2_axes=(),
+        nbins=500):
+    """
+    The statistics of the averages of the temperatures of a MonteCarloStream
+    over the locations (axis=0) or over the time steps (axis=1), see
+    `DataStore.average_single_ended()`.
+
+    Flag 1 pools the samples over the axis. Its variance is of the
+    deviations from `centers`, which follows from the moments per cell, and
+    its confidence intervals of the samples.
+    Flag 2 is the inverse-variance weighted average over the axis of each
+    sample, of which the set of shape (mc_sample_size, n) is returned.
+
+    Parameters
+    ----------
+    stream : MonteCarloStream
+    labels : list of str
+        The keys of the temperatures, e.g., ['tmpf', 'tmpb']
+    centers : dict
+        Per label, the temperature of the (x, time) domain of the stream
+    conf_ints : iterable of float, optional
+        Percentages
+    weighted : bool
+        Also reduce 'tmpw', the inverse-variance weighted average of 'tmpf'
+        and 'tmpb'
+    flag1_axes, flag2_axes : iterable of int
+        The axes over which the averages of flag 1 and flag 2 are computed
+    nbins : int
+        The number of bins of the histograms of flag 1
+
+    Returns
+    -------
+    dict
+        Per label, a dict with 'var', the variance per (x, time), and per
+        axis, ('avg1', axis) with the variance and the confidence intervals,
+        and ('avg2', axis) with the variance, the set, and the confidence
+        intervals
+    """
+    shape = stream.shape
+    q = np.asarray(conf_ints) / 100 if conf_ints else None
+    assert not flag2_axes or np.all(stream.sizes == stream.mc_sample_size), \
+        'The sets of flag 2 require the same number of samples per tile'
+
+    cells = stream.cell_statistics(labels)
+
+    out = {label: {'var': cells[label].var()} for label in labels}
+    reducers = {}
+    derived = None
+
+    for label in labels:
+        for axis in flag1_axes:
+            pooled = cells[label].moments.pool(axis, center=centers[label])
+            out[label]['avg1', axis] = pooled.var(), None
+
+            if q is not None:
+                reducers['avg1', label, axis] = PooledStatistics(
+                    label,
+                    shape,
+                    axis,
+                    q=q,
+                    lower=np.min(cells[label].moments.min, axis=axis),
+                    upper=np.max(cells[label].moments.max, axis=axis),
+                    nbins=nbins)
+
+        for axis in flag2_axes:
+            reducers['avg2', label, axis] = WeightedSum(
+                label, shape, axis, 1 / out[label]['var'],
+                stream.mc_sample_size)
+
+    if weighted:
+        derived = weighted_temperature_fn(
+            out['tmpf']['var'], out['tmpb']['var'])
+        reducers['var', 'tmpw', None] = CellStatistics('tmpw', shape)
+
+        lower = np.minimum(
+            cells['tmpf'].moments.min, cells['tmpb'].moments.min)
+        upper = np.maximum(
+            cells['tmpf'].moments.max, cells['tmpb'].moments.max)
+
+        for axis in flag1_axes:
+            reducers['avg1', 'tmpw', axis] = PooledStatistics(
+                'tmpw',
+                shape,
+                axis,
+                q=q,
+                lower=np.min(lower, axis=axis),
+                upper=np.max(upper, axis=axis),
+                nbins=nbins)
+
+    if reducers:
+        stream.run(list(reducers.values()), derived=derived)
+
+    if weighted:
+        out['tmpw'] = {'var': reducers['var', 'tmpw', None].var()}
+
+    for (kind, label, axis), reducer in reducers.items():
+        if kind == 'avg1':
+            if label == 'tmpw':
+                # the pooled samples themselves, as in the in-memory sets
+                out[label]['avg1', axis] = (
+                    reducer.var(ddof=0),
+                    reducer.quantiles if q is not None else None)
+            else:
+                out[label]['avg1', axis] = (
+                    out[label]['avg1', axis][0], reducer.quantiles)
+
+        elif kind == 'avg2':
+            avg_var = 1 / np.nansum(1 / out[label]['var'], axis=axis)
+            out[label]['avg2', axis] = avg_var, reducer.sums * avg_var
+
+    if weighted:
+        for axis in flag2_axes:
+            var_f, set_f = out['tmpf']['avg2', axis]
+            var_b, set_b = out['tmpb']['avg2', axis]
+            var_w = 1 / (1 / var_f + 1 / var_b)
+            out['tmpw']['avg2', axis] = (
+                var_w, (set_f / var_f + set_b / var_b) * var_w)
+
+    for label in out:
+        for axis in flag2_axes:
+            avg_var, avg_set = out[label]['avg2', axis]
+            ci = np.percentile(
+                avg_set, conf_ints, axis=0) if q is not None else None
+            out[label]['avg2', axis] = avg_var, avg_set, ci
+
+    return out
@@ -4,6 +4,8 @@ import glob
 import inspect
 import os
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Dict
 from typing import List
 
@@ -14,16 +16,42 @@ import scipy.sparse as sp
 import scipy.stats as sst
 import xarray as xr
 import yaml
-from scipy.optimize import minimize
 from scipy.sparse import linalg as ln
 
+from .calibrate_utils import BlockCovariance
+from .calibrate_utils import MonteCarloStream
+from .calibrate_utils import ParameterSampler
+from .calibrate_utils import RandomStreams
+from .calibrate_utils import TransientAttenuation
 from .calibrate_utils import calc_alpha_double
 from .calibrate_utils import calibration_double_ended_solver
 from .calibrate_utils import calibration_single_ended_solver
+from .calibrate_utils import double_ended_block_groups
 from .calibrate_utils import match_sections
+from .calibrate_utils import mc_memory_plan
+from .calibrate_utils import mc_parameter_samples
+from .calibrate_utils import mc_percentile
+from .calibrate_utils import mc_stream_average
+from .calibrate_utils import mc_stream_conf_int
+from .calibrate_utils import mc_temperature_double_ended
+from .calibrate_utils import mc_temperature_single_ended
+from .calibrate_utils import temperature_variance_double_ended
+from .calibrate_utils import temperature_variance_single_ended
+from .calibrate_utils import time_local_coefficients
+from .calibrate_utils import time_local_system_double_ended
+from .calibrate_utils import time_local_system_single_ended
+from .calibrate_utils import wls_block
 from .calibrate_utils import wls_sparse
 from .calibrate_utils import wls_stats
+from .calibrate_utils import wls_time_local
+from .datastore_utils import average_selection_indices
 from .datastore_utils import check_timestep_allclose
+from .datastore_utils import fill_region
+from .datastore_utils import from_object_array
+from .datastore_utils import object_array
+from .datastore_utils import region_indices
+from .datastore_utils import store_mc_average
+from .datastore_utils import time_chunk_order
 from .io import _dim_attrs
 from .io import apsensing_xml_version_check
 from .io import read_apsensing_files_routine
@@ -959,7 +987,12 @@ class DataStore(xr.Dataset):
         return self.variance_stokes_constant(*args, **kwargs)
 
     def variance_stokes_constant(
-            self, st_label, sections=None, reshape_residuals=True):
+            self,
+            st_label,
+            sections=None,
+            reshape_residuals=True,
+            time_chunk_size=None,
+            rtol=None):
         """
         Approximate the variance of the noise in Stokes intensity measurements
         with one value, suitable for small setups.
@@ -1040,6 +1073,22 @@ class DataStore(xr.Dataset):
             lists of slice objects, where each slice object is a fiber stretch
             that has the reference temperature. Afterwards, `sections` is stored
             under `ds.sections`.
+        time_chunk_size : int, optional
+            Stream the measurements of the reference sections in chunks of
+            `time_chunk_size` time steps, e.g., from a dask backed DataStore,
+            instead of loading them at once. Per stretch, only the sum over
+            time of the outer product of the measurements with themselves,
+            and their sum over time are accumulated, from which the fit and
+            the variance of its residuals follow exactly. The chunks are
+            spread over the entire period, see
+            `dtscalibration.datastore_utils.time_chunk_order()`. The
+            residuals are then a lazy, dask backed, DataArray if the
+            measurements are.
+        rtol : float, optional
+            With `time_chunk_size`, stop streaming once the variance changes
+            by less than `rtol` relative to its value after another chunk.
+            By default, all chunks are used, and the variance equals that
+            without `time_chunk_size`, up to rounding errors.
 
         Returns
         -------
@@ -1051,8 +1100,10 @@ class DataStore(xr.Dataset):
         Notes
         -----
 
-        * Because there are a large number of unknowns, spend time on\
-        calculating an initial estimate. Can be turned off by setting to False.
+        * The product of the constant per location and the time series that\
+        fits best is given by the leading singular vectors of the measurements\
+        of each stretch, which are computed in closed form. The measurements\
+        of the reference sections must be finite.
 
         * It is often not needed to use measurements from all time steps. If\
         your variance estimate does not change when including measurements from\
@@ -1081,26 +1132,59 @@ class DataStore(xr.Dataset):
 
         check_timestep_allclose(self, eps=0.01)
 
-        data_dict = da.compute(
-            self.ufunc_per_section(label=st_label, calc_per='stretch'))[
-                0]  # should maybe be per section. But then residuals
-        # seem to be correlated between stretches. I don't know why.. BdT.
-        resid_list = []
-
-        for k, v in data_dict.items():
-            for vi in v:
-                nxs, nt = vi.shape
-                npar = nt + nxs
-
-                p1 = np.ones(npar) * vi.mean()**0.5
+        # the indices of the stretches, in the order of `ds.sections`
+        ix_stretches = [
+            ix for v in self.ufunc_per_section(
+                x_indices=True, calc_per='stretch').values() for ix in v]
+        ix_resid = np.concatenate(ix_stretches)
+
+        if time_chunk_size is not None:
+            time_dim = self.get_time_dim(data_var_key=st_label)
+            bounds = np.cumsum([0] + [ix.size for ix in ix_stretches])
+            grams = [np.zeros((ix.size, ix.size)) for ix in ix_stretches]
+            sums = [np.zeros(ix.size) for ix in ix_stretches]
+            nt_used = 0
+            var_I = None
+
+            for it in time_chunk_order(self[time_dim].size, time_chunk_size):
+                data = self[st_label].isel(
+                    x=ix_resid, **{time_dim: it}).values
+
+                for i0, i1, gram, sum_i in zip(
+                        bounds[:-1], bounds[1:], grams, sums):
+                    gram += data[i0:i1].dot(data[i0:i1].T)
+                    sum_i += data[i0:i1].sum(axis=1)
+
+                nt_used += it.size
+                var_prev = var_I
+                var_I, profiles = variance_rank1_fit(grams, sums, nt_used)
+
+                if rtol is not None and var_prev is not None and \
+                        abs(var_I - var_prev) <= rtol * var_I:
+                    break
+
+            st = self[st_label].isel(x=ix_resid)
+            fits = [
+                u[:, None] * (u[:, None] * st.data[i0:i1]).sum(axis=0)
+                for i0, i1, u in zip(bounds[:-1], bounds[1:], profiles)]
+
+            if isinstance(st.data, da.Array):
+                resid = da.concatenate(fits) - st.data
+            else:
+                resid = np.concatenate(fits) - st.data
 
-                res = minimize(func_cost, p1, args=(vi, nxs), method='Powell')
-                assert res.success, 'Unable to fit. Try variance_stokes_exponential'
+            if not reshape_residuals:
+                return var_I, resid
 
-                fit = func_fit(res.x, nxs)
-                resid_list.append(fit - vi)
+            resid_da = xr.DataArray(
+                data=resid, dims=st.dims, coords=st.coords).reindex(x=self.x)
+            return var_I, resid_da
 
-        resid = np.concatenate(resid_list)
+        # should maybe be per section. But then residuals seem to be
+        # correlated between stretches. I don't know why.. BdT.
+        bounds = np.cumsum([0] + [ix.size for ix in ix_stretches])
+        data = self[st_label].isel(x=ix_resid).values
+        resid = fit_stretches_rank1(data, bounds)
 
         # unbiased estimater ddof=1, originally thought it was npar
         var_I = resid.var(ddof=1)
@@ -1109,8 +1193,6 @@ class DataStore(xr.Dataset):
             return var_I, resid
 
         else:
-            ix_resid = self.ufunc_per_section(x_indices=True, calc_per='all')
-
             resid_sorted = np.full(
                 shape=self[st_label].shape, fill_value=np.nan)
             resid_sorted[ix_resid, :] = resid
@@ -1393,7 +1475,9 @@ class DataStore(xr.Dataset):
             sections=None,
             nbin=50,
             through_zero=True,
-            plot_fit=False):
+            plot_fit=False,
+            time_chunk_size=None,
+            rtol=None):
         """
         Approximate the variance of the noise in Stokes intensity measurements
         with a linear function of the intensity, suitable for large setups.
@@ -1504,6 +1588,19 @@ class DataStore(xr.Dataset):
         plot_fit : bool
             If True plot the variances for each bin and plot the fitted
             linear function
+        time_chunk_size : int, optional
+            Stream the measurements of the reference sections and their
+            residuals in chunks of `time_chunk_size` time steps, see
+            `variance_stokes_constant()`. Per bin of the intensity, the
+            number of residuals, the sum of the intensities, and the sum and
+            the sum of squares of the residuals are accumulated. The bins
+            have about the same number of residuals in the first chunk,
+            instead of in all chunks.
+        rtol : float, optional
+            With `time_chunk_size`, stop streaming once the fitted variances
+            at the lowest and the highest intensity change by less than
+            `rtol` relative to their values after another chunk. Also
+            used for `variance_stokes_constant()`.
         """
         import matplotlib.pyplot as plt
 
@@ -1513,48 +1610,67 @@ class DataStore(xr.Dataset):
             assert self.sections, 'sections are not defined'
 
         assert self[st_label].dims[0] == 'x', 'Stokes are transposed'
-        _, resid = self.variance_stokes(st_label=st_label)
+        _, resid = self.variance_stokes(
+            st_label=st_label, time_chunk_size=time_chunk_size, rtol=rtol)
 
         ix_sec = self.ufunc_per_section(x_indices=True, calc_per='all')
-        st = self.isel(x=ix_sec)[st_label].values.ravel()
-        diff_st = resid.isel(x=ix_sec).values.ravel()
-
-        # Adjust nbin silently to fit residuals in
-        # rectangular matrix and use numpy for computation
-        nbin_ = nbin
-        while st.size % nbin_:
-            nbin_ -= 1
-
-        if nbin_ != nbin:
-            print(
-                'Estimation of linear variance of', st_label,
-                'Adjusting nbin to:', nbin_)
-            nbin = nbin_
-
-        isort = np.argsort(st)
-        st_sort_mean = st[isort].reshape((nbin, -1)).mean(axis=1)
-        st_sort_var = diff_st[isort].reshape((nbin, -1)).var(axis=1)
-
-        if through_zero:
-            # VAR(Stokes) = slope * Stokes
-            offset = 0.
-            slope = np.linalg.lstsq(
-                st_sort_mean[:, None], st_sort_var, rcond=None)[0]
+
+        if time_chunk_size is None:
+            st = self.isel(x=ix_sec)[st_label].values.ravel()
+            diff_st = resid.isel(x=ix_sec).values.ravel()
+            st_sort_mean, st_sort_var = bin_variance_linear(
+                st, diff_st, nbin, st_label)
+            slope, offset = fit_variance_linear(
+                st_sort_mean, st_sort_var, through_zero)
+
         else:
-            # VAR(Stokes) = slope * Stokes + offset
-            slope, offset = np.linalg.lstsq(
-                np.hstack((st_sort_mean[:, None], np.ones((nbin, 1)))),
-                st_sort_var,
-                rcond=None)[0]
-
-            if offset < 0:
-                warnings.warn(
-                    f"Warning! Offset of variance_stokes_linear() "
-                    f"of {st_label} is negative. This is phisically "
-                    f"not possible. Most likely, your {st_label} do "
-                    f"not vary enough to fit a linear curve. Either "
-                    f"use `through_zero` option or use "
-                    f"`ds.variance_stokes_constant()`")
+            time_dim = self.get_time_dim(data_var_key=st_label)
+
+            # Per bin, the number of residuals, the sum of the intensities,
+            # and the sum and the sum of squares of the residuals
+            stats = np.zeros((4, nbin))
+            edges = None
+            var_prev = None
+
+            for it in time_chunk_order(self[time_dim].size, time_chunk_size):
+                st = self[st_label].isel(
+                    x=ix_sec, **{time_dim: it}).values.ravel()
+                diff_st = resid.isel(
+                    x=ix_sec, **{time_dim: it}).values.ravel()
+
+                if edges is None:
+                    edges = np.quantile(
+                        st, np.linspace(0., 1., nbin + 1)[1:-1])
+
+                ibin = np.searchsorted(edges, st)
+
+                for stat, weights in zip(
+                        stats, [None, st, diff_st, diff_st**2]):
+                    stat += np.bincount(ibin, weights=weights, minlength=nbin)
+
+                n = stats[0, stats[0] > 1]
+                st_sort_mean = stats[1, stats[0] > 1] / n
+                st_sort_var = stats[3, stats[0] > 1] / n - (
+                    stats[2, stats[0] > 1] / n)**2
+                slope, offset = fit_variance_linear(
+                    st_sort_mean, st_sort_var, through_zero)
+
+                var_ends = slope * st_sort_mean[[0, -1]] + offset
+
+                if rtol is not None and var_prev is not None and np.all(
+                        np.abs(var_ends - var_prev) <= rtol * var_ends):
+                    break
+
+                var_prev = var_ends
+
+        if not through_zero and offset < 0:
+            warnings.warn(
+                f"Warning! Offset of variance_stokes_linear() "
+                f"of {st_label} is negative. This is phisically "
+                f"not possible. Most likely, your {st_label} do "
+                f"not vary enough to fit a linear curve. Either "
+                f"use `through_zero` option or use "
+                f"`ds.variance_stokes_constant()`")
 
         def var_fun(stokes):
             return slope * stokes + offset
@@ -1577,6 +1693,143 @@ class DataStore(xr.Dataset):
 
         return slope, offset, st_sort_mean, st_sort_var, resid, var_fun
 
+    def variance_stokes_all(
+            self,
+            st_labels=None,
+            sections=None,
+            method='constant',
+            reshape_residuals=True,
+            nbin=50,
+            through_zero=True,
+            num_workers=None):
+        """
+        Approximate the variance of the noise in the Stokes intensity
+        measurements of multiple channels at once, e.g., all four channels
+        required for a double-ended calibration.
+
+        The measurements of the reference sections of all channels are
+        selected and loaded at once, instead of once per channel, and the
+        fits of the channels run in parallel threads. The variances are the
+        same as those of `ds.variance_stokes_constant()` and
+        `ds.variance_stokes_linear()` for each channel separately. See
+        their documentation for the estimation methods.
+
+        Parameters
+        ----------
+        st_labels : list of str, optional
+            Labels of the Stokes and anti-Stokes measurements. Defaults to
+            `['st', 'ast']`, and to `['st', 'ast', 'rst', 'rast']` for
+            double-ended setups.
+        sections : Dict[str, List[slice]], optional
+            If `None` is supplied, `ds.sections` is used. Define calibration
+            sections. See `ds.variance_stokes_constant()`.
+        method : {'constant', 'linear'}
+            Approximate the variance with one value, as
+            `ds.variance_stokes_constant()`, or with a linear function of the
+            intensity, as `ds.variance_stokes_linear()`.
+        reshape_residuals : bool
+            If True, the residuals are returned as DataArrays with the shape
+            of the measurements, with NaN outside the reference sections.
+            Always True for `method='linear'`.
+        nbin : int
+            Number of bins for `method='linear'`. See
+            `ds.variance_stokes_linear()`.
+        through_zero : bool
+            For `method='linear'`. See `ds.variance_stokes_linear()`.
+        num_workers : int, optional
+            The number of threads that fit the channels. Defaults to dask's
+            `num_workers`, or the number of cores.
+
+        Returns
+        -------
+        dict
+            Per label in `st_labels`, the tuple returned by
+            `ds.variance_stokes_constant()`, `(I_var, resid)`, or by
+            `ds.variance_stokes_linear()`, `(slope, offset, st_sort_mean,
+            st_sort_var, resid, var_fun)`.
+        """
+        if sections:
+            self.sections = sections
+        else:
+            assert self.sections, 'sections are not defined'
+
+        if st_labels is None:
+            st_labels = ['st', 'ast']
+
+            if self.is_double_ended:
+                st_labels += ['rst', 'rast']
+
+        assert method in ['constant', 'linear'], \
+            'method should be either constant or linear'
+
+        for st_label in st_labels:
+            assert self[st_label].dims[0] == 'x', 'Stokes are transposed'
+
+        if method == 'linear':
+            reshape_residuals = True
+
+        check_timestep_allclose(self, eps=0.01)
+
+        # the indices of the stretches, in the order of `ds.sections`
+        ix_stretches = [
+            ix for v in self.ufunc_per_section(
+                x_indices=True, calc_per='stretch').values() for ix in v]
+        ix_resid = np.concatenate(ix_stretches)
+        bounds = np.cumsum([0] + [ix.size for ix in ix_stretches])
+
+        # Select and load the reference sections of all labels at once
+        data_list = dask.compute(
+            *[self[st_label].isel(x=ix_resid).data for st_label in st_labels])
+
+        def fit(st_label, data):
+            resid = fit_stretches_rank1(data, bounds)
+
+            if reshape_residuals:
+                resid_sorted = np.full(
+                    shape=self[st_label].shape, fill_value=np.nan)
+                resid_sorted[ix_resid, :] = resid
+                resid_da = xr.DataArray(
+                    data=resid_sorted, coords=self[st_label].coords)
+
+            else:
+                resid_da = resid
+
+            if method == 'constant':
+                # unbiased estimater ddof=1, originally thought it was npar
+                return resid.var(ddof=1), resid_da
+
+            st_sort_mean, st_sort_var = bin_variance_linear(
+                np.asarray(data).ravel(), resid.ravel(), nbin, st_label)
+            slope, offset = fit_variance_linear(
+                st_sort_mean, st_sort_var, through_zero)
+
+            def var_fun(stokes):
+                return slope * stokes + offset
+
+            return slope, offset, st_sort_mean, st_sort_var, resid_da, var_fun
+
+        if num_workers is None:
+            num_workers = dask.config.get('num_workers', None) or \
+                dask.system.CPU_COUNT
+
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(num_workers, len(st_labels)))) as ex:
+            out = dict(
+                zip(st_labels, ex.map(fit, st_labels, data_list)))
+
+        if method == 'linear' and not through_zero:
+            for st_label, (_, offset, *_) in out.items():
+                if offset < 0:
+                    warnings.warn(
+                        f"Warning! Offset of variance_stokes_linear() "
+                        f"of {st_label} is negative. This is phisically "
+                        f"not possible. Most likely, your {st_label} do "
+                        f"not vary enough to fit a linear curve. Either "
+                        f"use `through_zero` option or use "
+                        f"`ds.variance_stokes_constant()`")
+
+        return out
+
     def i_var(self, st_var, ast_var, st_label='st', ast_label='ast'):
         """
         Compute the variance of an observation given the stokes and anti-Stokes
@@ -1862,6 +2115,11 @@ class DataStore(xr.Dataset):
             fix_gamma=None,
             fix_dalpha=None,
             fix_alpha=None,
+            matrix_free=False,
+            plan=None,
+            time_chunks=None,
+            precondition=None,
+            calc_cov=None,
             **kwargs):
         """
         Calibrate the Stokes (`ds.st`) and anti-Stokes (`ds.ast`) data to
@@ -1911,7 +2169,10 @@ class DataStore(xr.Dataset):
         store_p_cov : str
             Key to store the covariance matrix of the calibrated parameters
         store_p_val : str
-            Key to store the values of the calibrated parameters
+            Key to store the values of the calibrated parameters. The
+            convergence diagnostics of the solver, such as the number of
+            iterations, the norm of the weighted residuals, an estimate of the
+            condition number, and the wall time, are stored as its attributes.
         p_val : array-like, optional
             Define `p_val`, `p_var`, `p_cov` if you used an external function
             for calibration. Has size 2 + `nt`. First value is :math:`\gamma`,
@@ -1968,12 +2229,59 @@ class DataStore(xr.Dataset):
             Use `'ols'` for ordinary least squares and `'wls'` for weighted least
             squares. `'wls'` is the default, and there is currently no reason to
             use `'ols'`.
-        solver : {'sparse', 'stats'}
+        solver : {'sparse', 'direct', 'stats', 'block', 'chunked'}
             Either use the homemade weighted sparse solver or the weighted
             dense matrix solver of statsmodels. The sparse solver uses much less
             memory, is faster, and gives the same result as the statsmodels
             solver. The statsmodels solver is mostly used to check the sparse
-            solver. `'stats'` is the default.
+            solver. The `'block'` solver eliminates :math:`C` and the transient
+            attenuation of each time step from the normal equations, and
+            only solves a small system for :math:`\gamma` and
+            :math:`\Delta\\alpha`. Its cost grows linearly with the number of
+            time steps, and is recommended for long time series.
+            The `'chunked'` solver accumulates the normal equations per time
+            chunk, so that only a single chunk of the Stokes data is loaded in
+            memory at a time. Intended for archives opened with
+            `open_mf_datastore()`.
+            The `'direct'` solver factorizes the sparse normal equations
+            instead of iterating with LSQR, which is much faster for
+            mid-sized problems. It falls back to LSQR for large or (nearly)
+            singular problems.
+            `'sparse'` is the default.
+        matrix_free : bool
+            Pass the coefficient matrix to the `'sparse'` and `'block'`
+            solvers as a `DesignOperator`, which describes the coefficients
+            per time step and per location instead of storing all row and
+            column indices. Uses much less memory for long time series. Not
+            available in combination with fixed parameters.
+        plan : CalibrationPlan, optional
+            Cache shared by repeated calibrations of the same geometry. The
+            coefficient matrix is reused, the previous solution serves as
+            initial estimate, and the `'block'` solver reuses its
+            factorization if the weights and the reference temperatures did
+            not change. The weights depend on the measured intensities, so
+            new measurements require a new factorization. Only for the
+            `'sparse'` and `'block'` solvers, and not in combination with
+            fixed parameters.
+        time_chunks : int, optional
+            Number of time steps per chunk for the `'chunked'` solver.
+            Defaults to the dask chunks of the Stokes data.
+        precondition : {'columns', 'blocks', None}
+            Preconditioner of LSQR, used by the `'sparse'` solver.
+            `'columns'` scales the columns of the coefficient matrix to unit
+            norm and `'blocks'` also decorrelates the parameters of each time
+            step. Both reduce the number of iterations. Defaults to None,
+            which keeps poorly determined parameters close to their initial
+            estimate.
+        calc_cov : {True, 'blocks'}, optional
+            Form of the covariance matrix of the parameters that is stored
+            under `store_p_cov` if method is wls. If `'blocks'`, a
+            `BlockCovariance` is stored, which holds the factorization of the
+            normal equations instead of the dense (npar x npar) matrix. Uses
+            far less memory for long time series, and is accepted by the
+            `conf_int_*` methods, but cannot be written to netCDF. Not
+            available for the `'stats'` solver. Defaults to `'blocks'` for the
+            `'chunked'` solver and to True otherwise.
         matching_sections : List[Tuple[slice, slice, bool]], optional
             Provide a list of tuples. A tuple per matching section. Each tuple
             has three items. The first two items are the slices of the sections
@@ -2053,7 +2361,49 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             'There is uncontrolled noise in the AST signal. Are your sections' \
             'correctly defined?'
 
-        if method == 'ols' or method == 'wls':
+        # filled by the solver, and stored as attributes of p_val
+        diagnostics = dict()
+
+        if calc_cov is None:
+            calc_cov = 'blocks' if solver == 'chunked' else True
+
+        assert calc_cov is True or calc_cov == 'blocks', \
+            "Choose calc_cov from {True, 'blocks'}"
+        assert not (calc_cov == 'blocks' and solver == 'stats'), \
+            "The stats solver does not support calc_cov='blocks'"
+
+        if (method == 'ols' or method == 'wls') and (
+                matrix_free or plan is not None or solver == 'chunked'):
+            assert not (fix_gamma or fix_dalpha or fix_alpha), \
+                'Fixing parameters is not supported with `matrix_free`, ' \
+                '`plan`, or the chunked solver'
+            assert solver in ['sparse', 'direct', 'block', 'chunked'], \
+                'Use the sparse, direct or block solver with `matrix_free` ' \
+                'or `plan`'
+
+            if method == 'ols':
+                assert st_var is None and ast_var is None, ''
+
+            calc_cov = calc_cov if method == 'wls' else False
+            out = calibration_single_ended_solver(
+                self,
+                st_var,
+                ast_var,
+                calc_cov=calc_cov,
+                solver=solver,
+                matching_indices=matching_indices,
+                matrix_free=matrix_free,
+                plan=plan,
+                time_chunks=time_chunks,
+                precondition=precondition,
+                diagnostics=diagnostics)
+
+            if calc_cov:
+                p_val, p_var, p_cov = out
+            else:
+                p_val, p_var = out
+
+        elif method == 'ols' or method == 'wls':
             if method == 'ols':
                 assert st_var is None and ast_var is None, ''
                 st_var = None  # ols
@@ -2065,115 +2415,171 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                                                    'variances (`st_var`, ' \
                                                    '`ast_var`) '
 
-                calc_cov = True
-
-            split = calibration_single_ended_solver(
-                self,
-                st_var,
-                ast_var,
-                calc_cov=calc_cov,
-                solver='external_split',
-                matching_indices=matching_indices)
-
-            y = split['y']
-            w = split['w']
-
-            # Stack all X's
             if fix_alpha:
                 assert not fix_dalpha, 'Use either `fix_dalpha` or `fix_alpha`'
                 assert fix_alpha[0].size == self.x.size, 'fix_alpha also needs to be defined outside the reference ' \
                                                          'sections'
                 assert fix_alpha[1].size == self.x.size, 'fix_alpha also needs to be defined outside the reference ' \
                                                          'sections'
-                p_val = split['p0_est_alpha'].copy()
 
                 if np.any(matching_indices):
                     raise NotImplementedError(
                         "Configuring fix_alpha and matching sections requires extra code"
                     )
 
-                X = sp.hstack(
-                    (
-                        split['X_gamma'], split['X_alpha'], split['X_c'],
-                        split['X_TA'])).tocsr()
-                ip_use = list(range(1 + nx + nt + nta * nt))
+            if fix_gamma and (fix_alpha or fix_dalpha) and solver in [
+                    'sparse', 'direct', 'block']:
+                # Only C and the transient attenuation remain, which are
+                # local to their time step and are solved in closed form,
+                # directly from the Stokes and anti-Stokes intensities
+                A, y, w, x0 = time_local_system_single_ended(
+                    self,
+                    st_var,
+                    ast_var,
+                    fix_gamma,
+                    fix_dalpha=fix_dalpha,
+                    fix_alpha=fix_alpha,
+                    matching_indices=matching_indices)
+                out = wls_time_local(
+                    A,
+                    y,
+                    w=w,
+                    x0=x0,
+                    calc_cov=calc_cov,
+                    diagnostics=diagnostics)
 
-            else:
-                X = sp.vstack(
-                    (
-                        sp.hstack(
-                            (
-                                split['X_gamma'], split['X_dalpha'],
-                                split['X_c'], split['X_TA'])),
-                        split['X_m'])).tocsr()
-                p_val = split['p0_est_dalpha'].copy()
-                ip_use = list(range(1 + 1 + nt + nta * nt))
+                if fix_alpha:
+                    p_val = np.concatenate(
+                        ([fix_gamma[0]], fix_alpha[0], out[0]))
+                    p_var = np.concatenate(
+                        ([fix_gamma[1]], fix_alpha[1], out[1]))
+                else:
+                    p_val = np.concatenate(
+                        ([fix_gamma[0], fix_dalpha[0]], out[0]))
+                    p_var = np.concatenate(
+                        ([fix_gamma[1], fix_dalpha[1]], out[1]))
 
-            p_var = np.zeros_like(p_val)
-            p_cov = np.zeros((p_val.size, p_val.size), dtype=np.float)
+                ip_use = np.arange(p_val.size - nt - nta * nt, p_val.size)
 
-            if fix_gamma:
-                ip_remove = [0]
-                ip_use = [i for i in ip_use if i not in ip_remove]
-                p_val[ip_remove] = fix_gamma[0]
-                p_var[ip_remove] = fix_gamma[1]
+            else:
+                split = calibration_single_ended_solver(
+                    self,
+                    st_var,
+                    ast_var,
+                    calc_cov=calc_cov,
+                    solver='external_split',
+                    matching_indices=matching_indices)
 
-                X_gamma = sp.vstack(
-                    (split['X_gamma'],
-                     split['X_m'].tocsr()[:, 0].tocoo())).toarray().flatten()
+                y = split['y']
+                w = split['w']
 
-                y -= fix_gamma[0] * X_gamma
-                w = 1 / (1 / w + fix_gamma[1] * X_gamma)
+                # Stack all X's
+                if fix_alpha:
+                    p_val = split['p0_est_alpha'].copy()
+                    X = sp.hstack(
+                        (
+                            split['X_gamma'], split['X_alpha'], split['X_c'],
+                            split['X_TA'])).tocsr()
+                    ip_use = list(range(1 + nx + nt + nta * nt))
 
-            if fix_alpha:
-                ip_remove = list(range(1, nx + 1))
-                ip_use = [i for i in ip_use if i not in ip_remove]
-                p_val[ip_remove] = fix_alpha[0]
-                p_var[ip_remove] = fix_alpha[1]
-
-                # X_alpha needs to be vertically extended to support matching sections
-                y -= split['X_alpha'].dot(fix_alpha[0])
-                w = 1 / (1 / w + split['X_alpha'].dot(fix_alpha[1]))
-
-            if fix_dalpha:
-                ip_remove = [1]
-                ip_use = [i for i in ip_use if i not in ip_remove]
-                p_val[ip_remove] = fix_dalpha[0]
-                p_var[ip_remove] = fix_dalpha[1]
-
-                y -= np.hstack(
-                    (
-                        fix_dalpha[0] * split['X_dalpha'].toarray().flatten(),
+                else:
+                    X = sp.vstack(
                         (
-                            fix_dalpha[0] * split['X_m'].tocsr()
-                            [:, 1].tocoo().toarray().flatten())))
-                w = 1 / (
-                    1 / w + np.hstack(
+                            sp.hstack(
+                                (
+                                    split['X_gamma'], split['X_dalpha'],
+                                    split['X_c'], split['X_TA'])),
+                            split['X_m'])).tocsr()
+                    p_val = split['p0_est_dalpha'].copy()
+                    ip_use = list(range(1 + 1 + nt + nta * nt))
+
+                p_var = np.zeros_like(p_val)
+
+                # C and the transient attenuation are local to their time
+                # step
+                if fix_alpha:
+                    p_groups = np.concatenate(
                         (
-                            fix_dalpha[1]
-                            * split['X_dalpha'].toarray().flatten(), (
-                                fix_dalpha[1] * split['X_m'].tocsr()
-                                [:, 1].tocoo().toarray().flatten()))))
-
-            if solver == 'sparse':
-                out = wls_sparse(
-                    X[:, ip_use],
-                    y,
-                    w=w,
-                    x0=p_val[ip_use],
-                    calc_cov=calc_cov,
-                    verbose=False)
+                            -np.ones(1 + nx, dtype=int), np.arange(nt),
+                            np.tile(np.arange(nt), nta)))
+                else:
+                    p_groups = np.concatenate(
+                        (
+                            [-1, -1], np.arange(nt),
+                            np.tile(np.arange(nt), nta)))
+
+                # Move the coefficients times the fixed parameters to the
+                # observations, and add their variance
+                if fix_gamma:
+                    ip_remove = [0]
+                    ip_use = [i for i in ip_use if i not in ip_remove]
+                    p_val[ip_remove] = fix_gamma[0]
+                    p_var[ip_remove] = fix_gamma[1]
+
+                    X_gamma = X[:, 0].toarray().ravel()
+                    y -= fix_gamma[0] * X_gamma
+                    w = 1 / (1 / w + fix_gamma[1] * X_gamma)
+
+                if fix_alpha:
+                    ip_remove = list(range(1, nx + 1))
+                    ip_use = [i for i in ip_use if i not in ip_remove]
+                    p_val[ip_remove] = fix_alpha[0]
+                    p_var[ip_remove] = fix_alpha[1]
+
+                    # X_alpha needs to be vertically extended to support
+                    # matching sections
+                    y -= split['X_alpha'].dot(fix_alpha[0])
+                    w = 1 / (1 / w + split['X_alpha'].dot(fix_alpha[1]))
+
+                if fix_dalpha:
+                    ip_remove = [1]
+                    ip_use = [i for i in ip_use if i not in ip_remove]
+                    p_val[ip_remove] = fix_dalpha[0]
+                    p_var[ip_remove] = fix_dalpha[1]
+
+                    X_dalpha = X[:, 1].toarray().ravel()
+                    y -= fix_dalpha[0] * X_dalpha
+                    w = 1 / (1 / w + fix_dalpha[1] * X_dalpha)
+
+                if solver in ['sparse', 'direct']:
+                    out = wls_sparse(
+                        X[:, ip_use],
+                        y,
+                        w=w,
+                        x0=p_val[ip_use],
+                        calc_cov=calc_cov,
+                        verbose=False,
+                        groups=p_groups[ip_use],
+                        precondition=precondition,
+                        backend='auto' if solver == 'direct' else 'lsqr',
+                        diagnostics=diagnostics)
+
+                elif solver == 'block':
+                    out = wls_block(
+                        X[:, ip_use],
+                        y,
+                        w=w,
+                        groups=p_groups[ip_use],
+                        x0=p_val[ip_use],
+                        calc_cov=calc_cov,
+                        verbose=False,
+                        diagnostics=diagnostics)
 
-            elif solver == 'stats':
-                out = wls_stats(
-                    X[:, ip_use], y, w=w, calc_cov=calc_cov, verbose=False)
+                elif solver == 'stats':
+                    out = wls_stats(
+                        X[:, ip_use], y, w=w, calc_cov=calc_cov, verbose=False)
 
-            p_val[ip_use] = out[0]
-            p_var[ip_use] = out[1]
+                else:
+                    raise ValueError('Choose a valid solver')
 
-            if calc_cov:
-                np.fill_diagonal(
-                    p_cov, p_var)  # set variance of all fixed params
+                p_val[ip_use] = out[0]
+                p_var[ip_use] = out[1]
+
+            # set variance of all fixed params
+            if calc_cov == 'blocks':
+                p_cov = out[2].embed(ip_use, p_var)
+            elif calc_cov:
+                p_cov = np.diag(p_var)
                 p_cov[np.ix_(ip_use, ip_use)] = out[2]
 
         elif method == 'external':
@@ -2229,10 +2635,9 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
         if store_tmpf:
             ta_arr = np.zeros((nx, nt))
             if nta > 0:
-                for tai, taxi in zip(self[store_ta].values.T,
-                                     self.trans_att.values):
-                    ta_arr[self.x.values >= taxi] = \
-                        ta_arr[self.x.values >= taxi] + tai
+                ta_arr += TransientAttenuation(
+                    self.x.values,
+                    self.trans_att.values).fw(self[store_ta].values.T)
 
             tempF_data = self.gamma.data / (
                 (
@@ -2250,10 +2655,15 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 del self[k]
 
             self[store_p_val] = (('params1',), p_val)
+            self[store_p_val].attrs.update(diagnostics)
 
             if method == 'wls' or method == 'external':
                 assert store_p_cov, 'Might as well store the covariance matrix. Already computed.'
-                self[store_p_cov] = (('params1', 'params2'), p_cov)
+
+                if isinstance(p_cov, BlockCovariance):
+                    self[store_p_cov] = ((), object_array(p_cov))
+                else:
+                    self[store_p_cov] = (('params1', 'params2'), p_cov)
 
         pass
 
@@ -2288,6 +2698,11 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             fix_alpha=None,
             matching_sections=None,
             matching_indices=None,
+            matrix_free=False,
+            plan=None,
+            time_chunks=None,
+            precondition=None,
+            calc_cov=None,
             verbose=False,
             **kwargs):
         """
@@ -2406,7 +2821,10 @@ C_\mathrm{B}(t) + \int_x^L{\Delta\\alpha(x')\,\mathrm{d}x'}}
         store_p_cov : str
             Key to store the covariance matrix of the calibrated parameters
         store_p_val : str
-            Key to store the values of the calibrated parameters
+            Key to store the values of the calibrated parameters. The
+            convergence diagnostics of the solver, such as the number of
+            iterations, the norm of the weighted residuals, an estimate of the
+            condition number, and the wall time, are stored as its attributes.
         p_val : array-like, optional
             Define `p_val`, `p_var`, `p_cov` if you used an external function
             for calibration. Has size `1 + 2 * nt + nx + 2 * nt * nta`.
@@ -2472,12 +2890,58 @@ C_\mathrm{B}(t) + \int_x^L{\Delta\\alpha(x')\,\mathrm{d}x'}}
             Use `'ols'` for ordinary least squares and `'wls'` for weighted least
             squares. `'wls'` is the default, and there is currently no reason to
             use `'ols'`.
-        solver : {'sparse', 'stats'}
+        solver : {'sparse', 'direct', 'stats', 'block', 'chunked'}
             Either use the homemade weighted sparse solver or the weighted
             dense matrix solver of statsmodels. The sparse solver uses much less
             memory, is faster, and gives the same result as the statsmodels
             solver. The statsmodels solver is mostly used to check the sparse
-            solver. `'stats'` is the default.
+            solver. The `'block'` solver eliminates either the parameters of
+            each time step or the integrated differential attenuation of each
+            location from the normal equations, whichever leaves the smallest
+            system to solve. Recommended for long time series.
+            The `'chunked'` solver accumulates the normal equations per time
+            chunk, so that only a single chunk of the Stokes data is loaded in
+            memory at a time. Intended for archives opened with
+            `open_mf_datastore()`.
+            The `'direct'` solver factorizes the sparse normal equations
+            instead of iterating with LSQR, which is much faster for
+            mid-sized problems. It falls back to LSQR for large or (nearly)
+            singular problems.
+            `'sparse'` is the default.
+        matrix_free : bool
+            Pass the coefficient matrix to the `'sparse'` and `'block'`
+            solvers as a `DesignOperator`, which describes the coefficients
+            per time step and per location instead of storing all row and
+            column indices. Uses much less memory for long time series. Not
+            available in combination with fixed parameters.
+        plan : CalibrationPlan, optional
+            Cache shared by repeated calibrations of the same geometry. The
+            coefficient matrix is reused, the previous solution serves as
+            initial estimate, and the `'block'` solver reuses its
+            factorization if the weights and the reference temperatures did
+            not change. The weights depend on the measured intensities, so
+            new measurements require a new factorization. Only for the
+            `'sparse'` and `'block'` solvers, and not in combination with
+            fixed parameters.
+        time_chunks : int, optional
+            Number of time steps per chunk for the `'chunked'` solver.
+            Defaults to the dask chunks of the Stokes data.
+        precondition : {'columns', 'blocks', None}
+            Preconditioner of LSQR, used by the `'sparse'` solver.
+            `'columns'` scales the columns of the coefficient matrix to unit
+            norm and `'blocks'` also decorrelates the parameters of each time
+            step. Both reduce the number of iterations. Defaults to None,
+            which keeps poorly determined parameters close to their initial
+            estimate.
+        calc_cov : {True, 'blocks'}, optional
+            Form of the covariance matrix of the parameters that is stored
+            under `store_p_cov` if method is wls. If `'blocks'`, a
+            `BlockCovariance` is stored, which holds the factorization of the
+            normal equations instead of the dense (npar x npar) matrix. Uses
+            far less memory for long time series, and is accepted by the
+            `conf_int_*` methods, but cannot be written to netCDF. Not
+            available for the `'stats'` solver. Defaults to `'blocks'` for the
+            `'chunked'` solver and to True otherwise.
         transient_att_x, transient_asym_att_x : iterable, optional
             Depreciated. See trans_att
         trans_att : iterable, optional
@@ -2586,13 +3050,33 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 'Either define `matching_sections` or `matching_indices'
             matching_indices = match_sections(self, matching_sections)
 
+        # filled by the solver, and stored as attributes of p_val
+        diagnostics = dict()
+
+        if calc_cov is None:
+            calc_cov = 'blocks' if solver == 'chunked' else True
+
+        assert calc_cov is True or calc_cov == 'blocks', \
+            "Choose calc_cov from {True, 'blocks'}"
+        assert not (calc_cov == 'blocks' and solver == 'stats'), \
+            "The stats solver does not support calc_cov='blocks'"
+
         if method == 'ols' or method == 'wls':
             if method == 'ols':
                 calc_cov = False
-            else:
-                calc_cov = True
 
-            if fix_alpha or fix_gamma:
+            # With gamma and alpha fixed, D_fw, D_bw and the transient
+            # attenuation are solved in closed form from the intensities
+            time_local = bool(fix_alpha) and bool(fix_gamma) and \
+                not np.any(matching_indices) and \
+                solver in ['sparse', 'direct', 'block']
+
+            if (fix_alpha or fix_gamma) and not time_local:
+                assert not matrix_free and plan is None, \
+                    'Fixing parameters is not supported with `matrix_free` ' \
+                    'or `plan`'
+                assert solver != 'chunked', \
+                    'Fixing parameters is not supported by the chunked solver'
                 split = calibration_double_ended_solver(
                     self,
                     st_var,
@@ -2603,7 +3087,7 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                     solver='external_split',
                     matching_indices=matching_indices,
                     verbose=verbose)
-            else:
+            elif not (fix_alpha or fix_gamma):
                 out = calibration_double_ended_solver(
                     self,
                     st_var,
@@ -2613,7 +3097,12 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                     calc_cov=calc_cov,
                     solver=solver,
                     matching_indices=matching_indices,
-                    verbose=verbose)
+                    matrix_free=matrix_free,
+                    plan=plan,
+                    time_chunks=time_chunks,
+                    precondition=precondition,
+                    verbose=verbose,
+                    diagnostics=diagnostics)
 
                 if calc_cov:
                     p_val, p_var, p_cov = out
@@ -2646,7 +3135,20 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 assert np.abs(fix_alpha[0][ix_sec[0]]) < 1e-8, m
                 # The array with the integrated differential att is termed E
 
-                if np.any(matching_indices):
+                if time_local:
+                    assert not matrix_free and plan is None, \
+                        'Fixing parameters is not supported with ' \
+                        '`matrix_free` or `plan`'
+                    A, y, w, p0_est = time_local_system_double_ended(
+                        self,
+                        st_var,
+                        ast_var,
+                        rst_var,
+                        rast_var,
+                        fix_gamma,
+                        fix_alpha)
+
+                elif np.any(matching_indices):
                     n_E_in_cal = split['ix_from_cal_match_to_glob'].size
                     p0_est = np.concatenate(
                         (
@@ -2749,14 +3251,30 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                             split['p0_est'][1:1 + 2 * nt],
                             split['p0_est'][1 + 2 * nt + nx_sec - 1:]))
 
-                if solver == 'sparse':
-                    out = wls_sparse(
-                        X, y, w=w, x0=p0_est, calc_cov=calc_cov, verbose=False)
+                if solver in ['sparse', 'direct', 'block']:
+                    # Only D_fw, D_bw and the transient attenuation remain,
+                    # which are local to their time step and are solved in
+                    # closed form
+                    if not time_local:
+                        A = time_local_coefficients(X, nt)
+                        y = np.reshape(y, (-1, nt))
+                        w = np.reshape(w, (-1, nt)) if np.size(w) > 1 else w
+
+                    out = wls_time_local(
+                        A,
+                        y,
+                        w=w,
+                        x0=p0_est,
+                        calc_cov=calc_cov,
+                        diagnostics=diagnostics)
 
                 elif solver == 'stats':
                     out = wls_stats(
                         X, y, w=w, calc_cov=calc_cov, verbose=False)
 
+                else:
+                    raise ValueError('Choose a valid solver')
+
                 # Added fixed gamma and its variance to the solution
                 p_val = np.concatenate(
                     (
@@ -2767,16 +3285,20 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                         [fix_gamma[1]], out[1][:2 * nt], fix_alpha[1],
                         out[1][2 * nt:]))
 
-                if calc_cov:
+                from_i = np.concatenate(
+                    (
+                        np.arange(1, 2 * nt + 1),
+                        np.arange(
+                            1 + 2 * nt + nx,
+                            1 + 2 * nt + nx + nta * nt * 2)))
+
+                if calc_cov == 'blocks':
+                    p_cov = out[2].embed(from_i, p_var)
+
+                elif calc_cov:
                     # whether it returns a copy or a view depends on what
                     # version of numpy you are using
                     p_cov = np.diag(p_var).copy()
-                    from_i = np.concatenate(
-                        (
-                            np.arange(1, 2 * nt + 1),
-                            np.arange(
-                                1 + 2 * nt + nx,
-                                1 + 2 * nt + nx + nta * nt * 2)))
                     iox_sec1, iox_sec2 = np.meshgrid(
                         from_i, from_i, indexing='ij')
                     p_cov[iox_sec1, iox_sec2] = out[2]
@@ -2865,14 +3387,43 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                         w = 1.
                     p0_est = split['p0_est'][1:]
 
-                if solver == 'sparse':
+                p_groups = double_ended_block_groups(
+                    nt,
+                    p0_est.size - 2 * nt - 2 * nt * nta,
+                    nta,
+                    matching_indices=matching_indices)[1:]
+
+                if solver in ['sparse', 'direct']:
                     out = wls_sparse(
-                        X, y, w=w, x0=p0_est, calc_cov=calc_cov, verbose=False)
+                        X,
+                        y,
+                        w=w,
+                        x0=p0_est,
+                        calc_cov=calc_cov,
+                        verbose=False,
+                        groups=p_groups,
+                        precondition=precondition,
+                        backend='auto' if solver == 'direct' else 'lsqr',
+                        diagnostics=diagnostics)
+
+                elif solver == 'block':
+                    out = wls_block(
+                        X,
+                        y,
+                        w=w,
+                        groups=p_groups,
+                        x0=p0_est,
+                        calc_cov=calc_cov,
+                        verbose=False,
+                        diagnostics=diagnostics)
 
                 elif solver == 'stats':
                     out = wls_stats(
                         X, y, w=w, calc_cov=calc_cov, verbose=False)
 
+                else:
+                    raise ValueError('Choose a valid solver')
+
                 # put E outside of reference section in solution
                 # concatenating makes a copy of the data instead of using a
                 # pointer
@@ -2958,26 +3509,27 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                     p_var[1 + 2 * nt + split['ix_from_cal_match_to_glob']] = \
                         out[1][2 * nt:2 * nt + n_E_in_cal]
 
-                if calc_cov:
-                    p_cov = np.diag(p_var).copy()
+                if not np.any(matching_indices):
+                    from_i = np.concatenate(
+                        (
+                            np.arange(1, 2 * nt + 1), 2 * nt + 1 + ix_sec[1:],
+                            np.arange(
+                                1 + 2 * nt + nx,
+                                1 + 2 * nt + nx + nta * nt * 2)))
+                else:
+                    from_i = np.concatenate(
+                        (
+                            np.arange(1, 2 * nt + 1), 2 * nt + 1
+                            + split['ix_from_cal_match_to_glob'],
+                            np.arange(
+                                1 + 2 * nt + nx,
+                                1 + 2 * nt + nx + nta * nt * 2)))
 
-                    if not np.any(matching_indices):
-                        from_i = np.concatenate(
-                            (
-                                np.arange(1,
-                                          2 * nt + 1), 2 * nt + 1 + ix_sec[1:],
-                                np.arange(
-                                    1 + 2 * nt + nx,
-                                    1 + 2 * nt + nx + nta * nt * 2)))
-                    else:
-                        from_i = np.concatenate(
-                            (
-                                np.arange(1, 2 * nt + 1), 2 * nt + 1
-                                + split['ix_from_cal_match_to_glob'],
-                                np.arange(
-                                    1 + 2 * nt + nx,
-                                    1 + 2 * nt + nx + nta * nt * 2)))
+                if calc_cov == 'blocks':
+                    p_cov = out[2].embed(from_i, p_var)
 
+                elif calc_cov:
+                    p_cov = np.diag(p_var).copy()
                     iox_sec1, iox_sec2 = np.meshgrid(
                         from_i, from_i, indexing='ij')
                     p_cov[iox_sec1, iox_sec2] = out[2]
@@ -3086,30 +3638,58 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                     else:
                         w = 1.
 
-                if solver == 'sparse':
+                p_groups = double_ended_block_groups(
+                    nt, 0, nta, matching_indices=matching_indices)
+
+                if solver in ['sparse', 'direct']:
                     out = wls_sparse(
-                        X, y, w=w, x0=p0_est, calc_cov=calc_cov, verbose=False)
+                        X,
+                        y,
+                        w=w,
+                        x0=p0_est,
+                        calc_cov=calc_cov,
+                        verbose=False,
+                        groups=p_groups,
+                        precondition=precondition,
+                        backend='auto' if solver == 'direct' else 'lsqr',
+                        diagnostics=diagnostics)
+
+                elif solver == 'block':
+                    out = wls_block(
+                        X,
+                        y,
+                        w=w,
+                        groups=p_groups,
+                        x0=p0_est,
+                        calc_cov=calc_cov,
+                        verbose=False,
+                        diagnostics=diagnostics)
 
                 elif solver == 'stats':
                     out = wls_stats(
                         X, y, w=w, calc_cov=calc_cov, verbose=False)
 
+                else:
+                    raise ValueError('Choose a valid solver')
+
                 # Added fixed gamma and its variance to the solution
                 p_val = np.concatenate(
                     (out[0][:1 + 2 * nt], fix_alpha[0], out[0][1 + 2 * nt:]))
                 p_var = np.concatenate(
                     (out[1][:1 + 2 * nt], fix_alpha[1], out[1][1 + 2 * nt:]))
 
-                if calc_cov:
-                    p_cov = np.diag(p_var).copy()
+                from_i = np.concatenate(
+                    (
+                        np.arange(1 + 2 * nt),
+                        np.arange(
+                            1 + 2 * nt + nx,
+                            1 + 2 * nt + nx + nta * nt * 2)))
 
-                    from_i = np.concatenate(
-                        (
-                            np.arange(1 + 2 * nt),
-                            np.arange(
-                                1 + 2 * nt + nx,
-                                1 + 2 * nt + nx + nta * nt * 2)))
+                if calc_cov == 'blocks':
+                    p_cov = out[2].embed(from_i, p_var)
 
+                elif calc_cov:
+                    p_cov = np.diag(p_var).copy()
                     iox_sec1, iox_sec2 = np.meshgrid(
                         from_i, from_i, indexing='ij')
                     p_cov[iox_sec1, iox_sec2] = out[2]
@@ -3176,10 +3756,9 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
         if store_tmpf or (store_tmpw and method == 'ols'):
             ta_arr = np.zeros((nx, nt))
             if nta > 0:
-                for tai, taxi in zip(self[store_ta + '_fw'].values.T,
-                                     self.trans_att.values):
-                    ta_arr[self.x.values >= taxi] = \
-                        ta_arr[self.x.values >= taxi] + tai
+                ta_arr += TransientAttenuation(
+                    self.x.values,
+                    self.trans_att.values).fw(self[store_ta + '_fw'].values.T)
 
             tempF_data = gamma / (
                 np.log(self.st.data / self.ast.data) + d_fw + alpha[:, None]
@@ -3190,10 +3769,9 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
         if store_tmpb or (store_tmpw and method == 'ols'):
             ta_arr = np.zeros((nx, nt))
             if nta > 0:
-                for tai, taxi in zip(self[store_ta + '_bw'].values.T,
-                                     self.trans_att.values):
-                    ta_arr[self.x.values < taxi] = \
-                        ta_arr[self.x.values < taxi] + tai
+                ta_arr += TransientAttenuation(
+                    self.x.values,
+                    self.trans_att.values).bw(self[store_ta + '_bw'].values.T)
             tempB_data = gamma / (
                 np.log(self.rst.data / self.rast.data) + d_bw - alpha[:, None]
                 + ta_arr) - 273.15
@@ -3232,13 +3810,259 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 del self[k]
 
             self[store_p_val] = (('params1',), p_val)
+            self[store_p_val].attrs.update(diagnostics)
 
             if method == 'wls' or method == 'external':
                 assert store_p_cov, 'Might as well store the covariance matrix. Already computed.'
-                self[store_p_cov] = (('params1', 'params2'), p_cov)
+
+                if isinstance(p_cov, BlockCovariance):
+                    self[store_p_cov] = ((), object_array(p_cov))
+                else:
+                    self[store_p_cov] = (('params1', 'params2'), p_cov)
 
         pass
 
+    def parameter_sampler(
+            self,
+            p_val='p_val',
+            p_cov='p_cov',
+            uncorrelated=None,
+            method=None,
+            rank=None,
+            tol=None):
+        """
+        The `ParameterSampler` of `p_val` and `p_cov`, which factorizes the
+        covariance matrix once. The sampler is cached on the DataStore, and
+        is shared by the Monte Carlo routines, e.g.,
+        `conf_int_single_ended()` and `average_double_ended()`, that draw
+        from the same `p_val` and `p_cov`. The cache is keyed on the values
+        of `p_val`, `p_cov` and `uncorrelated`, so a new calibration yields
+        a new sampler.
+
+        Call this method with `method`, `rank` or `tol` to replace the cached
+        sampler, e.g., by a low-rank approximation with
+        `method='eigen', rank=50`, which is then used by the Monte Carlo
+        routines as well.
+
+        Parameters
+        ----------
+        p_val, p_cov : array-like, str, BlockCovariance
+            The parameters and their covariance, or the keys under which they
+            are stored.
+        uncorrelated : array-like of bool, optional
+            Parameters that are drawn independently from their variance
+        method : {'cholesky', 'eigen'}, optional
+            See `ParameterSampler`. The cached sampler if None, or the
+            Cholesky factor if there is none.
+        rank, tol : optional
+            See `ParameterSampler`
+
+        Returns
+        -------
+        ParameterSampler
+            None if `p_cov` is False.
+        """
+        if isinstance(p_val, str):
+            p_val = self[p_val].values
+
+        if isinstance(p_cov, str):
+            p_cov = from_object_array(self[p_cov].values)
+
+        if isinstance(p_cov, bool):
+            return None
+
+        key = ParameterSampler.key(p_val, p_cov, uncorrelated)
+        cache = self.__dict__.setdefault('_parameter_samplers', dict())
+        sampler = cache.get(key)
+
+        if sampler is None or method is not None and \
+                sampler.method_requested != (method, rank, tol):
+            # keep the samplers of the last few calibrations
+            while len(cache) >= 4:
+                cache.pop(next(iter(cache)))
+
+            sampler = ParameterSampler(
+                p_val,
+                p_cov,
+                uncorrelated=uncorrelated,
+                method=method or 'cholesky',
+                rank=rank,
+                tol=tol)
+            cache[key] = sampler
+
+        return sampler
+
+    def mc_memory_plan(
+            self,
+            p_val='p_val',
+            conf_ints=None,
+            mc_sample_size=100,
+            memory_limit=None,
+            mc_streaming=False,
+            mc_chunk_size=None,
+            reduce_memory_usage=False,
+            ix=None,
+            it=None,
+            double_ended=None):
+        """
+        The chunks of the Monte Carlo samples of `conf_int_single_ended()`,
+        `conf_int_double_ended()` and the averaging routines, and an
+        estimate of their peak memory, without drawing any samples. With a
+        `memory_limit`, the chunks are chosen such that the estimate stays
+        below it, as with the `memory_limit` argument of these routines.
+        Use it as a dry run before scheduling an uncertainty analysis. See
+        `dtscalibration.calibrate_utils.mc_memory_plan()`.
+
+        Parameters
+        ----------
+        p_val : array-like, str
+            The parameters, or the key under which they are stored
+        conf_ints, mc_sample_size, memory_limit, mc_streaming
+            See `conf_int_single_ended()`
+        mc_chunk_size, reduce_memory_usage
+            See `conf_int_single_ended()`
+        ix, it : array-like of int, optional
+            The indices of the locations and time steps for which samples are
+            drawn. All by default.
+        double_ended : bool, optional
+            Defaults to `is_double_ended`
+
+        Returns
+        -------
+        dtscalibration.calibrate_utils.MonteCarloMemoryPlan
+        """
+        no, nt = self.st.shape
+
+        if isinstance(p_val, str):
+            p_val = self[p_val].values
+
+        if 'trans_att' in self.keys():
+            nta = self.trans_att.size
+        else:
+            nta = 0
+
+        if double_ended is None:
+            double_ended = self.is_double_ended
+
+        if double_ended:
+            nfields, ntemperatures, nta_fields = 4, 3, 2 * bool(nta)
+        else:
+            nfields, ntemperatures, nta_fields = 2, 1, int(bool(nta))
+
+        return mc_memory_plan(
+            (mc_sample_size,
+             no if ix is None else np.size(ix),
+             nt if it is None else np.size(it)),
+            np.size(p_val),
+            nfields,
+            ntemperatures=ntemperatures,
+            nta_fields=nta_fields,
+            nconf_ints=len(conf_ints) if conf_ints else 0,
+            memory_limit=memory_limit,
+            mc_chunk_size=mc_chunk_size,
+            streaming=mc_streaming,
+            reduce_memory_usage=reduce_memory_usage)
+
+    def monte_carlo_single_ended(
+            self,
+            p_val='p_val',
+            p_cov='p_cov',
+            st_var=None,
+            ast_var=None,
+            mc_sample_size=100,
+            mc_chunk_size=100,
+            tile_size=10000,
+            ix=None,
+            it=None,
+            da_random_state=None,
+            mc_seed=None,
+            mc_sampling='random'):
+        """
+        Monte Carlo samples of the temperature of single-ended setups, which
+        are drawn per tile of (x, time) and per chunk of `mc_chunk_size`
+        samples instead of all at once. The parameters are drawn from
+        `p_val` and `p_cov`, and the Stokes and anti-Stokes intensities from
+        Normal distributions with the variances `st_var` and `ast_var`, as
+        in `conf_int_single_ended()`.
+
+        The samples are reduced by passing reducers to `run()` of the
+        returned object. Every pass over the samples regenerates the same
+        samples, see `MonteCarloStream`.
+
+        Parameters
+        ----------
+        p_val, p_cov, st_var, ast_var, mc_sample_size
+            See `conf_int_single_ended()`
+        mc_chunk_size : int
+            The number of samples that are drawn at once
+        tile_size : int
+            The number of (x, time) cells per tile
+        ix, it : array-like of int, optional
+            The indices of the locations and time steps for which samples are
+            drawn. All by default.
+        da_random_state : np.random.RandomState, da.random.RandomState
+            For testing purposes. Draws the seeds of the tiles and chunks,
+            and the parameters are drawn from numpy's global random state.
+        mc_seed : int, np.random.SeedSequence, optional
+            The seed of the `RandomStreams` from which all samples are drawn
+            if `da_random_state` is not given. The samples are then the same
+            as those of `conf_int_single_ended()` or
+            `conf_int_double_ended()` with the same seed.
+        mc_sampling : {'random', 'lhs', 'sobol'}
+            See `conf_int_single_ended()`
+
+        Returns
+        -------
+        MonteCarloStream
+        """
+        no, nt = self.st.shape
+
+        if 'trans_att' in self.keys():
+            nta = self.trans_att.size
+        else:
+            nta = 0
+
+        if isinstance(p_val, str):
+            p_val = self[p_val].values
+
+        if isinstance(p_cov, str):
+            p_cov = from_object_array(self[p_cov].values)
+
+        npar = np.size(p_val)
+
+        if npar == nt + 2 + nt * nta:
+            fixed_alpha = False
+        elif npar == 1 + no + nt + nt * nta:
+            fixed_alpha = True
+        else:
+            raise Exception('The size of `p_val` is not what I expected')
+
+        if da_random_state is None:
+            random_streams = RandomStreams(mc_seed)
+        else:
+            random_streams = None
+
+        p_mc = mc_parameter_samples(
+            p_val,
+            p_cov,
+            mc_sample_size,
+            random_streams=random_streams,
+            mc_chunk_size=mc_chunk_size,
+            sampler=self.parameter_sampler(p_val, p_cov)
+            if random_streams is not None else None,
+            sampling=mc_sampling)
+
+        return MonteCarloStream(
+            self,
+            p_mc, ['st', 'ast'], [st_var, ast_var],
+            partial(mc_temperature_single_ended, self, fixed_alpha=fixed_alpha),
+            ix=ix,
+            it=it,
+            mc_chunk_size=mc_chunk_size,
+            tile_size=tile_size,
+            random_state=random_streams or da_random_state,
+            sampling=mc_sampling)
+
     def conf_int_single_ended(
             self,
             p_val='p_val',
@@ -3252,6 +4076,18 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             da_random_state=None,
             remove_mc_set_flag=True,
             reduce_memory_usage=False,
+            method='mc',
+            mc_streaming=False,
+            mc_chunk_size=None,
+            mc_seed=None,
+            mc_samples=None,
+            mc_sampling='random',
+            mc_tol=None,
+            mc_x_sel=None,
+            mc_x_isel=None,
+            mc_time_sel=None,
+            mc_time_isel=None,
+            memory_limit=None,
             **kwargs):
         """
         Estimation of the confidence intervals for the temperatures measured
@@ -3283,7 +4119,7 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             If set to False, no uncertainty in the parameters is propagated
             into the confidence intervals. Similar to the spec sheets of the DTS
             manufacturers. And similar to passing an array filled with zeros
-        p_cov : array-like, optional
+        p_cov : array-like, BlockCovariance, optional
             The covariances of `p_val`.
         st_var, ast_var : float, callable, array-like, optional
             The variance of the measurement noise of the Stokes signals in the
@@ -3318,7 +4154,83 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             variance are calculated.
         reduce_memory_usage : bool
             Use less memory but at the expense of longer computation time
-
+        method : {'mc', 'analytic'}
+            `'mc'` uses the Monte Carlo approach described above. `'analytic'`
+            propagates the covariance of the parameters and the variance of
+            the Stokes and anti-Stokes intensities with a first-order
+            (delta-method) linearization of Equation 12 [1]_. The confidence
+            intervals then follow from the Normal distribution. It is a single
+            pass over the data, without the (mc, x, time) sets, and is
+            accurate as long as the uncertainty in the denominator of
+            Equation 12 is small. The results are stored under the same keys
+            as with `'mc'`.
+        mc_streaming : bool
+            Draw the Monte Carlo samples per tile of (x, time) and per chunk
+            of `mc_chunk_size` samples, and reduce them to their moments and
+            to histograms as soon as they are drawn, instead of storing the
+            (mc, x, time) sets. The peak memory is then independent of
+            `mc_sample_size`. The confidence intervals are interpolated from
+            the histograms, which requires a second pass over the samples.
+            See `monte_carlo_single_ended()`.
+        mc_chunk_size : int, optional
+            The number of samples that are drawn at once if `mc_streaming`,
+            100 by default. Otherwise, the size of the chunks of the mc
+            dimension of the dask arrays, which is a single chunk by default.
+            With multiple chunks, the confidence intervals are interpolated
+            from histograms per chunk that are summed over the chunks. See
+            `dtscalibration.calibrate_utils.mc_percentile()`.
+        mc_seed : int, np.random.SeedSequence, optional
+            The seed of the random streams from which the parameters and the
+            intensities are drawn if `da_random_state` is not given, see
+            `dtscalibration.calibrate_utils.RandomStreams`. Each sample is
+            drawn from its own stream, so the samples are bit-identical
+            regardless of `mc_chunk_size`, `mc_streaming`, the chunks of the
+            dask arrays, or the number of workers. By default, the seed is
+            drawn from numpy's global random state.
+        mc_samples : MonteCarloStream, optional
+            The samples of `monte_carlo_single_ended()`, which are reduced
+            instead of drawing new samples. Implies `mc_streaming`. The
+            size of the samples is that of the stream. Pass the same stream
+            to `conf_int_*()` and `average_*()` to reduce the same samples,
+            of which the parameters are drawn only once.
+        mc_sampling : {'random', 'lhs', 'sobol'}
+            'random': Pseudo-random samples.
+            'lhs': Latin hypercube samples of the parameters and of the
+            intensities. The `mc_sample_size` samples of each standard
+            normal variable are stratified, with a single sample per stratum
+            of equal probability.
+            'sobol': Scrambled Sobol' samples of the parameters, see
+            `scipy.stats.qmc.Sobol`, and Latin hypercube samples of the
+            intensities, whose noise has a dimension per (x, time), more
+            than a Sobol' sequence provides. `mc_sample_size` is preferably
+            a power of 2.
+            The confidence intervals of low-discrepancy samples converge
+            faster with `mc_sample_size` than those of pseudo-random
+            samples. Requires that `da_random_state` is not given. Not
+            used with `mc_samples`.
+        mc_tol : float, optional
+            Draw the samples in chunks of `mc_chunk_size` until the standard
+            errors of the standard deviation and of the confidence intervals
+            of the temperature of each tile of (x, time) are smaller than
+            `mc_tol` (in K), with at most `mc_sample_size` samples. The number
+            of samples per (x, time) is stored as `mc_sample_size`. Implies
+            `mc_streaming`. Requires `mc_sampling='random'`. See
+            `dtscalibration.calibrate_utils.MonteCarloStream.adapt()`.
+        mc_x_sel, mc_time_sel : slice, array-like, optional
+            Select the locations and time steps by label, for which the
+            samples of the intensities are drawn and the confidence
+            intervals are computed, so that the cost scales with the
+            selection. The results are NaN outside of the selection. The
+            parameters are drawn for all. Implies `mc_streaming`.
+        mc_x_isel, mc_time_isel : slice, array-like of int, optional
+            As `mc_x_sel` and `mc_time_sel`, by index
+        memory_limit : int, str, optional
+            E.g., 4e9 or '4GB'. The chunks of the Monte Carlo samples, or
+            the tiles and `mc_chunk_size` if `mc_streaming`, are chosen
+            such that the estimate of the peak memory stays below the limit,
+            instead of from `reduce_memory_usage`. A ValueError is raised if
+            the samples of the parameters alone exceed it. Use
+            `mc_memory_plan()` for a dry run. Not used with `mc_samples`.
 
         References
         ----------
@@ -3329,10 +4241,16 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
         """
         self.check_deprecated_kwargs(kwargs)
 
+        assert mc_sampling in ['random', 'lhs', 'sobol'], \
+            "Choose mc_sampling from {'random', 'lhs', 'sobol'}"
+
         if da_random_state:
+            assert mc_sampling == 'random', \
+                'Only pseudo-random samples are drawn with da_random_state'
             state = da_random_state
+            random_streams = None
         else:
-            state = da.random.RandomState()
+            random_streams = RandomStreams(mc_seed)
 
         time_dim = self.get_time_dim(data_var_key='st')
 
@@ -3356,18 +4274,113 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
         else:
             raise Exception('The size of `p_val` is not what I expected')
 
-        self.coords['mc'] = range(mc_sample_size)
-
-        if conf_ints:
-            self.coords['CI'] = conf_ints
+        assert method in ['mc', 'analytic'], \
+            "Choose method from {'mc', 'analytic'}"
 
         # WLS
         if isinstance(p_cov, str):
-            p_cov = self[p_cov].data
+            p_cov = from_object_array(self[p_cov].data)
         assert p_cov.shape == (npar, npar)
 
-        p_mc = sst.multivariate_normal.rvs(
-            mean=p_val, cov=p_cov, size=mc_sample_size)
+        if method == 'analytic':
+            if conf_ints:
+                self.coords['CI'] = conf_ints
+
+            tmpf, tmpf_var = temperature_variance_single_ended(
+                self,
+                p_val,
+                p_cov,
+                st_var,
+                ast_var,
+                fixed_alpha=fixed_alpha)
+            self[store_tmpf + '_mc' + store_tempvar] = (
+                ('x', time_dim), tmpf_var)
+
+            if conf_ints:
+                z = sst.norm.ppf(np.asarray(conf_ints) / 100)
+                self[store_tmpf + '_mc'] = (
+                    ('CI', 'x', time_dim),
+                    tmpf[None] + z[:, None, None] * tmpf_var[None]**0.5)
+            return
+
+        region = any(
+            i is not None
+            for i in [mc_x_sel, mc_x_isel, mc_time_sel, mc_time_isel])
+
+        if mc_streaming or mc_samples is not None or mc_tol is not None or \
+                region:
+            ix, it = region_indices(
+                self, time_dim, mc_x_sel, mc_x_isel, mc_time_sel,
+                mc_time_isel)
+
+            if conf_ints:
+                self.coords['CI'] = conf_ints
+
+            if mc_tol is not None and mc_chunk_size is None:
+                # the tolerance is checked after every chunk of samples
+                mc_chunk_size = 100
+
+            plan = self.mc_memory_plan(
+                p_val=p_val,
+                conf_ints=conf_ints,
+                mc_sample_size=mc_sample_size,
+                memory_limit=memory_limit,
+                mc_streaming=True,
+                mc_chunk_size=mc_chunk_size,
+                ix=ix,
+                it=it,
+                double_ended=False)
+
+            if mc_samples is None:
+                stream = self.monte_carlo_single_ended(
+                    p_val=p_val,
+                    p_cov=p_cov,
+                    st_var=st_var,
+                    ast_var=ast_var,
+                    mc_sample_size=mc_sample_size,
+                    mc_chunk_size=plan.mc_chunk_size,
+                    tile_size=plan.tile_size,
+                    ix=ix,
+                    it=it,
+                    da_random_state=da_random_state,
+                    mc_seed=mc_seed,
+                    mc_sampling=mc_sampling)
+            else:
+                assert mc_samples.ds is self, \
+                    'The samples are drawn for another DataStore'
+                stream = mc_samples.select(ix, it)
+
+            if mc_tol is not None:
+                sizes = stream.adapt(['tmpf'], mc_tol, conf_ints=conf_ints)
+                self['mc_sample_size'] = (
+                    ('x', time_dim), fill_region(sizes, ix, it, (no, nt), 0))
+
+            tmpf_var, tmpf_ci = mc_stream_conf_int(
+                stream, ['tmpf'], conf_ints=conf_ints)['tmpf']
+
+            self[store_tmpf + '_mc' + store_tempvar] = (
+                ('x', time_dim), fill_region(tmpf_var, ix, it, (no, nt)))
+
+            if conf_ints:
+                self[store_tmpf + '_mc'] = (
+                    ('CI', 'x', time_dim),
+                    fill_region(tmpf_ci, ix, it, (no, nt)))
+            return
+
+        self.coords['mc'] = range(mc_sample_size)
+
+        if conf_ints:
+            self.coords['CI'] = conf_ints
+
+        p_mc = mc_parameter_samples(
+            p_val,
+            p_cov,
+            mc_sample_size,
+            random_streams=random_streams,
+            mc_chunk_size=mc_chunk_size or 100,
+            sampler=self.parameter_sampler(p_val, p_cov)
+            if random_streams is not None else None,
+            sampling=mc_sampling)
 
         if fixed_alpha:
             self['alpha_mc'] = (('mc', 'x'), p_mc[:, 1:no + 1])
@@ -3384,18 +4397,14 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
 
         rsize = (self.mc.size, self.x.size, self.time.size)
 
-        if reduce_memory_usage:
-            memchunk = da.ones(
-                (mc_sample_size, no, nt), chunks={
-                    0: -1,
-                    1: 1,
-                    2: 'auto'}).chunks
-        else:
-            memchunk = da.ones(
-                (mc_sample_size, no, nt), chunks={
-                    0: -1,
-                    1: 'auto',
-                    2: 'auto'}).chunks
+        memchunk = self.mc_memory_plan(
+            p_val=p_val,
+            conf_ints=conf_ints,
+            mc_sample_size=mc_sample_size,
+            memory_limit=memory_limit,
+            mc_chunk_size=mc_chunk_size,
+            reduce_memory_usage=reduce_memory_usage,
+            double_ended=False).chunks
 
         # Draw from the normal distributions for the Stokes intensities
         for k, st_labeli, st_vari in zip(['r_st', 'r_ast'], ['st', 'ast'],
@@ -3433,21 +4442,29 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             else:
                 st_vari_da = da.from_array(st_vari, chunks=memchunk[1:])
 
-            self[k] = (
-                ('mc', 'x', time_dim),
-                state.normal(
+            if random_streams is None:
+                r = state.normal(
                     loc=loc,  # has chunks=memchunk[1:]
                     scale=st_vari_da**0.5,
                     size=rsize,
-                    chunks=memchunk))
+                    chunks=memchunk)
+            else:
+                r = loc + st_vari_da**0.5 * \
+                    random_streams.standard_normal_dask(
+                        st_labeli, rsize, memchunk,
+                        lhs=mc_sampling != 'random')
 
-        ta_arr = np.zeros((mc_sample_size, no, nt))
+            self[k] = (('mc', 'x', time_dim), r)
 
         if nta:
-            for ii, ta in enumerate(self['ta_mc']):
-                for tai, taxi in zip(ta.values, self.trans_att.values):
-                    ta_arr[ii, self.x.values >= taxi] = \
-                        ta_arr[ii, self.x.values >= taxi] + tai
+            ta = da.from_array(
+                self['ta_mc'].values, chunks=(memchunk[0], -1, memchunk[2]))
+            ta_arr = TransientAttenuation(
+                self.x.values, self.trans_att.values).fw(ta, axis=1)
+            ta_arr = ta_arr.rechunk(memchunk)
+        else:
+            ta_arr = da.zeros(
+                (mc_sample_size, no, nt), chunks=memchunk, dtype=float)
         self['ta_mc_arr'] = (('mc', 'x', time_dim), ta_arr)
 
         if fixed_alpha:
@@ -3472,16 +4489,9 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 dim=avg_dims, ddof=1)
 
         if conf_ints:
-            new_chunks = (
-                (len(conf_ints),),) + self[store_tmpf + '_mc_set'].chunks[1:]
-
             qq = self[store_tmpf + '_mc_set']
 
-            q = qq.data.map_blocks(
-                lambda x: np.percentile(x, q=conf_ints, axis=avg_axis),
-                chunks=new_chunks,  #
-                drop_axis=avg_axis,  # avg dimesnions are dropped from input arr
-                new_axis=0)  # The new CI dimension is added as first axis
+            q = mc_percentile(qq.data, conf_ints, axis=avg_axis)
 
             self[store_tmpf + '_mc'] = (('CI', 'x', time_dim), q)
 
@@ -3517,6 +4527,13 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             da_random_state=None,
             remove_mc_set_flag=True,
             reduce_memory_usage=False,
+            mc_streaming=False,
+            mc_chunk_size=None,
+            mc_seed=None,
+            mc_samples=None,
+            mc_sampling='random',
+            mc_tol=None,
+            memory_limit=None,
             **kwargs):
         """
         Average temperatures from single-ended setups.
@@ -3649,6 +4666,45 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             variance are calculated.
         reduce_memory_usage : bool
             Use less memory but at the expense of longer computation time
+        mc_streaming : bool
+            Draw the Monte Carlo samples per tile of (x, time) and per chunk
+            of `mc_chunk_size` samples, and reduce them to their moments and
+            to histograms as soon as they are drawn, instead of storing the
+            (mc, x, time) sets. The peak memory is then independent of
+            `mc_sample_size`. The confidence intervals are interpolated from
+            the histograms, which requires a second pass over the samples.
+            The inverse-variance weighted averages (flag 2) are reduced from
+            their sets of (mc, time) or (mc, x), which are not stored.
+            See `monte_carlo_single_ended()`.
+        mc_chunk_size : int, optional
+            The number of samples that are drawn at once if `mc_streaming`,
+            100 by default. Otherwise, the size of the chunks of the mc
+            dimension of the dask arrays, which is a single chunk by default.
+            With multiple chunks, the confidence intervals are interpolated
+            from histograms per chunk that are summed over the chunks. See
+            `dtscalibration.calibrate_utils.mc_percentile()`.
+        mc_seed : int, np.random.SeedSequence, optional
+            The seed of the random streams from which the parameters and the
+            intensities are drawn if `da_random_state` is not given, see
+            `dtscalibration.calibrate_utils.RandomStreams`. Each sample is
+            drawn from its own stream, so the samples are bit-identical
+            regardless of `mc_chunk_size`, `mc_streaming`, the chunks of the
+            dask arrays, or the number of workers. By default, the seed is
+            drawn from numpy's global random state.
+        mc_samples : MonteCarloStream, optional
+            The samples of `monte_carlo_single_ended()`, which are reduced
+            instead of drawing new samples. Implies `mc_streaming`. The
+            size of the samples is that of the stream. Pass the same stream
+            to `conf_int_*()` and `average_*()` to reduce the same samples,
+            of which the parameters are drawn only once.
+        mc_sampling : {'random', 'lhs', 'sobol'}
+            See `conf_int_single_ended()`
+        mc_tol : float, optional
+            As in `conf_int_single_ended()`, but all (x, time) have
+            the same number of samples, as required for the averages.
+            Requires that `da_random_state` is not given.
+        memory_limit : int, str, optional
+            See `conf_int_single_ended()`
 
         Returns
         -------
@@ -3659,6 +4715,119 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
         if var_only_sections is not None:
             raise NotImplementedError()
 
+        if mc_streaming or mc_samples is not None or mc_tol is not None:
+            time_dim = self.get_time_dim(data_var_key='st')
+            ix, it, x_dim2, time_dim2 = average_selection_indices(
+                self, time_dim, ci_avg_time_sel, ci_avg_time_isel,
+                ci_avg_x_sel, ci_avg_x_isel)
+
+            if mc_tol is not None and mc_chunk_size is None:
+                # the tolerance is checked after every chunk of samples
+                mc_chunk_size = 100
+
+            plan = self.mc_memory_plan(
+                p_val=p_val,
+                conf_ints=conf_ints,
+                mc_sample_size=mc_sample_size,
+                memory_limit=memory_limit,
+                mc_streaming=True,
+                mc_chunk_size=mc_chunk_size,
+                ix=ix,
+                it=it,
+                double_ended=False)
+
+            # a single draw for the samples per cell and the averages, of
+            # the selection only
+            if mc_samples is not None:
+                mc_samples = mc_samples.select(ix, it)
+            elif da_random_state is None:
+                mc_samples = self.monte_carlo_single_ended(
+                    p_val=p_val,
+                    p_cov=p_cov,
+                    st_var=st_var,
+                    ast_var=ast_var,
+                    mc_sample_size=mc_sample_size,
+                    mc_chunk_size=plan.mc_chunk_size,
+                    tile_size=plan.tile_size,
+                    ix=ix,
+                    it=it,
+                    mc_seed=mc_seed,
+                    mc_sampling=mc_sampling)
+
+            if mc_tol is not None:
+                assert mc_samples is not None, \
+                    'mc_tol requires that da_random_state is not given'
+                sample_sizes = mc_samples.adapt(
+                    ['tmpf'], mc_tol, conf_ints=conf_ints, per_tile=False)
+
+            self.conf_int_single_ended(
+                p_val=p_val,
+                p_cov=p_cov,
+                st_var=st_var,
+                ast_var=ast_var,
+                store_tmpf=store_tmpf,
+                store_tempvar=store_tempvar,
+                conf_ints=None,
+                mc_sample_size=mc_sample_size,
+                da_random_state=da_random_state,
+                mc_seed=mc_seed,
+                mc_sampling=mc_sampling,
+                mc_streaming=True,
+                mc_chunk_size=mc_chunk_size,
+                memory_limit=memory_limit,
+                mc_samples=mc_samples,
+                mc_x_isel=ix,
+                mc_time_isel=it,
+                **kwargs)
+
+            if mc_tol is not None:
+                self['mc_sample_size'] = (
+                    ('x', time_dim),
+                    fill_region(sample_sizes, ix, it, self.st.shape, 0))
+
+            if conf_ints:
+                self.coords['CI'] = conf_ints
+
+            if mc_samples is None:
+                stream = self.monte_carlo_single_ended(
+                    p_val=p_val,
+                    p_cov=p_cov,
+                    st_var=st_var,
+                    ast_var=ast_var,
+                    mc_sample_size=mc_sample_size,
+                    mc_chunk_size=plan.mc_chunk_size,
+                    tile_size=plan.tile_size,
+                    ix=ix,
+                    it=it,
+                    da_random_state=da_random_state)
+            else:
+                stream = mc_samples
+
+            # axis 0 averages over x and axis 1 over time
+            flag1_axes = [
+                axis for axis, flag in zip(
+                    [0, 1], [ci_avg_x_flag1, ci_avg_time_flag1]) if flag]
+            flag2_axes = [
+                axis for axis, flag in zip(
+                    [0, 1], [ci_avg_x_flag2, ci_avg_time_flag2]) if flag]
+            center = self[store_tmpf].values[np.ix_(ix, it)]
+            out = mc_stream_average(
+                stream, ['tmpf'], {'tmpf': center},
+                conf_ints=conf_ints,
+                flag1_axes=flag1_axes,
+                flag2_axes=flag2_axes)
+            store_mc_average(
+                self, store_tmpf, out['tmpf'], center, x_dim2, time_dim2,
+                store_tempvar)
+
+            if remove_mc_set_flag:
+                for k in [store_tmpf + '_avgsec',
+                          store_tmpf + '_mc_avgsec' + store_tempvar, 'x_avg',
+                          'time_avg']:
+                    if k in self:
+                        del self[k]
+            return
+
         self.conf_int_single_ended(
             p_val=p_val,
             p_cov=p_cov,
@@ -3669,8 +4838,12 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             conf_ints=None,
             mc_sample_size=mc_sample_size,
             da_random_state=da_random_state,
+            mc_seed=mc_seed,
+            mc_sampling=mc_sampling,
             remove_mc_set_flag=False,
             reduce_memory_usage=reduce_memory_usage,
+            mc_chunk_size=mc_chunk_size,
+            memory_limit=memory_limit,
             **kwargs)
 
         time_dim = self.get_time_dim(data_var_key='st')
@@ -3750,16 +4923,11 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             self[store_tmpf + '_mc_avgx1' + store_tempvar] = qvar
 
             if conf_ints:
-                new_chunks = (
-                    len(conf_ints), self[store_tmpf + '_mc_set'].chunks[2])
                 avg_axis = self[store_tmpf + '_mc_set'].get_axis_num(
                     ['mc', x_dim2])
-                q = self[store_tmpf + '_mc_set'].data.map_blocks(
-                    lambda x: np.percentile(x, q=conf_ints, axis=avg_axis),
-                    chunks=new_chunks,  #
-                    drop_axis=avg_axis,
-                    # avg dimensions are dropped from input arr
-                    new_axis=0)  # The new CI dim is added as firsaxis
+                q = mc_percentile(
+                    self[store_tmpf + '_mc_set'].data, conf_ints,
+                    axis=avg_axis)
 
                 self[store_tmpf + '_mc_avgx1'] = (('CI', time_dim2), q)
 
@@ -3781,19 +4949,11 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                                     + '_mc_avgx2_set'].mean(dim='mc')
 
             if conf_ints:
-                new_chunks = (
-                    len(conf_ints), self[store_tmpf + '_mc_set'].chunks[2])
                 avg_axis_avgx = self[store_tmpf + '_mc_set'].get_axis_num('mc')
 
-                qq = self[store_tmpf + '_mc_avgx2_set'].data.map_blocks(
-                    lambda x: np.percentile(
-                        x, q=conf_ints, axis=avg_axis_avgx),
-                    chunks=new_chunks,  #
-                    drop_axis=avg_axis_avgx,
-                    # avg dimensions are dropped from input arr
-                    new_axis=0,
-                    dtype=float)  # The new CI dimension is added as
-                # firsaxis
+                qq = mc_percentile(
+                    self[store_tmpf + '_mc_avgx2_set'].data, conf_ints,
+                    axis=avg_axis_avgx)
                 self[store_tmpf + '_mc_avgx2'] = (('CI', time_dim2), qq)
 
         if ci_avg_time_flag1 is not None:
@@ -3806,16 +4966,11 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             self[store_tmpf + '_mc_avg1' + store_tempvar] = qvar
 
             if conf_ints:
-                new_chunks = (
-                    len(conf_ints), self[store_tmpf + '_mc_set'].chunks[1])
                 avg_axis = self[store_tmpf + '_mc_set'].get_axis_num(
                     ['mc', time_dim2])
-                q = self[store_tmpf + '_mc_set'].data.map_blocks(
-                    lambda x: np.percentile(x, q=conf_ints, axis=avg_axis),
-                    chunks=new_chunks,  #
-                    drop_axis=avg_axis,
-                    # avg dimensions are dropped from input arr
-                    new_axis=0)  # The new CI dim is added as firsaxis
+                q = mc_percentile(
+                    self[store_tmpf + '_mc_set'].data, conf_ints,
+                    axis=avg_axis)
 
                 self[store_tmpf + '_mc_avg1'] = (('CI', x_dim2), q)
 
@@ -3836,19 +4991,11 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                                               + '_mc_avg2_set'].mean(dim='mc')
 
             if conf_ints:
-                new_chunks = (
-                    len(conf_ints), self[store_tmpf + '_mc_set'].chunks[1])
                 avg_axis_avg2 = self[store_tmpf + '_mc_set'].get_axis_num('mc')
 
-                qq = self[store_tmpf + '_mc_avg2_set'].data.map_blocks(
-                    lambda x: np.percentile(
-                        x, q=conf_ints, axis=avg_axis_avg2),
-                    chunks=new_chunks,  #
-                    drop_axis=avg_axis_avg2,
-                    # avg dimensions are dropped from input arr
-                    new_axis=0,
-                    dtype=float)  # The new CI dimension is added as
-                # firsaxis
+                qq = mc_percentile(
+                    self[store_tmpf + '_mc_avg2_set'].data, conf_ints,
+                    axis=avg_axis_avg2)
                 self[store_tmpf + '_mc_avg2'] = (('CI', x_dim2), qq)
         # Clean up the garbage. All arrays with a Monte Carlo dimension.
         if remove_mc_set_flag:
@@ -3866,6 +5013,120 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                     del self[k]
         pass
 
+    def monte_carlo_double_ended(
+            self,
+            p_val='p_val',
+            p_cov='p_cov',
+            st_var=None,
+            ast_var=None,
+            rst_var=None,
+            rast_var=None,
+            store_ta=None,
+            mc_sample_size=100,
+            mc_chunk_size=100,
+            tile_size=10000,
+            ix=None,
+            it=None,
+            da_random_state=None,
+            mc_seed=None,
+            mc_sampling='random'):
+        """
+        Monte Carlo samples of the forward and backward temperatures of
+        double-ended setups, which are drawn per tile of (x, time) and per
+        chunk of `mc_chunk_size` samples instead of all at once. The
+        parameters are drawn from `p_val` and `p_cov`, and the Stokes and
+        anti-Stokes intensities from Normal distributions with the variances
+        `st_var`, `ast_var`, `rst_var` and `rast_var`, as in
+        `conf_int_double_ended()`. The integrated differential attenuation
+        outside of the reference sections is drawn independently of the other
+        parameters.
+
+        The samples are reduced by passing reducers to `run()` of the
+        returned object. Every pass over the samples regenerates the same
+        samples, see `MonteCarloStream`.
+
+        Parameters
+        ----------
+        p_val, p_cov, st_var, ast_var, rst_var, rast_var, store_ta
+            See `conf_int_double_ended()`
+        mc_sample_size : int
+        mc_chunk_size : int
+            The number of samples that are drawn at once
+        tile_size : int
+            The number of (x, time) cells per tile
+        ix, it : array-like of int, optional
+            The indices of the locations and time steps for which samples are
+            drawn. All by default.
+        da_random_state : np.random.RandomState, da.random.RandomState
+            For testing purposes. Draws the seeds of the tiles and chunks,
+            and the parameters are drawn from numpy's global random state.
+        mc_seed : int, np.random.SeedSequence, optional
+            The seed of the `RandomStreams` from which all samples are drawn
+            if `da_random_state` is not given. The samples are then the same
+            as those of `conf_int_single_ended()` or
+            `conf_int_double_ended()` with the same seed.
+        mc_sampling : {'random', 'lhs', 'sobol'}
+            See `conf_int_single_ended()`
+
+        Returns
+        -------
+        MonteCarloStream
+        """
+        time_dim = self.get_time_dim(data_var_key='st')
+        no, nt = self.st.shape
+        npar = 1 + 2 * nt + no
+
+        if store_ta:
+            ta_dim = [
+                i for i in self[store_ta + '_fw'].dims if i != time_dim][0]
+            trans_att = self[ta_dim].values
+            npar += nt * 2 * trans_att.size
+        else:
+            trans_att = None
+
+        if isinstance(p_val, str):
+            p_val = self[p_val].values
+
+        if isinstance(p_cov, str):
+            p_cov = from_object_array(self[p_cov].values)
+
+        assert np.size(p_val) == npar, "Did you set `store_ta='talpha'` as " \
+                                       "keyword argument?"
+
+        ix_sec = self.ufunc_per_section(x_indices=True, calc_per='all')
+        uncorrelated = np.zeros(npar, dtype=bool)
+        uncorrelated[1 + 2 * nt:1 + 2 * nt + no] = True
+        uncorrelated[1 + 2 * nt + ix_sec] = False
+
+        if da_random_state is None:
+            random_streams = RandomStreams(mc_seed)
+        else:
+            random_streams = None
+
+        p_mc = mc_parameter_samples(
+            p_val,
+            p_cov,
+            mc_sample_size,
+            uncorrelated=uncorrelated,
+            random_streams=random_streams,
+            mc_chunk_size=mc_chunk_size,
+            sampler=self.parameter_sampler(
+                p_val, p_cov, uncorrelated=uncorrelated)
+            if random_streams is not None else None,
+            sampling=mc_sampling)
+
+        return MonteCarloStream(
+            self,
+            p_mc, ['st', 'ast', 'rst', 'rast'],
+            [st_var, ast_var, rst_var, rast_var],
+            partial(mc_temperature_double_ended, self, trans_att=trans_att),
+            ix=ix,
+            it=it,
+            mc_chunk_size=mc_chunk_size,
+            tile_size=tile_size,
+            random_state=random_streams or da_random_state,
+            sampling=mc_sampling)
+
     def conf_int_double_ended(
             self,
             p_val='p_val',
@@ -3885,6 +5146,18 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             da_random_state=None,
             remove_mc_set_flag=True,
             reduce_memory_usage=False,
+            method='mc',
+            mc_streaming=False,
+            mc_chunk_size=None,
+            mc_seed=None,
+            mc_samples=None,
+            mc_sampling='random',
+            mc_tol=None,
+            mc_x_sel=None,
+            mc_x_isel=None,
+            mc_time_sel=None,
+            mc_time_isel=None,
+            memory_limit=None,
             **kwargs):
         """
         Estimation of the confidence intervals for the temperatures measured
@@ -3958,7 +5231,7 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             :math:`D_\mathrm{B}`, then for each location :math:`D_\mathrm{B}`,
             then for each connector that introduces directional attenuation two
             parameters per time step.
-        p_cov : array-like, optional
+        p_cov : array-like, BlockCovariance, optional
             The covariances of `p_val`. Square matrix.
             If set to False, no uncertainty in the parameters is propagated
             into the confidence intervals. Similar to the spec sheets of the DTS
@@ -4019,6 +5292,80 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             variance are calculated.
         reduce_memory_usage : bool
             Use less memory but at the expense of longer computation time
+        method : {'mc', 'analytic'}
+            `'mc'` uses the Monte Carlo approach described above. `'analytic'`
+            propagates the covariance of the parameters and the variance of
+            the Stokes and anti-Stokes intensities with a first-order
+            (delta-method) linearization of Equations 16 and 17 [1]_. Besides
+            the variances of :math:`T_\mathrm{F}` and :math:`T_\mathrm{B}`,
+            it computes their covariance, as they share :math:`\gamma` and
+            :math:`A`, which is stored as `store_tmpf + '_' + store_tmpb +
+            '_mc_cov'`. The variance of the weighted average accounts for
+            this covariance. The confidence intervals follow from the Normal
+            distribution. The memory usage is proportional to (x, time), and
+            the results are stored under the same keys as with `'mc'`.
+        mc_streaming : bool
+            Draw the Monte Carlo samples per tile of (x, time) and per chunk
+            of `mc_chunk_size` samples, and reduce them to their moments and
+            to histograms as soon as they are drawn, instead of storing the
+            (mc, x, time) sets. The peak memory is then independent of
+            `mc_sample_size`. The confidence intervals are interpolated from
+            the histograms, which requires a second pass over the samples.
+            See `monte_carlo_double_ended()`.
+        mc_chunk_size : int, optional
+            The number of samples that are drawn at once if `mc_streaming`,
+            100 by default. Otherwise, the size of the chunks of the mc
+            dimension of the dask arrays, which is a single chunk by default.
+            With multiple chunks, the confidence intervals are interpolated
+            from histograms per chunk that are summed over the chunks. See
+            `dtscalibration.calibrate_utils.mc_percentile()`.
+        mc_seed : int, np.random.SeedSequence, optional
+            The seed of the random streams from which the parameters and the
+            intensities are drawn if `da_random_state` is not given, see
+            `dtscalibration.calibrate_utils.RandomStreams`. Each sample is
+            drawn from its own stream, so the samples are bit-identical
+            regardless of `mc_chunk_size`, `mc_streaming`, the chunks of the
+            dask arrays, or the number of workers. By default, the seed is
+            drawn from numpy's global random state.
+        mc_samples : MonteCarloStream, optional
+            The samples of `monte_carlo_double_ended()`, which are reduced
+            instead of drawing new samples. Implies `mc_streaming`. The
+            size of the samples is that of the stream. Pass the same stream
+            to `conf_int_*()` and `average_*()` to reduce the same samples,
+            of which the parameters are drawn only once.
+        mc_sampling : {'random', 'lhs', 'sobol'}
+            'random': Pseudo-random samples.
+            'lhs': Latin hypercube samples of the parameters and of the
+            intensities. The `mc_sample_size` samples of each standard
+            normal variable are stratified, with a single sample per stratum
+            of equal probability.
+            'sobol': Scrambled Sobol' samples of the parameters, see
+            `scipy.stats.qmc.Sobol`, and Latin hypercube samples of the
+            intensities, whose noise has a dimension per (x, time), more
+            than a Sobol' sequence provides. `mc_sample_size` is preferably
+            a power of 2.
+            The confidence intervals of low-discrepancy samples converge
+            faster with `mc_sample_size` than those of pseudo-random
+            samples. Requires that `da_random_state` is not given. Not
+            used with `mc_samples`.
+        mc_tol : float, optional
+            Draw the samples in chunks of `mc_chunk_size` until the standard
+            errors of the standard deviation and of the confidence intervals
+            of the temperature of each tile of (x, time) are smaller than
+            `mc_tol` (in K), with at most `mc_sample_size` samples. The number
+            of samples per (x, time) is stored as `mc_sample_size`. Implies
+            `mc_streaming`. Requires `mc_sampling='random'`. See
+            `dtscalibration.calibrate_utils.MonteCarloStream.adapt()`.
+        mc_x_sel, mc_time_sel : slice, array-like, optional
+            Select the locations and time steps by label, for which the
+            samples of the intensities are drawn and the confidence
+            intervals are computed, so that the cost scales with the
+            selection. The results are NaN outside of the selection. The
+            parameters are drawn for all. Implies `mc_streaming`.
+        mc_x_isel, mc_time_isel : slice, array-like of int, optional
+            As `mc_x_sel` and `mc_time_sel`, by index
+        memory_limit : int, str, optional
+            See `conf_int_single_ended()`
 
         Returns
         -------
@@ -4031,43 +5378,20 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             https://doi.org/10.3390/s20082235
 
         """
-        def create_da_ta2(no, i_splice, direction='fw', chunks=None):
-            """create mask array mc, o, nt"""
-
-            if direction == 'fw':
-                arr = da.concatenate(
-                    (
-                        da.zeros(
-                            (1, i_splice, 1),
-                            chunks=((1, i_splice, 1)),
-                            dtype=bool),
-                        da.ones(
-                            (1, no - i_splice, 1),
-                            chunks=(1, no - i_splice, 1),
-                            dtype=bool)),
-                    axis=1).rechunk((1, chunks[1], 1))
-            else:
-                arr = da.concatenate(
-                    (
-                        da.ones(
-                            (1, i_splice, 1),
-                            chunks=(1, i_splice, 1),
-                            dtype=bool),
-                        da.zeros(
-                            (1, no - i_splice, 1),
-                            chunks=((1, no - i_splice, 1)),
-                            dtype=bool)),
-                    axis=1).rechunk((1, chunks[1], 1))
-            return arr
-
         self.check_deprecated_kwargs(kwargs)
 
+        assert mc_sampling in ['random', 'lhs', 'sobol'], \
+            "Choose mc_sampling from {'random', 'lhs', 'sobol'}"
+
         if da_random_state:
             # In testing environments
             assert isinstance(da_random_state, da.random.RandomState)
+            assert mc_sampling == 'random', \
+                'Only pseudo-random samples are drawn with da_random_state'
             state = da_random_state
+            random_streams = None
         else:
-            state = da.random.RandomState()
+            random_streams = RandomStreams(mc_seed)
 
         time_dim = self.get_time_dim(data_var_key='st')
 
@@ -4101,23 +5425,6 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
 
         rsize = (mc_sample_size, no, nt)
 
-        if reduce_memory_usage:
-            memchunk = da.ones(
-                (mc_sample_size, no, nt), chunks={
-                    0: -1,
-                    1: 1,
-                    2: 'auto'}).chunks
-        else:
-            memchunk = da.ones(
-                (mc_sample_size, no, nt), chunks={
-                    0: -1,
-                    1: 'auto',
-                    2: 'auto'}).chunks
-
-        self.coords['mc'] = range(mc_sample_size)
-        if conf_ints:
-            self.coords['CI'] = conf_ints
-
         assert isinstance(p_val, (str, np.ndarray, np.generic))
         if isinstance(p_val, str):
             p_val = self[p_val].values
@@ -4125,7 +5432,191 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                                        "keyword argument of the " \
                                        "conf_int_double_ended() function?"
 
-        assert isinstance(p_cov, (str, np.ndarray, np.generic, bool))
+        assert isinstance(
+            p_cov, (str, np.ndarray, np.generic, bool, BlockCovariance))
+        assert method in ['mc', 'analytic'], \
+            "Choose method from {'mc', 'analytic'}"
+
+        if conf_ints:
+            self.coords['CI'] = conf_ints
+
+        if method == 'analytic':
+            if isinstance(p_cov, str):
+                p_cov = from_object_array(self[p_cov].values)
+
+            ix_sec = self.ufunc_per_section(x_indices=True, calc_per='all')
+            tmpf, tmpb, tmpf_var, tmpb_var, tmpfb_cov = \
+                temperature_variance_double_ended(
+                    self,
+                    p_val,
+                    p_cov,
+                    st_var,
+                    ast_var,
+                    rst_var,
+                    rast_var,
+                    trans_att=self[ta_dim].values if store_ta else None,
+                    ix_sec=ix_sec)
+
+            if var_only_sections:
+                # sets the values outside the reference sections to NaN
+                x_mask = np.isin(np.arange(no), ix_sec)[:, None]
+                tmpf_var = np.where(x_mask, tmpf_var, np.nan)
+                tmpb_var = np.where(x_mask, tmpb_var, np.nan)
+                tmpfb_cov = np.where(x_mask, tmpfb_cov, np.nan)
+
+            # Weighted mean of the forward and backward
+            tmpw_var = 1 / (1 / tmpf_var + 1 / tmpb_var)
+            w_f = tmpw_var / tmpf_var
+            w_b = tmpw_var / tmpb_var
+            tmpw = w_f * tmpf + w_b * tmpb
+
+            # accounts for the covariance of tmpf and tmpb
+            tmpw_var = w_f**2 * tmpf_var + w_b**2 * tmpb_var + \
+                2 * w_f * w_b * tmpfb_cov
+
+            self[store_tmpf + '_mc' + store_tempvar] = (
+                ('x', time_dim), tmpf_var)
+            self[store_tmpb + '_mc' + store_tempvar] = (
+                ('x', time_dim), tmpb_var)
+            self[store_tmpf + '_' + store_tmpb + '_mc_cov'] = (
+                ('x', time_dim), tmpfb_cov)
+            self[store_tmpw] = (('x', time_dim), tmpw)
+            self[store_tmpw + '_mc' + store_tempvar] = (
+                ('x', time_dim), tmpw_var)
+
+            if conf_ints:
+                z = sst.norm.ppf(np.asarray(conf_ints) / 100)[:, None, None]
+
+                for label, tmp, var, del_label in zip(
+                        [store_tmpf, store_tmpb, store_tmpw],
+                        [tmpf, tmpb, tmpw],
+                        [tmpf_var, tmpb_var, tmpw_var],
+                        [del_tmpf_after, del_tmpb_after, False]):
+                    if not del_label:
+                        self[label + '_mc'] = (
+                            ('CI', 'x', time_dim), tmp[None] + z * var[None]**0.5)
+
+            if del_tmpf_after:
+                del self['tmpf']
+            if del_tmpb_after:
+                del self['tmpb']
+            return
+
+        region = any(
+            i is not None
+            for i in [mc_x_sel, mc_x_isel, mc_time_sel, mc_time_isel])
+
+        if mc_streaming or mc_samples is not None or mc_tol is not None or \
+                region:
+            ix, it = region_indices(
+                self, time_dim, mc_x_sel, mc_x_isel, mc_time_sel,
+                mc_time_isel)
+
+            if mc_tol is not None and mc_chunk_size is None:
+                # the tolerance is checked after every chunk of samples
+                mc_chunk_size = 100
+
+            plan = self.mc_memory_plan(
+                p_val=p_val,
+                conf_ints=conf_ints,
+                mc_sample_size=mc_sample_size,
+                memory_limit=memory_limit,
+                mc_streaming=True,
+                mc_chunk_size=mc_chunk_size,
+                ix=ix,
+                it=it,
+                double_ended=True)
+
+            if mc_samples is None:
+                stream = self.monte_carlo_double_ended(
+                    p_val=p_val,
+                    p_cov=p_cov,
+                    st_var=st_var,
+                    ast_var=ast_var,
+                    rst_var=rst_var,
+                    rast_var=rast_var,
+                    store_ta=store_ta,
+                    mc_sample_size=mc_sample_size,
+                    mc_chunk_size=plan.mc_chunk_size,
+                    tile_size=plan.tile_size,
+                    ix=ix,
+                    it=it,
+                    da_random_state=da_random_state,
+                    mc_seed=mc_seed,
+                    mc_sampling=mc_sampling)
+            else:
+                assert mc_samples.ds is self, \
+                    'The samples are drawn for another DataStore'
+                stream = mc_samples.select(ix, it)
+
+            if mc_tol is not None:
+                sizes = stream.adapt(
+                    ['tmpf', 'tmpb'], mc_tol, conf_ints=conf_ints)
+                self['mc_sample_size'] = (
+                    ('x', time_dim), fill_region(sizes, ix, it, (no, nt), 0))
+
+            if var_only_sections:
+                x_mask = np.isin(
+                    ix, self.ufunc_per_section(x_indices=True, calc_per='all'))
+            else:
+                x_mask = None
+
+            out = mc_stream_conf_int(
+                stream, ['tmpf', 'tmpb'],
+                conf_ints=conf_ints,
+                weighted=True,
+                x_mask=x_mask)
+
+            for label, key, del_label in zip(
+                    [store_tmpf, store_tmpb, store_tmpw],
+                    ['tmpf', 'tmpb', 'tmpw'],
+                    [del_tmpf_after, del_tmpb_after, False]):
+                self[label + '_mc' + store_tempvar] = (
+                    ('x', time_dim),
+                    fill_region(out[key][0], ix, it, (no, nt)))
+
+                if conf_ints and not del_label:
+                    self[label + '_mc'] = (
+                        ('CI', 'x', time_dim),
+                        fill_region(out[key][1], ix, it, (no, nt)))
+
+            # Weighted mean of the forward and backward
+            tmpw_var = 1 / (
+                1 / self[store_tmpf + '_mc' + store_tempvar]
+                + 1 / self[store_tmpb + '_mc' + store_tempvar])
+
+            tmpw = \
+                (self[store_tmpf] /
+                 self[store_tmpf + '_mc' + store_tempvar] +
+                 self[store_tmpb] /
+                 self[store_tmpb + '_mc' + store_tempvar]
+                 ) * tmpw_var
+
+            if region and store_tmpw in self:
+                # keeps the weighted mean outside of the selection
+                in_region = fill_region(
+                    np.ones((ix.size, it.size), dtype=bool), ix, it,
+                    (no, nt), False)
+                tmpw = tmpw.where(in_region, self[store_tmpw])
+
+            self[store_tmpw] = tmpw
+
+            if del_tmpf_after:
+                del self['tmpf']
+            if del_tmpb_after:
+                del self['tmpb']
+            return
+
+        self.coords['mc'] = range(mc_sample_size)
+
+        memchunk = self.mc_memory_plan(
+            p_val=p_val,
+            conf_ints=conf_ints,
+            mc_sample_size=mc_sample_size,
+            memory_limit=memory_limit,
+            mc_chunk_size=mc_chunk_size,
+            reduce_memory_usage=reduce_memory_usage,
+            double_ended=True).chunks
 
         if isinstance(p_cov, bool) and not p_cov:
             # Exclude parameter uncertainty if p_cov == False
@@ -4144,15 +5635,10 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 ta_fw = ta[:, 0, :]
                 ta_bw = ta[:, 1, :]
 
-                ta_fw_arr = np.zeros((no, nt))
-                for tai, taxi in zip(ta_fw.T, self.coords[ta_dim].values):
-                    ta_fw_arr[self.x.values >= taxi] = \
-                        ta_fw_arr[self.x.values >= taxi] + tai
-
-                ta_bw_arr = np.zeros((no, nt))
-                for tai, taxi in zip(ta_bw.T, self.coords[ta_dim].values):
-                    ta_bw_arr[self.x.values < taxi] = \
-                        ta_bw_arr[self.x.values < taxi] + tai
+                steps = TransientAttenuation(
+                    self.x.values, self.coords[ta_dim].values)
+                ta_fw_arr = steps.fw(ta_fw.T)
+                ta_bw_arr = steps.bw(ta_bw.T)
 
                 self[store_ta + '_fw_mc'] = (('x', time_dim), ta_fw_arr)
                 self[store_ta + '_bw_mc'] = (('x', time_dim), ta_bw_arr)
@@ -4164,77 +5650,45 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
         else:
             # WLS
             if isinstance(p_cov, str):
-                p_cov = self[p_cov].values
+                p_cov = from_object_array(self[p_cov].values)
             assert p_cov.shape == (npar, npar)
 
             ix_sec = self.ufunc_per_section(x_indices=True, calc_per='all')
-            nx_sec = ix_sec.size
-            from_i = np.concatenate(
-                (
-                    np.arange(1 + 2 * nt), 1 + 2 * nt + ix_sec,
-                    np.arange(1 + 2 * nt + no,
-                              1 + 2 * nt + no + nt * 2 * nta)))
-            iox_sec1, iox_sec2 = np.meshgrid(from_i, from_i, indexing='ij')
-            po_val = p_val[from_i]
-            po_cov = p_cov[iox_sec1, iox_sec2]
-
-            po_mc = sst.multivariate_normal.rvs(
-                mean=po_val, cov=po_cov, size=mc_sample_size)
-
-            gamma = po_mc[:, 0]
-            d_fw = po_mc[:, 1:nt + 1]
-            d_bw = po_mc[:, 1 + nt:2 * nt + 1]
-
-            self['gamma_mc'] = (('mc',), gamma)
-            self['df_mc'] = (('mc', time_dim), d_fw)
-            self['db_mc'] = (('mc', time_dim), d_bw)
 
-            # calculate alpha seperately
-            alpha = np.zeros((mc_sample_size, no), dtype=float)
-            alpha[:, ix_sec] = po_mc[:, 1 + 2 * nt:1 + 2 * nt + nx_sec]
-
-            not_ix_sec = np.array([i for i in range(no) if i not in ix_sec])
-
-            if np.any(not_ix_sec):
-                not_alpha_val = p_val[2 * nt + 1 + not_ix_sec]
-                not_alpha_var = p_cov[2 * nt + 1 + not_ix_sec,
-                                      2 * nt + 1 + not_ix_sec]
-
-                not_alpha_mc = np.random.normal(
-                    loc=not_alpha_val,
-                    scale=not_alpha_var**0.5,
-                    size=(mc_sample_size, not_alpha_val.size))
-
-                alpha[:, not_ix_sec] = not_alpha_mc
-
-            self['alpha_mc'] = (('mc', 'x'), alpha)
+            # alpha outside of the reference sections is uncorrelated
+            uncorrelated = np.zeros(npar, dtype=bool)
+            uncorrelated[1 + 2 * nt:1 + 2 * nt + no] = True
+            uncorrelated[1 + 2 * nt + ix_sec] = False
+            p_mc = mc_parameter_samples(
+                p_val,
+                p_cov,
+                mc_sample_size,
+                uncorrelated=uncorrelated,
+                random_streams=random_streams,
+                mc_chunk_size=mc_chunk_size or 100,
+                sampler=self.parameter_sampler(
+                    p_val, p_cov, uncorrelated=uncorrelated)
+                if random_streams is not None else None,
+                sampling=mc_sampling)
+
+            self['gamma_mc'] = (('mc',), p_mc[:, 0])
+            self['df_mc'] = (('mc', time_dim), p_mc[:, 1:nt + 1])
+            self['db_mc'] = (('mc', time_dim), p_mc[:, 1 + nt:2 * nt + 1])
+            self['alpha_mc'] = (
+                ('mc', 'x'), p_mc[:, 1 + 2 * nt:1 + 2 * nt + no])
 
             if store_ta:
-                ta = po_mc[:, 2 * nt + 1 + nx_sec:].reshape(
+                ta = p_mc[:, 2 * nt + 1 + no:].reshape(
                     (mc_sample_size, nt, 2, nta), order='F')
-                ta_fw = ta[:, :, 0, :]
-                ta_bw = ta[:, :, 1, :]
-
-                ta_fw_arr = da.zeros(
-                    (mc_sample_size, no, nt), chunks=memchunk, dtype=float)
-                for tai, taxi in zip(ta_fw.swapaxes(0, 2),
-                                     self.coords[ta_dim].values):
-                    # iterate over the splices
-                    i_splice = sum(self.x.values < taxi)
-                    mask = create_da_ta2(
-                        no, i_splice, direction='fw', chunks=memchunk)
-
-                    ta_fw_arr += mask * tai.T[:, None, :]
-
-                ta_bw_arr = da.zeros(
-                    (mc_sample_size, no, nt), chunks=memchunk, dtype=float)
-                for tai, taxi in zip(ta_bw.swapaxes(0, 2),
-                                     self.coords[ta_dim].values):
-                    i_splice = sum(self.x.values < taxi)
-                    mask = create_da_ta2(
-                        no, i_splice, direction='bw', chunks=memchunk)
-
-                    ta_bw_arr += mask * tai.T[:, None, :]
+                # of shape (mc, nta, nt), the step functions are gathered
+                # per chunk
+                ta = da.from_array(
+                    ta.transpose((0, 3, 2, 1)),
+                    chunks=(memchunk[0], -1, -1, memchunk[2]))
+                steps = TransientAttenuation(
+                    self.x.values, self.coords[ta_dim].values)
+                ta_fw_arr = steps.fw(ta[:, :, 0], axis=1).rechunk(memchunk)
+                ta_bw_arr = steps.bw(ta[:, :, 1], axis=1).rechunk(memchunk)
 
                 self[store_ta + '_fw_mc'] = (('mc', 'x', time_dim), ta_fw_arr)
                 self[store_ta + '_bw_mc'] = (('mc', 'x', time_dim), ta_bw_arr)
@@ -4276,13 +5730,19 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             else:
                 st_vari_da = da.from_array(st_vari, chunks=memchunk[1:])
 
-            self[k] = (
-                ('mc', 'x', time_dim),
-                state.normal(
+            if random_streams is None:
+                r = state.normal(
                     loc=loc,  # has chunks=memchunk[1:]
                     scale=st_vari_da**0.5,
                     size=rsize,
-                    chunks=memchunk))
+                    chunks=memchunk)
+            else:
+                r = loc + st_vari_da**0.5 * \
+                    random_streams.standard_normal_dask(
+                        st_labeli, rsize, memchunk,
+                        lhs=mc_sampling != 'random')
+
+            self[k] = (('mc', 'x', time_dim), r)
 
         for label, del_label in zip([store_tmpf, store_tmpb],
                                     [del_tmpf_after, del_tmpb_after]):
@@ -4323,15 +5783,9 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 self[label + '_mc' + store_tempvar] = (q.var(dim='mc', ddof=1))
 
                 if conf_ints and not del_label:
-                    new_chunks = list(self[label + '_mc_set'].chunks)
-                    new_chunks[0] = (len(conf_ints),)
                     avg_axis = self[label + '_mc_set'].get_axis_num('mc')
-                    q = self[label + '_mc_set'].data.map_blocks(
-                        lambda x: np.percentile(x, q=conf_ints, axis=avg_axis),
-                        chunks=new_chunks,  #
-                        drop_axis=avg_axis,
-                        # avg dimensions are dropped from input arr
-                        new_axis=0)  # The new CI dimension is added as firsaxis
+                    q = mc_percentile(
+                        self[label + '_mc_set'].data, conf_ints, axis=avg_axis)
 
                     self[label + '_mc'] = (('CI', 'x', time_dim), q)
 
@@ -4360,14 +5814,9 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
 
         # Calculate the CI of the weighted MC_set
         if conf_ints:
-            new_chunks_weighted = ((len(conf_ints),),) + memchunk[1:]
             avg_axis = self[store_tmpw + '_mc_set'].get_axis_num('mc')
-            q2 = self[store_tmpw + '_mc_set'].data.map_blocks(
-                lambda x: np.percentile(x, q=conf_ints, axis=avg_axis),
-                chunks=new_chunks_weighted,  # Explicitly define output chunks
-                drop_axis=avg_axis,  # avg dimensions are dropped
-                new_axis=0,
-                dtype=float)  # The new CI dimension is added as first axis
+            q2 = mc_percentile(
+                self[store_tmpw + '_mc_set'].data, conf_ints, axis=avg_axis)
             self[store_tmpw + '_mc'] = (('CI', 'x', time_dim), q2)
 
         # Clean up the garbage. All arrays with a Monte Carlo dimension.
@@ -4419,6 +5868,13 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             da_random_state=None,
             remove_mc_set_flag=True,
             reduce_memory_usage=False,
+            mc_streaming=False,
+            mc_chunk_size=None,
+            mc_seed=None,
+            mc_samples=None,
+            mc_sampling='random',
+            mc_tol=None,
+            memory_limit=None,
             **kwargs):
         """
         Average temperatures from double-ended setups.
@@ -4556,40 +6012,50 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             variance are calculated.
         reduce_memory_usage : bool
             Use less memory but at the expense of longer computation time
+        mc_streaming : bool
+            Draw the Monte Carlo samples per tile of (x, time) and per chunk
+            of `mc_chunk_size` samples, and reduce them to their moments and
+            to histograms as soon as they are drawn, instead of storing the
+            (mc, x, time) sets. The peak memory is then independent of
+            `mc_sample_size`. The confidence intervals are interpolated from
+            the histograms, which requires a second pass over the samples.
+            The inverse-variance weighted averages (flag 2) are reduced from
+            their sets of (mc, time) or (mc, x), which are not stored.
+            See `monte_carlo_double_ended()`.
+        mc_chunk_size : int, optional
+            The number of samples that are drawn at once if `mc_streaming`,
+            100 by default. Otherwise, the size of the chunks of the mc
+            dimension of the dask arrays, which is a single chunk by default.
+            With multiple chunks, the confidence intervals are interpolated
+            from histograms per chunk that are summed over the chunks. See
+            `dtscalibration.calibrate_utils.mc_percentile()`.
+        mc_seed : int, np.random.SeedSequence, optional
+            The seed of the random streams from which the parameters and the
+            intensities are drawn if `da_random_state` is not given, see
+            `dtscalibration.calibrate_utils.RandomStreams`. Each sample is
+            drawn from its own stream, so the samples are bit-identical
+            regardless of `mc_chunk_size`, `mc_streaming`, the chunks of the
+            dask arrays, or the number of workers. By default, the seed is
+            drawn from numpy's global random state.
+        mc_samples : MonteCarloStream, optional
+            The samples of `monte_carlo_double_ended()`, which are reduced
+            instead of drawing new samples. Implies `mc_streaming`. The
+            size of the samples is that of the stream. Pass the same stream
+            to `conf_int_*()` and `average_*()` to reduce the same samples,
+            of which the parameters are drawn only once.
+        mc_sampling : {'random', 'lhs', 'sobol'}
+            See `conf_int_double_ended()`
+        mc_tol : float, optional
+            As in `conf_int_double_ended()`, but all (x, time) have
+            the same number of samples, as required for the averages.
+            Requires that `da_random_state` is not given.
+        memory_limit : int, str, optional
+            See `conf_int_single_ended()`
 
         Returns
         -------
 
         """
-        def create_da_ta2(no, i_splice, direction='fw', chunks=None):
-            """create mask array mc, o, nt"""
-
-            if direction == 'fw':
-                arr = da.concatenate(
-                    (
-                        da.zeros(
-                            (1, i_splice, 1),
-                            chunks=((1, i_splice, 1)),
-                            dtype=bool),
-                        da.ones(
-                            (1, no - i_splice, 1),
-                            chunks=(1, no - i_splice, 1),
-                            dtype=bool)),
-                    axis=1).rechunk((1, chunks[1], 1))
-            else:
-                arr = da.concatenate(
-                    (
-                        da.ones(
-                            (1, i_splice, 1),
-                            chunks=(1, i_splice, 1),
-                            dtype=bool),
-                        da.zeros(
-                            (1, no - i_splice, 1),
-                            chunks=((1, no - i_splice, 1)),
-                            dtype=bool)),
-                    axis=1).rechunk((1, chunks[1], 1))
-            return arr
-
         self.check_deprecated_kwargs(kwargs)
 
         if (ci_avg_x_flag1 or ci_avg_x_flag2) and (ci_avg_time_flag1 or
@@ -4605,6 +6071,149 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
         else:
             pass
 
+        if mc_streaming or mc_samples is not None or mc_tol is not None:
+            time_dim = self.get_time_dim(data_var_key='st')
+            ix, it, x_dim2, time_dim2 = average_selection_indices(
+                self, time_dim, ci_avg_time_sel, ci_avg_time_isel,
+                ci_avg_x_sel, ci_avg_x_isel)
+
+            if mc_tol is not None and mc_chunk_size is None:
+                # the tolerance is checked after every chunk of samples
+                mc_chunk_size = 100
+
+            plan = self.mc_memory_plan(
+                p_val=p_val,
+                conf_ints=conf_ints,
+                mc_sample_size=mc_sample_size,
+                memory_limit=memory_limit,
+                mc_streaming=True,
+                mc_chunk_size=mc_chunk_size,
+                ix=ix,
+                it=it,
+                double_ended=True)
+
+            # a single draw for the samples per cell and the averages, of
+            # the selection only
+            if mc_samples is not None:
+                mc_samples = mc_samples.select(ix, it)
+            elif da_random_state is None:
+                mc_samples = self.monte_carlo_double_ended(
+                    p_val=p_val,
+                    p_cov=p_cov,
+                    st_var=st_var,
+                    ast_var=ast_var,
+                    rst_var=rst_var,
+                    rast_var=rast_var,
+                    store_ta=store_ta,
+                    mc_sample_size=mc_sample_size,
+                    mc_chunk_size=plan.mc_chunk_size,
+                    tile_size=plan.tile_size,
+                    ix=ix,
+                    it=it,
+                    mc_seed=mc_seed,
+                    mc_sampling=mc_sampling)
+
+            if mc_tol is not None:
+                assert mc_samples is not None, \
+                    'mc_tol requires that da_random_state is not given'
+                sample_sizes = mc_samples.adapt(
+                    ['tmpf', 'tmpb'], mc_tol, conf_ints=conf_ints,
+                    per_tile=False)
+
+            self.conf_int_double_ended(
+                p_val=p_val,
+                p_cov=p_cov,
+                store_ta=store_ta,
+                st_var=st_var,
+                ast_var=ast_var,
+                rst_var=rst_var,
+                rast_var=rast_var,
+                store_tmpf=store_tmpf,
+                store_tmpb=store_tmpb,
+                store_tmpw=store_tmpw,
+                store_tempvar=store_tempvar,
+                conf_ints=None,
+                mc_sample_size=mc_sample_size,
+                da_random_state=da_random_state,
+                mc_seed=mc_seed,
+                mc_sampling=mc_sampling,
+                mc_streaming=True,
+                mc_chunk_size=mc_chunk_size,
+                memory_limit=memory_limit,
+                mc_samples=mc_samples,
+                mc_x_isel=ix,
+                mc_time_isel=it,
+                **kwargs)
+
+            if mc_tol is not None:
+                self['mc_sample_size'] = (
+                    ('x', time_dim),
+                    fill_region(sample_sizes, ix, it, self.st.shape, 0))
+
+            if conf_ints:
+                self.coords['CI'] = conf_ints
+
+            if mc_samples is None:
+                stream = self.monte_carlo_double_ended(
+                    p_val=p_val,
+                    p_cov=p_cov,
+                    st_var=st_var,
+                    ast_var=ast_var,
+                    rst_var=rst_var,
+                    rast_var=rast_var,
+                    store_ta=store_ta,
+                    mc_sample_size=mc_sample_size,
+                    mc_chunk_size=plan.mc_chunk_size,
+                    tile_size=plan.tile_size,
+                    ix=ix,
+                    it=it,
+                    da_random_state=da_random_state)
+            else:
+                stream = mc_samples
+
+            # axis 0 averages over x and axis 1 over time
+            flag1_axes = [
+                axis for axis, flag in zip(
+                    [0, 1], [ci_avg_x_flag1, ci_avg_time_flag1]) if flag]
+            flag2_axes = [
+                axis for axis, flag in zip(
+                    [0, 1], [ci_avg_x_flag2, ci_avg_time_flag2]) if flag]
+            centers = {
+                'tmpf': self[store_tmpf].values[np.ix_(ix, it)],
+                'tmpb': self[store_tmpb].values[np.ix_(ix, it)]}
+            out = mc_stream_average(
+                stream, ['tmpf', 'tmpb'],
+                centers,
+                conf_ints=conf_ints,
+                weighted=True,
+                flag1_axes=flag1_axes,
+                flag2_axes=flag2_axes)
+
+            # Weighted mean of the forward and backward
+            tmpw_var = 1 / (
+                1 / out['tmpf']['var'] + 1 / out['tmpb']['var'])
+            centers['tmpw'] = (
+                centers['tmpf'] / out['tmpf']['var'] +
+                centers['tmpb'] / out['tmpb']['var']) * tmpw_var
+
+            for label, key in zip([store_tmpf, store_tmpb, store_tmpw],
+                                  ['tmpf', 'tmpb', 'tmpw']):
+                store_mc_average(
+                    self, label, out[key], centers[key], x_dim2, time_dim2,
+                    store_tempvar)
+
+            if remove_mc_set_flag:
+                for k in ['x_avg', 'time_avg']:
+                    if k in self:
+                        del self[k]
+
+                for i in [store_tmpf, store_tmpb, store_tmpw]:
+                    for k in [i + '_avgsec',
+                              i + '_mc_avgsec' + store_tempvar]:
+                        if k in self:
+                            del self[k]
+            return
+
         self.conf_int_double_ended(
             p_val=p_val,
             p_cov=p_cov,
@@ -4620,8 +6229,12 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
             conf_ints=None,
             mc_sample_size=mc_sample_size,
             da_random_state=da_random_state,
+            mc_seed=mc_seed,
+            mc_sampling=mc_sampling,
             remove_mc_set_flag=False,
             reduce_memory_usage=reduce_memory_usage,
+            mc_chunk_size=mc_chunk_size,
+            memory_limit=memory_limit,
             **kwargs)
 
         time_dim = self.get_time_dim(data_var_key='st')
@@ -4687,8 +6300,6 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 x_dim2 = 'x'
                 time_dim2 = time_dim
 
-            memchunk = self[label + '_mc_set'].chunks
-
             # subtract the mean temperature
             q = self[label + '_mc_set'] - self[label + '_avgsec']
             self[label + '_mc' + '_avgsec' + store_tempvar] = (
@@ -4704,16 +6315,10 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 self[label + '_mc_avgx1' + store_tempvar] = qvar
 
                 if conf_ints:
-                    new_chunks = (
-                        len(conf_ints), self[label + '_mc_set'].chunks[2])
                     avg_axis = self[label + '_mc_set'].get_axis_num(
                         ['mc', x_dim2])
-                    q = self[label + '_mc_set'].data.map_blocks(
-                        lambda x: np.percentile(x, q=conf_ints, axis=avg_axis),
-                        chunks=new_chunks,  #
-                        drop_axis=avg_axis,
-                        # avg dimensions are dropped from input arr
-                        new_axis=0)  # The new CI dim is added as firsaxis
+                    q = mc_percentile(
+                        self[label + '_mc_set'].data, conf_ints, axis=avg_axis)
 
                     self[label + '_mc_avgx1'] = (('CI', time_dim2), q)
 
@@ -4734,19 +6339,11 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                     dim='mc')
 
                 if conf_ints:
-                    new_chunks = (
-                        len(conf_ints), self[label + '_mc_set'].chunks[2])
                     avg_axis_avgx = self[label + '_mc_set'].get_axis_num('mc')
 
-                    qq = self[label + '_mc_avgx2_set'].data.map_blocks(
-                        lambda x: np.percentile(
-                            x, q=conf_ints, axis=avg_axis_avgx),
-                        chunks=new_chunks,  #
-                        drop_axis=avg_axis_avgx,
-                        # avg dimensions are dropped from input arr
-                        new_axis=0,
-                        dtype=float)  # The new CI dimension is added as
-                    # firsaxis
+                    qq = mc_percentile(
+                        self[label + '_mc_avgx2_set'].data, conf_ints,
+                        axis=avg_axis_avgx)
                     self[label + '_mc_avgx2'] = (('CI', time_dim2), qq)
 
             if ci_avg_time_flag1 is not None:
@@ -4759,16 +6356,10 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 self[label + '_mc_avg1' + store_tempvar] = qvar
 
                 if conf_ints:
-                    new_chunks = (
-                        len(conf_ints), self[label + '_mc_set'].chunks[1])
                     avg_axis = self[label + '_mc_set'].get_axis_num(
                         ['mc', time_dim2])
-                    q = self[label + '_mc_set'].data.map_blocks(
-                        lambda x: np.percentile(x, q=conf_ints, axis=avg_axis),
-                        chunks=new_chunks,  #
-                        drop_axis=avg_axis,
-                        # avg dimensions are dropped from input arr
-                        new_axis=0)  # The new CI dim is added as firsaxis
+                    q = mc_percentile(
+                        self[label + '_mc_set'].data, conf_ints, axis=avg_axis)
 
                     self[label + '_mc_avg1'] = (('CI', x_dim2), q)
 
@@ -4789,19 +6380,11 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                                              + '_mc_avg2_set'].mean(dim='mc')
 
                 if conf_ints:
-                    new_chunks = (
-                        len(conf_ints), self[label + '_mc_set'].chunks[1])
                     avg_axis_avg2 = self[label + '_mc_set'].get_axis_num('mc')
 
-                    qq = self[label + '_mc_avg2_set'].data.map_blocks(
-                        lambda x: np.percentile(
-                            x, q=conf_ints, axis=avg_axis_avg2),
-                        chunks=new_chunks,  #
-                        drop_axis=avg_axis_avg2,
-                        # avg dimensions are dropped from input arr
-                        new_axis=0,
-                        dtype=float)  # The new CI dimension is added as
-                    # firsaxis
+                    qq = mc_percentile(
+                        self[label + '_mc_avg2_set'].data, conf_ints,
+                        axis=avg_axis_avg2)
                     self[label + '_mc_avg2'] = (('CI', x_dim2), qq)
 
         # Weighted mean of the forward and backward
@@ -4837,17 +6420,11 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 self[store_tmpw + '_mc_set'].var(dim=['mc', time_dim2])
 
             if conf_ints:
-                new_chunks_weighted = ((len(conf_ints),),) + (memchunk[1],)
                 avg_axis = self[store_tmpw + '_mc_set'].get_axis_num(
                     ['mc', time_dim2])
-                q2 = self[store_tmpw + '_mc_set'].data.map_blocks(
-                    lambda x: np.percentile(x, q=conf_ints, axis=avg_axis),
-                    chunks=new_chunks_weighted,
-                    # Explicitly define output chunks
-                    drop_axis=avg_axis,  # avg dimensions are dropped
-                    new_axis=0,
-                    dtype=float)  # The new CI dimension is added as
-                # first axis
+                q2 = mc_percentile(
+                    self[store_tmpw + '_mc_set'].data, conf_ints,
+                    axis=avg_axis)
                 self[store_tmpw + '_mc_avg1'] = (('CI', x_dim2), q2)
 
         if ci_avg_time_flag2:
@@ -4875,17 +6452,11 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
 
             if conf_ints:
                 # We first need to know the x-dim-chunk-size
-                new_chunks_weighted = ((len(conf_ints),),) + (memchunk[1],)
                 avg_axis_avg2 = self[store_tmpw
                                      + '_mc_avg2_set'].get_axis_num('mc')
-                q2 = self[store_tmpw + '_mc_avg2_set'].data.map_blocks(
-                    lambda x: np.percentile(
-                        x, q=conf_ints, axis=avg_axis_avg2),
-                    chunks=new_chunks_weighted,
-                    # Explicitly define output chunks
-                    drop_axis=avg_axis_avg2,  # avg dimensions are dropped
-                    new_axis=0,
-                    dtype=float)  # The new CI dimension is added as firstax
+                q2 = mc_percentile(
+                    self[store_tmpw + '_mc_avg2_set'].data, conf_ints,
+                    axis=avg_axis_avg2)
                 self[store_tmpw + '_mc_avg2'] = (('CI', x_dim2), q2)
 
         if ci_avg_x_flag1:
@@ -4896,17 +6467,11 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
                 self[store_tmpw + '_mc_set'].var(dim=x_dim2)
 
             if conf_ints:
-                new_chunks_weighted = ((len(conf_ints),),) + (memchunk[2],)
                 avg_axis = self[store_tmpw + '_mc_set'].get_axis_num(
                     ['mc', x_dim2])
-                q2 = self[store_tmpw + '_mc_set'].data.map_blocks(
-                    lambda x: np.percentile(x, q=conf_ints, axis=avg_axis),
-                    chunks=new_chunks_weighted,
-                    # Explicitly define output chunks
-                    drop_axis=avg_axis,  # avg dimensions are dropped
-                    new_axis=0,
-                    dtype=float)  # The new CI dimension is added as
-                # first axis
+                q2 = mc_percentile(
+                    self[store_tmpw + '_mc_set'].data, conf_ints,
+                    axis=avg_axis)
                 self[store_tmpw + '_mc_avgx1'] = (('CI', time_dim2), q2)
 
         if ci_avg_x_flag2:
@@ -4934,17 +6499,11 @@ dtscalibration/python-dts-calibration/blob/master/examples/notebooks/\
 
             if conf_ints:
                 # We first need to know the x-dim-chunk-size
-                new_chunks_weighted = ((len(conf_ints),),) + (memchunk[2],)
                 avg_axis_avgx2 = self[store_tmpw
                                       + '_mc_avgx2_set'].get_axis_num('mc')
-                q2 = self[store_tmpw + '_mc_avgx2_set'].data.map_blocks(
-                    lambda x: np.percentile(
-                        x, q=conf_ints, axis=avg_axis_avgx2),
-                    chunks=new_chunks_weighted,
-                    # Explicitly define output chunks
-                    drop_axis=avg_axis_avgx2,  # avg dimensions are dropped
-                    new_axis=0,
-                    dtype=float)  # The new CI dimension is added as firstax
+                q2 = mc_percentile(
+                    self[store_tmpw + '_mc_avgx2_set'].data, conf_ints,
+                    axis=avg_axis_avgx2)
                 self[store_tmpw + '_mc_avgx2'] = (('CI', time_dim2), q2)
 
         # Clean up the garbage. All arrays with a Monte Carlo dimension.
@@ -5785,3 +7344,119 @@ def func_fit(p, xs):
 def func_cost(p, data, xs):
     fit = func_fit(p, xs)
     return np.sum((fit - data)**2)
+
+
+def variance_rank1_fit(grams, sums, nt):
+    """
+    The variance of the residuals of the fits of `func_fit_rank1()` to the
+    measurements of multiple stretches, from the sum over `nt` time steps of
+    the outer product of the measurements of each stretch with themselves,
+    `grams`, and of the measurements, `sums`. The sum of the squared
+    residuals of a stretch is the trace of its Gram matrix minus its largest
+    eigenvalue.
+
+    Returns
+    -------
+    var : float
+        As `np.var(resid, ddof=1)`
+    profiles : list of array-like
+        The leading left singular vector of each stretch
+    """
+    ssr, sum_resid, n = 0., 0., 0
+    profiles = []
+
+    for gram, sum_i in zip(grams, sums):
+        eigval, u = np.linalg.eigh(gram)
+        u = u[:, -1]
+        profiles.append(u)
+        ssr += np.trace(gram) - eigval[-1]
+        sum_resid += u.sum() * u.dot(sum_i) - sum_i.sum()
+        n += sum_i.size * nt
+
+    return (ssr - sum_resid**2 / n) / (n - 1), profiles
+
+
+def fit_stretches_rank1(data, bounds):
+    """
+    The residuals of the fits of `func_fit_rank1()` to the measurements of
+    each stretch, where `data[bounds[i]:bounds[i + 1]]` are the measurements
+    of stretch `i`. The closed-form fit is finite for finite measurements.
+    """
+    if np.any(~np.isfinite(data)):
+        raise ValueError(
+            'NaN/inf value(s) found in the Stokes intensities of the '
+            'reference sections')
+
+    resid_list = []
+
+    for i0, i1 in zip(bounds[:-1], bounds[1:]):
+        vi = data[i0:i1]
+        resid_list.append(func_fit_rank1(vi) - vi)
+
+    return np.concatenate(resid_list)
+
+
+def bin_variance_linear(st, diff_st, nbin, st_label='st'):
+    """
+    The mean of the Stokes intensities `st` and the variance of their
+    residuals `diff_st` per bin of about the same number of intensities,
+    sorted by intensity. `nbin` is reduced until the residuals fit in a
+    rectangular matrix.
+    """
+    # Adjust nbin silently to fit residuals in
+    # rectangular matrix and use numpy for computation
+    nbin_ = nbin
+    while st.size % nbin_:
+        nbin_ -= 1
+
+    if nbin_ != nbin:
+        print(
+            'Estimation of linear variance of', st_label, 'Adjusting nbin to:',
+            nbin_)
+        nbin = nbin_
+
+    isort = np.argsort(st)
+    st_sort_mean = st[isort].reshape((nbin, -1)).mean(axis=1)
+    st_sort_var = diff_st[isort].reshape((nbin, -1)).var(axis=1)
+    return st_sort_mean, st_sort_var
+
+
+def fit_variance_linear(st_sort_mean, st_sort_var, through_zero=True):
+    """
+    Fit the variance per bin with a linear function of the intensity.
+
+    Returns
+    -------
+    slope, offset : float
+        VAR(Stokes) = slope * Stokes + offset. The offset is zero if
+        `through_zero`.
+    """
+    if through_zero:
+        # VAR(Stokes) = slope * Stokes
+        slope = np.linalg.lstsq(
+            st_sort_mean[:, None], st_sort_var, rcond=None)[0]
+        return slope, 0.
+    else:
+        # VAR(Stokes) = slope * Stokes + offset
+        return np.linalg.lstsq(
+            np.hstack(
+                (st_sort_mean[:, None], np.ones((st_sort_mean.size, 1)))),
+            st_sort_var,
+            rcond=None)[0]
+
+
+def func_fit_rank1(data):
+    """
+    The least-squares fit of a constant per location times a time series to
+    `data` of shape (nx, nt), the product of its leading singular vectors.
+    These follow from the eigendecomposition of the Gram matrix of the
+    smallest dimension, in closed form.
+    """
+    if data.shape[0] <= data.shape[1]:
+        _, u = np.linalg.eigh(data.dot(data.T))
+        u = u[:, -1]
+        return u[:, None] * u.dot(data)[None]
+    else:
+        _, v = np.linalg.eigh(data.T.dot(data))
+        v = v[:, -1]
+        return data.dot(v)[:, None] * v[None]
@@ -1,6 +1,7 @@
 # coding=utf-8
 import matplotlib.pyplot as plt
 import numpy as np
+import xarray as xr
 
 
 def check_dims(ds, labels, correct_dims=None):
@@ -95,6 +96,203 @@ def check_timestep_allclose(ds, eps=0.01):
                                               'for all time steps'
 
 
+def average_selection_indices(
+        ds,
+        time_dim,
+        ci_avg_time_sel=None,
+        ci_avg_time_isel=None,
+        ci_avg_x_sel=None,
+        ci_avg_x_isel=None):
+    """
+    The indices of the locations and time steps that are selected for the
+    averages of `average_single_ended()` and `average_double_ended()`, and
+    the names of their dimensions. The coordinate of the selected dimension
+    is added to `ds`.
+
+    Parameters
+    ----------
+    ds : DataStore
+    time_dim : str
+    ci_avg_time_sel, ci_avg_time_isel, ci_avg_x_sel, ci_avg_x_isel
+        See `average_single_ended()`
+
+    Returns
+    -------
+    ix, it : array-like of int
+    x_dim2, time_dim2 : str
+    """
+    ix = np.arange(ds.x.size)
+    it = np.arange(ds[time_dim].size)
+    x_dim2 = 'x'
+    time_dim2 = time_dim
+
+    if ci_avg_time_sel is not None or ci_avg_time_isel is not None:
+        time_dim2 = time_dim + '_avg'
+        it = xr.DataArray(it, coords=[ds[time_dim]])
+
+        if ci_avg_time_sel is not None:
+            it = it.sel(**{time_dim: ci_avg_time_sel}).values
+        else:
+            it = it.isel(**{time_dim: ci_avg_time_isel}).values
+
+        ds.coords[time_dim2] = ((time_dim2,), ds[time_dim].values[it])
+
+    elif ci_avg_x_sel is not None or ci_avg_x_isel is not None:
+        x_dim2 = 'x_avg'
+        ix = xr.DataArray(ix, coords=[ds.x])
+
+        if ci_avg_x_sel is not None:
+            ix = ix.sel(x=ci_avg_x_sel).values
+        else:
+            ix = ix.isel(x=ci_avg_x_isel).values
+
+        ds.coords[x_dim2] = ((x_dim2,), ds.x.values[ix])
+
+    return ix, it, x_dim2, time_dim2
+
+
+def region_indices(
+        ds, time_dim, x_sel=None, x_isel=None, time_sel=None,
+        time_isel=None):
+    """
+    The indices of the locations and time steps of a region of `ds`, which
+    are selected by label or by index. All by default.
+
+    Parameters
+    ----------
+    ds : DataStore
+    time_dim : str
+    x_sel, time_sel : slice, array-like, optional
+        Selection by label, as with `ds.sel()`
+    x_isel, time_isel : slice, array-like of int, optional
+        Selection by index, as with `ds.isel()`
+
+    Returns
+    -------
+    ix, it : array-like of int
+    """
+    ix = xr.DataArray(np.arange(ds.x.size), coords=[ds.x])
+    it = xr.DataArray(np.arange(ds[time_dim].size), coords=[ds[time_dim]])
+
+    if x_sel is not None:
+        ix = ix.sel(x=x_sel)
+    elif x_isel is not None:
+        ix = ix.isel(x=x_isel)
+
+    if time_sel is not None:
+        it = it.sel(**{time_dim: time_sel})
+    elif time_isel is not None:
+        it = it.isel(**{time_dim: time_isel})
+
+    return np.atleast_1d(ix.values), np.atleast_1d(it.values)
+
+
+def fill_region(values, ix, it, shape, fill_value=np.nan):
+    """
+    Place the values of a region, of shape (..., ix.size, it.size), in an
+    array of shape (..., *shape) that is `fill_value` outside the region.
+    """
+    values = np.asarray(values)
+    out = np.full(
+        values.shape[:-2] + tuple(shape), fill_value,
+        dtype=np.result_type(values, fill_value))
+    out[..., np.asarray(ix)[:, None], np.asarray(it)[None, :]] = values
+    return out
+
+
+def object_array(obj):
+    """
+    A 0-d array of dtype object that holds `obj`, e.g., to store a
+    `BlockCovariance` in a DataStore without forming its dense matrix.
+    """
+    out = np.empty((), dtype=object)
+    out[()] = obj
+    return out
+
+
+def from_object_array(values):
+    """
+    The object held by a 0-d array of dtype object, see `object_array()`.
+    Other arrays are returned as is.
+    """
+    if np.ndim(values) == 0 and getattr(values, 'dtype', None) == object:
+        return values.item()
+    else:
+        return values
+
+
+def time_chunk_order(nt, time_chunk_size):
+    """
+    The indices of the time steps per chunk of `time_chunk_size` time steps.
+    The chunks are in van der Corput order, so that any number of leading
+    chunks is spread over the entire period.
+
+    Parameters
+    ----------
+    nt : int
+        The number of time steps
+    time_chunk_size : int
+
+    Returns
+    -------
+    list of array-like of int
+    """
+    nchunk = -(-nt // time_chunk_size)
+    nbit = max(1, int(np.ceil(np.log2(nchunk))))
+    i = np.arange(2**nbit)
+
+    # reverse the bits of the chunk indices
+    rev = np.zeros_like(i)
+    for b in range(nbit):
+        rev |= ((i >> b) & 1) << (nbit - 1 - b)
+
+    return [
+        np.arange(j * time_chunk_size, min((j + 1) * time_chunk_size, nt))
+        for j in rev[rev < nchunk]]
+
+
+def store_mc_average(
+        ds, label, result, center, x_dim2, time_dim2, store_tempvar='_var'):
+    """
+    Stores the output of `mc_stream_average()` for a single temperature in
+    `ds`, under the keys of `average_single_ended()`.
+
+    Parameters
+    ----------
+    ds : DataStore
+    label : str
+        The key of the temperature, e.g., `store_tmpf`
+    result : dict
+        The output of `mc_stream_average()` for this temperature
+    center : array-like
+        The temperature of the selection, of shape (x_dim2, time_dim2)
+    x_dim2, time_dim2 : str
+        The dimensions of the selection
+    store_tempvar : str
+    """
+    ds[label + '_avgsec'] = ((x_dim2, time_dim2), center)
+    ds[label + '_mc_avgsec' + store_tempvar] = (
+        (x_dim2, time_dim2), result['var'])
+
+    for axis, suffix, dim, avg_dim in [(0, '_avgx', time_dim2, x_dim2),
+                                       (1, '_avg', x_dim2, time_dim2)]:
+        if ('avg1', axis) in result:
+            var, ci = result['avg1', axis]
+            ds[label + suffix + '1'] = ds[label + '_avgsec'].mean(dim=avg_dim)
+            ds[label + '_mc' + suffix + '1' + store_tempvar] = ((dim,), var)
+
+            if ci is not None:
+                ds[label + '_mc' + suffix + '1'] = (('CI', dim), ci)
+
+        if ('avg2', axis) in result:
+            var, avg_set, ci = result['avg2', axis]
+            ds[label + suffix + '2'] = ((dim,), avg_set.mean(axis=0))
+            ds[label + '_mc' + suffix + '2' + store_tempvar] = ((dim,), var)
+
+            if ci is not None:
+                ds[label + '_mc' + suffix + '2'] = (('CI', dim), ci)
+
+
 def merge_double_ended(ds_fw, ds_bw, cable_length, plot_result=True):
     """
     Some measurements are not set up on the DTS-device as double-ended
@@ -198,9 +198,9 @@ def test_variance_input_types_single():
         da_random_state=state)
 
     assert_almost_equal_verbose(
-        ds.tmpf_mc_var.sel(x=slice(0, 50)).mean().values, 0.2377, decimal=2)
+        ds.tmpf_mc_var.sel(x=slice(0, 50)).mean().values, 0.2133, decimal=2)
     assert_almost_equal_verbose(
-        ds.tmpf_mc_var.sel(x=slice(50, 100)).mean().values, 1.3203, decimal=2)
+        ds.tmpf_mc_var.sel(x=slice(50, 100)).mean().values, 1.2907, decimal=2)
 
     # Test input with shape (ntime)
     st_var = ds.st.mean(dim='x').values * 0 + np.linspace(5, 200, num=nt)
@@ -738,6 +738,180 @@ def test_variance_of_stokes_synthetic():
     pass
 
 
+def test_variance_of_stokes_residuals_unsorted_sections():
+    """Checks that the reshaped residuals are placed at the locations of
+    their stretch if the reference sections are not in the order of their
+    locations"""
+    rs = np.random.RandomState(0)
+
+    nx = 100
+    x = np.linspace(0., 20., nx)
+
+    nt = 50
+    G = np.linspace(500, 4000, nt)[None]
+
+    y = G * np.exp(-0.1 * x[:, None])
+    y += rs.normal(size=y.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], y),
+            'probe1Temperature': (['time'], range(nt)),
+            'probe2Temperature': (['time'], range(nt)),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt))},
+        coords={
+            'x': x,
+            'time': range(nt)},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'probe1Temperature': [slice(11., 20.)],
+        'probe2Temperature': [slice(0., 5.)]}
+    _, resid = ds.variance_stokes_constant(
+        st_label='st', sections=sections)
+
+    for (sec,) in sections.values():
+        vi = ds.st.sel(x=sec).values
+        v = np.linalg.svd(vi)[2][0]
+        resid_sec = np.outer(vi.dot(v), v) - vi
+        np.testing.assert_allclose(
+            resid.sel(x=sec).values, resid_sec, atol=1e-8)
+
+    assert np.all(np.isnan(resid.sel(x=slice(5.1, 10.9)).values))
+
+    pass
+
+
+def test_variance_of_stokes_rank1_fit():
+    """Checks the closed-form fit of a constant per location times a time
+    series against the truncated SVD, for both orientations, that
+    noise-free products are reproduced, and that non-finite measurements
+    raise an error"""
+    from dtscalibration.datastore import fit_stretches_rank1
+    from dtscalibration.datastore import func_fit_rank1
+
+    rs = np.random.RandomState(0)
+
+    for nx, nt in [(30, 200), (200, 30)]:
+        y = np.linspace(1., 2., nx)[:, None] * rs.uniform(3000, 4000, nt)
+        np.testing.assert_allclose(func_fit_rank1(y), y, rtol=1e-10)
+
+        y += rs.normal(scale=2., size=y.shape)
+        u, s, vt = np.linalg.svd(y, full_matrices=False)
+        np.testing.assert_allclose(
+            func_fit_rank1(y), s[0] * np.outer(u[:, 0], vt[0]), rtol=1e-8)
+
+    y[5, 3] = np.nan
+    with pytest.raises(ValueError):
+        fit_stretches_rank1(y, [0, 100, 200])
+
+    pass
+
+
+def test_variance_of_stokes_streaming_synthetic():
+    """Checks that the variance of chunks of time steps that are streamed
+    from a dask backed DataStore equals that of all time steps at once, and
+    that the linear variance is recovered from streamed chunks"""
+    import dask.array as da
+
+    from dtscalibration.datastore_utils import time_chunk_order
+
+    rs = np.random.RandomState(0)
+
+    chunks = time_chunk_order(100, 16)
+    assert [c[0] for c in chunks[:3]] == [0, 64, 32]
+    np.testing.assert_array_equal(np.sort(np.concatenate(chunks)), range(100))
+
+    nx = 200
+    x = np.linspace(0., 20., nx)
+
+    nt = 200
+    G = np.linspace(500, 4000, nt)[None]
+
+    y = G * np.exp(-0.1 * x[:, None])
+    slope, offset = 0.02, 2.
+    y += rs.normal(size=y.shape) * (slope * y + offset)**0.5
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], y),
+            'probe1Temperature': (['time'], range(nt)),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt))},
+        coords={
+            'x': x,
+            'time': range(nt)},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'probe1Temperature': [slice(0., 9.), slice(11., 20.)]}
+    I_var, resid = ds.variance_stokes_constant(
+        st_label='st', sections=sections)
+
+    ds_dask = ds.chunk({'time': 30})
+    I_var2, resid2 = ds_dask.variance_stokes_constant(
+        st_label='st', time_chunk_size=16)
+    np.testing.assert_allclose(I_var2, I_var, rtol=1e-6)
+    assert isinstance(resid2.data, da.Array)
+    np.testing.assert_allclose(resid2.values, resid.values, atol=1e-6)
+
+    slope2, offset2 = ds_dask.variance_stokes_linear(
+        st_label='st', through_zero=False, time_chunk_size=16,
+        rtol=0.01)[:2]
+    np.testing.assert_allclose(
+        slope2 * G.mean() + offset2, slope * G.mean() + offset, rtol=0.1)
+
+    pass
+
+
+def test_variance_of_stokes_all_synthetic():
+    """Checks that the variances of all channels that are estimated at once
+    equal those that are estimated per channel"""
+    rs = np.random.RandomState(0)
+
+    nx = 200
+    x = np.linspace(0., 20., nx)
+
+    nt = 100
+    G = np.linspace(500, 4000, nt)[None]
+
+    data_vars = {
+        'probe1Temperature': (['time'], range(nt)),
+        'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+        'userAcquisitionTimeBW': (['time'], np.ones(nt))}
+
+    for label, scale in zip(['st', 'ast', 'rst', 'rast'], [1., 2., 3., 4.]):
+        y = G * np.exp(-0.1 * x[:, None])
+        y += rs.normal(size=y.shape) * (0.02 * y)**0.5 * scale
+        data_vars[label] = (['x', 'time'], y)
+
+    ds = DataStore(
+        data_vars,
+        coords={
+            'x': x,
+            'time': range(nt)},
+        attrs={'isDoubleEnded': '1'})
+
+    ds.sections = {
+        'probe1Temperature': [slice(11., 20.), slice(0., 9.)]}
+    out = ds.chunk({'time': 30}).variance_stokes_all(num_workers=2)
+    assert list(out) == ['st', 'ast', 'rst', 'rast']
+
+    for label, (I_var, resid) in out.items():
+        I_var2, resid2 = ds.variance_stokes_constant(st_label=label)
+        np.testing.assert_allclose(I_var, I_var2, rtol=1e-10)
+        np.testing.assert_allclose(resid.values, resid2.values, atol=1e-8)
+
+    out = ds.variance_stokes_all(
+        st_labels=['st', 'rast'], method='linear', nbin=10)
+
+    for label, (slope, offset, *_) in out.items():
+        slope2, offset2 = ds.variance_stokes_linear(
+            st_label=label, nbin=10)[:2]
+        np.testing.assert_allclose(slope, slope2, rtol=1e-10)
+
+    pass
+
+
 def test_variance_of_stokes_linear_synthetic():
     """
     Produces a synthetic Stokes measurement with a known noise distribution.
@@ -1543,16 +1717,18 @@ def test_double_ended_two_matching_sections_and_two_asym_atts():
     pass
 
 
-def test_double_ended_ols_wls_fix_gamma_estimate_synthetic():
-    """Checks whether the coefficients are correctly defined by creating a
-    synthetic measurement set, and derive the parameters from this set.
-    Without variance.
-    They should be the same as the parameters used to create the synthetic
-    measurment set"""
+def test_double_ended_block_solver_synthetic():
+    """Checks whether the block solver gives the same result as the sparse
+    solver, if either the time steps or the locations are eliminated"""
     from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import calibration_double_ended_solver
+    from dtscalibration.calibrate_utils import double_ended_block_groups
+    from dtscalibration.calibrate_utils import wls_block
+
+    rs = np.random.RandomState(0)
 
     cable_len = 100.
-    nt = 500
+    nt = 50
     time = np.arange(nt)
     x = np.linspace(0., cable_len, 100)
     ts_cold = np.ones(nt) * 4.
@@ -1581,11 +1757,6 @@ def test_double_ended_ols_wls_fix_gamma_estimate_synthetic():
 
     alpha = np.mean(np.log(rst / rast) - np.log(st / ast), axis=1) / 2
     alpha -= alpha[0]  # the first x-index is where to start counting
-    dalpha = dalpha_p - dalpha_m
-    alpha2 = x * dalpha
-
-    # to ensure the st, rst, ast, rast were correctly defined.
-    np.testing.assert_allclose(alpha2, alpha, atol=1e-15, rtol=0)
 
     ds = DataStore(
         {
@@ -1603,54 +1774,56 @@ def test_double_ended_ols_wls_fix_gamma_estimate_synthetic():
         attrs={'isDoubleEnded': '1'})
 
     sections = {
-        'cold': [slice(0., 0.35 * cable_len)],
-        'warm': [slice(0.67 * cable_len, cable_len)]}
-
-    # OLS
-    ds.calibration_double_ended(
-        sections=sections,
-        method='ols',
-        solver='sparse',
-        fix_gamma=(gamma, 0.))
-
-    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=18)
-    assert_almost_equal_verbose(
-        ds.alpha.values, alpha, decimal=10)  # 11 in 64-bit
-    assert_almost_equal_verbose(ds.tmpf.values, temp_real - 273.15, decimal=8)
-    assert_almost_equal_verbose(ds.tmpb.values, temp_real - 273.15, decimal=8)
-    assert_almost_equal_verbose(ds.tmpw.values, temp_real - 273.15, decimal=8)
+        'cold': [slice(0., 0.4 * cable_len)],
+        'warm': [slice(0.65 * cable_len, cable_len)]}
 
-    # WLS
     ds.calibration_double_ended(
         sections=sections,
-        st_var=1e-12,
-        ast_var=1e-12,
-        rst_var=1e-12,
-        rast_var=1e-12,
+        st_var=1e-7,
+        ast_var=1e-7,
+        rst_var=1e-7,
+        rast_var=1e-7,
         method='wls',
-        solver='sparse',
-        tmpw_mc_size=5,
-        fix_gamma=(gamma, 0.))
+        solver='block',
+        store_tmpw=None)
 
-    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=18)
-    assert_almost_equal_verbose(ds.alpha.values, alpha, decimal=9)
+    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=10)
+    assert_almost_equal_verbose(ds.alpha.values, alpha, decimal=8)
     assert_almost_equal_verbose(ds.tmpf.values, temp_real - 273.15, decimal=6)
     assert_almost_equal_verbose(ds.tmpb.values, temp_real - 273.15, decimal=6)
-    assert_almost_equal_verbose(ds.tmpw.values, temp_real - 273.15, decimal=6)
 
-    pass
+    # Add noise and compare both eliminations with the sparse solver
+    ds.st.values += rs.normal(scale=1., size=ds.st.shape)
+    ds.rst.values += rs.normal(scale=1., size=ds.rst.shape)
 
+    X, y, w, p0_est = calibration_double_ended_solver(
+        ds, 1., 1e-7, 1., 1e-7, solver='external')
+    p_sol, p_var, p_cov = wls_sparse(X, y, w=w, x0=p0_est, calc_cov=True)
 
-def test_double_ended_ols_wls_fix_alpha_estimate_synthetic():
-    """Checks whether the coefficients are correctly defined by creating a
-    synthetic measurement set, and derive the parameters from this set.
-    Without variance.
-    They should be the same as the parameters used to create the synthetic
-    measurment set"""
+    for eliminate in ['time', 'x']:
+        groups = double_ended_block_groups(
+            nt, p0_est.size - 1 - 2 * nt, 0, eliminate=eliminate)
+        p_sol2, p_var2, p_cov2 = wls_block(
+            X, y, w=w, groups=groups, x0=p0_est, calc_cov=True)
+
+        np.testing.assert_allclose(p_sol2, p_sol, rtol=1e-8)
+        np.testing.assert_allclose(p_var2, p_var, rtol=1e-6)
+        np.testing.assert_allclose(
+            p_cov2, p_cov, rtol=1e-6, atol=1e-6 * np.abs(p_cov).max())
+
+
+def test_double_ended_matrix_free_synthetic():
+    """Checks whether the matrix-free coefficient matrix equals the sparse
+    coefficient matrix, also with matching sections and transient
+    attenuation, and whether the calibration gives the same result"""
     from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import calibration_double_ended_solver
+    from dtscalibration.calibrate_utils import match_sections
+
+    rs = np.random.RandomState(0)
 
     cable_len = 100.
-    nt = 500
+    nt = 20
     time = np.arange(nt)
     x = np.linspace(0., cable_len, 100)
     ts_cold = np.ones(nt) * 4.
@@ -1677,9 +1850,6 @@ def test_double_ended_ols_wls_fix_alpha_estimate_synthetic():
     rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
         (np.exp(gamma / temp_real) - 1)
 
-    alpha = np.mean(np.log(rst / rast) - np.log(st / ast), axis=1) / 2
-    alpha -= alpha[0]  # the first x-index is where to start counting
-
     ds = DataStore(
         {
             'st': (['x', 'time'], st),
@@ -1695,57 +1865,94 @@ def test_double_ended_ols_wls_fix_alpha_estimate_synthetic():
             'time': time},
         attrs={'isDoubleEnded': '1'})
 
+    ds.st.values += rs.normal(scale=1., size=ds.st.shape)
+    ds.rst.values += rs.normal(scale=1., size=ds.rst.shape)
+
     sections = {
         'cold': [slice(0., 0.4 * cable_len)],
-        'warm': [slice(0.78 * cable_len, cable_len)]}
-
-    # OLS
-    ds.calibration_double_ended(
-        sections=sections,
-        method='ols',
-        solver='sparse',
-        fix_alpha=(alpha, np.zeros_like(alpha)))
-
-    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=9)
-    assert_almost_equal_verbose(ds.alpha.values, alpha, decimal=18)
-    assert_almost_equal_verbose(
-        ds.tmpf.values, temp_real - 273.15, decimal=8)  # 9 on 64-bit
-    assert_almost_equal_verbose(
-        ds.tmpb.values, temp_real - 273.15, decimal=8)  # 9 on 64-bit
-    assert_almost_equal_verbose(
-        ds.tmpw.values, temp_real - 273.15, decimal=7)  # 11 on 64-bit
-
-    # WLS
-    ds.calibration_double_ended(
-        sections=sections,
-        st_var=1e-7,
-        ast_var=1e-7,
-        rst_var=1e-7,
-        rast_var=1e-7,
-        method='wls',
-        solver='sparse',
-        tmpw_mc_size=5,
-        fix_alpha=(alpha, np.zeros_like(alpha)))
-
-    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=8)
-    assert_almost_equal_verbose(ds.alpha.values, alpha, decimal=18)
-    assert_almost_equal_verbose(ds.tmpf.values, temp_real - 273.15, decimal=7)
-    assert_almost_equal_verbose(ds.tmpb.values, temp_real - 273.15, decimal=7)
-    assert_almost_equal_verbose(ds.tmpw.values, temp_real - 273.15, decimal=7)
-
-    pass
-
-
-def test_double_ended_ols_wls_fix_alpha_fix_gamma_estimate_synthetic():
-    """Checks whether the coefficients are correctly defined by creating a
-    synthetic measurement set, and derive the parameters from this set.
-    Without variance.
-    They should be the same as the parameters used to create the synthetic
-    measurment set"""
+        'warm': [slice(0.65 * cable_len, cable_len)]}
+    matching_sections = [
+        (
+            slice(.42 * cable_len, .48 * cable_len),
+            slice(.52 * cable_len, .58 * cable_len), False)]
+
+    # Compare the coefficient matrices
+    ds_x = ds.copy(deep=True)
+    ds_x.sections = sections
+    ds_x.set_trans_att([30., 50.])
+    matching_indices = match_sections(ds_x, matching_sections)
+
+    for mi in [None, matching_indices]:
+        X = calibration_double_ended_solver(
+            ds_x, 1., 1., 1., 1., solver='external', matching_indices=mi)[0]
+        X_op = calibration_double_ended_solver(
+            ds_x,
+            1.,
+            1.,
+            1.,
+            1.,
+            solver='external',
+            matching_indices=mi,
+            matrix_free=True)[0]
+
+        assert X_op.shape == X.shape
+        p = rs.normal(size=X.shape[1])
+        r = rs.normal(size=X.shape[0])
+        w = rs.uniform(size=X.shape[0])
+        np.testing.assert_allclose(X_op.dot(p), X.dot(p), atol=1e-10)
+        np.testing.assert_allclose(X_op.T.dot(r), X.T.dot(r), atol=1e-10)
+        np.testing.assert_allclose(
+            X_op.weighted(w**0.5).gram().toarray(),
+            (X.T.dot(sp.diags(w)).dot(X)).toarray(),
+            rtol=1e-10,
+            atol=1e-10)
+
+    # Compare the calibration
+    for solver in ['sparse', 'block']:
+        ds_sparse = ds.copy(deep=True)
+        ds_sparse.calibration_double_ended(
+            sections=sections,
+            st_var=1.,
+            ast_var=1.,
+            rst_var=1.,
+            rast_var=1.,
+            method='wls',
+            solver=solver,
+            store_tmpw=None)
+
+        ds_op = ds.copy(deep=True)
+        ds_op.calibration_double_ended(
+            sections=sections,
+            st_var=1.,
+            ast_var=1.,
+            rst_var=1.,
+            rast_var=1.,
+            method='wls',
+            solver=solver,
+            store_tmpw=None,
+            matrix_free=True)
+
+        np.testing.assert_allclose(
+            ds_op.p_val.values, ds_sparse.p_val.values, rtol=1e-8)
+        np.testing.assert_allclose(
+            ds_op.p_cov.values,
+            ds_sparse.p_cov.values,
+            rtol=1e-6,
+            atol=1e-6 * np.abs(ds_sparse.p_cov.values).max())
+        np.testing.assert_allclose(
+            ds_op.tmpf.values, ds_sparse.tmpf.values, atol=1e-8)
+
+
+def test_double_ended_chunked_solver_synthetic():
+    """Checks whether accumulating the normal equations per time chunk of a
+    dask backed DataStore gives the same result as the block solver"""
     from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import BlockCovariance
+
+    rs = np.random.RandomState(0)
 
     cable_len = 100.
-    nt = 500
+    nt = 20
     time = np.arange(nt)
     x = np.linspace(0., cable_len, 100)
     ts_cold = np.ones(nt) * 4.
@@ -1772,14 +1979,11 @@ def test_double_ended_ols_wls_fix_alpha_fix_gamma_estimate_synthetic():
     rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
         (np.exp(gamma / temp_real) - 1)
 
-    alpha = np.mean(np.log(rst / rast) - np.log(st / ast), axis=1) / 2
-    alpha -= alpha[0]  # the first x-index is where to start counting
-
     ds = DataStore(
         {
-            'st': (['x', 'time'], st),
+            'st': (['x', 'time'], st + rs.normal(scale=1., size=st.shape)),
             'ast': (['x', 'time'], ast),
-            'rst': (['x', 'time'], rst),
+            'rst': (['x', 'time'], rst + rs.normal(scale=1., size=st.shape)),
             'rast': (['x', 'time'], rast),
             'userAcquisitionTimeFW': (['time'], np.ones(nt)),
             'userAcquisitionTimeBW': (['time'], np.ones(nt)),
@@ -1791,99 +1995,91 @@ def test_double_ended_ols_wls_fix_alpha_fix_gamma_estimate_synthetic():
         attrs={'isDoubleEnded': '1'})
 
     sections = {
-        'cold': [slice(0., 0.5 * cable_len)],
-        'warm': [slice(0.5 * cable_len, cable_len)]}
+        'cold': [slice(0., 0.4 * cable_len)],
+        'warm': [slice(0.65 * cable_len, cable_len)]}
 
-    # OLS
-    ds.calibration_double_ended(
+    ds_block = ds.copy(deep=True)
+    ds_block.calibration_double_ended(
         sections=sections,
-        method='ols',
-        solver='sparse',
-        fix_gamma=(gamma, 0.),
-        fix_alpha=(alpha, np.zeros_like(alpha)))
-
-    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=18)
-    assert_almost_equal_verbose(ds.alpha.values, alpha, decimal=18)
-    assert_almost_equal_verbose(ds.tmpf.values, temp_real - 273.15, decimal=9)
-    assert_almost_equal_verbose(ds.tmpb.values, temp_real - 273.15, decimal=9)
-    assert_almost_equal_verbose(ds.tmpw.values, temp_real - 273.15, decimal=9)
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        method='wls',
+        solver='block',
+        store_tmpw=None)
 
-    # WLS
-    ds.calibration_double_ended(
+    ds_chunked = ds.copy(deep=True).chunk({'time': 7})
+    ds_chunked.calibration_double_ended(
         sections=sections,
-        st_var=1e-7,
-        ast_var=1e-7,
-        rst_var=1e-7,
-        rast_var=1e-7,
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
         method='wls',
-        solver='sparse',
-        tmpw_mc_size=5,
-        fix_gamma=(gamma, 0.),
-        fix_alpha=(alpha, np.zeros_like(alpha)))
-
-    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=18)
-    assert_almost_equal_verbose(ds.alpha.values, alpha, decimal=18)
-    assert_almost_equal_verbose(ds.tmpf.values, temp_real - 273.15, decimal=11)
-    assert_almost_equal_verbose(ds.tmpb.values, temp_real - 273.15, decimal=11)
-    assert_almost_equal_verbose(ds.tmpw.values, temp_real - 273.15, decimal=11)
-
-    pass
-
-
-def test_double_ended_fix_alpha_matching_sections_and_one_asym_att():
+        solver='chunked',
+        store_tmpw=None)
+
+    # The chunked solver stores the covariance as its factorization
+    p_cov_blocks = ds_chunked.p_cov.values.item()
+    assert isinstance(p_cov_blocks, BlockCovariance)
+
+    np.testing.assert_allclose(
+        ds_chunked.p_val.values, ds_block.p_val.values, rtol=1e-8)
+    np.testing.assert_allclose(
+        p_cov_blocks.toarray(),
+        ds_block.p_cov.values,
+        rtol=1e-6,
+        atol=1e-6 * np.abs(ds_block.p_cov.values).max())
+    np.testing.assert_allclose(
+        ds_chunked.tmpf.values, ds_block.tmpf.values, atol=1e-8)
+    np.testing.assert_allclose(
+        ds_chunked.tmpb.values, ds_block.tmpb.values, atol=1e-8)
+
+
+def test_double_ended_analytic_conf_int_synthetic():
+    """Checks the delta-method variances of the forward and backward
+    temperatures, and their covariance, with a numerical Jacobian"""
     from dtscalibration import DataStore
 
+    rs = np.random.RandomState(0)
+
     cable_len = 100.
-    nt = 3
+    nt = 4
+    nx = 40
     time = np.arange(nt)
-    nx_per_sec = 2
-    nx = nx_per_sec * 8
     x = np.linspace(0., cable_len, nx)
-    ts_cold = 4. + np.cos(time) * 4
-    ts_warm = 20. + -np.sin(time) * 4
-    ts_ground = 6.
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
 
-    C_p = 1324  # 1/2 * E0 * v * K_+/lam_+^4
-    eta_pf = np.cos(time) / 10 + 1  # eta_+ (gain factor forward channel)
-    eta_pb = np.sin(time) / 10 + 1  # eta_- (gain factor backward channel)
-    C_m = 5000.
-    eta_mf = np.cos(time + np.pi / 8) / 10 + 1
-    eta_mb = np.sin(time + np.pi / 8) / 10 + 1
-    dalpha_r = 0.005284
-    dalpha_m = 0.004961
-    dalpha_p = 0.005607
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
     gamma = 482.6
-    talph_fw = 0.9
-    talph_bw = 0.8
+    cold_mask = x < 0.3 * cable_len
+    warm_mask = x > 0.7 * cable_len
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
 
-    temp_real_kelvin = np.zeros((len(x), nt)) + 273.15
-    temp_real_kelvin[:nx_per_sec] += ts_cold[None]
-    temp_real_kelvin[nx_per_sec:2 * nx_per_sec] += ts_warm[None]
-    temp_real_kelvin[-nx_per_sec:] += ts_cold[None]
-    temp_real_kelvin[-2 * nx_per_sec:-nx_per_sec] += ts_warm[None]
-    temp_real_kelvin[2 * nx_per_sec:-2 * nx_per_sec] += ts_ground
-    temp_real_celsius = temp_real_kelvin - 273.15
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
 
-    st = eta_pf[None] * C_p * np.exp(-dalpha_r * x[:, None]) * \
-        np.exp(-dalpha_p * x[:, None]) * np.exp(gamma / temp_real_kelvin) / \
-        (np.exp(gamma / temp_real_kelvin) - 1)
-    st[4 * nx_per_sec:] *= talph_fw
-    ast = eta_mf[None] * C_m * np.exp(-dalpha_r * x[:, None]) * \
-        np.exp(-dalpha_m * x[:, None]) / (
-        np.exp(gamma / temp_real_kelvin) - 1)
-    rst = eta_pb[None] * C_p * np.exp(-dalpha_r * (-x[:, None] + cable_len)) * \
-        np.exp(-dalpha_p * (-x[:, None] + cable_len)) * \
-        np.exp(gamma / temp_real_kelvin) / (
-        np.exp(gamma / temp_real_kelvin) - 1)
-    rst[:4 * nx_per_sec] *= talph_bw
-    rast = eta_mb[None] * C_m * np.exp(
-        -dalpha_r * (-x[:, None] + cable_len)) * np.exp(
-        -dalpha_m * (-x[:, None] + cable_len)) / \
-        (np.exp(gamma / temp_real_kelvin) - 1)
+    st[x >= 50.] *= 0.9
+    rst[x < 50.] *= 0.8
+    st, ast, rst, rast = [
+        a + rs.normal(scale=1., size=a.shape) for a in (st, ast, rst, rast)]
 
     ds = DataStore(
         {
-            'TMPR': (['x', 'time'], temp_real_celsius),
             'st': (['x', 'time'], st),
             'ast': (['x', 'time'], ast),
             'rst': (['x', 'time'], rst),
@@ -1897,111 +2093,138 @@ def test_double_ended_fix_alpha_matching_sections_and_one_asym_att():
             'time': time},
         attrs={'isDoubleEnded': '1'})
 
-    ds.sections = {
-        'cold': [slice(0., x[nx_per_sec - 1])],
-        'warm': [slice(x[nx_per_sec], x[2 * nx_per_sec - 1])]}
+    sections = {
+        'cold': [slice(0., 0.3 * cable_len)],
+        'warm': [slice(0.7 * cable_len, cable_len)]}
 
     ds.calibration_double_ended(
-        st_var=1.5,
-        ast_var=1.5,
+        sections=sections,
+        st_var=1.,
+        ast_var=1.,
         rst_var=1.,
         rast_var=1.,
         method='wls',
         solver='sparse',
-        tmpw_mc_size=3,
-        remove_mc_set_flag=True,
         trans_att=[50.],
-        matching_sections=[
-            (
-                slice(x[3 * nx_per_sec], x[4 * nx_per_sec - 1]),
-                slice(x[4 * nx_per_sec], x[5 * nx_per_sec - 1]), True)])
-
-    # remove TA vars
-    k = [
-        'talpha_fw', 'talpha_bw', 'talpha_fw_var', 'talpha_bw_var',
-        'trans_att']
-    for ki in k:
-        del ds[ki]
-
-    alpha_adj = ds.alpha.values.copy()
-    alpha_var_adj = ds.alpha_var.values.copy()
-
-    ds.calibration_double_ended(
-        st_var=1.5,
-        ast_var=1.5,
+        store_tmpw=None)
+    ds.conf_int_double_ended(
+        p_val='p_val',
+        p_cov='p_cov',
+        st_var=1.,
+        ast_var=1.,
         rst_var=1.,
         rast_var=1.,
-        method='wls',
-        solver='sparse',
-        tmpw_mc_size=3,
-        remove_mc_set_flag=True,
-        fix_alpha=(alpha_adj, alpha_var_adj),
-        trans_att=[50.],
-        matching_sections=[
-            (
-                slice(x[3 * nx_per_sec], x[4 * nx_per_sec - 1]),
-                slice(x[4 * nx_per_sec], x[5 * nx_per_sec - 1]), True)])
-
-    assert_almost_equal_verbose(temp_real_celsius, ds.tmpf.values, decimal=7)
-    assert_almost_equal_verbose(temp_real_celsius, ds.tmpb.values, decimal=7)
-    assert_almost_equal_verbose(temp_real_celsius, ds.tmpw.values, decimal=7)
-    pass
+        store_tmpw='tmpw',
+        store_ta='talpha',
+        conf_ints=[2.5, 50., 97.5],
+        method='analytic',
+        memory_limit='1kB')  # no Monte Carlo samples are drawn
+
+    on_fw = (x >= 50.)[:, None]
+
+    def tmpfb(p, st, ast, rst, rast):
+        alpha = p[1 + 2 * nt:1 + 2 * nt + nx, None]
+        ta = p[1 + 2 * nt + nx:]
+        tmpf = p[0] / (
+            np.log(st / ast) + p[1:1 + nt] + alpha
+            + np.where(on_fw, ta[:nt], 0.)) - 273.15
+        tmpb = p[0] / (
+            np.log(rst / rast) + p[1 + nt:1 + 2 * nt] - alpha
+            + np.where(on_fw, 0., ta[nt:])) - 273.15
+        return np.stack((tmpf, tmpb))
+
+    p_val = ds.p_val.values
+    p_cov = ds.p_cov.values.copy()
+
+    # alpha outside of the reference sections is uncorrelated
+    ix_out = 1 + 2 * nt + np.flatnonzero(~(cold_mask | warm_mask))
+    p_cov_diag = p_cov[ix_out, ix_out]
+    p_cov[ix_out] = 0.
+    p_cov[:, ix_out] = 0.
+    p_cov[ix_out, ix_out] = p_cov_diag
+
+    # central differences
+    intensities = [st, ast, rst, rast]
+    dp = 1e-5 * np.eye(p_val.size)
+    jac = np.stack(
+        [
+            (tmpfb(p_val + dpi, *intensities) -
+             tmpfb(p_val - dpi, *intensities)) / 2e-5 for dpi in dp],
+        axis=-1)
+    cov = np.einsum('fxti,ij,gxtj->fgxt', jac, p_cov, jac)
+
+    for i in range(4):
+        up = [a + 1e-3 * (k == i) for k, a in enumerate(intensities)]
+        down = [a - 1e-3 * (k == i) for k, a in enumerate(intensities)]
+        jac_i = (tmpfb(p_val, *up) - tmpfb(p_val, *down)) / 2e-3
+        cov += jac_i[:, None] * jac_i[None]
+
+    assert 'mc' not in ds.coords
+    np.testing.assert_allclose(ds.tmpf_mc_var, cov[0, 0], rtol=1e-6)
+    np.testing.assert_allclose(ds.tmpb_mc_var, cov[1, 1], rtol=1e-6)
+    np.testing.assert_allclose(ds.tmpf_tmpb_mc_cov, cov[0, 1], rtol=1e-6)
+
+    w_f = cov[1, 1] / (cov[0, 0] + cov[1, 1])
+    w_b = 1 - w_f
+    np.testing.assert_allclose(
+        ds.tmpw, w_f * ds.tmpf + w_b * ds.tmpb, rtol=1e-10)
+    np.testing.assert_allclose(
+        ds.tmpw_mc_var,
+        w_f**2 * cov[0, 0] + w_b**2 * cov[1, 1] + 2 * w_f * w_b * cov[0, 1],
+        rtol=1e-6)
+    np.testing.assert_allclose(ds.tmpw_mc.sel(CI=50.), ds.tmpw, rtol=1e-10)
+    np.testing.assert_allclose(
+        ds.tmpb_mc.sel(CI=97.5) - ds.tmpb,
+        1.959964 * ds.tmpb_mc_var**0.5,
+        rtol=1e-6)
 
 
-def test_double_ended_fix_alpha_gamma_matching_sections_and_one_asym_att():
+def test_double_ended_ols_wls_fix_gamma_estimate_synthetic():
+    """Checks whether the coefficients are correctly defined by creating a
+    synthetic measurement set, and derive the parameters from this set.
+    Without variance.
+    They should be the same as the parameters used to create the synthetic
+    measurment set"""
     from dtscalibration import DataStore
 
     cable_len = 100.
-    nt = 3
+    nt = 500
     time = np.arange(nt)
-    nx_per_sec = 2
-    nx = nx_per_sec * 8
-    x = np.linspace(0., cable_len, nx)
-    ts_cold = 4. + np.cos(time) * 4
-    ts_warm = 20. + -np.sin(time) * 4
-    ts_ground = 6.
+    x = np.linspace(0., cable_len, 100)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
 
-    C_p = 1324  # 1/2 * E0 * v * K_+/lam_+^4
-    eta_pf = np.cos(time) / 10 + 1  # eta_+ (gain factor forward channel)
-    eta_pb = np.sin(time) / 10 + 1  # eta_- (gain factor backward channel)
-    C_m = 5000.
-    eta_mf = np.cos(time + np.pi / 8) / 10 + 1
-    eta_mb = np.sin(time + np.pi / 8) / 10 + 1
-    dalpha_r = 0.005284
-    dalpha_m = 0.004961
-    dalpha_p = 0.005607
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
     gamma = 482.6
-    talph_fw = 0.9
-    talph_bw = 0.8
+    cold_mask = x < 0.5 * cable_len
+    warm_mask = np.invert(cold_mask)  # == False
+    temp_real = np.ones((len(x), nt))
+    temp_real[cold_mask] *= ts_cold + 273.15
+    temp_real[warm_mask] *= ts_warm + 273.15
 
-    temp_real_kelvin = np.zeros((len(x), nt)) + 273.15
-    temp_real_kelvin[:nx_per_sec] += ts_cold[None]
-    temp_real_kelvin[nx_per_sec:2 * nx_per_sec] += ts_warm[None]
-    temp_real_kelvin[-nx_per_sec:] += ts_cold[None]
-    temp_real_kelvin[-2 * nx_per_sec:-nx_per_sec] += ts_warm[None]
-    temp_real_kelvin[2 * nx_per_sec:-2 * nx_per_sec] += ts_ground
-    temp_real_celsius = temp_real_kelvin - 273.15
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
 
-    st = eta_pf[None] * C_p * np.exp(-dalpha_r * x[:, None]) * \
-        np.exp(-dalpha_p * x[:, None]) * np.exp(gamma / temp_real_kelvin) / \
-        (np.exp(gamma / temp_real_kelvin) - 1)
-    st[4 * nx_per_sec:] *= talph_fw
-    ast = eta_mf[None] * C_m * np.exp(-dalpha_r * x[:, None]) * \
-        np.exp(-dalpha_m * x[:, None]) / (
-        np.exp(gamma / temp_real_kelvin) - 1)
-    rst = eta_pb[None] * C_p * np.exp(-dalpha_r * (-x[:, None] + cable_len)) * \
-        np.exp(-dalpha_p * (-x[:, None] + cable_len)) * \
-        np.exp(gamma / temp_real_kelvin) / (
-        np.exp(gamma / temp_real_kelvin) - 1)
-    rst[:4 * nx_per_sec] *= talph_bw
-    rast = eta_mb[None] * C_m * np.exp(
-        -dalpha_r * (-x[:, None] + cable_len)) * np.exp(
-        -dalpha_m * (-x[:, None] + cable_len)) / \
-        (np.exp(gamma / temp_real_kelvin) - 1)
+    alpha = np.mean(np.log(rst / rast) - np.log(st / ast), axis=1) / 2
+    alpha -= alpha[0]  # the first x-index is where to start counting
+    dalpha = dalpha_p - dalpha_m
+    alpha2 = x * dalpha
+
+    # to ensure the st, rst, ast, rast were correctly defined.
+    np.testing.assert_allclose(alpha2, alpha, atol=1e-15, rtol=0)
 
     ds = DataStore(
         {
-            'TMPR': (['x', 'time'], temp_real_celsius),
             'st': (['x', 'time'], st),
             'ast': (['x', 'time'], ast),
             'rst': (['x', 'time'], rst),
@@ -2015,59 +2238,235 @@ def test_double_ended_fix_alpha_gamma_matching_sections_and_one_asym_att():
             'time': time},
         attrs={'isDoubleEnded': '1'})
 
-    ds.sections = {
-        'cold': [slice(0., x[nx_per_sec - 1])],
-        'warm': [slice(x[nx_per_sec], x[2 * nx_per_sec - 1])]}
+    sections = {
+        'cold': [slice(0., 0.35 * cable_len)],
+        'warm': [slice(0.67 * cable_len, cable_len)]}
 
+    # OLS
     ds.calibration_double_ended(
-        st_var=1.5,
-        ast_var=1.5,
-        rst_var=1.,
-        rast_var=1.,
-        method='wls',
+        sections=sections,
+        method='ols',
         solver='sparse',
-        tmpw_mc_size=3,
-        remove_mc_set_flag=True,
-        trans_att=[50.],
-        matching_sections=[
-            (
-                slice(x[3 * nx_per_sec], x[4 * nx_per_sec - 1]),
-                slice(x[4 * nx_per_sec], x[5 * nx_per_sec - 1]), True)])
-
-    # remove TA vars
-    k = [
-        'talpha_fw', 'talpha_bw', 'talpha_fw_var', 'talpha_bw_var',
-        'trans_att']
-    for ki in k:
-        del ds[ki]
+        fix_gamma=(gamma, 0.))
 
-    alpha_adj = ds.alpha.values.copy()
-    alpha_var_adj = ds.alpha_var.values.copy()
+    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=18)
+    assert_almost_equal_verbose(
+        ds.alpha.values, alpha, decimal=10)  # 11 in 64-bit
+    assert_almost_equal_verbose(ds.tmpf.values, temp_real - 273.15, decimal=8)
+    assert_almost_equal_verbose(ds.tmpb.values, temp_real - 273.15, decimal=8)
+    assert_almost_equal_verbose(ds.tmpw.values, temp_real - 273.15, decimal=8)
 
+    # WLS
     ds.calibration_double_ended(
-        st_var=1.5,
-        ast_var=1.5,
-        rst_var=1.,
-        rast_var=1.,
+        sections=sections,
+        st_var=1e-12,
+        ast_var=1e-12,
+        rst_var=1e-12,
+        rast_var=1e-12,
         method='wls',
         solver='sparse',
-        tmpw_mc_size=3,
-        remove_mc_set_flag=True,
-        fix_alpha=(alpha_adj, alpha_var_adj),
-        fix_gamma=(gamma, 0.),
-        trans_att=[50.],
-        matching_sections=[
-            (
-                slice(x[3 * nx_per_sec], x[4 * nx_per_sec - 1]),
-                slice(x[4 * nx_per_sec], x[5 * nx_per_sec - 1]), True)])
+        tmpw_mc_size=5,
+        fix_gamma=(gamma, 0.))
+
+    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=18)
+    assert_almost_equal_verbose(ds.alpha.values, alpha, decimal=9)
+    assert_almost_equal_verbose(ds.tmpf.values, temp_real - 273.15, decimal=6)
+    assert_almost_equal_verbose(ds.tmpb.values, temp_real - 273.15, decimal=6)
+    assert_almost_equal_verbose(ds.tmpw.values, temp_real - 273.15, decimal=6)
 
-    assert_almost_equal_verbose(temp_real_celsius, ds.tmpf.values, decimal=7)
-    assert_almost_equal_verbose(temp_real_celsius, ds.tmpb.values, decimal=7)
-    assert_almost_equal_verbose(temp_real_celsius, ds.tmpw.values, decimal=7)
     pass
 
 
-def test_double_ended_fix_gamma_matching_sections_and_one_asym_att():
+def test_double_ended_ols_wls_fix_alpha_estimate_synthetic():
+    """Checks whether the coefficients are correctly defined by creating a
+    synthetic measurement set, and derive the parameters from this set.
+    Without variance.
+    They should be the same as the parameters used to create the synthetic
+    measurment set"""
+    from dtscalibration import DataStore
+
+    cable_len = 100.
+    nt = 500
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, 100)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = x < 0.5 * cable_len
+    warm_mask = np.invert(cold_mask)  # == False
+    temp_real = np.ones((len(x), nt))
+    temp_real[cold_mask] *= ts_cold + 273.15
+    temp_real[warm_mask] *= ts_warm + 273.15
+
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
+
+    alpha = np.mean(np.log(rst / rast) - np.log(st / ast), axis=1) / 2
+    alpha -= alpha[0]  # the first x-index is where to start counting
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    sections = {
+        'cold': [slice(0., 0.4 * cable_len)],
+        'warm': [slice(0.78 * cable_len, cable_len)]}
+
+    # OLS
+    ds.calibration_double_ended(
+        sections=sections,
+        method='ols',
+        solver='sparse',
+        fix_alpha=(alpha, np.zeros_like(alpha)))
+
+    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=9)
+    assert_almost_equal_verbose(ds.alpha.values, alpha, decimal=18)
+    assert_almost_equal_verbose(
+        ds.tmpf.values, temp_real - 273.15, decimal=8)  # 9 on 64-bit
+    assert_almost_equal_verbose(
+        ds.tmpb.values, temp_real - 273.15, decimal=8)  # 9 on 64-bit
+    assert_almost_equal_verbose(
+        ds.tmpw.values, temp_real - 273.15, decimal=7)  # 11 on 64-bit
+
+    # WLS
+    ds.calibration_double_ended(
+        sections=sections,
+        st_var=1e-7,
+        ast_var=1e-7,
+        rst_var=1e-7,
+        rast_var=1e-7,
+        method='wls',
+        solver='sparse',
+        tmpw_mc_size=5,
+        fix_alpha=(alpha, np.zeros_like(alpha)))
+
+    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=8)
+    assert_almost_equal_verbose(ds.alpha.values, alpha, decimal=18)
+    assert_almost_equal_verbose(ds.tmpf.values, temp_real - 273.15, decimal=7)
+    assert_almost_equal_verbose(ds.tmpb.values, temp_real - 273.15, decimal=7)
+    assert_almost_equal_verbose(ds.tmpw.values, temp_real - 273.15, decimal=7)
+
+    pass
+
+
+def test_double_ended_ols_wls_fix_alpha_fix_gamma_estimate_synthetic():
+    """Checks whether the coefficients are correctly defined by creating a
+    synthetic measurement set, and derive the parameters from this set.
+    Without variance.
+    They should be the same as the parameters used to create the synthetic
+    measurment set"""
+    from dtscalibration import DataStore
+
+    cable_len = 100.
+    nt = 500
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, 100)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = x < 0.5 * cable_len
+    warm_mask = np.invert(cold_mask)  # == False
+    temp_real = np.ones((len(x), nt))
+    temp_real[cold_mask] *= ts_cold + 273.15
+    temp_real[warm_mask] *= ts_warm + 273.15
+
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
+
+    alpha = np.mean(np.log(rst / rast) - np.log(st / ast), axis=1) / 2
+    alpha -= alpha[0]  # the first x-index is where to start counting
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    sections = {
+        'cold': [slice(0., 0.5 * cable_len)],
+        'warm': [slice(0.5 * cable_len, cable_len)]}
+
+    # OLS
+    ds.calibration_double_ended(
+        sections=sections,
+        method='ols',
+        solver='sparse',
+        fix_gamma=(gamma, 0.),
+        fix_alpha=(alpha, np.zeros_like(alpha)))
+
+    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=18)
+    assert_almost_equal_verbose(ds.alpha.values, alpha, decimal=18)
+    assert_almost_equal_verbose(ds.tmpf.values, temp_real - 273.15, decimal=9)
+    assert_almost_equal_verbose(ds.tmpb.values, temp_real - 273.15, decimal=9)
+    assert_almost_equal_verbose(ds.tmpw.values, temp_real - 273.15, decimal=9)
+
+    # WLS
+    ds.calibration_double_ended(
+        sections=sections,
+        st_var=1e-7,
+        ast_var=1e-7,
+        rst_var=1e-7,
+        rast_var=1e-7,
+        method='wls',
+        solver='sparse',
+        tmpw_mc_size=5,
+        fix_gamma=(gamma, 0.),
+        fix_alpha=(alpha, np.zeros_like(alpha)))
+
+    assert_almost_equal_verbose(ds.gamma.values, gamma, decimal=18)
+    assert_almost_equal_verbose(ds.alpha.values, alpha, decimal=18)
+    assert_almost_equal_verbose(ds.tmpf.values, temp_real - 273.15, decimal=11)
+    assert_almost_equal_verbose(ds.tmpb.values, temp_real - 273.15, decimal=11)
+    assert_almost_equal_verbose(ds.tmpw.values, temp_real - 273.15, decimal=11)
+
+    pass
+
+
+def test_double_ended_fix_alpha_matching_sections_and_one_asym_att():
     from dtscalibration import DataStore
 
     cable_len = 100.
@@ -2146,7 +2545,6 @@ def test_double_ended_fix_gamma_matching_sections_and_one_asym_att():
         method='wls',
         solver='sparse',
         tmpw_mc_size=3,
-        fix_gamma=(gamma, 0.),
         remove_mc_set_flag=True,
         trans_att=[50.],
         matching_sections=[
@@ -2154,45 +2552,283 @@ def test_double_ended_fix_gamma_matching_sections_and_one_asym_att():
                 slice(x[3 * nx_per_sec], x[4 * nx_per_sec - 1]),
                 slice(x[4 * nx_per_sec], x[5 * nx_per_sec - 1]), True)])
 
+    # remove TA vars
+    k = [
+        'talpha_fw', 'talpha_bw', 'talpha_fw_var', 'talpha_bw_var',
+        'trans_att']
+    for ki in k:
+        del ds[ki]
+
+    alpha_adj = ds.alpha.values.copy()
+    alpha_var_adj = ds.alpha_var.values.copy()
+
+    ds.calibration_double_ended(
+        st_var=1.5,
+        ast_var=1.5,
+        rst_var=1.,
+        rast_var=1.,
+        method='wls',
+        solver='sparse',
+        tmpw_mc_size=3,
+        remove_mc_set_flag=True,
+        fix_alpha=(alpha_adj, alpha_var_adj),
+        trans_att=[50.],
+        matching_sections=[
+            (
+                slice(x[3 * nx_per_sec], x[4 * nx_per_sec - 1]),
+                slice(x[4 * nx_per_sec], x[5 * nx_per_sec - 1]), True)])
+
     assert_almost_equal_verbose(temp_real_celsius, ds.tmpf.values, decimal=7)
     assert_almost_equal_verbose(temp_real_celsius, ds.tmpb.values, decimal=7)
     assert_almost_equal_verbose(temp_real_celsius, ds.tmpw.values, decimal=7)
     pass
 
 
-@pytest.mark.skip(
-    reason="Superseeded by "
-    "test_estimate_variance_of_temperature_estimate")
-def test_double_ended_exponential_variance_estimate_synthetic():
-    import dask.array as da
-
+def test_double_ended_fix_alpha_gamma_matching_sections_and_one_asym_att():
     from dtscalibration import DataStore
 
-    state = da.random.RandomState(0)
-
-    stokes_m_var = 4.
     cable_len = 100.
-    nt = 5
+    nt = 3
     time = np.arange(nt)
-    x = np.linspace(0., cable_len, 100)
-    ts_cold = np.ones(nt) * 4.
-    ts_warm = np.ones(nt) * 20.
+    nx_per_sec = 2
+    nx = nx_per_sec * 8
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = 4. + np.cos(time) * 4
+    ts_warm = 20. + -np.sin(time) * 4
+    ts_ground = 6.
 
-    C_p = 15246
-    C_m = 2400.
-    dalpha_r = 0.0005284
-    dalpha_m = 0.0004961
-    dalpha_p = 0.0005607
+    C_p = 1324  # 1/2 * E0 * v * K_+/lam_+^4
+    eta_pf = np.cos(time) / 10 + 1  # eta_+ (gain factor forward channel)
+    eta_pb = np.sin(time) / 10 + 1  # eta_- (gain factor backward channel)
+    C_m = 5000.
+    eta_mf = np.cos(time + np.pi / 8) / 10 + 1
+    eta_mb = np.sin(time + np.pi / 8) / 10 + 1
+    dalpha_r = 0.005284
+    dalpha_m = 0.004961
+    dalpha_p = 0.005607
     gamma = 482.6
-    cold_mask = x < 0.5 * cable_len
-    warm_mask = np.invert(cold_mask)  # == False
-    temp_real = np.ones((len(x), nt))
-    temp_real[cold_mask] *= ts_cold + 273.15
-    temp_real[warm_mask] *= ts_warm + 273.15
+    talph_fw = 0.9
+    talph_bw = 0.8
 
-    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
-        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
-    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+    temp_real_kelvin = np.zeros((len(x), nt)) + 273.15
+    temp_real_kelvin[:nx_per_sec] += ts_cold[None]
+    temp_real_kelvin[nx_per_sec:2 * nx_per_sec] += ts_warm[None]
+    temp_real_kelvin[-nx_per_sec:] += ts_cold[None]
+    temp_real_kelvin[-2 * nx_per_sec:-nx_per_sec] += ts_warm[None]
+    temp_real_kelvin[2 * nx_per_sec:-2 * nx_per_sec] += ts_ground
+    temp_real_celsius = temp_real_kelvin - 273.15
+
+    st = eta_pf[None] * C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * np.exp(gamma / temp_real_kelvin) / \
+        (np.exp(gamma / temp_real_kelvin) - 1)
+    st[4 * nx_per_sec:] *= talph_fw
+    ast = eta_mf[None] * C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (
+        np.exp(gamma / temp_real_kelvin) - 1)
+    rst = eta_pb[None] * C_p * np.exp(-dalpha_r * (-x[:, None] + cable_len)) * \
+        np.exp(-dalpha_p * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real_kelvin) / (
+        np.exp(gamma / temp_real_kelvin) - 1)
+    rst[:4 * nx_per_sec] *= talph_bw
+    rast = eta_mb[None] * C_m * np.exp(
+        -dalpha_r * (-x[:, None] + cable_len)) * np.exp(
+        -dalpha_m * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real_kelvin) - 1)
+
+    ds = DataStore(
+        {
+            'TMPR': (['x', 'time'], temp_real_celsius),
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    ds.sections = {
+        'cold': [slice(0., x[nx_per_sec - 1])],
+        'warm': [slice(x[nx_per_sec], x[2 * nx_per_sec - 1])]}
+
+    ds.calibration_double_ended(
+        st_var=1.5,
+        ast_var=1.5,
+        rst_var=1.,
+        rast_var=1.,
+        method='wls',
+        solver='sparse',
+        tmpw_mc_size=3,
+        remove_mc_set_flag=True,
+        trans_att=[50.],
+        matching_sections=[
+            (
+                slice(x[3 * nx_per_sec], x[4 * nx_per_sec - 1]),
+                slice(x[4 * nx_per_sec], x[5 * nx_per_sec - 1]), True)])
+
+    # remove TA vars
+    k = [
+        'talpha_fw', 'talpha_bw', 'talpha_fw_var', 'talpha_bw_var',
+        'trans_att']
+    for ki in k:
+        del ds[ki]
+
+    alpha_adj = ds.alpha.values.copy()
+    alpha_var_adj = ds.alpha_var.values.copy()
+
+    ds.calibration_double_ended(
+        st_var=1.5,
+        ast_var=1.5,
+        rst_var=1.,
+        rast_var=1.,
+        method='wls',
+        solver='sparse',
+        tmpw_mc_size=3,
+        remove_mc_set_flag=True,
+        fix_alpha=(alpha_adj, alpha_var_adj),
+        fix_gamma=(gamma, 0.),
+        trans_att=[50.],
+        matching_sections=[
+            (
+                slice(x[3 * nx_per_sec], x[4 * nx_per_sec - 1]),
+                slice(x[4 * nx_per_sec], x[5 * nx_per_sec - 1]), True)])
+
+    assert_almost_equal_verbose(temp_real_celsius, ds.tmpf.values, decimal=7)
+    assert_almost_equal_verbose(temp_real_celsius, ds.tmpb.values, decimal=7)
+    assert_almost_equal_verbose(temp_real_celsius, ds.tmpw.values, decimal=7)
+    pass
+
+
+def test_double_ended_fix_gamma_matching_sections_and_one_asym_att():
+    from dtscalibration import DataStore
+
+    cable_len = 100.
+    nt = 3
+    time = np.arange(nt)
+    nx_per_sec = 2
+    nx = nx_per_sec * 8
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = 4. + np.cos(time) * 4
+    ts_warm = 20. + -np.sin(time) * 4
+    ts_ground = 6.
+
+    C_p = 1324  # 1/2 * E0 * v * K_+/lam_+^4
+    eta_pf = np.cos(time) / 10 + 1  # eta_+ (gain factor forward channel)
+    eta_pb = np.sin(time) / 10 + 1  # eta_- (gain factor backward channel)
+    C_m = 5000.
+    eta_mf = np.cos(time + np.pi / 8) / 10 + 1
+    eta_mb = np.sin(time + np.pi / 8) / 10 + 1
+    dalpha_r = 0.005284
+    dalpha_m = 0.004961
+    dalpha_p = 0.005607
+    gamma = 482.6
+    talph_fw = 0.9
+    talph_bw = 0.8
+
+    temp_real_kelvin = np.zeros((len(x), nt)) + 273.15
+    temp_real_kelvin[:nx_per_sec] += ts_cold[None]
+    temp_real_kelvin[nx_per_sec:2 * nx_per_sec] += ts_warm[None]
+    temp_real_kelvin[-nx_per_sec:] += ts_cold[None]
+    temp_real_kelvin[-2 * nx_per_sec:-nx_per_sec] += ts_warm[None]
+    temp_real_kelvin[2 * nx_per_sec:-2 * nx_per_sec] += ts_ground
+    temp_real_celsius = temp_real_kelvin - 273.15
+
+    st = eta_pf[None] * C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * np.exp(gamma / temp_real_kelvin) / \
+        (np.exp(gamma / temp_real_kelvin) - 1)
+    st[4 * nx_per_sec:] *= talph_fw
+    ast = eta_mf[None] * C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (
+        np.exp(gamma / temp_real_kelvin) - 1)
+    rst = eta_pb[None] * C_p * np.exp(-dalpha_r * (-x[:, None] + cable_len)) * \
+        np.exp(-dalpha_p * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real_kelvin) / (
+        np.exp(gamma / temp_real_kelvin) - 1)
+    rst[:4 * nx_per_sec] *= talph_bw
+    rast = eta_mb[None] * C_m * np.exp(
+        -dalpha_r * (-x[:, None] + cable_len)) * np.exp(
+        -dalpha_m * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real_kelvin) - 1)
+
+    ds = DataStore(
+        {
+            'TMPR': (['x', 'time'], temp_real_celsius),
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    ds.sections = {
+        'cold': [slice(0., x[nx_per_sec - 1])],
+        'warm': [slice(x[nx_per_sec], x[2 * nx_per_sec - 1])]}
+
+    ds.calibration_double_ended(
+        st_var=1.5,
+        ast_var=1.5,
+        rst_var=1.,
+        rast_var=1.,
+        method='wls',
+        solver='sparse',
+        tmpw_mc_size=3,
+        fix_gamma=(gamma, 0.),
+        remove_mc_set_flag=True,
+        trans_att=[50.],
+        matching_sections=[
+            (
+                slice(x[3 * nx_per_sec], x[4 * nx_per_sec - 1]),
+                slice(x[4 * nx_per_sec], x[5 * nx_per_sec - 1]), True)])
+
+    assert_almost_equal_verbose(temp_real_celsius, ds.tmpf.values, decimal=7)
+    assert_almost_equal_verbose(temp_real_celsius, ds.tmpb.values, decimal=7)
+    assert_almost_equal_verbose(temp_real_celsius, ds.tmpw.values, decimal=7)
+    pass
+
+
+@pytest.mark.skip(
+    reason="Superseeded by "
+    "test_estimate_variance_of_temperature_estimate")
+def test_double_ended_exponential_variance_estimate_synthetic():
+    import dask.array as da
+
+    from dtscalibration import DataStore
+
+    state = da.random.RandomState(0)
+
+    stokes_m_var = 4.
+    cable_len = 100.
+    nt = 5
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, 100)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = x < 0.5 * cable_len
+    warm_mask = np.invert(cold_mask)  # == False
+    temp_real = np.ones((len(x), nt))
+    temp_real[cold_mask] *= ts_cold + 273.15
+    temp_real[warm_mask] *= ts_warm + 273.15
+
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
         (np.exp(gamma / temp_real) - 1)
     rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
         np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
@@ -3158,6 +3794,2917 @@ def test_single_ended_matching_sections_synthetic():
     ), 'Single-ended, trans. att.; 97.5% confidence interval is incorrect'
 
 
+def test_single_ended_block_solver_synthetic():
+    """Checks whether the block solver gives the same parameters and
+    covariances as the sparse solver, for a setup with transient attenuation
+    and matching sections"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 50
+    nx = 200
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+    ts_ambient = np.ones(nt) * 12
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask1 = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    cold_mask2 = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    warm_mask1 = np.logical_and(x > 0.75 * cable_len, x < 0.875 * cable_len)
+    warm_mask2 = np.logical_and(x > 0.25 * cable_len, x < 0.375 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask1 + cold_mask2] = ts_cold + 273.15
+    temp_real[warm_mask1 + warm_mask2] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    # Add attenuation
+    tr_att = rs.rand(nt) * .2 + 0.8
+    st[int(x.size * 0.4):] *= tr_att
+    tr_att2 = rs.rand(nt) * .2 + 0.8
+    st[int(x.size * 0.6):] *= tr_att2
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm),
+            'ambient': (['time'], ts_ambient)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'ambient': [slice(.52 * cable_len, .58 * cable_len)],
+        'cold':
+            [
+                slice(0.125 * cable_len, 0.25 * cable_len),
+                slice(0.65 * cable_len, 0.70 * cable_len)],
+        'warm': [slice(0.25 * cable_len, 0.375 * cable_len)]}
+    matching_sections = [
+        (
+            slice(.01 * cable_len,
+                  .09 * cable_len), slice(.51 * cable_len,
+                                          .59 * cable_len), True)]
+
+    ds_test = ds.copy(deep=True)
+    ds_test.calibration_single_ended(
+        sections=sections,
+        st_var=1.0,
+        ast_var=1.0,
+        method='wls',
+        matching_sections=matching_sections,
+        trans_att=[40, 60],
+        solver='block')
+
+    assert_almost_equal_verbose(ds_test.gamma.values, gamma, decimal=8)
+    assert_almost_equal_verbose(
+        ds_test.tmpf.values, temp_real - 273.15, decimal=8)
+    assert_almost_equal_verbose(
+        ds_test.isel(trans_att=0).talpha, -np.log(tr_att), decimal=8)
+    assert_almost_equal_verbose(
+        ds_test.isel(trans_att=1).talpha, -np.log(tr_att2), decimal=8)
+
+    # With noise, so that the covariances are meaningful
+    ds.st.values += rs.normal(scale=1., size=ds.st.shape)
+    ds.ast.values += rs.normal(scale=1., size=ds.ast.shape)
+
+    ds_sparse = ds.copy(deep=True)
+    ds_sparse.calibration_single_ended(
+        sections=sections,
+        st_var=1.0,
+        ast_var=1.0,
+        method='wls',
+        matching_sections=matching_sections,
+        trans_att=[40, 60],
+        solver='sparse')
+
+    ds_block = ds.copy(deep=True)
+    ds_block.calibration_single_ended(
+        sections=sections,
+        st_var=1.0,
+        ast_var=1.0,
+        method='wls',
+        matching_sections=matching_sections,
+        trans_att=[40, 60],
+        solver='block')
+
+    np.testing.assert_allclose(
+        ds_block.p_val.values, ds_sparse.p_val.values, rtol=1e-8)
+    np.testing.assert_allclose(
+        ds_block.p_cov.values,
+        ds_sparse.p_cov.values,
+        rtol=1e-5,
+        atol=1e-5 * np.abs(ds_sparse.p_cov.values).max())
+    np.testing.assert_allclose(
+        ds_block.tmpf.values, ds_sparse.tmpf.values, atol=1e-8)
+
+
+def test_single_ended_block_covariance_synthetic():
+    """Checks whether the covariance returned as `BlockCovariance` object
+    equals the dense covariance matrix, and whether it can be used for the
+    confidence intervals"""
+    from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import BlockCovariance
+    from dtscalibration.calibrate_utils import calibration_single_ended_solver
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 20
+    nx = 200
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_or(x < 0.5 * cable_len, x > 0.8 * cable_len)
+    warm_mask = np.invert(cold_mask)  # == False
+    temp_real = np.ones((len(x), nt))
+    temp_real[cold_mask] *= ts_cold + 273.15
+    temp_real[warm_mask] *= ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+    st[int(x.size * 0.4):] *= rs.rand(nt) * .2 + 0.8
+
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold': [
+            slice(0., 0.35 * cable_len),
+            slice(0.85 * cable_len, cable_len)],
+        'warm': [slice(0.5 * cable_len, 0.75 * cable_len)]}
+
+    ds.calibration_single_ended(
+        sections=sections,
+        st_var=1.0,
+        ast_var=1.0,
+        method='wls',
+        trans_att=[40],
+        solver='sparse')
+
+    p_cov = ds.p_cov.values
+    npar = p_cov.shape[0]
+
+    for solver in ['sparse', 'block']:
+        p_val, p_var, p_cov_blocks = calibration_single_ended_solver(
+            ds, st_var=1.0, ast_var=1.0, calc_cov='blocks', solver=solver)
+
+        assert isinstance(p_cov_blocks, BlockCovariance)
+        assert p_cov_blocks.shape == (npar, npar)
+
+        atol = 1e-6 * np.abs(p_cov).max()
+        np.testing.assert_allclose(p_val, ds.p_val.values, rtol=1e-8)
+        np.testing.assert_allclose(p_var, np.diag(p_cov), rtol=1e-6, atol=atol)
+        np.testing.assert_allclose(
+            p_cov_blocks.toarray(), p_cov, rtol=1e-6, atol=atol)
+
+        ix = np.array([0, 1, 5, nt + 3, npar - 1])
+        np.testing.assert_allclose(
+            p_cov_blocks.block(ix, [1, 2]),
+            p_cov[np.ix_(ix, [1, 2])],
+            rtol=1e-6,
+            atol=atol)
+
+        v = rs.normal(size=npar)
+        np.testing.assert_allclose(
+            p_cov_blocks.dot(v),
+            p_cov.dot(v),
+            rtol=1e-6,
+            atol=1e-6 * np.abs(p_cov.dot(v)).max())
+
+    # The sample covariance approaches the covariance
+    sample = p_cov_blocks.rvs(mean=p_val, size=50000, random_state=0)
+    np.testing.assert_allclose(sample.mean(axis=0), p_val, atol=1e-2)
+    np.testing.assert_allclose(
+        np.cov(sample.T), p_cov, atol=0.05 * np.abs(p_cov).max())
+
+    ds.conf_int_single_ended(
+        st_var=1.0, ast_var=1.0, mc_sample_size=50, p_cov=p_cov_blocks)
+
+    assert np.all(np.isfinite(ds.tmpf_mc_var.values))
+    assert np.all(ds.tmpf_mc_var.values > 0.)
+
+
+def test_calibration_block_covariance_conf_int_synthetic():
+    """Checks whether the calibration routines store the covariance as
+    `BlockCovariance` with `calc_cov='blocks'`, with and without fixed
+    parameters, and whether the confidence intervals computed from it equal
+    those of the dense covariance matrix"""
+    from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import BlockCovariance
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 10
+    nx = 100
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = x < 0.5 * cable_len
+    warm_mask = np.invert(cold_mask)  # == False
+    temp_real = np.ones((len(x), nt))
+    temp_real[cold_mask] *= ts_cold + 273.15
+    temp_real[warm_mask] *= ts_warm + 273.15
+
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
+
+    alpha = np.mean(np.log(rst / rast) - np.log(st / ast), axis=1) / 2
+    alpha -= alpha[0]  # the first x-index is where to start counting
+
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+    rst += rs.normal(scale=1., size=rst.shape)
+    rast += rs.normal(scale=1., size=rast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    sections = {
+        'cold': [slice(0., 0.4 * cable_len)],
+        'warm': [slice(0.6 * cable_len, cable_len)]}
+
+    single_fixes = [
+        dict(),
+        dict(fix_gamma=(gamma, 1e-4)),
+        dict(fix_gamma=(gamma, 1e-4), fix_dalpha=(dalpha_p - dalpha_m, 0.))]
+
+    for solver in ['sparse', 'block']:
+        for fixes in single_fixes:
+            ds.calibration_single_ended(
+                sections=sections,
+                st_var=1.,
+                ast_var=1.,
+                method='wls',
+                solver=solver,
+                trans_att=[30.],
+                **fixes)
+            p_cov = ds.p_cov.values
+            ds.conf_int_single_ended(
+                st_var=1., ast_var=1., method='analytic')
+            tmpf_var = ds.tmpf_mc_var.values
+
+            ds.calibration_single_ended(
+                sections=sections,
+                st_var=1.,
+                ast_var=1.,
+                method='wls',
+                solver=solver,
+                trans_att=[30.],
+                calc_cov='blocks',
+                **fixes)
+            p_cov_blocks = ds.p_cov.values.item()
+            assert ds.p_cov.dims == ()
+            assert isinstance(p_cov_blocks, BlockCovariance)
+
+            atol = 1e-6 * np.abs(p_cov).max()
+            np.testing.assert_allclose(
+                p_cov_blocks.toarray(), p_cov, rtol=1e-6, atol=atol)
+
+            ds.conf_int_single_ended(
+                st_var=1., ast_var=1., method='analytic')
+            np.testing.assert_allclose(
+                ds.tmpf_mc_var.values, tmpf_var, rtol=1e-6)
+
+            ds.conf_int_single_ended(
+                st_var=1., ast_var=1., mc_sample_size=20, conf_ints=[50.])
+            assert np.all(np.isfinite(ds.tmpf_mc_var.values))
+
+    double_fixes = [
+        dict(fix_gamma=(gamma, 1e-4)),
+        dict(fix_alpha=(alpha, 1e-6 * np.ones_like(alpha))),
+        dict(
+            fix_gamma=(gamma, 1e-4),
+            fix_alpha=(alpha, 1e-6 * np.ones_like(alpha)))]
+
+    for fixes in double_fixes:
+        ds.calibration_double_ended(
+            sections=sections,
+            st_var=1.,
+            ast_var=1.,
+            rst_var=1.,
+            rast_var=1.,
+            method='wls',
+            solver='sparse',
+            store_tmpw=None,
+            **fixes)
+        p_cov = ds.p_cov.values
+        ds.conf_int_double_ended(
+            st_var=1., ast_var=1., rst_var=1., rast_var=1.,
+            method='analytic')
+        tmpw_var = ds.tmpw_mc_var.values
+
+        ds.calibration_double_ended(
+            sections=sections,
+            st_var=1.,
+            ast_var=1.,
+            rst_var=1.,
+            rast_var=1.,
+            method='wls',
+            solver='sparse',
+            calc_cov='blocks',
+            store_tmpw=None,
+            **fixes)
+        p_cov_blocks = ds.p_cov.values.item()
+        assert isinstance(p_cov_blocks, BlockCovariance)
+
+        atol = 1e-6 * np.abs(p_cov).max()
+        np.testing.assert_allclose(
+            p_cov_blocks.toarray(), p_cov, rtol=1e-6, atol=atol)
+
+        ds.conf_int_double_ended(
+            st_var=1., ast_var=1., rst_var=1., rast_var=1.,
+            method='analytic')
+        np.testing.assert_allclose(
+            ds.tmpw_mc_var.values, tmpw_var, rtol=1e-6)
+
+        ds.conf_int_double_ended(
+            st_var=1., ast_var=1., rst_var=1., rast_var=1.,
+            mc_sample_size=20, conf_ints=[50.])
+        assert np.all(np.isfinite(ds.tmpw_mc_var.values))
+
+    # Falls back to the global random state
+    np.random.seed(0)
+    sample1 = p_cov_blocks.rvs(size=3)
+    np.random.seed(0)
+    sample2 = p_cov_blocks.rvs(size=3)
+    np.testing.assert_array_equal(sample1, sample2)
+
+    pass
+
+
+def test_single_ended_matrix_free_synthetic():
+    """Checks whether the matrix-free coefficient matrix equals the sparse
+    coefficient matrix, and whether the calibration gives the same result,
+    for a setup with transient attenuation and matching sections"""
+    from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import calibration_single_ended_solver
+    from dtscalibration.calibrate_utils import match_sections
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 30
+    nx = 200
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+    ts_ambient = np.ones(nt) * 12
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask1 = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    cold_mask2 = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    warm_mask1 = np.logical_and(x > 0.75 * cable_len, x < 0.875 * cable_len)
+    warm_mask2 = np.logical_and(x > 0.25 * cable_len, x < 0.375 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask1 + cold_mask2] = ts_cold + 273.15
+    temp_real[warm_mask1 + warm_mask2] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st[int(x.size * 0.4):] *= rs.rand(nt) * .2 + 0.8
+    st[int(x.size * 0.6):] *= rs.rand(nt) * .2 + 0.8
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm),
+            'ambient': (['time'], ts_ambient)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'ambient': [slice(.52 * cable_len, .58 * cable_len)],
+        'cold':
+            [
+                slice(0.125 * cable_len, 0.25 * cable_len),
+                slice(0.65 * cable_len, 0.70 * cable_len)],
+        'warm': [slice(0.25 * cable_len, 0.375 * cable_len)]}
+    matching_sections = [
+        (
+            slice(.01 * cable_len,
+                  .09 * cable_len), slice(.51 * cable_len,
+                                          .59 * cable_len), True)]
+
+    for solver in ['sparse', 'block']:
+        ds_sparse = ds.copy(deep=True)
+        ds_sparse.calibration_single_ended(
+            sections=sections,
+            st_var=1.0,
+            ast_var=1.0,
+            method='wls',
+            matching_sections=matching_sections,
+            trans_att=[40, 60],
+            solver=solver)
+
+        ds_op = ds.copy(deep=True)
+        ds_op.calibration_single_ended(
+            sections=sections,
+            st_var=1.0,
+            ast_var=1.0,
+            method='wls',
+            matching_sections=matching_sections,
+            trans_att=[40, 60],
+            solver=solver,
+            matrix_free=True)
+
+        np.testing.assert_allclose(
+            ds_op.p_val.values, ds_sparse.p_val.values, rtol=1e-8)
+        np.testing.assert_allclose(
+            ds_op.p_cov.values,
+            ds_sparse.p_cov.values,
+            rtol=1e-6,
+            atol=1e-6 * np.abs(ds_sparse.p_cov.values).max())
+        np.testing.assert_allclose(
+            ds_op.tmpf.values, ds_sparse.tmpf.values, atol=1e-8)
+
+    matching_indices = match_sections(ds_op, matching_sections)
+    X = calibration_single_ended_solver(
+        ds_op,
+        solver='external',
+        matching_indices=matching_indices)[0]
+    X_op = calibration_single_ended_solver(
+        ds_op,
+        solver='external',
+        matching_indices=matching_indices,
+        matrix_free=True)[0]
+
+    assert X_op.shape == X.shape
+    p = rs.normal(size=X.shape[1])
+    r = rs.normal(size=X.shape[0])
+    np.testing.assert_allclose(X_op.dot(p), X.dot(p), atol=1e-10)
+    np.testing.assert_allclose(X_op.T.dot(r), X.T.dot(r), atol=1e-10)
+    np.testing.assert_allclose(
+        X_op.gram().toarray(), (X.T.dot(X)).toarray(), rtol=1e-10)
+
+
+def test_single_ended_calibration_plan_synthetic():
+    """Checks whether repeated calibrations that share a CalibrationPlan give
+    the same result as calibrations without a plan, and whether the
+    coefficient matrix and the factorization are reused"""
+    from dtscalibration import CalibrationPlan
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 20
+    nx = 200
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    warm_mask = np.logical_and(x > 0.25 * cable_len, x < 0.375 * cable_len)
+    cold_mask2 = np.logical_and(x > 0.65 * cable_len, x < 0.70 * cable_len)
+
+    sections = {
+        'cold':
+            [
+                slice(0.125 * cable_len, 0.25 * cable_len),
+                slice(0.65 * cable_len, 0.70 * cable_len)],
+        'warm': [slice(0.25 * cable_len, 0.375 * cable_len)]}
+
+    def measurement(ts_cold):
+        ts_warm = np.ones(nt) * 20.
+        temp_real = np.ones((len(x), nt)) * 12 + 273.15
+        temp_real[cold_mask + cold_mask2] = ts_cold + 273.15
+        temp_real[warm_mask] = ts_warm + 273.15
+
+        st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+            np.exp(-dalpha_p * x[:, None]) * \
+            np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+        ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+            np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+        st[int(x.size * 0.4):] *= rs.rand(nt) * .2 + 0.8
+        st += rs.normal(scale=1., size=st.shape)
+        ast += rs.normal(scale=1., size=ast.shape)
+
+        return DataStore(
+            {
+                'st': (['x', 'time'], st),
+                'ast': (['x', 'time'], ast),
+                'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+                'cold': (['time'], ts_cold),
+                'warm': (['time'], ts_warm)},
+            coords={
+                'x': x,
+                'time': time},
+            attrs={'isDoubleEnded': '0'})
+
+    for solver in ['sparse', 'block']:
+        plan = CalibrationPlan()
+
+        for ts_cold in [4., 4., 6.]:
+            ds = measurement(np.ones(nt) * ts_cold)
+            ds_plan = ds.copy(deep=True)
+
+            ds.calibration_single_ended(
+                sections=sections,
+                st_var=1.0,
+                ast_var=1.0,
+                method='wls',
+                trans_att=[40],
+                solver=solver)
+            ds_plan.calibration_single_ended(
+                sections=sections,
+                st_var=1.0,
+                ast_var=1.0,
+                method='wls',
+                trans_att=[40],
+                solver=solver,
+                plan=plan)
+
+            np.testing.assert_allclose(
+                ds_plan.p_val.values, ds.p_val.values, rtol=1e-8)
+            np.testing.assert_allclose(
+                ds_plan.tmpf.values, ds.tmpf.values, atol=1e-8)
+
+        assert len(plan) == 1
+        assert plan.hits == 2 and plan.misses == 1
+
+    # ols with the same reference temperatures reuses the factorization
+    plan = CalibrationPlan()
+    facs = []
+
+    for _ in range(2):
+        ds = measurement(np.ones(nt) * 4.)
+        ds.calibration_single_ended(
+            sections=sections,
+            method='ols',
+            trans_att=[40],
+            solver='block',
+            plan=plan)
+        facs.append(next(iter(plan._entries.values()))['fac'])
+
+    assert facs[0] is facs[1]
+
+
+def test_single_ended_chunked_solver_synthetic():
+    """Checks whether accumulating the normal equations per time chunk gives
+    the same result as the block solver, for a setup with transient
+    attenuation and matching sections"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 30
+    nx = 200
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+    ts_ambient = np.ones(nt) * 12
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask1 = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    cold_mask2 = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    warm_mask1 = np.logical_and(x > 0.75 * cable_len, x < 0.875 * cable_len)
+    warm_mask2 = np.logical_and(x > 0.25 * cable_len, x < 0.375 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask1 + cold_mask2] = ts_cold + 273.15
+    temp_real[warm_mask1 + warm_mask2] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st[int(x.size * 0.4):] *= rs.rand(nt) * .2 + 0.8
+    st[int(x.size * 0.6):] *= rs.rand(nt) * .2 + 0.8
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm),
+            'ambient': (['time'], ts_ambient)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'ambient': [slice(.52 * cable_len, .58 * cable_len)],
+        'cold':
+            [
+                slice(0.125 * cable_len, 0.25 * cable_len),
+                slice(0.65 * cable_len, 0.70 * cable_len)],
+        'warm': [slice(0.25 * cable_len, 0.375 * cable_len)]}
+    matching_sections = [
+        (
+            slice(.01 * cable_len,
+                  .09 * cable_len), slice(.51 * cable_len,
+                                          .59 * cable_len), True)]
+
+    ds_block = ds.copy(deep=True)
+    ds_block.calibration_single_ended(
+        sections=sections,
+        st_var=1.0,
+        ast_var=1.0,
+        method='wls',
+        matching_sections=matching_sections,
+        trans_att=[40, 60],
+        solver='block')
+
+    for ds_chunked, time_chunks in [
+            (ds.copy(deep=True).chunk({'time': 7}), None),
+            (ds.copy(deep=True), 4)]:
+        ds_chunked.calibration_single_ended(
+            sections=sections,
+            st_var=1.0,
+            ast_var=1.0,
+            method='wls',
+            matching_sections=matching_sections,
+            trans_att=[40, 60],
+            solver='chunked',
+            time_chunks=time_chunks,
+            calc_cov=True)
+
+        np.testing.assert_allclose(
+            ds_chunked.p_val.values, ds_block.p_val.values, rtol=1e-8)
+        np.testing.assert_allclose(
+            ds_chunked.p_cov.values,
+            ds_block.p_cov.values,
+            rtol=1e-6,
+            atol=1e-6 * np.abs(ds_block.p_cov.values).max())
+        np.testing.assert_allclose(
+            ds_chunked.tmpf.values, ds_block.tmpf.values, atol=1e-8)
+
+    # Only the reduced system of gamma and dalpha is accumulated
+    ds_chunked.calibration_single_ended(
+        sections=sections,
+        st_var=1.0,
+        ast_var=1.0,
+        method='wls',
+        matching_sections=matching_sections,
+        trans_att=[40, 60],
+        solver='chunked',
+        time_chunks=4,
+        calc_cov='blocks')
+    p_cov_blocks = ds_chunked.p_cov.values.item()
+
+    assert p_cov_blocks.fac['S'].shape == (2, 2)
+    assert p_cov_blocks.fac['nblock'] == nt
+    np.testing.assert_allclose(
+        p_cov_blocks.toarray(),
+        ds_block.p_cov.values,
+        rtol=1e-6,
+        atol=1e-6 * np.abs(ds_block.p_cov.values).max())
+
+
+def test_single_ended_online_calibration_synthetic():
+    """Checks whether the recursive calibration, with one time step at a
+    time, gives the same gamma, dalpha, and temperature of the last time step
+    as the calibration of all time steps at once"""
+    from dtscalibration import DataStore
+    from dtscalibration import OnlineSingleEndedCalibration
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 30
+    nx = 200
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4. + rs.normal(scale=0.1, size=nt)
+    ts_warm = np.ones(nt) * 20. + rs.normal(scale=0.1, size=nt)
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask1 = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    cold_mask2 = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    warm_mask = np.logical_and(x > 0.25 * cable_len, x < 0.375 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask1 + cold_mask2] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st[int(x.size * 0.4):] *= rs.rand(nt) * .2 + 0.8
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold':
+            [
+                slice(0.125 * cable_len, 0.25 * cable_len),
+                slice(0.65 * cable_len, 0.70 * cable_len)],
+        'warm': [slice(0.25 * cable_len, 0.375 * cable_len)]}
+
+    ds.calibration_single_ended(
+        sections=sections,
+        st_var=1.0,
+        ast_var=1.0,
+        method='wls',
+        trans_att=[40],
+        solver='block')
+
+    cal = OnlineSingleEndedCalibration(ds, st_var=1.0, ast_var=1.0)
+
+    for it in range(nt):
+        tmpf = cal.update(
+            st[:, it], ast[:, it], {
+                'cold': ts_cold[it],
+                'warm': ts_warm[it]})
+
+    assert cal.nt == nt
+    np.testing.assert_allclose(cal.gamma, ds.gamma.values, rtol=1e-10)
+    np.testing.assert_allclose(cal.dalpha, ds.dalpha.values, rtol=1e-8)
+    np.testing.assert_allclose(
+        cal.p_cov, ds.p_cov.values[:2, :2], rtol=1e-6)
+    np.testing.assert_allclose(cal.c, ds.c.values[-1], rtol=1e-8)
+    np.testing.assert_allclose(tmpf, ds.tmpf.values[:, -1], atol=1e-8)
+
+
+def test_single_ended_preconditioned_lsqr_synthetic():
+    """Checks whether the preconditioners of LSQR give the same solution in
+    fewer iterations, and whether the diagnostics are stored"""
+    from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import calibration_single_ended_solver
+    from dtscalibration.calibrate_utils import wls_block
+    from dtscalibration.calibrate_utils import wls_sparse
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 50
+    nx = 200
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask1 = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    cold_mask2 = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    warm_mask = np.logical_and(x > 0.25 * cable_len, x < 0.375 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask1 + cold_mask2] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st[int(x.size * 0.4):] *= rs.rand(nt) * .2 + 0.8
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold':
+            [
+                slice(0.125 * cable_len, 0.25 * cable_len),
+                slice(0.65 * cable_len, 0.70 * cable_len)],
+        'warm': [slice(0.25 * cable_len, 0.375 * cable_len)]}
+    ds.sections = sections
+    ds.set_trans_att([40])
+
+    X, y, w, p0 = calibration_single_ended_solver(
+        ds, 1.0, 1.0, solver='external')
+    groups = np.concatenate(([-1, -1], np.arange(nt), np.arange(nt)))
+    p_block, p_var_block = wls_block(X, y, w=w, groups=groups, x0=p0)
+
+    iterations = dict()
+    for precondition in [None, 'columns', 'blocks']:
+        diagnostics = dict()
+        p_sol, p_var = wls_sparse(
+            X,
+            y,
+            w=w,
+            x0=p0,
+            groups=groups,
+            precondition=precondition,
+            diagnostics=diagnostics)
+        iterations[precondition] = diagnostics['iterations']
+
+        np.testing.assert_allclose(p_sol, p_block, rtol=1e-10)
+        assert np.isfinite(diagnostics['cond_estimate'])
+        assert diagnostics['wall_time'] >= 0.
+
+    # only the block preconditioner gives the exact variance
+    np.testing.assert_allclose(p_var, p_var_block, rtol=1e-8)
+    assert iterations['blocks'] < iterations['columns'] < iterations[None]
+
+    ds.calibration_single_ended(
+        st_var=1.0,
+        ast_var=1.0,
+        method='wls',
+        solver='sparse',
+        precondition='blocks')
+    assert ds.p_val.attrs['solver'] == 'sparse'
+    assert ds.p_val.attrs['precondition'] == 'blocks'
+    assert ds.p_val.attrs['iterations'] > 0
+    assert ds.p_val.attrs['residual_norm'] > 0.
+
+
+def test_single_ended_direct_solver_synthetic():
+    """Checks whether the direct sparse backend gives the same parameters
+    and covariance as the block solver, and falls back to LSQR if the normal
+    equations are singular"""
+    from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import wls_sparse
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 30
+    nx = 200
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    warm_mask = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold': [slice(0.125 * cable_len, 0.25 * cable_len)],
+        'warm': [slice(0.625 * cable_len, 0.75 * cable_len)]}
+
+    ds_block = ds.copy()
+    ds_block.calibration_single_ended(
+        sections=sections,
+        st_var=1.0,
+        ast_var=1.0,
+        method='wls',
+        solver='block')
+    ds.calibration_single_ended(
+        sections=sections,
+        st_var=1.0,
+        ast_var=1.0,
+        method='wls',
+        solver='direct')
+
+    assert ds.p_val.attrs['backend'] == 'splu'
+    np.testing.assert_allclose(ds.p_val, ds_block.p_val, rtol=1e-8)
+    np.testing.assert_allclose(ds.p_cov, ds_block.p_cov, rtol=1e-6, atol=1e-20)
+    np.testing.assert_allclose(ds.tmpf, ds_block.tmpf, rtol=1e-10)
+
+    # A duplicated column makes the normal equations singular
+    X = sp.csr_matrix(rs.normal(size=(50, 3)))
+    X = sp.hstack((X, X[:, 2])).tocsr()
+    y = X.dot(np.ones(4)) + rs.normal(scale=0.1, size=50)
+    diagnostics = dict()
+    p_sol, _ = wls_sparse(
+        X, y, x0=np.zeros(4), backend='splu', diagnostics=diagnostics)
+    assert diagnostics['backend'] == 'lsqr'
+    np.testing.assert_allclose(p_sol[2], p_sol[3])
+
+
+def test_single_ended_fixed_gamma_dalpha_closed_form_synthetic():
+    """Checks whether the closed-form solution of C and the transient
+    attenuation with fixed gamma and dalpha, is equal to that of statsmodels
+    """
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 10
+    nx = 100
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    warm_mask = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st[int(x.size * 0.4):] *= rs.rand(nt) * .2 + 0.8
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold': [slice(0.125 * cable_len, 0.25 * cable_len)],
+        'warm': [slice(0.625 * cable_len, 0.75 * cable_len)]}
+
+    ds_stats = ds.copy()
+
+    for ds_i, solver in [(ds, 'sparse'), (ds_stats, 'stats')]:
+        ds_i.calibration_single_ended(
+            sections=sections,
+            st_var=1.0,
+            ast_var=1.0,
+            method='wls',
+            solver=solver,
+            trans_att=[40.],
+            fix_gamma=(gamma, 0.1),
+            fix_dalpha=(dalpha_p - dalpha_m, 1e-10))
+
+    assert ds.p_val.attrs['solver'] == 'time_local'
+    np.testing.assert_allclose(ds.p_val, ds_stats.p_val, rtol=1e-12)
+    np.testing.assert_allclose(
+        ds.p_cov, ds_stats.p_cov, rtol=1e-8, atol=1e-20)
+    np.testing.assert_allclose(ds.tmpf, ds_stats.tmpf, rtol=1e-12)
+
+
+def test_double_ended_fixed_gamma_alpha_closed_form_synthetic():
+    """Checks whether the closed-form solution of D_fw, D_bw and the transient
+    attenuation with fixed gamma and alpha, computed directly from the Stokes
+    data, is equal to that of statsmodels"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 10
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, 100)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = x < 0.5 * cable_len
+    warm_mask = np.invert(cold_mask)  # == False
+    temp_real = np.ones((len(x), nt))
+    temp_real[cold_mask] *= ts_cold + 273.15
+    temp_real[warm_mask] *= ts_warm + 273.15
+
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
+
+    alpha = np.mean(np.log(rst / rast) - np.log(st / ast), axis=1) / 2
+    alpha -= alpha[0]  # the first x-index is where to start counting
+
+    st[int(x.size * 0.6):] *= rs.rand(nt) * .2 + 0.8
+    rst[:int(x.size * 0.6)] *= rs.rand(nt) * .2 + 0.8
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+    rst += rs.normal(scale=1., size=rst.shape)
+    rast += rs.normal(scale=1., size=rast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    sections = {
+        'cold': [slice(0., 0.35 * cable_len)],
+        'warm': [slice(0.67 * cable_len, cable_len)]}
+
+    ds_stats = ds.copy()
+
+    for ds_i, solver in [(ds, 'sparse'), (ds_stats, 'stats')]:
+        ds_i.calibration_double_ended(
+            sections=sections,
+            st_var=1.0,
+            ast_var=1.0,
+            rst_var=1.0,
+            rast_var=1.0,
+            method='wls',
+            solver=solver,
+            trans_att=[50.],
+            store_tmpw=None,
+            fix_gamma=(gamma, 0.1),
+            fix_alpha=(alpha, 1e-8 * np.ones_like(alpha)))
+
+    assert ds.p_val.attrs['solver'] == 'time_local'
+    np.testing.assert_allclose(ds.p_val, ds_stats.p_val, rtol=1e-12)
+    np.testing.assert_allclose(
+        ds.p_cov, ds_stats.p_cov, rtol=1e-8, atol=1e-20)
+    np.testing.assert_allclose(ds.tmpf, ds_stats.tmpf, atol=1e-10)
+    np.testing.assert_allclose(ds.tmpb, ds_stats.tmpb, atol=1e-10)
+
+
+def test_single_ended_analytic_conf_int_synthetic():
+    """Checks the delta-method variance of the single-ended temperature with
+    a numerical Jacobian"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 5
+    nx = 50
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    warm_mask = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st[int(x.size * 0.4):] *= rs.rand(nt) * .2 + 0.8
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold': [slice(0.125 * cable_len, 0.25 * cable_len)],
+        'warm': [slice(0.625 * cable_len, 0.75 * cable_len)]}
+
+    st_var = 1.
+    ast_var = np.linspace(1., 2., nx)[:, None]
+    ds.calibration_single_ended(
+        sections=sections,
+        st_var=st_var,
+        ast_var=ast_var,
+        method='wls',
+        trans_att=[40.])
+    ds.conf_int_single_ended(
+        st_var=st_var,
+        ast_var=ast_var,
+        conf_ints=[2.5, 50., 97.5],
+        method='analytic')
+
+    def tmpf(p, st, ast):
+        ta = np.where(x[:, None] >= 40., p[2 + nt:], 0.)
+        return p[0] / (
+            np.log(st) - np.log(ast) + p[2:2 + nt] + ta
+            + p[1] * x[:, None]) - 273.15
+
+    p_val = ds.p_val.values
+    p_cov = ds.p_cov.values
+
+    # central differences
+    dp = 1e-5 * np.eye(p_val.size)
+    jac = np.stack(
+        [
+            (tmpf(p_val + dpi, st, ast) - tmpf(p_val - dpi, st, ast)) / 2e-5
+            for dpi in dp],
+        axis=-1)
+    jac_st = (tmpf(p_val, st + 1e-3, ast) - tmpf(p_val, st - 1e-3, ast)) / 2e-3
+    jac_ast = (
+        tmpf(p_val, st, ast + 1e-3) - tmpf(p_val, st, ast - 1e-3)) / 2e-3
+    var = np.einsum('xti,ij,xtj->xt', jac, p_cov, jac) + \
+        jac_st**2 * st_var + jac_ast**2 * ast_var
+
+    assert 'mc' not in ds.coords
+    np.testing.assert_allclose(ds.tmpf_mc_var, var, rtol=1e-6)
+    np.testing.assert_allclose(ds.tmpf_mc.sel(CI=50.), ds.tmpf, rtol=1e-10)
+    np.testing.assert_allclose(
+        ds.tmpf_mc.sel(CI=97.5) - ds.tmpf,
+        1.959964 * ds.tmpf_mc_var**0.5,
+        rtol=1e-6)
+
+
+def test_single_ended_mc_streaming_synthetic():
+    """Checks the reductions of the Monte Carlo samples that are drawn per
+    tile and per chunk against the reductions of all samples at once"""
+    from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import MonteCarloStream
+    from dtscalibration.calibrate_utils import mc_stream_average
+    from dtscalibration.calibrate_utils import mc_stream_conf_int
+    from dtscalibration.calibrate_utils import mc_temperature_single_ended
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 5
+    nx = 50
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    warm_mask = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st[int(x.size * 0.4):] *= rs.rand(nt) * .2 + 0.8
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold': [slice(0.125 * cable_len, 0.25 * cable_len)],
+        'warm': [slice(0.625 * cable_len, 0.75 * cable_len)]}
+
+    ds.calibration_single_ended(
+        sections=sections,
+        st_var=1.,
+        ast_var=1.,
+        method='wls',
+        trans_att=[40.])
+
+    mc_sample_size = 1000
+    p_mc = rs.multivariate_normal(
+        ds.p_val.values, ds.p_cov.values, size=mc_sample_size)
+    stream = MonteCarloStream(
+        ds,
+        p_mc, ['st', 'ast'], [1., np.linspace(1., 2., nx)[:, None]],
+        lambda p, r, ix, it: mc_temperature_single_ended(ds, p, r, ix, it),
+        mc_chunk_size=300,
+        tile_size=60,
+        random_state=rs)
+
+    assert len(stream.tiles) == 5 and len(stream.mc_chunks) == 4
+
+    # all samples at once
+    tmpf_set = np.zeros((mc_sample_size, nx, nt))
+
+    for (jx, jt), seeds in zip(stream.tiles, stream.seeds):
+        for mc, seed in zip(stream.mc_chunks, seeds):
+            tmpf_set[mc, jx, jt] = stream.samples(jx, jt, mc, seed)['tmpf']
+
+    tmpf_var = tmpf_set.var(axis=0, ddof=1)
+
+    tmpf_var_stream, tmpf_ci_stream = mc_stream_conf_int(
+        stream, ['tmpf'], conf_ints=[2.5, 50., 97.5])['tmpf']
+
+    np.testing.assert_allclose(tmpf_var_stream, tmpf_var, rtol=1e-10)
+
+    # the histograms are accurate to a fraction of the standard deviation
+    tmpf_ci = np.percentile(tmpf_set, [2.5, 50., 97.5], axis=0)
+    assert np.all(np.abs(tmpf_ci_stream - tmpf_ci) < 0.02 * tmpf_var**0.5)
+
+    out = mc_stream_average(
+        stream, ['tmpf'], {'tmpf': ds.tmpf.values},
+        conf_ints=[2.5, 97.5],
+        flag1_axes=[1],
+        flag2_axes=[0])['tmpf']
+
+    # flag 1: pooled over mc and time
+    avg1_var = (tmpf_set - ds.tmpf.values).swapaxes(0, 1).reshape(
+        (nx, -1)).var(axis=1, ddof=1)
+    np.testing.assert_allclose(out['avg1', 1][0], avg1_var, rtol=1e-10)
+
+    # flag 2: inverse-variance weighted average over x of each sample
+    avg2_var = 1 / (1 / tmpf_var).sum(axis=0)
+    avg2_set = (tmpf_set / tmpf_var).sum(axis=1) * avg2_var
+    np.testing.assert_allclose(out['avg2', 0][0], avg2_var, rtol=1e-10)
+    np.testing.assert_allclose(out['avg2', 0][1], avg2_set, rtol=1e-10)
+    np.testing.assert_allclose(
+        out['avg2', 0][2], np.percentile(avg2_set, [2.5, 97.5], axis=0))
+
+
+def test_double_ended_mc_streaming_synthetic():
+    """Checks the streaming reductions of conf_int_double_ended() and
+    average_double_ended() against those of the (mc, x, time) sets, for the
+    same mc_seed"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 4
+    nx = 40
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = x < 0.3 * cable_len
+    warm_mask = x > 0.7 * cable_len
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
+
+    st[x >= 50.] *= 0.9
+    rst[x < 50.] *= 0.8
+    st, ast, rst, rast = [
+        a + rs.normal(scale=1., size=a.shape) for a in (st, ast, rst, rast)]
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    sections = {
+        'cold': [slice(0., 0.3 * cable_len)],
+        'warm': [slice(0.7 * cable_len, cable_len)]}
+
+    ds.calibration_double_ended(
+        sections=sections,
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        method='wls',
+        solver='sparse',
+        trans_att=[50.],
+        store_tmpw=None)
+
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        store_ta='talpha',
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        conf_ints=[2.5, 50., 97.5],
+        mc_sample_size=500,
+        mc_seed=0)
+
+    ds_set = ds.copy()
+    ds_set.conf_int_double_ended(**kwargs)
+    ds_stream = ds.copy()
+    ds_stream.conf_int_double_ended(
+        mc_streaming=True, mc_chunk_size=70, **kwargs)
+
+    for label in ['tmpf', 'tmpb', 'tmpw']:
+        var = ds_set[label + '_mc_var'].values
+        np.testing.assert_allclose(
+            ds_stream[label + '_mc_var'].values, var, rtol=1e-10)
+
+        # the tails are interpolated from the histograms instead of between
+        # the order statistics, which are a fraction of the standard
+        # deviation apart
+        assert np.all(
+            np.abs(ds_stream[label + '_mc'].values -
+                   ds_set[label + '_mc'].values) < 0.2 * var**0.5)
+
+    # weighted with the variances of tmpf and tmpb
+    np.testing.assert_allclose(
+        ds_stream.tmpw.values, ds_set.tmpw.values, rtol=1e-12)
+
+    for flags in [dict(ci_avg_time_flag1=True, ci_avg_time_isel=[1, 2, 3]),
+                  dict(ci_avg_time_flag2=True, ci_avg_time_isel=[1, 2, 3]),
+                  dict(ci_avg_x_flag1=True, ci_avg_x_sel=slice(20., 80.)),
+                  dict(ci_avg_x_flag2=True, ci_avg_x_sel=slice(20., 80.))]:
+        ds_set = ds.copy()
+        ds_set.average_double_ended(**flags, **kwargs)
+        ds_stream = ds.copy()
+        ds_stream.average_double_ended(
+            mc_streaming=True, mc_chunk_size=70, **flags, **kwargs)
+
+        suffix = '_avg' if 'ci_avg_time_isel' in flags else '_avgx'
+        suffix += '1' if 'ci_avg_time_flag1' in flags or \
+            'ci_avg_x_flag1' in flags else '2'
+
+        for label in ['tmpf', 'tmpb', 'tmpw']:
+            if label + suffix == 'tmpw_avgx1':
+                # the (mc, x, time) sets keep the mc dimension of its variance
+                np.testing.assert_allclose(
+                    ds_stream[label + suffix].values,
+                    ds_set[label + suffix].values,
+                    rtol=1e-12)
+                continue
+
+            var = ds_set[label + '_mc' + suffix + '_var'].values
+            np.testing.assert_allclose(
+                ds_stream[label + '_mc' + suffix + '_var'].values,
+                var,
+                rtol=1e-10)
+            np.testing.assert_allclose(
+                ds_stream[label + suffix].values,
+                ds_set[label + suffix].values,
+                rtol=1e-12)
+            assert np.all(
+                np.abs(ds_stream[label + '_mc' + suffix].values -
+                       ds_set[label + '_mc' + suffix].values)
+                < 0.2 * var**0.5)
+
+    pass
+
+
+def test_mc_percentile_chunked_mc_synthetic():
+    """Checks the percentiles from the histograms of the blocks that are
+    chunked along the mc dimension against np.percentile of all samples"""
+    import dask.array as da
+
+    from dtscalibration.calibrate_utils import mc_chunks
+    from dtscalibration.calibrate_utils import mc_percentile
+
+    rs = np.random.RandomState(0)
+    samples = rs.normal(loc=20., scale=0.5, size=(2000, 30, 8))
+    conf_ints = [2.5, 50., 97.5]
+    nbins = 500
+
+    chunks = mc_chunks(samples.shape, mc_chunk_size=300, nbins=nbins)
+    assert chunks[0] == (300,) * 6 + (200,)
+
+    for axis in [0, (0, 1)]:
+        desired = np.percentile(samples, conf_ints, axis=axis)
+        width = (
+            samples.max(axis=axis) - samples.min(axis=axis)) / nbins
+
+        # single chunk along the reduced axes: np.percentile per block
+        single = mc_percentile(
+            da.from_array(samples, chunks=(-1, -1, 4)), conf_ints, axis=axis)
+        np.testing.assert_allclose(single.compute(), desired)
+
+        # chunked along mc: merged histograms
+        chunked = da.from_array(samples, chunks=(300, 10, 4))
+        actual = mc_percentile(chunked, conf_ints, axis=axis, nbins=nbins)
+        assert actual.shape == desired.shape
+        assert np.all(np.abs(actual.compute() - desired) < 2 * width)
+
+    pass
+
+
+def test_single_ended_mc_seed_synthetic():
+    """Checks that the Monte Carlo samples drawn with `mc_seed` do not depend
+    on the chunks of the mc dimension, and that streaming draws the same
+    samples"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 4
+    nx = 40
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    warm_mask = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold': [slice(0.125 * cable_len, 0.25 * cable_len)],
+        'warm': [slice(0.625 * cable_len, 0.75 * cable_len)]}
+
+    ds.calibration_single_ended(
+        sections=sections, st_var=1., ast_var=1., method='wls')
+
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        st_var=1.,
+        ast_var=1.,
+        mc_sample_size=200,
+        remove_mc_set_flag=False)
+
+    ds.conf_int_single_ended(mc_seed=0, **kwargs)
+    desired_set = ds.tmpf_mc_set.values
+    desired_var = ds.tmpf_mc_var.values
+
+    ds.conf_int_single_ended(mc_seed=0, mc_chunk_size=30, **kwargs)
+    assert len(ds.tmpf_mc_set.chunks[0]) == 7
+    np.testing.assert_array_equal(ds.tmpf_mc_set.values, desired_set)
+
+    ds.conf_int_single_ended(mc_seed=1, **kwargs)
+    assert not np.any(ds.tmpf_mc_set.values == desired_set)
+
+    ds.conf_int_single_ended(
+        p_val='p_val',
+        p_cov='p_cov',
+        st_var=1.,
+        ast_var=1.,
+        mc_sample_size=200,
+        mc_streaming=True,
+        mc_chunk_size=17,
+        mc_seed=0)
+    np.testing.assert_allclose(ds.tmpf_mc_var.values, desired_var, rtol=1e-10)
+
+    pass
+
+
+def test_average_single_ended_mc_samples_synthetic():
+    """Checks that the averages of a shared MonteCarloStream equal those of
+    separate draws with the same seed"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 6
+    nx = 60
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    warm_mask = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold': [slice(0.125 * cable_len, 0.25 * cable_len)],
+        'warm': [slice(0.625 * cable_len, 0.75 * cable_len)]}
+
+    ds.calibration_single_ended(
+        sections=sections, st_var=1., ast_var=1., method='wls')
+
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        st_var=1.,
+        ast_var=1.,
+        conf_ints=[2.5, 97.5],
+        mc_sample_size=200)
+
+    stream = ds.monte_carlo_single_ended(
+        p_val='p_val',
+        p_cov='p_cov',
+        st_var=1.,
+        ast_var=1.,
+        mc_sample_size=200,
+        mc_chunk_size=50,
+        mc_seed=0)
+
+    ds.average_single_ended(
+        ci_avg_time_flag1=True, mc_samples=stream, **kwargs)
+    avg1 = ds.tmpf_mc_avg1.values
+    avg1_var = ds.tmpf_mc_avg1_var.values
+
+    # the moments per cell are kept, also for selections of the stream
+    assert 'tmpf' in stream.cells
+    sub = stream.select(ix=np.arange(10, 30), it=[1, 4])
+    np.testing.assert_array_equal(
+        sub.cells['tmpf'].var(), ds.tmpf_mc_var.values[10:30][:, [1, 4]])
+
+    ds.average_single_ended(
+        ci_avg_x_flag2=True,
+        ci_avg_x_isel=range(10, 30),
+        mc_samples=stream,
+        **kwargs)
+    avgx2 = ds.tmpf_mc_avgx2.values
+    avgx2_var = ds.tmpf_mc_avgx2_var.values
+
+    ds.average_single_ended(
+        ci_avg_time_flag1=True, mc_streaming=True, mc_seed=0, **kwargs)
+    np.testing.assert_allclose(ds.tmpf_mc_avg1.values, avg1, rtol=1e-12)
+    np.testing.assert_allclose(
+        ds.tmpf_mc_avg1_var.values, avg1_var, rtol=1e-12)
+
+    # the in-memory sets of the same seed
+    ds.average_single_ended(
+        ci_avg_x_flag2=True, ci_avg_x_isel=range(10, 30), mc_seed=0,
+        **kwargs)
+    np.testing.assert_allclose(ds.tmpf_mc_avgx2.values, avgx2, rtol=1e-10)
+    np.testing.assert_allclose(
+        ds.tmpf_mc_avgx2_var.values, avgx2_var, rtol=1e-10)
+
+    pass
+
+
+def test_average_double_ended_mc_samples_synthetic():
+    """Checks that the confidence intervals and averages of a shared
+    MonteCarloStream of a double-ended setup equal those of separate draws
+    with the same seed"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 4
+    nx = 40
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = x < 0.3 * cable_len
+    warm_mask = x > 0.7 * cable_len
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
+
+    st[x >= 50.] *= 0.9
+    rst[x < 50.] *= 0.8
+    st, ast, rst, rast = [
+        a + rs.normal(scale=1., size=a.shape) for a in (st, ast, rst, rast)]
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    sections = {
+        'cold': [slice(0., 0.3 * cable_len)],
+        'warm': [slice(0.7 * cable_len, cable_len)]}
+
+    ds.calibration_double_ended(
+        sections=sections,
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        method='wls',
+        solver='sparse',
+        trans_att=[50.],
+        store_tmpw=None)
+
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        store_ta='talpha',
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        conf_ints=[2.5, 97.5],
+        mc_sample_size=200)
+
+    stream = ds.monte_carlo_double_ended(
+        p_val='p_val',
+        p_cov='p_cov',
+        store_ta='talpha',
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        mc_sample_size=200,
+        mc_chunk_size=50,
+        mc_seed=0)
+
+    ds.conf_int_double_ended(mc_samples=stream, **kwargs)
+    desired = {
+        k: ds[k].values
+        for k in ['tmpf_mc_var', 'tmpb_mc_var', 'tmpw_mc_var', 'tmpw_mc']}
+
+    ds.average_double_ended(
+        ci_avg_time_flag1=True, mc_samples=stream, **kwargs)
+    avg1 = {
+        k: ds[k].values
+        for k in ['tmpf_mc_avg1_var', 'tmpw_mc_avg1_var', 'tmpw_mc_avg1']}
+
+    ds.average_double_ended(
+        ci_avg_x_flag2=True,
+        ci_avg_x_isel=range(10, 30),
+        mc_samples=stream,
+        **kwargs)
+    avgx2 = {
+        k: ds[k].values
+        for k in ['tmpb_mc_avgx2_var', 'tmpw_mc_avgx2_var', 'tmpw_mc_avgx2']}
+
+    # separate draws with the same seed
+    ds.conf_int_double_ended(
+        mc_streaming=True, mc_chunk_size=50, mc_seed=0, **kwargs)
+
+    for k, v in desired.items():
+        np.testing.assert_allclose(ds[k].values, v, rtol=1e-12)
+
+    ds.average_double_ended(
+        ci_avg_time_flag1=True,
+        mc_streaming=True,
+        mc_chunk_size=50,
+        mc_seed=0,
+        **kwargs)
+
+    for k, v in avg1.items():
+        np.testing.assert_allclose(ds[k].values, v, rtol=1e-12)
+
+    ds.average_double_ended(
+        ci_avg_x_flag2=True,
+        ci_avg_x_isel=range(10, 30),
+        mc_streaming=True,
+        mc_chunk_size=50,
+        mc_seed=0,
+        **kwargs)
+
+    for k, v in avgx2.items():
+        np.testing.assert_allclose(ds[k].values, v, rtol=1e-12)
+
+    pass
+
+
+def test_conf_int_single_ended_mc_sampling_synthetic():
+    """Checks the strata of the Latin hypercube samples, and that the
+    in-memory and streaming Latin hypercube and Sobol' samples are equal"""
+    from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import RandomStreams
+
+    rs = np.random.RandomState(0)
+
+    # a single sample per stratum of each position, regardless of the chunk
+    streams = RandomStreams(0)
+    u = streams.uniform('st', range(50), np.arange(7), lhs_size=50)
+    np.testing.assert_array_equal(
+        np.sort(np.floor(u * 50), axis=0),
+        np.tile(np.arange(50.)[:, None], (1, 7)))
+    np.testing.assert_array_equal(
+        streams.uniform('st', range(10, 20), [3, 5], lhs_size=50),
+        u[10:20][:, [3, 5]])
+
+    for lhs_size in [1, 7]:
+        np.testing.assert_array_equal(
+            np.sort(streams.strata('st', range(lhs_size), [0, 9], lhs_size),
+                    axis=0),
+            np.tile(np.arange(lhs_size)[:, None], (1, 2)))
+
+    cable_len = 100.
+    nt = 5
+    nx = 40
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    warm_mask = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold': [slice(0.125 * cable_len, 0.25 * cable_len)],
+        'warm': [slice(0.625 * cable_len, 0.75 * cable_len)]}
+
+    ds.calibration_single_ended(
+        sections=sections, st_var=1., ast_var=1., method='wls')
+
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        st_var=1.,
+        ast_var=1.,
+        mc_sample_size=64,
+        mc_seed=0)
+
+    for mc_sampling in ['lhs', 'sobol']:
+        ds.conf_int_single_ended(
+            mc_sampling=mc_sampling, remove_mc_set_flag=False, **kwargs)
+        desired_var = ds.tmpf_mc_var.values
+
+        if mc_sampling == 'lhs':
+            # the noise of each (x, time) is stratified over the samples
+            z = (ds.r_st - ds.st) / 1.
+            strata = np.floor(stats.norm.cdf(z.values) * 64)
+            np.testing.assert_array_equal(
+                np.sort(strata, axis=0),
+                np.broadcast_to(np.arange(64.)[:, None, None], strata.shape))
+
+        ds.conf_int_single_ended(
+            mc_sampling=mc_sampling,
+            mc_streaming=True,
+            mc_chunk_size=10,
+            **kwargs)
+        np.testing.assert_allclose(
+            ds.tmpf_mc_var.values, desired_var, rtol=1e-10)
+
+    pass
+
+
+def test_conf_int_double_ended_mc_sampling_synthetic():
+    """Checks the strata of the Latin hypercube samples of a double-ended
+    setup, that the in-memory and streaming low-discrepancy samples are
+    equal, and that their variances agree with those of many pseudo-random
+    samples"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 4
+    nx = 40
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = x < 0.3 * cable_len
+    warm_mask = x > 0.7 * cable_len
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
+
+    st[x >= 50.] *= 0.9
+    rst[x < 50.] *= 0.8
+    st, ast, rst, rast = [
+        a + rs.normal(scale=1., size=a.shape) for a in (st, ast, rst, rast)]
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    sections = {
+        'cold': [slice(0., 0.3 * cable_len)],
+        'warm': [slice(0.7 * cable_len, cable_len)]}
+
+    ds.calibration_double_ended(
+        sections=sections,
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        method='wls',
+        solver='sparse',
+        trans_att=[50.],
+        store_tmpw=None)
+
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        store_ta='talpha',
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        mc_seed=0)
+    labels = ['tmpf_mc_var', 'tmpb_mc_var', 'tmpw_mc_var']
+
+    ds.conf_int_double_ended(
+        mc_sample_size=2000, mc_streaming=True, mc_chunk_size=500, **kwargs)
+    reference = {k: ds[k].values for k in labels}
+
+    for mc_sampling in ['lhs', 'sobol']:
+        ds.conf_int_double_ended(
+            mc_sample_size=128,
+            mc_sampling=mc_sampling,
+            remove_mc_set_flag=False,
+            **kwargs)
+        desired = {k: ds[k].values for k in labels}
+
+        if mc_sampling == 'lhs':
+            # the noise of each (x, time) is stratified over the samples
+            for k in ['st', 'rast']:
+                z = (ds['r_' + k] - ds[k]) / 1.
+                strata = np.floor(stats.norm.cdf(z.values) * 128)
+                np.testing.assert_array_equal(
+                    np.sort(strata, axis=0),
+                    np.broadcast_to(
+                        np.arange(128.)[:, None, None], strata.shape))
+
+        for k in labels:
+            ratio = desired[k] / reference[k]
+            assert np.abs(ratio.mean() - 1) < 0.05
+            assert np.all(np.abs(ratio - 1) < 0.5)
+
+        ds.conf_int_double_ended(
+            mc_sample_size=128,
+            mc_sampling=mc_sampling,
+            mc_streaming=True,
+            mc_chunk_size=10,
+            **kwargs)
+
+        for k in labels:
+            np.testing.assert_allclose(ds[k].values, desired[k], rtol=1e-10)
+
+    pass
+
+
+def test_single_ended_mc_tol_synthetic():
+    """Checks that the adaptive number of samples per tile meets the
+    tolerance of the standard errors, and that the averages have the same
+    number of samples everywhere"""
+    from scipy.stats import norm
+
+    from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import MonteCarloStream
+    from dtscalibration.calibrate_utils import RandomStreams
+    from dtscalibration.calibrate_utils import mc_stream_conf_int
+    from dtscalibration.calibrate_utils import mc_temperature_single_ended
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 5
+    nx = 50
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    warm_mask = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold': [slice(0.125 * cable_len, 0.25 * cable_len)],
+        'warm': [slice(0.625 * cable_len, 0.75 * cable_len)]}
+
+    ds.calibration_single_ended(
+        sections=sections, st_var=1., ast_var=1., method='wls')
+
+    # the noise of the Stokes intensity increases along x
+    tol = 0.2
+    mc_sample_size = 3000
+    p_mc = rs.multivariate_normal(
+        ds.p_val.values, ds.p_cov.values, size=mc_sample_size)
+    stream = MonteCarloStream(
+        ds,
+        p_mc, ['st', 'ast'], [np.linspace(1., 2e4, nx)[:, None], 1.],
+        lambda p, r, ix, it: mc_temperature_single_ended(ds, p, r, ix, it),
+        mc_chunk_size=100,
+        tile_size=50,
+        random_state=RandomStreams(0))
+    sizes = stream.adapt(['tmpf'], tol, conf_ints=[2.5, 97.5])
+
+    assert len(stream.tiles) == 5
+    assert np.all(np.diff(stream.sizes) >= 0) and \
+        stream.sizes[0] < stream.sizes[-1] <= mc_sample_size
+
+    # the standard errors of the bounds, of the required sample sizes
+    tmpf_var, _ = mc_stream_conf_int(
+        stream, ['tmpf'], conf_ints=[2.5, 97.5])['tmpf']
+    factor = 0.025 * 0.975 / norm.pdf(norm.ppf(0.025))**2
+    required = 1 + factor * tmpf_var / tol**2
+
+    for (jx, jt), size in zip(stream.tiles, stream.sizes):
+        assert size == mc_sample_size or size >= required[jx, jt].max()
+        assert size - 100 < required[jx, jt].max()
+        assert np.all(sizes[jx, jt] == size)
+
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        st_var=1.,
+        ast_var=1.,
+        conf_ints=[2.5, 97.5],
+        mc_sample_size=mc_sample_size,
+        mc_chunk_size=100,
+        mc_seed=0)
+
+    ds.conf_int_single_ended(mc_tol=0.05, **kwargs)
+    size = ds.mc_sample_size.values.max()
+    assert 100 < size < mc_sample_size
+
+    ds.average_single_ended(
+        ci_avg_x_flag2=True, mc_tol=0.05, **kwargs)
+    np.testing.assert_array_equal(ds.mc_sample_size.values, size)
+    assert np.all(np.isfinite(ds.tmpf_mc_avgx2.values))
+
+    pass
+
+
+def test_double_ended_mc_tol_synthetic():
+    """Checks that conf_int_double_ended() and average_double_ended() stop
+    drawing samples once the tolerance is met"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 4
+    nx = 40
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = x < 0.3 * cable_len
+    warm_mask = x > 0.7 * cable_len
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
+
+    st[x >= 50.] *= 0.9
+    rst[x < 50.] *= 0.8
+    st, ast, rst, rast = [
+        a + rs.normal(scale=1., size=a.shape) for a in (st, ast, rst, rast)]
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    sections = {
+        'cold': [slice(0., 0.3 * cable_len)],
+        'warm': [slice(0.7 * cable_len, cable_len)]}
+
+    ds.calibration_double_ended(
+        sections=sections,
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        method='wls',
+        solver='sparse',
+        trans_att=[50.],
+        store_tmpw=None)
+
+    mc_sample_size = 3000
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        store_ta='talpha',
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        conf_ints=[2.5, 97.5],
+        mc_sample_size=mc_sample_size,
+        mc_chunk_size=100,
+        mc_seed=0)
+
+    ds.conf_int_double_ended(mc_tol=0.05, **kwargs)
+    sizes = ds.mc_sample_size.values
+    assert 100 < sizes.max() < mc_sample_size
+    assert np.all(np.isfinite(ds.tmpw_mc.values))
+
+    # a looser tolerance requires fewer samples
+    ds.conf_int_double_ended(mc_tol=0.1, **kwargs)
+    assert np.all(ds.mc_sample_size.values <= sizes)
+    assert ds.mc_sample_size.values.max() < sizes.max()
+
+    ds.average_double_ended(
+        ci_avg_time_flag2=True, mc_tol=0.05, **kwargs)
+    size = ds.mc_sample_size.values.max()
+    assert 100 < size < mc_sample_size
+    np.testing.assert_array_equal(ds.mc_sample_size.values, size)
+    assert np.all(np.isfinite(ds.tmpw_mc_avg2.values))
+
+    pass
+
+
+def test_conf_int_single_ended_mc_region_synthetic():
+    """Checks that the confidence intervals of a region equal those of the
+    full domain, with the same seed, and that these are NaN outside the
+    region"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 10
+    nx = 60
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    warm_mask = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold': [slice(0.125 * cable_len, 0.25 * cable_len)],
+        'warm': [slice(0.625 * cable_len, 0.75 * cable_len)]}
+
+    ds.calibration_single_ended(
+        sections=sections, st_var=1., ast_var=1., method='wls')
+
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        st_var=1.,
+        ast_var=1.,
+        conf_ints=[2.5, 97.5],
+        mc_sample_size=200,
+        mc_streaming=True,
+        mc_seed=0)
+
+    ds.conf_int_single_ended(**kwargs)
+    tmpf_mc_var = ds.tmpf_mc_var.values.copy()
+    tmpf_mc = ds.tmpf_mc.values.copy()
+
+    ds.conf_int_single_ended(
+        mc_x_sel=slice(20., 40.), mc_time_isel=[2, 3, 7], **kwargs)
+    ix = np.flatnonzero((x >= 20.) & (x <= 40.))
+    it = [2, 3, 7]
+    inside = np.zeros((nx, nt), dtype=bool)
+    inside[np.ix_(ix, it)] = True
+
+    np.testing.assert_array_equal(
+        ds.tmpf_mc_var.values[inside], tmpf_mc_var[inside])
+    np.testing.assert_array_equal(
+        ds.tmpf_mc.values[:, inside], tmpf_mc[:, inside])
+    assert np.all(np.isnan(ds.tmpf_mc_var.values[~inside]))
+    assert np.all(np.isnan(ds.tmpf_mc.values[:, ~inside]))
+
+    pass
+
+
+def test_double_ended_mc_region_synthetic():
+    """Checks that the Monte Carlo results of conf_int_double_ended() and
+    average_double_ended() for a region equal those of the full domain,
+    sliced to the region"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 4
+    nx = 40
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = x < 0.3 * cable_len
+    warm_mask = x > 0.7 * cable_len
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
+
+    st[x >= 50.] *= 0.9
+    rst[x < 50.] *= 0.8
+    st, ast, rst, rast = [
+        a + rs.normal(scale=1., size=a.shape) for a in (st, ast, rst, rast)]
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    sections = {
+        'cold': [slice(0., 0.3 * cable_len)],
+        'warm': [slice(0.7 * cable_len, cable_len)]}
+
+    ds.calibration_double_ended(
+        sections=sections,
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        method='wls',
+        solver='sparse',
+        trans_att=[50.],
+        store_tmpw=None)
+
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        store_ta='talpha',
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        conf_ints=[2.5, 97.5],
+        mc_sample_size=200,
+        mc_streaming=True,
+        mc_seed=0)
+    labels = ['tmpf', 'tmpb', 'tmpw']
+
+    ds.conf_int_double_ended(**kwargs)
+    desired = {}
+
+    for label in labels:
+        desired[label + '_mc_var'] = ds[label + '_mc_var'].values.copy()
+        desired[label + '_mc'] = ds[label + '_mc'].values.copy()
+
+    tmpw = ds.tmpw.values.copy()
+
+    ds.conf_int_double_ended(
+        mc_x_sel=slice(20., 60.), mc_time_isel=[0, 2], **kwargs)
+    ix = np.flatnonzero((x >= 20.) & (x <= 60.))
+    inside = np.zeros((nx, nt), dtype=bool)
+    inside[np.ix_(ix, [0, 2])] = True
+
+    for label in labels:
+        var = ds[label + '_mc_var'].values
+        ci = ds[label + '_mc'].values
+        np.testing.assert_array_equal(
+            var[inside], desired[label + '_mc_var'][inside])
+        np.testing.assert_array_equal(
+            ci[:, inside], desired[label + '_mc'][:, inside])
+        assert np.all(np.isnan(var[~inside]))
+        assert np.all(np.isnan(ci[:, ~inside]))
+
+    np.testing.assert_allclose(ds.tmpw.values, tmpw, rtol=1e-12)
+
+    # the averages draw the intensities of the averaging selection only
+    ds.average_double_ended(
+        ci_avg_x_flag2=True,
+        ci_avg_x_sel=slice(20., 60.),
+        remove_mc_set_flag=False,
+        **kwargs)
+
+    for label in labels:
+        np.testing.assert_allclose(
+            ds[label + '_mc_avgsec_var'].values,
+            desired[label + '_mc_var'][ix],
+            rtol=1e-12)
+
+    for label in ['tmpf', 'tmpb']:
+        var = ds[label + '_mc_var'].values
+        np.testing.assert_allclose(
+            var[ix], desired[label + '_mc_var'][ix], rtol=1e-12)
+        assert np.all(np.isnan(np.delete(var, ix, axis=0)))
+
+    pass
+
+
+def test_transient_attenuation_steps():
+    """Checks the step functions of the transient attenuation against a mask
+    per connector, for unsorted connectors, NumPy and Dask arrays and a
+    selection of the locations"""
+    import dask.array as da
+
+    from dtscalibration.calibrate_utils import TransientAttenuation
+
+    rs = np.random.RandomState(0)
+
+    x = np.linspace(0., 100., 51)
+    trans_att = np.array([60., 20., 20.5, 98.])
+    ta = rs.normal(size=(7, trans_att.size, 5))
+
+    fw = np.zeros((7, x.size, 5))
+    bw = np.zeros((7, x.size, 5))
+    for j, taxj in enumerate(trans_att):
+        fw[:, x >= taxj] += ta[:, None, j]
+        bw[:, x < taxj] += ta[:, None, j]
+
+    steps = TransientAttenuation(x, trans_att)
+    np.testing.assert_allclose(steps.fw(ta, axis=1), fw, atol=1e-12)
+    np.testing.assert_allclose(steps.bw(ta, axis=1), bw, atol=1e-12)
+
+    ix = [0, 10, 11, 30, 50]
+    np.testing.assert_array_equal(steps.count(ix), [0, 1, 2, 3, 4])
+    np.testing.assert_allclose(
+        steps.fw(ta, ix=ix, axis=1), fw[:, ix], atol=1e-12)
+
+    ta_da = da.from_array(ta, chunks=(3, -1, 2))
+    np.testing.assert_allclose(
+        steps.bw(ta_da, axis=1).compute(), bw, atol=1e-12)
+
+    # the connectors along the first axis, for (x, time)
+    np.testing.assert_allclose(steps.fw(ta[0]), fw[0], atol=1e-12)
+
+    pass
+
+
+def test_conf_int_single_ended_memory_limit_synthetic():
+    """Checks that the chunks of the memory plan stay below the memory
+    limit and that the confidence intervals do not depend on them"""
+    from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import mc_memory_plan
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 20
+    nx = 100
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = np.logical_and(x > 0.125 * cable_len, x < 0.25 * cable_len)
+    warm_mask = np.logical_and(x > 0.625 * cable_len, x < 0.75 * cable_len)
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_p * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-dalpha_r * x[:, None]) * \
+        np.exp(-dalpha_m * x[:, None]) / (np.exp(gamma / temp_real) - 1)
+
+    st += rs.normal(scale=1., size=st.shape)
+    ast += rs.normal(scale=1., size=ast.shape)
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '0'})
+
+    sections = {
+        'cold': [slice(0.125 * cable_len, 0.25 * cable_len)],
+        'warm': [slice(0.625 * cable_len, 0.75 * cable_len)]}
+
+    ds.calibration_single_ended(
+        sections=sections, st_var=1., ast_var=1., method='wls')
+
+    # the mc dimension is chunked if a single cell does not fit
+    plan = mc_memory_plan(
+        (1000, nx, nt), 5, 2, nconf_ints=2, memory_limit=200000,
+        num_workers=2)
+    assert plan.peak <= 200000 and plan.mc_chunk_size < 1000
+    assert len(plan.chunks[1]) == nx and len(plan.chunks[2]) == nt
+
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        st_var=1.,
+        ast_var=1.,
+        conf_ints=[2.5, 97.5],
+        mc_sample_size=200,
+        mc_seed=0)
+
+    for mc_streaming in [False, True]:
+        plan = ds.mc_memory_plan(
+            conf_ints=[2.5, 97.5],
+            mc_sample_size=200,
+            memory_limit='2MB',
+            mc_streaming=mc_streaming)
+        assert plan.peak <= 2e6 < ds.mc_memory_plan(
+            conf_ints=[2.5, 97.5],
+            mc_sample_size=200,
+            mc_streaming=mc_streaming).peak
+
+        ds.conf_int_single_ended(mc_streaming=mc_streaming, **kwargs)
+        tmpf_mc_var = ds.tmpf_mc_var.values.copy()
+        tmpf_mc = ds.tmpf_mc.values.copy()
+
+        ds.conf_int_single_ended(
+            mc_streaming=mc_streaming, memory_limit='2MB', **kwargs)
+        np.testing.assert_array_equal(ds.tmpf_mc_var.values, tmpf_mc_var)
+        np.testing.assert_array_equal(ds.tmpf_mc.values, tmpf_mc)
+
+    with pytest.raises(ValueError):
+        ds.conf_int_single_ended(memory_limit='10kB', **kwargs)
+
+    pass
+
+
+def test_conf_int_double_ended_memory_limit_synthetic():
+    """Checks that the memory plan of the double-ended routines uses a single
+    chunk if the samples fit in the memory limit, that smaller chunks stay
+    below it, and that the results do not depend on the chunks"""
+    from dtscalibration import DataStore
+
+    rs = np.random.RandomState(0)
+
+    cable_len = 100.
+    nt = 4
+    nx = 40
+    time = np.arange(nt)
+    x = np.linspace(0., cable_len, nx)
+    ts_cold = np.ones(nt) * 4.
+    ts_warm = np.ones(nt) * 20.
+
+    C_p = 15246
+    C_m = 2400.
+    dalpha_r = 0.0005284
+    dalpha_m = 0.0004961
+    dalpha_p = 0.0005607
+    gamma = 482.6
+    cold_mask = x < 0.3 * cable_len
+    warm_mask = x > 0.7 * cable_len
+    temp_real = np.ones((len(x), nt)) * 12 + 273.15
+    temp_real[cold_mask] = ts_cold + 273.15
+    temp_real[warm_mask] = ts_warm + 273.15
+
+    st = C_p * np.exp(-(dalpha_r + dalpha_p) * x[:, None]) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    ast = C_m * np.exp(-(dalpha_r + dalpha_m) * x[:, None]) / \
+        (np.exp(gamma / temp_real) - 1)
+    rst = C_p * np.exp(-(dalpha_r + dalpha_p) * (-x[:, None] + cable_len)) * \
+        np.exp(gamma / temp_real) / (np.exp(gamma / temp_real) - 1)
+    rast = C_m * np.exp(-(dalpha_r + dalpha_m) * (-x[:, None] + cable_len)) / \
+        (np.exp(gamma / temp_real) - 1)
+
+    st[x >= 50.] *= 0.9
+    rst[x < 50.] *= 0.8
+    st, ast, rst, rast = [
+        a + rs.normal(scale=1., size=a.shape) for a in (st, ast, rst, rast)]
+
+    ds = DataStore(
+        {
+            'st': (['x', 'time'], st),
+            'ast': (['x', 'time'], ast),
+            'rst': (['x', 'time'], rst),
+            'rast': (['x', 'time'], rast),
+            'userAcquisitionTimeFW': (['time'], np.ones(nt)),
+            'userAcquisitionTimeBW': (['time'], np.ones(nt)),
+            'cold': (['time'], ts_cold),
+            'warm': (['time'], ts_warm)},
+        coords={
+            'x': x,
+            'time': time},
+        attrs={'isDoubleEnded': '1'})
+
+    sections = {
+        'cold': [slice(0., 0.3 * cable_len)],
+        'warm': [slice(0.7 * cable_len, cable_len)]}
+
+    ds.calibration_double_ended(
+        sections=sections,
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        method='wls',
+        solver='sparse',
+        trans_att=[50.],
+        store_tmpw=None)
+
+    kwargs = dict(
+        p_val='p_val',
+        p_cov='p_cov',
+        store_ta='talpha',
+        st_var=1.,
+        ast_var=1.,
+        rst_var=1.,
+        rast_var=1.,
+        conf_ints=[2.5, 97.5],
+        mc_sample_size=200,
+        mc_seed=0)
+
+    for mc_streaming in [False, True]:
+        plan = ds.mc_memory_plan(
+            conf_ints=[2.5, 97.5],
+            mc_sample_size=200,
+            memory_limit='4GB',
+            mc_streaming=mc_streaming)
+        assert plan.chunks == ((200,), (nx,), (nt,))
+
+        peak = ds.mc_memory_plan(
+            conf_ints=[2.5, 97.5],
+            mc_sample_size=200,
+            mc_streaming=mc_streaming).peak
+        memory_limit = plan.fixed + (peak - plan.fixed) // 4
+        plan = ds.mc_memory_plan(
+            conf_ints=[2.5, 97.5],
+            mc_sample_size=200,
+            memory_limit=memory_limit,
+            mc_streaming=mc_streaming)
+        assert plan.peak <= memory_limit
+        assert len(plan.chunks[0]) * len(plan.chunks[1]) > 1
+
+        ds_ref = ds.copy()
+        ds_ref.conf_int_double_ended(mc_streaming=mc_streaming, **kwargs)
+
+        for limit in ['4GB', memory_limit]:
+            ds_lim = ds.copy()
+            ds_lim.conf_int_double_ended(
+                mc_streaming=mc_streaming, memory_limit=limit, **kwargs)
+
+            for label in ['tmpf', 'tmpb', 'tmpw']:
+                np.testing.assert_allclose(
+                    ds_lim[label + '_mc_var'].values,
+                    ds_ref[label + '_mc_var'].values,
+                    rtol=1e-10)
+
+    pass
+
+
+def test_parameter_sampler():
+    """Checks the covariance of the samples of the Cholesky and the truncated
+    eigen factors, the jitter fallback, and the cache on the DataStore"""
+    from dtscalibration import DataStore
+    from dtscalibration.calibrate_utils import ParameterSampler
+
+    rs = np.random.RandomState(0)
+
+    npar = 6
+    scale = 10.**np.arange(-3, 3)
+    a = rs.normal(size=(npar, npar))
+    cov = a.dot(a.T) * np.outer(scale, scale)
+    p_val = rs.normal(size=npar) * scale
+
+    sampler = ParameterSampler(p_val, cov)
+    assert sampler.method == 'cholesky' and sampler.jitter == 0.
+    samples = sampler.rvs(200000, random_state=rs)
+    np.testing.assert_allclose(
+        samples.mean(axis=0) / scale, p_val / scale, atol=0.02)
+    np.testing.assert_allclose(
+        np.cov(samples.T) / np.outer(scale, scale),
+        cov / np.outer(scale, scale),
+        atol=0.05)
+
+    # rank 2: the Cholesky factor requires jitter, the eigen factor is
+    # truncated to the nonzero eigenvalues
+    b = rs.normal(size=(npar, 2)) * scale[:, None]
+    cov_lr = b.dot(b.T)
+    sampler = ParameterSampler(p_val, cov_lr)
+    assert sampler.method == 'cholesky' and sampler.jitter > 0.
+    sampler = ParameterSampler(p_val, cov_lr, method='eigen')
+    assert sampler.method == 'eigen' and sampler.rank == 2
+    factor = sampler.factor
+    np.testing.assert_allclose(
+        factor.dot(factor.T), cov_lr, atol=1e-10 * np.abs(cov_lr).max())
+
+    ds = DataStore(
+        {
+            'p_val': (('params1',), p_val),
+            'p_cov': (('params1', 'params2'), cov)})
+    sampler = ds.parameter_sampler()
+    assert ds.parameter_sampler(p_cov=cov) is sampler
+
+    sampler_lr = ds.parameter_sampler(method='eigen', rank=3)
+    assert sampler_lr.rank == 3 and ds.parameter_sampler() is sampler_lr
+
+    ds['p_cov'] = ds.p_cov * 2.
+    assert ds.parameter_sampler().method == 'cholesky'
+
+    # the mean of scrambled Sobol' samples converges faster than 1 / sqrt(n)
+    samples = ParameterSampler(p_val, cov).rvs(
+        1024, random_state=rs, sampling='sobol')
+    np.testing.assert_allclose(
+        samples.mean(axis=0) / scale, p_val / scale, atol=0.01)
+    pass
+
+
 def test_single_ended_exponential_variance_estimate_synthetic():
     """Checks whether the coefficients are correctly defined by creating a
     synthetic measurement set, and derive the parameters from this set.